@@ -28,6 +28,11 @@ from maasserver.models import (
     Config,
     PackageRepository,
 )
+from maasserver.regiondservices.process_stats import read_process_stats
+from maasserver.utils import (
+    contention,
+    latency,
+)
 from piston3.utils import rc
 
 
@@ -117,6 +122,34 @@ class MaasHandler(OperationsHandler):
     # about the available configuration items.
     get_config.__doc__ %= get_config_doc(indentation=8)
 
+    @admin_method
+    @operation(idempotent=True)
+    def get_region_stats(self, request):
+        """Get request and retry statistics for this region controller.
+
+        Statistics are merged from each region process on the region
+        controller that answers this request. They are published by each
+        process every 30 seconds, so may be that much out of date, and are
+        reset when a process restarts.
+
+        Request latency is only recorded for the fraction of requests given
+        by the region's ``telemetry_sample_rate`` setting, which is zero by
+        default.
+
+        Returns a JSON object with "processes", the number of region
+        processes reporting; "requests", latency histograms and database
+        query counts for each operation, and slow requests with the SQL they
+        ran; and "retries", transactions retried for each callsite.
+        """
+        processes = read_process_stats()
+        return {
+            "processes": len(processes),
+            "requests": latency.merge_stats(
+                [process["requests"] for process in processes]),
+            "retries": contention.merge_stats(
+                [process["retries"] for process in processes]),
+        }
+
     @classmethod
     def resource_uri(cls, *args, **kwargs):
         return ('maas_handler', [])
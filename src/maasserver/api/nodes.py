@@ -9,17 +9,25 @@ __all__ = [
 ]
 
 from base64 import b64decode
-from itertools import chain
+from heapq import merge
+from itertools import (
+    chain,
+    islice,
+)
 import json
+from operator import attrgetter
 
 import bson
 from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
+from formencode.validators import Int
 from maasserver.api.support import (
     admin_method,
     AnonymousOperationsHandler,
+    get_field_name,
     operation,
     OperationsHandler,
+    StreamingJSONEmitter,
 )
 from maasserver.api.utils import (
     get_mandatory_param,
@@ -45,12 +53,20 @@ from maasserver.fields import MAC_RE
 from maasserver.forms import BulkNodeActionForm
 from maasserver.forms.ephemeral import TestForm
 from maasserver.models import (
+    Device,
     Interface,
+    Machine,
     Node,
     OwnerData,
+    RackController,
+    RegionController,
+)
+from maasserver.models.nodeprobeddetails import (
+    get_probed_details,
+    get_single_probed_details,
 )
-from maasserver.models.nodeprobeddetails import get_single_probed_details
 from maasserver.utils.orm import prefetch_queryset
+from piston3.handler import typemapper
 from piston3.utils import rc
 from provisioningserver.drivers.power import UNKNOWN_POWER_TYPE
 
@@ -101,6 +117,80 @@ NODES_PREFETCH = [
     'tags',
 ]
 
+# The node fields on the API that use each of the relations in
+# `NODES_PREFETCH`, keyed by the first relation in its path. Fields that are
+# not listed here use none of them.
+NODES_PREFETCH_FIELDS = {
+    'domain': {'domain', 'fqdn'},
+    'ownerdata_set': {'owner_data'},
+    'special_filesystems': {'special_filesystems'},
+    'gateway_link_ipv4': {'default_gateways'},
+    'gateway_link_ipv6': {'default_gateways'},
+    'blockdevice_set': {
+        'blockdevice_set', 'boot_disk', 'iscsiblockdevice_set',
+        'physicalblockdevice_set', 'storage', 'virtualblockdevice_set'},
+    'boot_interface': {'boot_interface', 'default_gateways'},
+    'interface_set': {
+        'boot_interface', 'default_gateways', 'interface_set',
+        'ip_addresses'},
+    'tags': {'tag_names'},
+}
+
+# The number of nodes fetched, with their prefetched relations, at a time
+# when nodes are listed one page at a time.
+NODES_BATCH_SIZE = 500
+
+
+def get_nodes_prefetch(fields=None):
+    """Return the relations in `NODES_PREFETCH` used by `fields`.
+
+    :param fields: Names of node fields, or `None` for all of them.
+    """
+    if fields is None:
+        return NODES_PREFETCH
+    else:
+        return [
+            prefetch for prefetch in NODES_PREFETCH
+            if not NODES_PREFETCH_FIELDS[
+                prefetch.split('__', 1)[0]].isdisjoint(fields)
+        ]
+
+
+def iter_nodes(nodes, fields=None, limit=None):
+    """Yield `nodes` in order of id, fetching a batch at a time.
+
+    Each batch is fetched with the relations that rendering `fields` uses,
+    and is released once it has been consumed.
+
+    :param fields: Names of node fields, or `None` for all of them.
+    :param limit: The maximum number of nodes to yield, or `None`.
+    """
+    prefetch = get_nodes_prefetch(fields)
+    relations = {relation.split('__', 1)[0] for relation in prefetch}
+    nodes = nodes.select_related('bmc', 'owner', 'zone')
+    nodes = prefetch_queryset(nodes, prefetch).order_by('id')
+    batch_size = NODES_BATCH_SIZE
+    if limit is not None:
+        batch_size = min(batch_size, limit)
+    batch = list(nodes[:batch_size])
+    count = 0
+    while len(batch) != 0:
+        for node in batch:
+            # Set related node parents so no extra queries are needed.
+            if 'interface_set' in relations:
+                for interface in node.interface_set.all():
+                    interface.node = node
+            if 'blockdevice_set' in relations:
+                for block_device in node.blockdevice_set.all():
+                    block_device.node = node
+            yield node
+        count += len(batch)
+        if len(batch) < batch_size or count == limit:
+            break
+        elif limit is not None:
+            batch_size = min(batch_size, limit - count)
+        batch = list(nodes.filter(id__gt=batch[-1].id)[:batch_size])
+
 
 def store_node_power_parameters(node, request):
     """Store power parameters in request.
@@ -396,7 +486,26 @@ class NodesHandler(OperationsHandler):
         :param agent_name: An optional agent name.  Only nodes relating to the
             nodes with matching agent names will be returned.
         :type agent_name: unicode
+
+        :param fields: An optional list of fields. Only these fields, and the
+            system_id, of each node will be returned. This can be specified
+            multiple times to return more than one field.
+        :type fields: unicode
+
+        :param limit: An optional maximum number of nodes to return. When
+            given, nodes are sorted by id only, not grouped by type.
+        :type limit: int
+
+        :param after: An optional system id. Only nodes created after the node
+            with this system id will be returned. Give the system id of the
+            last node returned to get the next page of nodes.
+        :type after: unicode
         """
+        fields = get_optional_list(request.GET, 'fields')
+        limit = get_optional_param(request.GET, 'limit', None, Int(min=1))
+        after = get_optional_param(request.GET, 'after')
+        if fields is not None or limit is not None or after is not None:
+            return self._read_page(request, fields, limit, after)
 
         if self.base_model == Node:
             # Avoid circular dependencies
@@ -428,6 +537,61 @@ class NodesHandler(OperationsHandler):
                     block_device.node = node
             return nodes
 
+    def _read_page(self, request, fields, limit, after):
+        """List nodes for `read`, one page at a time.
+
+        Nodes are fetched in batches and written as JSON one at a time, with
+        only the relations that their requested fields use prefetched.
+        """
+        if self.base_model == Node:
+            racks = filtered_nodes_list_from_request(request, RackController)
+            querysets = [
+                filtered_nodes_list_from_request(request, Device),
+                filtered_nodes_list_from_request(request, Machine),
+                racks,
+                filtered_nodes_list_from_request(
+                    request, RegionController).exclude(id__in=racks),
+            ]
+        else:
+            querysets = [
+                filtered_nodes_list_from_request(request, self.base_model),
+            ]
+
+        if fields is not None:
+            known_fields = {
+                get_field_name(field)
+                for handler, (model, anonymous) in typemapper.items()
+                if not anonymous and any(
+                    model is queryset.model for queryset in querysets)
+                for field in handler.fields
+            }
+            unknown_fields = set(fields).difference(known_fields)
+            if len(unknown_fields) != 0:
+                raise MAASAPIBadRequest(
+                    "Unknown field(s): %s" % ", ".join(sorted(unknown_fields)))
+            fields = set(fields)
+            fields.add('system_id')
+
+        if after is not None:
+            after_id = Node.objects.filter(
+                system_id=after).values_list('id', flat=True).first()
+            if after_id is None:
+                raise MAASAPIBadRequest("Unknown system id: %s" % after)
+            querysets = [
+                queryset.filter(id__gt=after_id)
+                for queryset in querysets
+            ]
+
+        nodes = merge(
+            *(iter_nodes(queryset, fields, limit) for queryset in querysets),
+            key=attrgetter('id'))
+        if limit is not None:
+            nodes = islice(nodes, limit)
+        emitter = StreamingJSONEmitter(nodes, typemapper, self, fields)
+        return HttpResponse(
+            emitter.stream_render(request),
+            content_type='application/json; charset=utf-8')
+
     @operation(idempotent=True)
     def is_registered(self, request):
         """Returns whether or not the given MAC address is registered within
@@ -442,6 +606,43 @@ class NodesHandler(OperationsHandler):
         """
         return is_registered(request)
 
+    @operation(idempotent=True)
+    def details(self, request):
+        """Obtain various system details for many nodes at once.
+
+        This is the bulk equivalent of the ``details`` operation on a single
+        node, for example for evaluating tags across many nodes.
+
+        :param id: System ids of the nodes for which to obtain details. This
+            should be given multiple times, once for each node.
+        :type id: unicode
+
+        Returns a sequence of BSON documents, one for each node found, with
+        no separator; each BSON document is prefixed with its length. Each is
+        of the form ``{"system_id": system_id, "details": {detail_type: xml,
+        ...}}``, where ``detail_type`` is something like "lldp" or "lshw".
+        Nodes that are not found are omitted.
+        """
+        system_ids = get_optional_list(request.GET, 'id', default=[])
+        nodes = list(self.base_model.objects.filter(system_id__in=system_ids))
+        if len(nodes) == 0:
+            probed_details = {}
+        else:
+            probed_details = get_probed_details(nodes)
+        return HttpResponse(
+            (
+                bson.BSON.encode({
+                    "system_id": system_id,
+                    "details": {
+                        name: None if data is None else bson.Binary(data)
+                        for name, data in details.items()
+                    },
+                })
+                for system_id, details in probed_details.items()
+            ),
+            # A sequence of BSON documents; see `details` on a single node.
+            content_type='application/bson-seq')
+
     @admin_method
     @operation(idempotent=False)
     def set_zone(self, request):
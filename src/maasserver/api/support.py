@@ -8,16 +8,22 @@ __all__ = [
     'AnonymousOperationsHandler',
     'operation',
     'OperationsHandler',
+    'StreamingJSONEmitter',
     ]
 
 from functools import wraps
+import json
 
 from django.core.exceptions import PermissionDenied
+from django.core.serializers.json import DjangoJSONEncoder
 from django.http import Http404
 from maasserver.api.doc import get_api_description_hash
 from maasserver.exceptions import MAASAPIBadRequest
 from piston3.authentication import NoAuthentication
-from piston3.emitters import Emitter
+from piston3.emitters import (
+    Emitter,
+    JSONEmitter,
+)
 from piston3.handler import (
     AnonymousBaseHandler,
     BaseHandler,
@@ -354,3 +360,76 @@ def method_fields_reserved_fields_patch(self, handler, fields):
     return ret
 
 Emitter.method_fields = method_fields_reserved_fields_patch
+
+
+class ProjectedHandler:
+    """A handler restricted to some of its fields.
+
+    Everything else is looked up on the handler it wraps, including the
+    methods that render its fields.
+    """
+
+    def __init__(self, handler, names):
+        self._handler = handler
+        self.fields = tuple(
+            field for field in handler.fields
+            if get_field_name(field) in names)
+
+    def __getattr__(self, name):
+        return getattr(self._handler, name)
+
+
+def get_field_name(field):
+    """Return the name of a handler's field.
+
+    Fields that render related objects are (name, fields) tuples.
+    """
+    if isinstance(field, tuple):
+        return field[0]
+    else:
+        return field
+
+
+class StreamingJSONEmitter(JSONEmitter):
+    """Emit an iterable of objects as a JSON list, one object at a time.
+
+    Piston's `JSONEmitter` constructs the whole payload as Python objects and
+    then dumps it as one string. This constructs and dumps each object in
+    turn, so only the JSON written so far is kept, not every object too.
+
+    :param fields: Optional field names. When given, the objects in the
+        payload are rendered with only those of their handler's fields that
+        are named; objects related to them are rendered in full.
+    """
+
+    def __init__(
+            self, payload, typemapper, handler, fields=None, anonymous=False):
+        super(StreamingJSONEmitter, self).__init__(
+            payload, typemapper, handler, (), anonymous)
+        self.payload = payload
+        self.projection = None if fields is None else frozenset(fields)
+        self.projected_handlers = {}
+        self.projected_model = None
+
+    def in_typemapper(self, model, anonymous):
+        handler = super(StreamingJSONEmitter, self).in_typemapper(
+            model, anonymous)
+        if handler is None or model is not self.projected_model:
+            return handler
+        elif handler not in self.projected_handlers:
+            self.projected_handlers[handler] = ProjectedHandler(
+                handler, self.projection)
+        return self.projected_handlers[handler]
+
+    def stream_render(self, request):
+        """Yield the payload as JSON, one object at a time."""
+        yield "["
+        for index, obj in enumerate(self.payload):
+            self.data = obj
+            if self.projection is not None:
+                self.projected_model = type(obj)
+            if index != 0:
+                yield ","
+            yield json.dumps(
+                self.construct(), cls=DjangoJSONEncoder, ensure_ascii=False)
+        yield "]"
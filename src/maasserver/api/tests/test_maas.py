@@ -8,6 +8,7 @@ __all__ = []
 import http.client
 import json
 from operator import itemgetter
+import os
 
 from django.conf import settings
 from maasserver.forms.settings import CONFIG_ITEMS_KEYS
@@ -16,6 +17,7 @@ from maasserver.models.config import (
     Config,
     DEFAULT_CONFIG,
 )
+from maasserver.regiondservices.process_stats import write_process_stats
 from maasserver.testing.api import APITestCase
 from maasserver.testing.factory import factory
 from maasserver.testing.osystems import (
@@ -24,6 +26,7 @@ from maasserver.testing.osystems import (
     patch_usable_osystems,
 )
 from maasserver.utils.django_urls import reverse
+from maastesting.fixtures import MAASRootFixture
 from maastesting.matchers import DocTestMatches
 from maastesting.testcase import MAASTestCase
 from testtools.content import text_content
@@ -292,3 +295,37 @@ class MAASHandlerAPITest(APITestCase.ForUser):
             })
         self.assertEqual(http.client.OK, response.status_code)
         self.assertTrue(Config.objects.get_config("use_peer_proxy"))
+
+    def test_get_region_stats_requires_admin(self):
+        response = self.client.get(
+            reverse('maas_handler'), {"op": "get_region_stats"})
+        self.assertEqual(
+            http.client.FORBIDDEN, response.status_code, response.content)
+
+    def test_get_region_stats_merges_published_process_stats(self):
+        self.become_admin()
+        self.useFixture(MAASRootFixture())
+        histogram = {
+            "buckets": [1] + [0] * 11, "count": 1, "total": 0.001,
+            "max": 0.001, "queries": 3, "query_time": 0.0005,
+        }
+        write_process_stats({
+            "pid": os.getpid(),
+            "requests": {
+                "bounds": [], "slow": [],
+                "operations": {"GET machines_handler": histogram},
+            },
+            "retries": {"callsites": {}, "relations": {}, "samples": []},
+        })
+        response = self.client.get(
+            reverse('maas_handler'), {"op": "get_region_stats"})
+        self.assertEqual(
+            http.client.OK, response.status_code, response.content)
+        stats = json.loads(response.content.decode(settings.DEFAULT_CHARSET))
+        self.assertThat(stats["processes"], Equals(1))
+        self.assertThat(
+            stats["requests"]["operations"],
+            Equals({"GET machines_handler": histogram}))
+        self.assertThat(
+            stats["retries"],
+            Equals({"callsites": {}, "relations": {}, "samples": []}))
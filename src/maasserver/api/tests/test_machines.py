@@ -346,6 +346,43 @@ class TestMachinesAPI(APITestCase.ForUser):
         self.assertEqual(DEFAULT_NUM + (10 * 3), num_queries1)
         self.assertEqual(DEFAULT_NUM + (20 * 3), num_queries2)
 
+    def test_GET_machines_with_fields_skips_unused_prefetches(self):
+        # Patch middleware so it does not affect query counting.
+        self.patch(
+            middleware.ExternalComponentsMiddleware,
+            '_check_rack_controller_connectivity')
+
+        for _ in range(10):
+            factory.make_Node_with_Interface_on_Subnet()
+        num_queries_all, response_all = count_queries(
+            self.client.get, reverse('machines_handler'), {'limit': 10})
+        num_queries_some, response_some = count_queries(
+            self.client.get, reverse('machines_handler'),
+            {'limit': 10, 'fields': ['hostname', 'cpu_count']})
+
+        parsed_result_all = json.loads(
+            response_all.content.decode(settings.DEFAULT_CHARSET))
+        parsed_result_some = json.loads(
+            response_some.content.decode(settings.DEFAULT_CHARSET))
+        self.assertEqual(
+            [http.client.OK, http.client.OK],
+            [response_all.status_code, response_some.status_code])
+        self.assertEqual(
+            extract_system_ids(parsed_result_all),
+            extract_system_ids(parsed_result_some))
+        self.assertLess(num_queries_some, num_queries_all)
+
+    def test_GET_machines_with_limit_renders_like_without(self):
+        for _ in range(3):
+            factory.make_Node_with_Interface_on_Subnet()
+        response = self.client.get(reverse('machines_handler'))
+        response_paged = self.client.get(
+            reverse('machines_handler'), {'limit': 3})
+        self.assertEqual(
+            json.loads(response.content.decode(settings.DEFAULT_CHARSET)),
+            json.loads(
+                response_paged.content.decode(settings.DEFAULT_CHARSET)))
+
     def test_GET_without_machines_returns_empty_list(self):
         # If there are no machines to list, the "read" op still works but
         # returns an empty list.
@@ -241,8 +241,8 @@ class TestNodeAPI(APITestCase.ForUser):
             http.client.METHOD_NOT_ALLOWED, response.status_code)
 
 
-class TestGetDetails(APITestCase.ForUser):
-    """Tests for /api/2.0/nodes/<node>/?op=details."""
+class ProbedDetailsMixin:
+    """Helpers for making nodes with probed details."""
 
     def make_script_result(self, node, script_result=0, script_name=None):
         script_set = node.current_commissioning_script_set
@@ -265,6 +265,10 @@ class TestGetDetails(APITestCase.ForUser):
     def make_lldp_result(self, node, script_result=0):
         return self.make_script_result(node, script_result, LLDP_OUTPUT_NAME)
 
+
+class TestGetDetails(ProbedDetailsMixin, APITestCase.ForUser):
+    """Tests for /api/2.0/nodes/<node>/?op=details."""
+
     def get_details(self, node):
         url = reverse('node_handler', args=[node.system_id])
         response = self.client.get(url, {'op': 'details'})
@@ -301,6 +305,48 @@ class TestGetDetails(APITestCase.ForUser):
         self.assertEqual(http.client.NOT_FOUND, response.status_code)
 
 
+class TestGetDetailsForNodes(ProbedDetailsMixin, APITestCase.ForUser):
+    """Tests for /api/2.0/nodes/?op=details."""
+
+    def get_details(self, *nodes):
+        response = self.client.get(reverse('nodes_handler'), {
+            'op': 'details',
+            'id': [node.system_id for node in nodes],
+        })
+        self.assertEqual(http.client.OK, response.status_code)
+        self.assertEqual('application/bson-seq', response['content-type'])
+        return list(bson.decode_iter(response.content))
+
+    def test_GET_returns_details_of_each_node(self):
+        node1 = factory.make_Node()
+        node2 = factory.make_Node()
+        lshw_result = self.make_lshw_result(node1)
+        lldp_result = self.make_lldp_result(node2)
+        self.assertItemsEqual([
+            {
+                "system_id": node1.system_id,
+                "details": {"lshw": lshw_result.stdout, "lldp": None},
+            },
+            {
+                "system_id": node2.system_id,
+                "details": {"lshw": None, "lldp": lldp_result.stdout},
+            },
+        ], self.get_details(node1, node2))
+
+    def test_GET_omits_nodes_that_do_not_exist(self):
+        node = factory.make_Node()
+        response = self.client.get(reverse('nodes_handler'), {
+            'op': 'details', 'id': [node.system_id, 'does-not-exist'],
+        })
+        self.assertEqual(http.client.OK, response.status_code)
+        self.assertEqual(
+            [node.system_id],
+            [doc["system_id"] for doc in bson.decode_iter(response.content)])
+
+    def test_GET_returns_nothing_without_nodes(self):
+        self.assertEqual([], self.get_details())
+
+
 class TestPowerParameters(APITestCase.ForUser):
     def get_node_uri(self, node):
         """Get the API URI for `node`."""
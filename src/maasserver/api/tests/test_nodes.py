@@ -25,6 +25,7 @@ from maasserver.testing.factory import factory
 from maasserver.utils import ignore_unused
 from maasserver.utils.django_urls import reverse
 from maasserver.utils.orm import reload_object
+from maastesting.testcase import MAASTestCase
 
 
 class TestIsRegisteredAPI(APITestCase.ForAnonymousAndUserAndAdmin):
@@ -526,6 +527,94 @@ class TestNodesAPI(APITestCase.ForUser):
             [node.system_id for node in nodes],
             extract_system_ids(parsed_result))
 
+    def test_GET_with_limit_returns_first_nodes(self):
+        nodes = [factory.make_Node() for _ in range(3)]
+        response = self.client.get(reverse('nodes_handler'), {'limit': 2})
+        self.assertEqual(http.client.OK, response.status_code)
+        parsed_result = json.loads(
+            response.content.decode(settings.DEFAULT_CHARSET))
+        self.assertSequenceEqual(
+            [node.system_id for node in nodes[:2]],
+            extract_system_ids(parsed_result))
+
+    def test_GET_with_after_returns_later_nodes(self):
+        nodes = [factory.make_Node() for _ in range(3)]
+        response = self.client.get(
+            reverse('nodes_handler'), {'after': nodes[0].system_id})
+        self.assertEqual(http.client.OK, response.status_code)
+        parsed_result = json.loads(
+            response.content.decode(settings.DEFAULT_CHARSET))
+        self.assertSequenceEqual(
+            [node.system_id for node in nodes[1:]],
+            extract_system_ids(parsed_result))
+
+    def test_GET_with_limit_and_after_pages_through_all_types(self):
+        self.become_admin()
+        nodes = [
+            factory.make_Node(node_type=node_type, owner=self.user)
+            for node_type, _ in NODE_TYPE_CHOICES * 2
+        ]
+        system_ids = []
+        params = {'limit': 3}
+        while True:
+            response = self.client.get(reverse('nodes_handler'), params)
+            self.assertEqual(http.client.OK, response.status_code)
+            page = extract_system_ids(json.loads(
+                response.content.decode(settings.DEFAULT_CHARSET)))
+            if len(page) == 0:
+                break
+            self.assertLessEqual(len(page), 3)
+            system_ids.extend(page)
+            params['after'] = page[-1]
+        self.assertSequenceEqual(
+            [node.system_id for node in sorted(nodes, key=lambda n: n.id)],
+            system_ids)
+
+    def test_GET_with_limit_fetches_nodes_in_batches(self):
+        self.patch(nodes_module, 'NODES_BATCH_SIZE', 2)
+        nodes = [factory.make_Node() for _ in range(5)]
+        response = self.client.get(reverse('nodes_handler'), {'limit': 4})
+        self.assertEqual(http.client.OK, response.status_code)
+        parsed_result = json.loads(
+            response.content.decode(settings.DEFAULT_CHARSET))
+        self.assertSequenceEqual(
+            [node.system_id for node in nodes[:4]],
+            extract_system_ids(parsed_result))
+
+    def test_GET_with_unknown_after_returns_bad_request(self):
+        response = self.client.get(
+            reverse('nodes_handler'), {'after': factory.make_name('node')})
+        self.assertEqual(http.client.BAD_REQUEST, response.status_code)
+
+    def test_GET_with_invalid_limit_returns_bad_request(self):
+        response = self.client.get(reverse('nodes_handler'), {'limit': 0})
+        self.assertEqual(http.client.BAD_REQUEST, response.status_code)
+
+    def test_GET_with_fields_returns_only_those_fields(self):
+        node = factory.make_Node()
+        response = self.client.get(
+            reverse('nodes_handler'), {'fields': ['hostname', 'cpu_count']})
+        self.assertEqual(http.client.OK, response.status_code)
+        parsed_result = json.loads(
+            response.content.decode(settings.DEFAULT_CHARSET))
+        self.assertEqual(
+            [{
+                'system_id': node.system_id,
+                'hostname': node.hostname,
+                'cpu_count': node.cpu_count,
+                'resource_uri': reverse(
+                    'machine_handler', args=[node.system_id]),
+            }],
+            parsed_result)
+
+    def test_GET_with_unknown_fields_returns_bad_request(self):
+        factory.make_Node()
+        response = self.client.get(
+            reverse('nodes_handler'), {'fields': ['hostname', 'foo']})
+        self.assertEqual(
+            (http.client.BAD_REQUEST, b"Unknown field(s): foo"),
+            (response.status_code, response.content))
+
     def test_POST_set_zone_sets_zone_on_nodes(self):
         self.become_admin()
         node = factory.make_Node()
@@ -585,6 +674,29 @@ class TestNodesAPI(APITestCase.ForUser):
             http.client.METHOD_NOT_ALLOWED, response.status_code)
 
 
+class TestGetNodesPrefetch(MAASTestCase):
+    """Tests for `get_nodes_prefetch`."""
+
+    def test_returns_all_prefetches_without_fields(self):
+        self.assertEqual(
+            nodes_module.NODES_PREFETCH, nodes_module.get_nodes_prefetch())
+
+    def test_returns_no_prefetches_for_plain_fields(self):
+        self.assertEqual(
+            [], nodes_module.get_nodes_prefetch(['hostname', 'cpu_count']))
+
+    def test_returns_prefetches_used_by_fields(self):
+        self.assertEqual(
+            ['ownerdata_set', 'tags'],
+            nodes_module.get_nodes_prefetch(['owner_data', 'tag_names']))
+
+    def test_knows_fields_for_every_prefetch(self):
+        for prefetch in nodes_module.NODES_PREFETCH:
+            self.assertIn(
+                prefetch.split('__', 1)[0],
+                nodes_module.NODES_PREFETCH_FIELDS)
+
+
 class TestPowersMixin(APITestCase.ForUser):
     """Test the powers mixin."""
 
@@ -8,6 +8,7 @@ __all__ = []
 
 from collections import namedtuple
 import http.client
+import json
 from unittest.mock import (
     call,
     Mock,
@@ -15,6 +16,7 @@ from unittest.mock import (
 )
 
 from django.core.exceptions import PermissionDenied
+from django.test import RequestFactory
 from maasserver.api.doc import get_api_description_hash
 from maasserver.api.support import (
     admin_method,
@@ -22,6 +24,7 @@ from maasserver.api.support import (
     OperationsHandlerMixin,
     OperationsResource,
     RestrictedResource,
+    StreamingJSONEmitter,
 )
 from maasserver.models.config import (
     Config,
@@ -33,6 +36,8 @@ from maasserver.testing.testcase import MAASServerTestCase
 from maasserver.utils.django_urls import reverse
 from maastesting.testcase import MAASTestCase
 from piston3.authentication import NoAuthentication
+from piston3.emitters import JSONEmitter
+from piston3.handler import typemapper
 from testtools.matchers import (
     Equals,
     Is,
@@ -185,3 +190,38 @@ class TestOperationsHandlerMixin(MAASTestCase):
         handler.decorate(lambda thing: str(thing).upper())
         self.assertEqual({"foo": "SENTINEL.FOO"}, handler.exports)
         self.assertEqual({"bar": "SENTINEL.BAR"}, handler.anonymous.exports)
+
+
+class TestStreamingJSONEmitter(MAASServerTestCase):
+    """Tests for :py:class:`maasserver.api.support.StreamingJSONEmitter`."""
+
+    def render(self, objects, fields=None):
+        emitter = StreamingJSONEmitter(objects, typemapper, None, fields)
+        return "".join(emitter.stream_render(RequestFactory().get("/")))
+
+    def test__renders_empty_list(self):
+        self.assertEqual("[]", self.render([]))
+
+    def test__renders_like_json_emitter(self):
+        zones = [factory.make_Zone() for _ in range(3)]
+        emitter = JSONEmitter(zones, typemapper, None)
+        expected = emitter.render(RequestFactory().get("/"))
+        self.assertEqual(json.loads(expected), json.loads(self.render(zones)))
+
+    def test__renders_one_object_at_a_time(self):
+        zones = [factory.make_Zone() for _ in range(3)]
+        emitter = StreamingJSONEmitter(iter(zones), typemapper, None)
+        chunks = list(emitter.stream_render(RequestFactory().get("/")))
+        self.assertEqual(
+            ["[", zones[0].name, ",", zones[1].name, ",", zones[2].name, "]"],
+            [
+                json.loads(chunk)["name"] if chunk.startswith("{") else chunk
+                for chunk in chunks
+            ])
+
+    def test__renders_only_given_fields(self):
+        zone = factory.make_Zone()
+        [rendered] = json.loads(self.render([zone], ["name"]))
+        self.assertEqual(
+            {"name": zone.name, "resource_uri": rendered["resource_uri"]},
+            rendered)
@@ -15,10 +15,14 @@ __all__ = [
     "SIMPLESTREAMS_URL_REGEXP",
 ]
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
+import hashlib
 from operator import itemgetter
 import os
+import re
 from subprocess import CalledProcessError
+from tempfile import mkstemp
 from textwrap import dedent
 import threading
 import time
@@ -29,8 +33,10 @@ from django.db import (
 )
 from django.db.utils import load_backend
 from django.http import (
+    FileResponse,
     Http404,
     HttpResponse,
+    HttpResponseNotModified,
     StreamingHttpResponse,
 )
 from django.shortcuts import get_object_or_404
@@ -69,6 +75,7 @@ from maasserver.utils import (
     absolute_url_reverse,
     synchronised,
 )
+from maasserver.utils.converters import human_readable_bytes
 from maasserver.utils.dblocks import DatabaseLockNotHeld
 from maasserver.utils.orm import (
     get_one,
@@ -94,6 +101,7 @@ from provisioningserver.logger import (
     get_maas_logger,
     LegacyLogger,
 )
+from provisioningserver.path import get_data_path
 from provisioningserver.rpc.cluster import (
     ListBootImages,
     ListBootImagesV2,
@@ -206,6 +214,224 @@ class ConnectionWrapper:
             self._connection = None
 
 
+class CachingContentWrapper:
+    """Wraps an iterator over the content of a `LargeFile`, and caches it.
+
+    Everything read through the wrapper is also written to a temporary file
+    in `cache`. Once the whole content has been read, and it has the
+    expected size and SHA256 digest, the file is moved into the cache.
+    """
+
+    def __init__(self, content, largefile, cache):
+        self.content = content
+        self.sha256 = largefile.sha256
+        self.total_size = largefile.total_size
+        self.cache = cache
+        self._file = None
+        self._path = None
+        self._digest = hashlib.sha256()
+        self._size = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._path is None:
+            fd, self._path = mkstemp(
+                dir=self.cache.path, prefix=self.sha256 + ".",
+                suffix=".partial")
+            self._file = os.fdopen(fd, "wb")
+        try:
+            data = next(self.content)
+        except StopIteration:
+            self._finish()
+            raise
+        else:
+            if self._file is not None:
+                self._file.write(data)
+                self._digest.update(data)
+                self._size += len(data)
+            return data
+
+    def _finish(self):
+        """Move the file into the cache if it has the expected content."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            if (self._size == self.total_size and
+                    self._digest.hexdigest() == self.sha256):
+                os.rename(self._path, self.cache.get_path(self.sha256))
+                self._path = None
+            else:
+                maaslog.error(
+                    "Not caching boot resource file %s; the content read "
+                    "does not match its size and SHA256 digest.",
+                    self.sha256)
+
+    def close(self):
+        """Close the wrapped content, and forget any partial file."""
+        try:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if self._path is not None:
+                os.unlink(self._path)
+                self._path = None
+        finally:
+            self.cache.release(self.sha256)
+            self.content.close()
+
+
+class BootResourceFileCache:
+    """Cache of the content of `LargeFile`s on disk, by SHA256 digest.
+
+    Rack controllers downloading boot resources from the database each need
+    a database connection for the duration of the download. Instead, the
+    content of each file is cached on disk the first time that it is
+    downloaded, and subsequent downloads are served from the cache.
+
+    The cache directory is shared by all the region processes on a host.
+    """
+
+    # Where, relative to MAAS_ROOT, the cache is kept.
+    location = "/var/lib/maas/boot-resources-cache"
+
+    def __init__(self):
+        super(BootResourceFileCache, self).__init__()
+        self._filling = set()
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        """The directory in which cached files are kept.
+
+        This is computed on each use because `MAAS_ROOT` can change.
+        """
+        path = get_data_path(self.location)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def get_path(self, sha256):
+        """Return the path at which content with `sha256` is cached."""
+        return os.path.join(self.path, sha256)
+
+    def get(self, largefile):
+        """Return the path to the cached content of `largefile`, or `None`."""
+        path = self.get_path(largefile.sha256)
+        try:
+            size = os.stat(path).st_size
+        except FileNotFoundError:
+            return None
+        else:
+            return path if size == largefile.total_size else None
+
+    def fill(self, largefile):
+        """Return an iterator over the content of `largefile`.
+
+        If the content can be cached, and no other request in this process
+        is already caching it, the content is cached as it is read.
+        """
+        content = ConnectionWrapper(largefile.content)
+        if largefile.complete:
+            with self._lock:
+                if largefile.sha256 not in self._filling:
+                    self._filling.add(largefile.sha256)
+                    return CachingContentWrapper(content, largefile, self)
+        return content
+
+    def release(self, sha256):
+        """Note that `sha256` is no longer being cached by this process."""
+        with self._lock:
+            self._filling.discard(sha256)
+
+    def prune(self, sha256s):
+        """Remove cached content that is not one of `sha256s`.
+
+        Partial files left behind by processes that have since stopped are
+        removed too, once they have been left untouched for a day.
+        """
+        keep = set(sha256s)
+        path = self.path
+        stale = time.time() - timedelta(days=1).total_seconds()
+        for filename in os.listdir(path):
+            filepath = os.path.join(path, filename)
+            if filename.endswith(".partial"):
+                try:
+                    if os.stat(filepath).st_mtime >= stale:
+                        continue
+                except FileNotFoundError:
+                    continue
+            elif filename in keep:
+                continue
+            try:
+                os.unlink(filepath)
+            except FileNotFoundError:
+                pass  # Removed by another process.
+
+
+boot_resource_file_cache = BootResourceFileCache()
+
+
+def parse_etags(header):
+    """Return the entity tags in an `If-None-Match` header value."""
+    etags = set()
+    for etag in header.split(","):
+        etag = etag.strip()
+        if etag.startswith("W/"):
+            etag = etag[2:]
+        if len(etag) != 0:
+            etags.add(etag)
+    return etags
+
+
+def parse_range(header, size):
+    """Return the range of bytes requested by a `Range` header value.
+
+    Only requests for a single range of bytes are honoured; the header is
+    ignored, as HTTP permits, if it's anything else.
+
+    :return: A `(start, end)` tuple, where `end` is inclusive, or `None`
+        if the whole content should be sent.
+    :raise ValueError: If the range cannot be satisfied.
+    """
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", header.strip(), re.ASCII)
+    if match is None:
+        return None
+    first, last = match.groups()
+    if first == "":
+        if last == "":
+            return None
+        # A suffix range: the last bytes of the content.
+        if int(last) == 0 or size == 0:
+            raise ValueError("Range is empty.")
+        return max(0, size - int(last)), size - 1
+    start = int(first)
+    if start >= size:
+        raise ValueError("Range starts beyond the content.")
+    end = size - 1 if last == "" else min(int(last), size - 1)
+    if end < start:
+        return None  # Invalid, so ignored.
+    return start, end
+
+
+class BootResourceFileResponse(FileResponse):
+    """Streams a cached boot resource file in large blocks."""
+
+    block_size = 1 << 20  # 1MiB
+
+
+def read_file_range(path, start, length, block_size=(1 << 20)):
+    """Yield `length` bytes from `path`, starting at `start`."""
+    with open(path, "rb") as stream:
+        stream.seek(start)
+        while length > 0:
+            data = stream.read(min(length, block_size))
+            if len(data) == 0:
+                break
+            length -= len(data)
+            yield data
+
+
 class SimpleStreamsHandler:
     """Simplestreams endpoint, that the racks talk to.
 
@@ -373,10 +599,47 @@ class SimpleStreamsHandler:
             rfile = resource_set.files.get(filename=filename)
         except BootResourceFile.DoesNotExist:
             raise Http404()
-        response = StreamingHttpResponse(
-            ConnectionWrapper(rfile.largefile.content),
-            content_type='application/octet-stream')
-        response['Content-Length'] = rfile.largefile.total_size
+        largefile = rfile.largefile
+        etag = '"%s"' % largefile.sha256
+        etags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+        if etag in etags or '*' in etags:
+            response = HttpResponseNotModified()
+        else:
+            path = boot_resource_file_cache.get(largefile)
+            if path is None:
+                response = StreamingHttpResponse(
+                    boot_resource_file_cache.fill(largefile),
+                    content_type='application/octet-stream')
+                response['Content-Length'] = largefile.total_size
+            else:
+                response = self.get_cached_file_response(
+                    request, path, largefile.total_size)
+        response['ETag'] = etag
+        return response
+
+    def get_cached_file_response(self, request, path, size):
+        """Return a response for the cached file at `path`.
+
+        A single range of bytes can be requested with a `Range` header.
+        """
+        try:
+            byte_range = parse_range(request.META.get('HTTP_RANGE', ''), size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */%d' % size
+            return response
+        if byte_range is None:
+            response = BootResourceFileResponse(
+                open(path, 'rb'), content_type='application/octet-stream')
+            response['Content-Length'] = size
+        else:
+            start, end = byte_range
+            response = StreamingHttpResponse(
+                read_file_range(path, start, end - start + 1),
+                content_type='application/octet-stream', status=206)
+            response['Content-Length'] = end - start + 1
+            response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+        response['Accept-Ranges'] = 'bytes'
         return response
 
 
@@ -392,6 +655,22 @@ def simplestreams_file_handler(
         request, os, arch, subarch, series, version, filename)
 
 
+def skip_content(reader, count, read_size):
+    """Skip over the first `count` bytes from `reader`.
+
+    Readers that can seek are told to; others are read and discarded.
+    """
+    seekable = getattr(reader, "seekable", None)
+    if seekable is not None and seekable():
+        reader.seek(count, os.SEEK_CUR)
+    else:
+        while count > 0:
+            buf = reader.read(min(count, read_size))
+            if len(buf) == 0:
+                break
+            count -= len(buf)
+
+
 class BootResourceStore(ObjectStore):
     """Stores the simplestream data into the `BootResource` model.
 
@@ -427,6 +706,11 @@ class BootResourceStore(ObjectStore):
     # Read at 10MiB per chunk.
     read_size = 1024 * 1024 * 10
 
+    # Commit the content written, and record the progress, at least every
+    # 100MiB. This is also how much is lost, and must be written again, when
+    # an import is interrupted.
+    commit_size = 1024 * 1024 * 100
+
     def __init__(self):
         """Initialize store."""
         self.cache_current_resources()
@@ -710,6 +994,14 @@ class BootResourceStore(ObjectStore):
             needs_saving = True
             maaslog.debug(
                 "New large file created %s.", largefile)
+        elif not largefile.complete:
+            # Writing the content for this largefile was interrupted, most
+            # likely by restarting the region during an earlier import. It
+            # needs to be finished, unless it's already to be finished for
+            # another resource file that shares this largefile.
+            needs_saving = not BootResourceFile.objects.filter(
+                id__in=self._content_to_finalize,
+                largefile=largefile).exists()
 
         # A largefile now exists for this resource file. Its either a new
         # largefile or an existing one that already existed in the database.
@@ -749,7 +1041,13 @@ class BootResourceStore(ObjectStore):
 
     def write_content_thread(self, rid, reader):
         """Writes the data from the given reader, into the object storage
-        for the given `BootResourceFile`."""
+        for the given `BootResourceFile`.
+
+        The content is committed, and the size of the largefile updated, at
+        least every `commit_size` bytes. Writing resumes from what has been
+        committed already, so an import that was interrupted, for example by
+        restarting the region, does not need to write everything again.
+        """
 
         @transactional
         def get_rfile_and_ident():
@@ -759,37 +1057,65 @@ class BootResourceStore(ObjectStore):
             return rfile, ident
 
         rfile, ident = get_rfile_and_ident()
-        cksummer = sutil.checksummer(
-            {'sha256': rfile.largefile.sha256})
+        largefile = rfile.largefile
+        cksummer = sutil.checksummer({'sha256': largefile.sha256})
         maaslog.debug("Finalizing boot image %s.", ident)
 
-        # Ensure that the size of the largefile starts at zero.
-        rfile.largefile.size = 0
-        transactional(rfile.largefile.save)(update_fields=['size'])
+        @transactional
+        def resume():
+            """Find how much content has been committed already.
+
+            Content past the recorded size of the largefile is discarded.
+            What remains is checksummed, so that only the new content needs
+            to be checksummed as it is written.
+            """
+            with largefile.content.open('rwb') as stream:
+                written = stream.seek(0, 2)
+                offset = min(written, largefile.size)
+                if offset != written:
+                    stream.truncate(offset)
+                stream.seek(0)
+                while stream.tell() < offset:
+                    cksummer.update(stream.read(
+                        min(self.read_size, offset - stream.tell())))
+            largefile.size = offset
+            largefile.save(update_fields=['size'])
+            return offset
 
         @transactional
-        def write_chunk():
-            """Write a chunk into the database with a transaction per trunk.
+        def write_chunks():
+            """Write chunks into the database until `commit_size` bytes have
+            been written, all of the content has been written, or writing has
+            been cancelled.
 
-            This ensures that the content and the size is committed into the
-            database per chunk. This makes the process be reported correctly.
+            :return: True when all of the content has been written.
             """
-            with rfile.largefile.content.open('wb') as stream:
-                buf = reader.read(self.read_size)
+            written = 0
+            done = False
+            with largefile.content.open('wb') as stream:
                 stream.seek(0, 2)
-                stream.write(buf)
-                cksummer.update(buf)
-                buf_len = len(buf)
-                rfile.largefile.size += buf_len
-                rfile.largefile.save(update_fields=['size'])
-                if buf_len != self.read_size:
-                    return True
-                else:
-                    return False
+                while not done and written < self.commit_size:
+                    if self._cancel_finalize:
+                        break
+                    buf = reader.read(self.read_size)
+                    stream.write(buf)
+                    cksummer.update(buf)
+                    written += len(buf)
+                    done = len(buf) != self.read_size
+                largefile.size = stream.tell()
+            largefile.save(update_fields=['size'])
+            return done
+
+        offset = resume()
+        if offset != 0:
+            maaslog.info(
+                "Resuming boot image %s from %s.",
+                ident, human_readable_bytes(offset))
+            skip_content(reader, offset, self.read_size)
 
-        # Write chunks until it says its done.
+        started = time.monotonic()
         while not self._cancel_finalize:
-            if write_chunk():
+            if write_chunks():
                 break
 
         # Don't check the checksum if finalization was cancelled.
@@ -811,40 +1137,49 @@ class BootResourceStore(ObjectStore):
             maaslog.error(msg)
             transactional(rfile.delete)()
         else:
-            maaslog.debug('Finalized boot image %s.', ident)
+            elapsed = max(time.monotonic() - started, 0.001)
+            written = largefile.size - offset
+            maaslog.info(
+                "Finalized boot image %s; wrote %s in %.1f seconds (%s/s).",
+                ident, human_readable_bytes(written), elapsed,
+                human_readable_bytes(written / elapsed))
 
-    def perform_write(self):
-        """Performs all writing of content into the object storage.
+    def write_queued_content(self):
+        """Write queued content until there is none left, or writing has
+        been cancelled.
 
-        This method will spawn threads to perform the writing. Maximum of
-        `write_threads` will be running at once."""
-        threads = []
-        while True:
-            # Update list to only those that are still running.
-            threads = [thread for thread in threads if thread.isAlive()]
-            if len(threads) >= self.write_threads:
-                # Cannot start any more threads as the maximum is already
-                # running. Lets wait a second and try again.
-                time.sleep(1)
-                continue
+        A failure to write one file is logged, and does not stop the rest
+        of the queue from being written."""
+        while not self._cancel_finalize:
+            try:
+                rid, reader = self._content_to_finalize.popitem()
+            except KeyError:
+                break  # Nothing more to write.
+            try:
+                self.write_content_thread(rid, reader)
+            except Exception as error:
+                maaslog.error(
+                    "Failed to write boot image content for boot resource "
+                    "file %s: %s", rid, error)
 
-            if self._cancel_finalize or len(self._content_to_finalize) == 0:
-                # No more threads to spawn because the finalization has been
-                # cancelled or all of the content has been de-queued. Wait for
-                # all the remaining running threads to finish.
-                for thread in threads:
-                    thread.join()
-                break
+    def perform_write(self):
+        """Performs all writing of content into the object storage.
 
-            # Spawn a writer thread with a resource file and reader from
-            # the queue of content to be saved.
-            rid, reader = self._content_to_finalize.popitem()
-            # FIXME: Use deferToDatabase and the coiterator if possible.
-            thread = threading.Thread(
-                target=self.write_content_thread,
-                args=(rid, reader))
-            thread.start()
-            threads.append(thread)
+        A pool of at most `write_threads` threads perform the writing, each
+        taking the next content to write from the queue as it finishes the
+        last, and this waits for them all to finish."""
+        workers = min(self.write_threads, len(self._content_to_finalize))
+        if workers == 0:
+            return
+        with ThreadPoolExecutor(workers) as executor:
+            futures = [
+                executor.submit(self.write_queued_content)
+                for _ in range(workers)
+            ]
+        for future in futures:
+            error = future.exception()
+            if error is not None:
+                maaslog.error("Failed to write boot image content: %s", error)
 
     def _other_resources_exists(self, os, arch, subarch, series):
         """Return `True` when simplestreams provided an image with the same
@@ -1467,6 +1802,7 @@ class ImportResourcesProgressService(TimerService, object):
 
     @inlineCallbacks
     def check_boot_images(self):
+        yield deferToDatabase(self.prune_boot_resource_file_cache)
         if (yield deferToDatabase(
                 self.are_boot_images_available_in_the_region)):
             # The region has boot resources. The racks will too soon if
@@ -1495,6 +1831,12 @@ class ImportResourcesProgressService(TimerService, object):
     <a href="%(images_link)s">boot images</a> page to start the import.
     """)
 
+    @transactional
+    def prune_boot_resource_file_cache(self):
+        """Remove cached files that are no longer in the database."""
+        boot_resource_file_cache.prune(
+            LargeFile.objects.values_list("sha256", flat=True))
+
     @transactional
     def clear_import_warning(self):
         discard_persistent_error(COMPONENT.IMPORT_PXE_FILES)
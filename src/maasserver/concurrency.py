@@ -10,13 +10,17 @@ Twisted concurrency primative, like `DeferredLock` or `DeferredSemaphore`.
 """
 
 __all__ = [
+    "database",
+    "rpc",
     "webapp",
+    "websocket",
 ]
 
-from twisted.internet.defer import DeferredSemaphore
+from maasserver.utils.limiter import AdaptiveLimiter
+from maasserver.utils.threads import max_threads_for_database_pool
 
 #
-# Limit web application and threaded websocket handler requests.
+# Limit web application, threaded websocket handler, and RPC requests.
 #
 # These requests are distinct from other work going on within the region
 # because they hold a database connection for their entire duration. If they
@@ -47,4 +51,19 @@ from twisted.internet.defer import DeferredSemaphore
 # connections for example. It is a stopgap. Ultimately we want to reduce or
 # eliminate all RPC calls made while a database connection is being held.
 #
-webapp = DeferredSemaphore(4)
+# The limit was once fixed at 4. Now it adapts to how long requests take and
+# how often their transactions conflict; see `AdaptiveLimiter`. It never goes
+# below that old limit: requests of very different lengths are mixed here, so
+# a window of slow ones can look like congestion when it is not. It stays two
+# below the size of the database thread-pool to leave room for the RPC calls
+# described above. Those are admitted up to the size of the pool, counted
+# apart from the adaptive limit: they are never held back by it, and however
+# busy the racks keep RPC, they never take its room from web application and
+# websocket requests, nor skew the latency by which it adapts.
+#
+database = AdaptiveLimiter(
+    initial=4, minimum=4, maximum=max_threads_for_database_pool - 2)
+rpc = database.gate(
+    "rpc", priority=0, ceiling=max_threads_for_database_pool)
+websocket = database.gate("websocket", priority=1)
+webapp = database.gate("webapp", priority=2)
@@ -7,7 +7,10 @@ __all__ = [
     "RegionConfiguration",
 ]
 
-from formencode.validators import Int
+from formencode.validators import (
+    Int,
+    Number,
+)
 from provisioningserver.config import (
     Configuration,
     ConfigurationFile,
@@ -51,3 +54,15 @@ class RegionConfiguration(Configuration, metaclass=RegionConfigurationMeta):
     database_pass = ConfigurationOption(
         "database_pass", "The password for the PostgreSQL user.",
         UnicodeString(if_missing="", accept_python=False))
+
+    # Telemetry options.
+    telemetry_sample_rate = ConfigurationOption(
+        "telemetry_sample_rate", (
+            "The fraction of requests, from 0 to 1, for which to record "
+            "latency and database queries."),
+        Number(if_missing=0.0, accept_python=False, min=0, max=1))
+    telemetry_slow_request = ConfigurationOption(
+        "telemetry_slow_request", (
+            "The time, in seconds, at or above which a sampled request has "
+            "its SQL captured."),
+        Number(if_missing=2.0, accept_python=False, min=0))
@@ -5,15 +5,21 @@
 
 __all__ = [
     'configure_dhcp',
+    'DHCPConfigurationCache',
     'validate_dhcp_config',
     ]
 
 from collections import (
+    Counter,
     defaultdict,
     namedtuple,
 )
+from copy import deepcopy
+import hashlib
 from itertools import groupby
+import json
 from operator import itemgetter
+import threading
 from typing import (
     Iterable,
     Union,
@@ -76,6 +82,8 @@ from twisted.protocols import amp
 
 log = LegacyLogger()
 
+undefined = object()
+
 
 def get_omapi_key():
     """Return the OMAPI key for all DHCP servers that are ran by MAAS."""
@@ -461,16 +469,30 @@ def make_failover_peer_config(vlan, rack_controller):
     }
 
 
-@typed
-def get_dhcp_configure_for(
-        ip_version: int, rack_controller, vlan, subnets: list,
-        ntp_servers: Union[list, dict], domain, dhcp_snippets: Iterable=None):
-    """Get the DHCP configuration for `ip_version`."""
+def get_maas_dns_server_for(rack_controller, ip_version):
+    """Return the address of the MAAS DNS server for `ip_version`.
+
+    :return: An IP address, or `None` if it cannot be resolved.
+    """
     try:
-        maas_dns_server = get_dns_server_address(
+        return get_dns_server_address(
             rack_controller, ipv4=(ip_version == 4), ipv6=(ip_version == 6))
     except UnresolvableHost:
-        maas_dns_server = None
+        return None
+
+
+@typed
+def get_dhcp_configure_for(
+        ip_version: int, rack_controller, vlan, subnets: list,
+        ntp_servers: Union[list, dict], domain, dhcp_snippets: Iterable=None,
+        maas_dns_server=undefined):
+    """Get the DHCP configuration for `ip_version`.
+
+    :param maas_dns_server: The result of `get_maas_dns_server_for`, if it
+        is already known.
+    """
+    if maas_dns_server is undefined:
+        maas_dns_server = get_maas_dns_server_for(rack_controller, ip_version)
 
     # Select the best interface for this VLAN. This is an interface that
     # at least has an IP address.
@@ -511,11 +533,132 @@ def get_dhcp_configure_for(
         hosts, None if interface is None else interface.name)
 
 
+class DHCPConfigurationCache:
+    """Cache of the DHCP configuration for the VLANs of rack controllers.
+
+    Each entry holds what `get_dhcp_configure_for` returns for one VLAN and
+    IP version on one rack controller. An entry is also keyed on the inputs
+    that no trigger reports changes to, like the NTP servers and the set of
+    subnets on the VLAN. It is only reused while they are unchanged. The
+    other changes are reported by the `sys_dhcp_{id}` notifications, which
+    carry the ID of the affected VLAN. `RackControllerService` passes them
+    on to `invalidate`.
+
+    The cache also records a digest of the configuration that was last sent
+    to each rack controller, so that `configure_dhcp` can skip sending the
+    same configuration again. It is used from the reactor and from database
+    threads.
+    """
+
+    def __init__(self):
+        super(DHCPConfigurationCache, self).__init__()
+        # Incremented for a rack controller on every invalidation so that a
+        # configuration computed from data that has since changed is not
+        # cached; see `put`.
+        self.generations = Counter()
+        self.entries = {}
+        self.digests = {}
+        self.stats = Counter()
+        self.lock = threading.Lock()
+
+    def get_generation(self, rack_id):
+        """Return the generation to pass to `put`.
+
+        Read this before the data used to compute a configuration.
+        """
+        with self.lock:
+            return self.generations[rack_id]
+
+    def get(self, rack_id, vlan_id, ip_version, inputs):
+        """Return a copy of the cached configuration, or `None`."""
+        with self.lock:
+            entry = self.entries.get((rack_id, vlan_id, ip_version))
+            if entry is None or entry[0] != inputs:
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1
+        # The configuration is changed in place when downgrading it for
+        # older rack controllers; see `_perform_dhcp_config`.
+        return deepcopy(entry[1])
+
+    def put(self, generation, rack_id, vlan_id, ip_version, inputs, config):
+        """Cache the configuration for a VLAN and IP version.
+
+        Nothing is cached if the rack controller's entries have been
+        invalidated since `generation` was read.
+        """
+        config = deepcopy(config)
+        with self.lock:
+            if generation != self.generations[rack_id]:
+                self.stats["discarded"] += 1
+            else:
+                self.entries[rack_id, vlan_id, ip_version] = inputs, config
+
+    def invalidate(self, rack_id, vlan_ids=None):
+        """Remove the entries for a rack controller.
+
+        :param vlan_ids: Remove only the entries for these VLANs.
+        """
+        with self.lock:
+            self.generations[rack_id] += 1
+            for key in list(self.entries):
+                if key[0] == rack_id and (
+                        vlan_ids is None or key[1] in vlan_ids):
+                    del self.entries[key]
+                    self.stats["invalidations"] += 1
+
+    def forget(self, rack_id):
+        """Remove everything known about a rack controller.
+
+        Use this when the rack controller may no longer be running with the
+        configuration it was last sent, e.g. when it has reconnected.
+        """
+        self.invalidate(rack_id)
+        with self.lock:
+            self.digests.pop((rack_id, 4), None)
+            self.digests.pop((rack_id, 6), None)
+
+    def is_current(self, rack_id, ip_version, digest):
+        """Return whether `digest` is of the configuration last sent."""
+        with self.lock:
+            return self.digests.get((rack_id, ip_version)) == digest
+
+    def set_current(self, rack_id, ip_version, digest):
+        """Record the digest of the configuration last sent.
+
+        :param digest: The digest, or `None` if the rack controller failed
+            to apply the configuration.
+        """
+        with self.lock:
+            if digest is None:
+                self.digests.pop((rack_id, ip_version), None)
+            else:
+                self.digests[rack_id, ip_version] = digest
+
+
+def get_config_digest(config):
+    """Return a digest of the arguments for configuring a DHCP server."""
+    data = json.dumps(config, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
 @synchronous
 @transactional
-def get_dhcp_configuration(rack_controller, test_dhcp_snippet=None):
+def get_dhcp_configuration(
+        rack_controller, test_dhcp_snippet=None, cache=None):
     """Return tuple with IPv4 and IPv6 configurations for the
-    rack controller."""
+    rack controller.
+
+    :param cache: A `DHCPConfigurationCache` from which to reuse, and in
+        which to store, the configuration for each VLAN. It is not used when
+        testing a DHCP snippet.
+    """
+    if test_dhcp_snippet is not None:
+        cache = None
+    elif cache is not None:
+        # Read this before querying the database; see `put`.
+        generation = cache.get_generation(rack_controller.id)
+
     # Get list of all vlans that are being managed by the rack controller.
     vlans = gen_managed_vlans_for(rack_controller)
 
@@ -570,12 +713,35 @@ def get_dhcp_configuration(rack_controller, test_dhcp_snippet=None):
         ntp_servers = get_ntp_server_addresses_for_rack(rack_controller)
 
     default_domain = Domain.objects.get_default_domain()
+    maas_dns_servers = {}
+
+    def get_configure_for(ip_version, vlan, subnets):
+        if ip_version not in maas_dns_servers:
+            maas_dns_servers[ip_version] = get_maas_dns_server_for(
+                rack_controller, ip_version)
+        maas_dns_server = maas_dns_servers[ip_version]
+        if cache is None:
+            return get_dhcp_configure_for(
+                ip_version, rack_controller, vlan, subnets, ntp_servers,
+                default_domain, dhcp_snippets, maas_dns_server=maas_dns_server)
+        inputs = (
+            maas_dns_server, ntp_servers, default_domain.name,
+            vlan.primary_rack_id, vlan.secondary_rack_id,
+            [subnet.id for subnet in subnets])
+        config = cache.get(rack_controller.id, vlan.id, ip_version, inputs)
+        if config is None:
+            config = get_dhcp_configure_for(
+                ip_version, rack_controller, vlan, subnets, ntp_servers,
+                default_domain, dhcp_snippets, maas_dns_server=maas_dns_server)
+            cache.put(
+                generation, rack_controller.id, vlan.id, ip_version, inputs,
+                config)
+        return config
+
     for vlan, (subnets_v4, subnets_v6) in vlan_subnets.items():
         # IPv4
         if len(subnets_v4) > 0:
-            config = get_dhcp_configure_for(
-                4, rack_controller, vlan, subnets_v4, ntp_servers,
-                default_domain, dhcp_snippets)
+            config = get_configure_for(4, vlan, subnets_v4)
             failover_peer, subnets, hosts, interface = config
             if failover_peer is not None:
                 failover_peers_v4.append(failover_peer)
@@ -588,9 +754,7 @@ def get_dhcp_configuration(rack_controller, test_dhcp_snippet=None):
                 interfaces_v4.add(interface)
         # IPv6
         if len(subnets_v6) > 0:
-            config = get_dhcp_configure_for(
-                6, rack_controller, vlan, subnets_v6,
-                ntp_servers, default_domain, dhcp_snippets)
+            config = get_configure_for(6, vlan, subnets_v6)
             failover_peer, subnets, hosts, interface = config
             if failover_peer is not None:
                 failover_peers_v6.append(failover_peer)
@@ -621,9 +785,13 @@ DHCPConfigurationForRack = namedtuple("DHCPConfigurationForRack", (
 
 @asynchronous
 @inlineCallbacks
-def configure_dhcp(rack_controller):
+def configure_dhcp(rack_controller, cache=None):
     """Write the DHCP configuration files and restart the DHCP servers.
 
+    :param cache: A `DHCPConfigurationCache`. If given, the configuration for
+        each VLAN is reused from it where possible, and a configuration is
+        not sent to the rack controller if it is the same as the one last
+        sent successfully.
     :raises: :py:class:`~.exceptions.NoConnectionsAvailable` when there
         are no open connections to the specified cluster controller.
     """
@@ -639,7 +807,8 @@ def configure_dhcp(rack_controller):
     client = yield getClientFor(rack_controller.system_id)
 
     # Get configuration for both IPv4 and IPv6.
-    config = yield deferToDatabase(get_dhcp_configuration, rack_controller)
+    config = yield deferToDatabase(
+        get_dhcp_configuration, rack_controller, cache=cache)
 
     # Fix interfaces to go over the wire.
     interfaces_v4 = [
@@ -650,54 +819,80 @@ def configure_dhcp(rack_controller):
         {"name": name}
         for name in config.interfaces_v6
     ]
+    ipv4_args = dict(
+        failover_peers=config.failover_peers_v4, interfaces=interfaces_v4,
+        shared_networks=config.shared_networks_v4, hosts=config.hosts_v4,
+        global_dhcp_snippets=config.global_dhcp_snippets,
+        omapi_key=config.omapi_key)
+    ipv6_args = dict(
+        failover_peers=config.failover_peers_v6, interfaces=interfaces_v6,
+        shared_networks=config.shared_networks_v6, hosts=config.hosts_v6,
+        global_dhcp_snippets=config.global_dhcp_snippets,
+        omapi_key=config.omapi_key)
+    if cache is not None:
+        # Digest the arguments before they're downgraded for older racks.
+        ipv4_digest = get_config_digest(ipv4_args)
+        ipv6_digest = get_config_digest(ipv6_args)
 
     # Configure both IPv4 and IPv6.
     ipv4_exc, ipv6_exc = None, None
     ipv4_status, ipv6_status = SERVICE_STATUS.UNKNOWN, SERVICE_STATUS.UNKNOWN
 
-    try:
-        yield _perform_dhcp_config(
-            client, ConfigureDHCPv4_V2, ConfigureDHCPv4,
-            failover_peers=config.failover_peers_v4, interfaces=interfaces_v4,
-            shared_networks=config.shared_networks_v4, hosts=config.hosts_v4,
-            global_dhcp_snippets=config.global_dhcp_snippets,
-            omapi_key=config.omapi_key)
-    except Exception as exc:
-        ipv4_exc = exc
-        ipv4_status = SERVICE_STATUS.DEAD
-        log.err(
-            "Error configuring DHCPv4 on rack controller '%s': %s" % (
-                rack_controller.system_id, exc))
+    if cache is not None and cache.is_current(
+            rack_controller.id, 4, ipv4_digest):
+        log.msg(
+            "DHCPv4 configuration on rack controller '%s' is unchanged." % (
+                rack_controller.system_id))
     else:
+        try:
+            yield _perform_dhcp_config(
+                client, ConfigureDHCPv4_V2, ConfigureDHCPv4, **ipv4_args)
+        except Exception as exc:
+            ipv4_exc = exc
+            ipv4_status = SERVICE_STATUS.DEAD
+            ipv4_digest = None
+            log.err(
+                "Error configuring DHCPv4 on rack controller '%s': %s" % (
+                    rack_controller.system_id, exc))
+        else:
+            log.msg(
+                "Successfully configured DHCPv4 on rack controller '%s'." % (
+                    rack_controller.system_id))
+        if cache is not None:
+            cache.set_current(rack_controller.id, 4, ipv4_digest)
+    if ipv4_exc is None:
         if len(config.shared_networks_v4) > 0:
             ipv4_status = SERVICE_STATUS.RUNNING
         else:
             ipv4_status = SERVICE_STATUS.OFF
+
+    if cache is not None and cache.is_current(
+            rack_controller.id, 6, ipv6_digest):
         log.msg(
-            "Successfully configured DHCPv4 on rack controller '%s'." % (
+            "DHCPv6 configuration on rack controller '%s' is unchanged." % (
                 rack_controller.system_id))
-
-    try:
-        yield _perform_dhcp_config(
-            client, ConfigureDHCPv6_V2, ConfigureDHCPv6,
-            failover_peers=config.failover_peers_v6, interfaces=interfaces_v6,
-            shared_networks=config.shared_networks_v6, hosts=config.hosts_v6,
-            global_dhcp_snippets=config.global_dhcp_snippets,
-            omapi_key=config.omapi_key)
-    except Exception as exc:
-        ipv6_exc = exc
-        ipv6_status = SERVICE_STATUS.DEAD
-        log.err(
-            "Error configuring DHCPv6 on rack controller '%s': %s" % (
-                rack_controller.system_id, exc))
     else:
+        try:
+            yield _perform_dhcp_config(
+                client, ConfigureDHCPv6_V2, ConfigureDHCPv6, **ipv6_args)
+        except Exception as exc:
+            ipv6_exc = exc
+            ipv6_status = SERVICE_STATUS.DEAD
+            ipv6_digest = None
+            log.err(
+                "Error configuring DHCPv6 on rack controller '%s': %s" % (
+                    rack_controller.system_id, exc))
+        else:
+            log.msg(
+                "Successfully configured DHCPv6 on rack controller '%s'." % (
+                    rack_controller.system_id))
+        if cache is not None:
+            cache.set_current(rack_controller.id, 6, ipv6_digest)
+    if ipv6_exc is None:
         if len(config.shared_networks_v6) > 0:
             ipv6_status = SERVICE_STATUS.RUNNING
         else:
             ipv6_status = SERVICE_STATUS.OFF
-        log.msg(
-            "Successfully configured DHCPv6 on rack controller '%s'." % (
-                rack_controller.system_id))
 
     # Update the status for both services so the user is always seeing the
     # most up to date status.
@@ -214,6 +214,10 @@ TEMPLATES = [
 
 MIDDLEWARE_CLASSES = (
 
+    # Records latency and database queries for a sample of requests. Keep
+    # this first so that it sees every response.
+    'maasserver.middleware.RequestTelemetryMiddleware',
+
     # Used to append trailing slashes to URLs (APPEND_SLASH defaults on).
     'django.middleware.common.CommonMiddleware',
 
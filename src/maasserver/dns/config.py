@@ -8,6 +8,11 @@ __all__ = [
     'dns_update_all_zones',
     ]
 
+from datetime import timedelta
+from hashlib import sha256
+from subprocess import CalledProcessError
+import time
+
 from django.conf import settings
 from maasserver.dns.zonegenerator import ZoneGenerator
 from maasserver.enum import RDNS_MODE
@@ -16,17 +21,79 @@ from maasserver.models.dnspublication import DNSPublication
 from maasserver.models.domain import Domain
 from maasserver.models.subnet import Subnet
 from provisioningserver.dns.actions import (
+    bind_reconfigure,
     bind_reload,
     bind_reload_with_retries,
+    bind_reload_zones,
     bind_write_configuration,
     bind_write_options,
-    bind_write_zones,
 )
+from provisioningserver.dns.config import (
+    compose_config_path,
+    MAAS_NAMED_CONF_NAME,
+)
+from provisioningserver.dns.zoneconfig import DNSForwardZoneConfig
 from provisioningserver.logger import get_maas_logger
 
 
 maaslog = get_maas_logger("dns")
 
+# The source of a publication that demands every zone be rewritten.
+FORCE_RELOAD_SOURCE = "Force reload"
+
+# How often every zone is rewritten and BIND fully reloaded, whether or not
+# the zones appear to have changed. This is a consistency check: it puts
+# right zone files that have been changed or lost behind MAAS's back.
+FULL_RELOAD_INTERVAL = timedelta(hours=1).total_seconds()
+
+
+class PublishedZones:
+    """Remember what this process has published to BIND.
+
+    Zones are identified by the path of their zone file, and remembered by
+    a fingerprint of everything that goes into them except the serial. A
+    publication need only write and reload the zones whose fingerprints
+    have changed.
+    """
+
+    def __init__(self):
+        super(PublishedZones, self).__init__()
+        self.clear()
+
+    def clear(self):
+        """Forget everything so that the next publication is in full."""
+        self.fingerprints = {}
+        self.config = None
+        self.reloaded = None
+
+    def needs_full_reload(self):
+        """Is it time to rewrite and reload everything?"""
+        return (
+            self.reloaded is None or
+            time.monotonic() - self.reloaded > FULL_RELOAD_INTERVAL)
+
+
+published_zones = PublishedZones()
+
+
+def fingerprint(*things):
+    """Return a fingerprint of the `repr` of `things`."""
+    return sha256(repr(things).encode("utf-8")).hexdigest()
+
+
+def get_zone_fingerprint(zone, parameters):
+    """Return a fingerprint of a zone file's content, ignoring the serial.
+
+    :param zone: A `DomainConfigBase`.
+    :param parameters: The parameters for one of its zone files, as
+        generated by `get_zone_parameters`.
+    """
+    common = zone.make_parameters()
+    # These change with every publication; nothing else does unless the
+    # content of the zone has changed.
+    del common['serial'], common['modified']
+    return fingerprint(sorted(common.items()), sorted(parameters.items()))
+
 
 def current_zone_serial():
     return '%0.10d' % DNSPublication.objects.get_most_recent().serial
@@ -39,18 +106,25 @@ def is_dns_enabled():
 
 def dns_force_reload():
     """Force the DNS to be regenerated."""
-    DNSPublication(source="Force reload").save()
+    DNSPublication(source=FORCE_RELOAD_SOURCE).save()
 
 
 def dns_update_all_zones(reload_retry=False):
-    """Update all zone files for all domains.
+    """Update the zone files for all domains and subnets.
 
     Serving these zone files means updating BIND's configuration to include
     them, then asking it to load the new configuration.
 
+    Only those zones that have changed since they were last published by
+    this process are written, and BIND is asked to reload only those. Every
+    zone is written and BIND fully reloaded on the first publication, when
+    forced by `dns_force_reload`, and every `FULL_RELOAD_INTERVAL` seconds.
+
     :param reload_retry: Should the DNS server reload be retried in case
-        of failure? Defaults to `False`.
+        of failure? Defaults to `False`. This also forces a full reload.
     :type reload_retry: bool
+    :return: The serial, and the names of the domains whose zones were
+        reloaded with that serial.
     """
     if not is_dns_enabled():
         return
@@ -62,7 +136,31 @@ def dns_update_all_zones(reload_retry=False):
     zones = ZoneGenerator(
         domains, subnets, default_ttl,
         serial).as_list()
-    bind_write_zones(zones)
+
+    full_reload = (
+        reload_retry or published_zones.needs_full_reload() or
+        DNSPublication.objects.get_most_recent().source ==
+        FORCE_RELOAD_SOURCE)
+    if full_reload:
+        published_zones.clear()
+
+    # Write the zone files that have changed, which is all of them for a
+    # full reload. Zones are compared without their serial: that changes
+    # with every publication even if nothing else does.
+    fingerprints = {}
+    changed = []
+    for zone in zones:
+        for zone_info, parameters in zone.get_zone_parameters():
+            path = zone_info.target_path
+            fingerprints[path] = get_zone_fingerprint(zone, parameters)
+            if published_zones.fingerprints.get(path) != fingerprints[path]:
+                zone.write_zone_file(
+                    path, zone.make_parameters(), parameters)
+                changed.append((zone, zone_info))
+
+    upstream_dns = get_upstream_dns()
+    dnssec_validation = get_dnssec_validation()
+    trusted_networks = get_trusted_networks()
 
     # We should not be calling bind_write_options() here; call-sites should be
     # making a separate call. It's a historical legacy, where many sites now
@@ -70,31 +168,72 @@ def dns_update_all_zones(reload_retry=False):
     # some that call it for this side-effect alone. At present all it does is
     # set the upstream DNS servers, nothing to do with serving zones at all!
     bind_write_options(
-        upstream_dns=get_upstream_dns(),
-        dnssec_validation=get_dnssec_validation())
+        upstream_dns=upstream_dns,
+        dnssec_validation=dnssec_validation)
 
     # Nor should we be rewriting ACLs that are related only to allowing
     # recursive queries to the upstream DNS servers. Again, this is legacy,
     # where the "trusted" ACL ended up in the same configuration file as the
     # zone stanzas, and so both need to be rewritten at the same time.
-    bind_write_configuration(zones, trusted_networks=get_trusted_networks())
-
-    # Reloading with retries may be a legacy from Celery days, or it may be
-    # necessary to recover from races during start-up. We're not sure if it is
-    # actually needed but it seems safer to maintain this behaviour until we
-    # have a better understanding.
-    if reload_retry:
-        bind_reload_with_retries()
+    bind_write_configuration(zones, trusted_networks=trusted_networks)
+
+    config = fingerprint(
+        compose_config_path(MAAS_NAMED_CONF_NAME), sorted(fingerprints),
+        upstream_dns, dnssec_validation, trusted_networks)
+
+    if full_reload:
+        # Reloading with retries may be a legacy from Celery days, or it may
+        # be necessary to recover from races during start-up. We're not sure
+        # if it is actually needed but it seems safer to maintain this
+        # behaviour until we have a better understanding.
+        if reload_retry:
+            bind_reload_with_retries()
+        else:
+            bind_reload()
+        published_zones.reloaded = time.monotonic()
+        reloaded = set(domain.name for domain in domains)
     else:
-        bind_reload()
+        reloaded = {
+            zone.domain for zone, _ in changed
+            if isinstance(zone, DNSForwardZoneConfig)
+        }
+        if not reload_changes(config, changed):
+            # Try again in full with the next publication.
+            published_zones.clear()
+
+    published_zones.fingerprints = fingerprints
+    published_zones.config = config
 
     # Return the current serial and list of domain names.
     return serial, [
         domain.name
         for domain in domains
+        if domain.name in reloaded
     ]
 
 
+def reload_changes(config, changed):
+    """Ask BIND to load changes to its configuration and zones.
+
+    :param config: A fingerprint of BIND's configuration. If it differs from
+        that last published BIND is asked to reload its configuration, which
+        also loads new zones and drops those that have gone.
+    :param changed: A list of `(zone, zone_info)` tuples for the zone files
+        that have been written. BIND is asked to reload only these zones.
+    :return: True if BIND loaded the changes, False otherwise.
+    """
+    if config != published_zones.config:
+        try:
+            bind_reconfigure()
+        except CalledProcessError:
+            return False
+    if len(changed) == 0:
+        return True
+    else:
+        return bind_reload_zones([
+            zone_info.zone_name for _, zone_info in changed])
+
+
 def get_upstream_dns():
     """Return the IP addresses of configured upstream DNS servers.
 
@@ -17,8 +17,11 @@ from maasserver.dns.config import (
     current_zone_serial,
     dns_force_reload,
     dns_update_all_zones,
+    FULL_RELOAD_INTERVAL,
     get_trusted_networks,
     get_upstream_dns,
+    get_zone_fingerprint,
+    PublishedZones,
 )
 from maasserver.enum import (
     IPADDRESS_TYPE,
@@ -33,7 +36,11 @@ from maasserver.models.dnspublication import DNSPublication
 from maasserver.testing.config import RegionConfigurationFixture
 from maasserver.testing.factory import factory
 from maasserver.testing.testcase import MAASServerTestCase
-from maastesting.matchers import MockCalledOnceWith
+from maastesting.matchers import (
+    MockCalledOnce,
+    MockCalledOnceWith,
+    MockNotCalled,
+)
 from netaddr import IPAddress
 from provisioningserver.dns.config import (
     compose_config_path,
@@ -43,6 +50,7 @@ from provisioningserver.dns.testing import (
     patch_dns_config_path,
     patch_dns_rndc_port,
 )
+from provisioningserver.dns.zoneconfig import DNSForwardZoneConfig
 from provisioningserver.testing.bindfixture import (
     allocate_ports,
     BINDServer,
@@ -375,6 +383,136 @@ class TestIPv6DNS(TestDNSServer):
             node.hostname, node.domain.name, static.ip, version=6)
 
 
+class TestDNSUpdateAllZonesIncrementally(MAASServerTestCase):
+    """Tests for the incremental publication of zones.
+
+    These do not run BIND; they watch what it is asked to do.
+    """
+
+    def setUp(self):
+        super(TestDNSUpdateAllZonesIncrementally, self).setUp()
+        self.useFixture(RegionConfigurationFixture())
+        self.patch(settings, 'DNS_CONNECT', True)
+        patch_dns_config_path(self)
+        self.published_zones = PublishedZones()
+        self.patch(dns_config_module, "published_zones", self.published_zones)
+        self.bind_reload = self.patch_autospec(
+            dns_config_module, "bind_reload")
+        self.bind_reload_zones = self.patch_autospec(
+            dns_config_module, "bind_reload_zones")
+        self.bind_reload_zones.return_value = True
+        self.bind_reconfigure = self.patch_autospec(
+            dns_config_module, "bind_reconfigure")
+
+    def make_node_with_static_ip(self, domain):
+        subnet = factory.make_Subnet(cidr=str(factory.make_ipv4_network()))
+        node = factory.make_Node(
+            interface=True, status=NODE_STATUS.READY, domain=domain)
+        return factory.make_StaticIPAddress(
+            alloc_type=IPADDRESS_TYPE.AUTO,
+            ip=factory.pick_ip_in_Subnet(subnet),
+            subnet=subnet, interface=node.get_boot_interface())
+
+    def publish(self, source=None):
+        if source is None:
+            source = factory.make_name("source")
+        DNSPublication(source=source).save()
+        self.bind_reload.reset_mock()
+        self.bind_reload_zones.reset_mock()
+        self.bind_reconfigure.reset_mock()
+        return dns_update_all_zones()
+
+    def test_first_publication_reloads_everything(self):
+        domain = factory.make_Domain()
+        serial, domains = self.publish()
+        self.assertThat(self.bind_reload, MockCalledOnceWith())
+        self.assertThat(self.bind_reload_zones, MockNotCalled())
+        self.assertIn(domain.name, domains)
+        self.assertItemsEqual(
+            Domain.objects.filter(
+                authoritative=True).values_list("name", flat=True),
+            domains)
+
+    def test_unchanged_zones_are_not_written_or_reloaded(self):
+        self.publish()
+        write_zone_file = self.patch(
+            DNSForwardZoneConfig, "write_zone_file")
+        serial, domains = self.publish()
+        self.assertEqual(serial, current_zone_serial())
+        self.assertEqual([], domains)
+        self.assertThat(write_zone_file, MockNotCalled())
+        self.assertThat(self.bind_reload, MockNotCalled())
+        self.assertThat(self.bind_reload_zones, MockNotCalled())
+        self.assertThat(self.bind_reconfigure, MockNotCalled())
+
+    def test_only_changed_zones_are_reloaded(self):
+        domain = factory.make_Domain()
+        other_domain = factory.make_Domain()
+        self.publish()
+        self.make_node_with_static_ip(domain)
+        serial, domains = self.publish()
+        self.assertEqual([domain.name], domains)
+        self.assertThat(self.bind_reload, MockNotCalled())
+        self.assertThat(self.bind_reload_zones, MockCalledOnce())
+        [zone_names] = self.bind_reload_zones.call_args[0]
+        self.assertIn(domain.name, zone_names)
+        self.assertNotIn(other_domain.name, zone_names)
+        # The new subnet brings a new reverse zone, so BIND's configuration
+        # must be reloaded too.
+        self.assertThat(self.bind_reconfigure, MockCalledOnceWith())
+
+    def test_changed_zones_are_written_with_new_serial(self):
+        domain = factory.make_Domain()
+        self.publish()
+        self.make_node_with_static_ip(domain)
+        serial, _ = self.publish()
+        self.assertThat(
+            compose_config_path("zone.%s" % domain.name),
+            FileContains(matcher=Contains(serial)))
+
+    def test_new_domains_reconfigure_bind(self):
+        self.publish()
+        domain = factory.make_Domain()
+        serial, domains = self.publish()
+        self.assertEqual([domain.name], domains)
+        self.assertThat(self.bind_reconfigure, MockCalledOnceWith())
+        self.assertThat(
+            self.bind_reload_zones, MockCalledOnceWith([domain.name]))
+
+    def test_force_reload_reloads_everything(self):
+        self.publish()
+        self.publish(source="Force reload")
+        self.assertThat(self.bind_reload, MockCalledOnceWith())
+
+    def test_reloads_everything_periodically(self):
+        self.publish()
+        self.published_zones.reloaded -= FULL_RELOAD_INTERVAL + 1
+        self.publish()
+        self.assertThat(self.bind_reload, MockCalledOnceWith())
+
+    def test_reloads_everything_after_failing_to_reload_zones(self):
+        self.publish()
+        factory.make_Domain()
+        self.bind_reload_zones.return_value = False
+        self.publish()
+        self.assertThat(self.bind_reload, MockNotCalled())
+        self.publish()
+        self.assertThat(self.bind_reload, MockCalledOnceWith())
+
+    def test_get_zone_fingerprint_ignores_serial(self):
+        domain = factory.make_name("domain")
+        zone1 = DNSForwardZoneConfig(domain, serial=1)
+        zone2 = DNSForwardZoneConfig(domain, serial=2)
+        zone3 = DNSForwardZoneConfig(domain, serial=1, default_ttl=99)
+        [(_, parameters)] = zone1.get_zone_parameters()
+        self.assertEqual(
+            get_zone_fingerprint(zone1, parameters),
+            get_zone_fingerprint(zone2, parameters))
+        self.assertNotEqual(
+            get_zone_fingerprint(zone1, parameters),
+            get_zone_fingerprint(zone3, parameters))
+
+
 class TestGetUpstreamDNS(MAASServerTestCase):
     """Test for maasserver/dns/config.py:get_upstream_dns()"""
 
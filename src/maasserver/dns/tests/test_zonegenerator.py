@@ -20,9 +20,12 @@ from maasserver.dns import zonegenerator
 from maasserver.dns.zonegenerator import (
     get_dns_search_paths,
     get_dns_server_address,
+    get_dynamic_ranges,
     get_hostname_dnsdata_mapping,
     get_hostname_ip_mapping,
+    get_hostname_ip_mappings,
     lazydict,
+    ReverseMappingIndex,
     warn_loopback,
     WARNING_MESSAGE,
     ZoneGenerator,
@@ -47,6 +50,7 @@ from maasserver.testing.testcase import (
     MAASTransactionServerTestCase,
 )
 from maasserver.utils.orm import transactional
+from maastesting.djangotestcase import count_queries
 from maastesting.factory import factory as maastesting_factory
 from maastesting.fakemethod import FakeMethod
 from maastesting.matchers import (
@@ -251,6 +255,92 @@ class TestGetHostnameMapping(MAASServerTestCase):
             expected_mapping.items(), actual.items())
 
 
+class TestGetHostnameIPMappings(MAASServerTestCase):
+    """Tests for `get_hostname_ip_mappings`."""
+
+    def test__returns_mappings_for_domains_and_subnets(self):
+        domain = factory.make_Domain()
+        subnet = factory.make_Subnet()
+        factory.make_Node_with_Interface_on_Subnet(
+            subnet=subnet, domain=domain)
+        factory.make_Node_with_Interface_on_Subnet(subnet=subnet)
+        mappings = get_hostname_ip_mappings()
+        self.assertEqual(
+            get_hostname_ip_mapping(domain), mappings[domain])
+        self.assertEqual(
+            get_hostname_ip_mapping(subnet), mappings[subnet])
+        self.assertEqual(
+            get_hostname_ip_mapping(subnet), mappings['reverse'])
+
+    def test__reads_database_once(self):
+        domains = [factory.make_Domain() for _ in range(3)]
+        for domain in domains:
+            factory.make_Node_with_Interface_on_Subnet(domain=domain)
+        mappings = get_hostname_ip_mappings()
+        mappings[domains[0]]  # Reads the snapshot.
+        count, _ = count_queries(
+            lambda: [mappings[domain] for domain in domains[1:]])
+        self.assertEqual(0, count)
+        count, _ = count_queries(lambda: mappings['reverse'])
+        self.assertEqual(0, count)
+
+
+class TestGetDynamicRanges(MAASServerTestCase):
+    """Tests for `get_dynamic_ranges`."""
+
+    def test__returns_dynamic_ranges_by_subnet(self):
+        subnets = [
+            factory.make_ipv4_Subnet_with_IPRanges() for _ in range(3)]
+        dynamic_ranges = get_dynamic_ranges()
+        self.assertEqual({
+            subnet.id: list(subnet.get_dynamic_ranges().order_by("id"))
+            for subnet in subnets
+        }, dynamic_ranges)
+
+
+class TestReverseMappingIndex(TestCase):
+    """Tests for `ReverseMappingIndex`."""
+
+    def test__returns_only_addresses_in_network(self):
+        mapping = {
+            "one.maas": HostnameIPMapping(
+                "abcdef", 30, {"10.0.0.1", "10.0.1.1"}, 0),
+            "two.maas": HostnameIPMapping(None, 60, {"10.0.1.2"}, None),
+            "three.maas": HostnameIPMapping(None, 60, {"fe80::1"}, None),
+        }
+        index = ReverseMappingIndex(mapping)
+        self.assertEqual({
+            "one.maas": HostnameIPMapping("abcdef", 30, {"10.0.0.1"}, 0),
+        }, index.get_mapping(IPNetwork("10.0.0.0/24")))
+        self.assertEqual({
+            "one.maas": HostnameIPMapping("abcdef", 30, {"10.0.1.1"}, 0),
+            "two.maas": HostnameIPMapping(None, 60, {"10.0.1.2"}, None),
+        }, index.get_mapping(IPNetwork("10.0.1.0/24")))
+        self.assertEqual({
+            "one.maas": mapping["one.maas"],
+            "two.maas": mapping["two.maas"],
+        }, index.get_mapping(IPNetwork("10.0.0.0/8")))
+
+    def test__separates_address_families(self):
+        mapping = {
+            "four.maas": HostnameIPMapping(None, 30, {"0.0.0.1"}, None),
+            "six.maas": HostnameIPMapping(None, 30, {"::1"}, None),
+        }
+        index = ReverseMappingIndex(mapping)
+        self.assertEqual(
+            {"six.maas": mapping["six.maas"]},
+            index.get_mapping(IPNetwork("::/64")))
+        self.assertEqual(
+            {"four.maas": mapping["four.maas"]},
+            index.get_mapping(IPNetwork("0.0.0.0/8")))
+
+    def test__returns_empty_mapping_for_network_without_addresses(self):
+        index = ReverseMappingIndex({
+            "one.maas": HostnameIPMapping(None, 30, {"10.0.0.1"}, None),
+        })
+        self.assertEqual({}, index.get_mapping(IPNetwork("192.168.0.0/16")))
+
+
 def forward_zone(domain):
     """Create a matcher for a :class:`DNSForwardZoneConfig`.
 
@@ -551,6 +641,22 @@ class TestZoneGenerator(MAASServerTestCase):
             domains, subnets, serial=random.randint(0, 65535)).as_list()
         self.assertThat(actual_zones, MatchesSetwise(*expected_zones))
 
+    def test_query_count_does_not_depend_on_number_of_subnets(self):
+        domain = factory.make_Domain()
+
+        def count_zone_queries():
+            zones = ZoneGenerator(
+                domain, Subnet.objects.all(),
+                serial=random.randint(0, 65535))
+            return count_queries(zones.as_list)[0]
+
+        factory.make_ipv4_Subnet_with_IPRanges()
+        count_few = count_zone_queries()
+        for _ in range(3):
+            factory.make_ipv4_Subnet_with_IPRanges()
+        count_many = count_zone_queries()
+        self.assertEqual(count_few, count_many)
+
     def test_zone_generator_handles_rdns_mode_equal_enabled(self):
         Domain.objects.get_or_create(name="one")
         subnet = factory.make_Subnet(cidr="10.0.0.0/29")
@@ -8,6 +8,10 @@ __all__ = [
     ]
 
 
+from bisect import (
+    bisect_left,
+    bisect_right,
+)
 import collections
 from itertools import chain
 import socket
@@ -22,8 +26,11 @@ from maasserver.models.config import Config
 from maasserver.models.dnsdata import DNSData
 from maasserver.models.dnsresource import separate_fqdn
 from maasserver.models.domain import Domain
-from maasserver.models.staticipaddress import StaticIPAddress
-from maasserver.models.subnet import Subnet
+from maasserver.models.iprange import IPRange
+from maasserver.models.staticipaddress import (
+    HostnameIPMapping,
+    StaticIPAddress,
+)
 from maasserver.server_address import get_maas_facing_server_addresses
 from netaddr import (
     IPAddress,
@@ -75,6 +82,77 @@ def get_hostname_ip_mapping(domain_or_subnet):
     return StaticIPAddress.objects.get_hostname_ip_mapping(domain_or_subnet)
 
 
+def get_hostname_ip_mappings():
+    """Return a `lazydict` of hostname mappings for domains and subnets.
+
+    All of the mappings come from one `HostnameIPMappingSnapshot`, which is
+    read from the database when the first of them is needed. A `Domain` key
+    gets the mapping for that domain's forward zone. Any other key, such as
+    a `Subnet`, gets the mapping for the reverse zones, which is the same
+    for every subnet.
+    """
+    snapshot = None
+
+    def get_mapping(domain_or_subnet):
+        nonlocal snapshot
+        if snapshot is None:
+            snapshot = (
+                StaticIPAddress.objects.get_hostname_ip_mapping_snapshot())
+        if isinstance(domain_or_subnet, Domain):
+            return snapshot.get_mapping(domain_or_subnet)
+        else:
+            return snapshot.get_reverse_mapping()
+
+    return lazydict(get_mapping)
+
+
+def get_dynamic_ranges():
+    """Return the dynamic `IPRange`s of all subnets, by subnet ID."""
+    dynamic_ranges = collections.defaultdict(list)
+    ip_ranges = IPRange.objects.filter(
+        type=IPRANGE_TYPE.DYNAMIC).order_by("subnet_id", "id")
+    for ip_range in ip_ranges:
+        dynamic_ranges[ip_range.subnet_id].append(ip_range)
+    return dynamic_ranges
+
+
+class ReverseMappingIndex:
+    """Index a reverse hostname mapping by address.
+
+    `DNSReverseZoneConfig` drops the addresses in its mapping that are not
+    in its network, so giving it the whole mapping means looking at every
+    address once for every reverse zone. This instead finds the addresses
+    within a network by bisection.
+    """
+
+    def __init__(self, mapping):
+        self.mapping = mapping
+        entries = sorted(
+            (address.version, address.value, hostname, ip)
+            for hostname, info in mapping.items()
+            for ip in info.ips
+            for address in [IPAddress(ip)])
+        self.keys = [(version, value) for version, value, _, _ in entries]
+        self.names = [(hostname, ip) for _, _, hostname, ip in entries]
+
+    def get_mapping(self, network):
+        """Return the entries of the mapping with addresses in `network`.
+
+        :type network: :class:`netaddr.IPNetwork`
+        """
+        start = bisect_left(self.keys, (network.version, network.first))
+        end = bisect_right(self.keys, (network.version, network.last))
+        mapping = {}
+        for hostname, ip in self.names[start:end]:
+            if hostname in mapping:
+                mapping[hostname].ips.add(ip)
+            else:
+                info = self.mapping[hostname]
+                mapping[hostname] = HostnameIPMapping(
+                    info.system_id, info.ttl, {ip}, info.node_type)
+        return mapping
+
+
 def get_hostname_dnsdata_mapping(domain):
     """Return a mapping {hostnames -> info} for the allocated nodes in
     `domain`.  Info contains: system_id and rrsets (which contain (ttl, rrtype,
@@ -187,7 +265,7 @@ class ZoneGenerator:
     @staticmethod
     def _get_mappings():
         """Return a lazily evaluated mapping dict."""
-        return lazydict(get_hostname_ip_mapping)
+        return get_hostname_ip_mappings()
 
     @staticmethod
     def _get_rrset_mappings():
@@ -197,7 +275,7 @@ class ZoneGenerator:
     @staticmethod
     def _gen_forward_zones(
             domains, serial, ns_host_name, mappings,
-            rrset_mappings, default_ttl):
+            rrset_mappings, default_ttl, dynamic_ranges):
         """Generator of forward zones, collated by domain name."""
         dns_ip_list = get_dns_server_addresses()
         domains = set(domains)
@@ -226,17 +304,14 @@ class ZoneGenerator:
                 other_mapping, ns_host_name, dns_ip_list, default_ttl)
 
             # 3. All of the special handling for the default domain.
-            dynamic_ranges = []
+            forward_dynamic_ranges = []
             if domain.is_default():
                 # 3a. All forward entries for the managed and unmanaged dynamic
                 # ranges go into the default domain.
-                subnets = Subnet.objects.all().prefetch_related("iprange_set")
-                for subnet in subnets:
-                    # We loop through the whole set so the prefetch above works
-                    # in one query.
-                    for ip_range in subnet.iprange_set.all():
-                        if ip_range.type == IPRANGE_TYPE.DYNAMIC:
-                            dynamic_ranges.append(ip_range.get_MAASIPRange())
+                for subnet_id in sorted(dynamic_ranges):
+                    for ip_range in dynamic_ranges[subnet_id]:
+                        forward_dynamic_ranges.append(
+                            ip_range.get_MAASIPRange())
                 # 3b. Add A/AAAA RRset for @.  If glue is needed for any other
                 # domain, adding the glue is the responsibility of the admin.
                 ttl = domain.get_base_ttl('A', default_ttl)
@@ -256,12 +331,13 @@ class ZoneGenerator:
                 mapping=mapping,
                 ns_host_name=ns_host_name,
                 other_mapping=other_mapping,
-                dynamic_ranges=dynamic_ranges,
+                dynamic_ranges=forward_dynamic_ranges,
                 )
 
     @staticmethod
     def _gen_reverse_zones(
-            subnets, serial, ns_host_name, mappings, default_ttl):
+            subnets, serial, ns_host_name, mappings, default_ttl,
+            dynamic_ranges):
         """Generator of reverse zones, sorted by network."""
 
         subnets = set(subnets)
@@ -288,10 +364,10 @@ class ZoneGenerator:
                         IPNetwork("%s/124" % network.network).network)
                     rfc2317_glue.setdefault(basenet, set()).add(network)
 
-        # Since get_hostname_ip_mapping(Subnet) ignores Subnet.id, so we can
-        # just do it once and be happy.  LP#1600259
+        # The reverse mapping is the same for every subnet, so we can just
+        # get it once and be happy.  LP#1600259
         if len(subnets):
-            mappings['reverse'] = mappings[Subnet.objects.first()]
+            reverse_index = ReverseMappingIndex(mappings['reverse'])
 
         # For each of the zones that we are generating (one or more per
         # subnet), compile the zone from:
@@ -315,17 +391,16 @@ class ZoneGenerator:
                 continue
 
             # 1. Figure out the dynamic ranges.
-            dynamic_ranges = [
+            subnet_dynamic_ranges = [
                 ip_range.netaddr_iprange
-                for ip_range in subnet.get_dynamic_ranges()
+                for ip_range in dynamic_ranges[subnet.id]
             ]
 
             # 2. Start with the map of all of the nodes, including all
-            # DNSResource-associated addresses.  We will prune this to just
-            # entries for the subnet when we actually generate the zonefile.
-            # If we get here, then we have subnets, so we noticed that above
-            # and created mappings['reverse'].  LP#1600259
-            mapping = mappings['reverse']
+            # DNSResource-associated addresses, pruned to just the entries
+            # for the subnet.  If we get here, then we have subnets, so we
+            # noticed that above and indexed mappings['reverse'].
+            mapping = reverse_index.get_mapping(network)
 
             # Use the default_domain as the name for the NS host in the reverse
             # zones.  If this network is actually a parent rfc2317 glue
@@ -351,7 +426,7 @@ class ZoneGenerator:
                 default_ttl=default_ttl,
                 ns_host_name=ns_host_name,
                 mapping=mapping, network=IPNetwork(subnet.cidr),
-                dynamic_ranges=dynamic_ranges,
+                dynamic_ranges=subnet_dynamic_ranges,
                 rfc2317_ranges=glue,
             )
         # Now provide any remaining rfc2317 glue networks.
@@ -378,12 +453,14 @@ class ZoneGenerator:
         rrset_mappings = self._get_rrset_mappings()
         serial = self.serial
         default_ttl = self.default_ttl
+        dynamic_ranges = get_dynamic_ranges()
         return chain(
             self._gen_forward_zones(
                 self.domains, serial, ns_host_name, mappings,
-                rrset_mappings, default_ttl),
+                rrset_mappings, default_ttl, dynamic_ranges),
             self._gen_reverse_zones(
-                self.subnets, serial, ns_host_name, mappings, default_ttl),
+                self.subnets, serial, ns_host_name, mappings, default_ttl,
+                dynamic_ranges),
             )
 
     def as_list(self):
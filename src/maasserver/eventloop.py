@@ -151,6 +151,18 @@ def make_ReverseDNSService(postgresListener):
     return ReverseDNSService(postgresListener)
 
 
+def make_BootConfigCacheService(postgresListener):
+    from maasserver.regiondservices.boot_config_cache import (
+        BootConfigCacheService
+    )
+    return BootConfigCacheService(postgresListener)
+
+
+def make_ProcessStatsService():
+    from maasserver.regiondservices.process_stats import ProcessStatsService
+    return ProcessStatsService()
+
+
 def make_NetworkTimeProtocolService():
     from maasserver.regiondservices import ntp
     return ntp.RegionNetworkTimeProtocolService(reactor)
@@ -288,6 +300,16 @@ class RegionEventLoop:
             "factory": make_NetworkTimeProtocolService,
             "requires": [],
         },
+        "boot-config-cache": {
+            "only_on_master": False,
+            "factory": make_BootConfigCacheService,
+            "requires": ["postgres-listener"],
+        },
+        "process-stats": {
+            "only_on_master": False,
+            "factory": make_ProcessStatsService,
+            "requires": [],
+        },
     }
 
     def __init__(self):
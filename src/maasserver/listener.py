@@ -8,9 +8,14 @@ __all__ = [
     "PostgresListenerService",
     ]
 
-from collections import defaultdict
+from collections import (
+    Counter,
+    defaultdict,
+    OrderedDict,
+)
 from contextlib import closing
 from errno import ENOENT
+from functools import partial
 
 from django.db import connections
 from django.db.utils import load_backend
@@ -82,16 +87,34 @@ class PostgresListenerService(Service, object):
 
     # Seconds to wait to handle new notifications. When the notifications set
     # is empty it will wait this amount of time to check again for new
-    # notifications.
+    # notifications. This is also the window in which repeated notifications
+    # for the same object are coalesced into one.
     HANDLE_NOTIFY_DELAY = 0.5
 
+    # Seconds to spend dispatching queued notifications in each tick. Once
+    # exceeded, the remaining notifications are left for the next tick.
+    HANDLE_NOTIFY_TIME_SLICE = 0.2
+
+    # Maximum number of distinct notifications to hold in the queue. When
+    # reached, the listener stops reading from the database connection until
+    # the queue has drained to half this size; PostgreSQL holds the pending
+    # notifications meanwhile. System channels are delayed too in this case.
+    MAX_PENDING_NOTIFICATIONS = 10000
+
     def __init__(self, alias="default"):
         self.alias = alias
         self.listeners = defaultdict(list)
+        self.batchHandlers = set()
         self.autoReconnect = False
         self.connection = None
         self.connectionFileno = None
-        self.notifications = set()
+        self.readingPaused = False
+        # Ordered, so that notifications are handled in the order in which
+        # they were first received; keyed, to remove duplicates.
+        self.notifications = OrderedDict()
+        # Counts of notifications queued, coalesced, and dispatched, and of
+        # how often the queue has exerted back-pressure.
+        self.stats = Counter()
         self.notifier = task.LoopingCall(self.handleNotifies)
         self.notifierDone = None
         self.connecting = None
@@ -150,7 +173,7 @@ class PostgresListenerService(Service, object):
             #
             self.loseConnection(Failure(error.ConnectionLost()))
         else:
-            # Add each notify to to the notifications set. This removes
+            # Add each notify to to the notifications queue. This removes
             # duplicate notifications when one entity in the database is
             # updated multiple times in a short interval. Accumulating
             # notifications and allowing the listener to pick them up in
@@ -178,11 +201,23 @@ class PostgresListenerService(Service, object):
                     else:
                         # Place non-system messages into the queue to be
                         # processed.
-                        self.notifications.add(
-                            (notify.channel, notify.payload))
+                        self.queueNotification(notify.channel, notify.payload)
                 # Delete the contents of the connection's notifies list so
                 # that we don't process them a second time.
                 del notifies[:]
+                if len(self.notifications) >= self.MAX_PENDING_NOTIFICATIONS:
+                    self.pauseReading()
+
+    def queueNotification(self, channel, payload):
+        """Queue a notification, coalescing it with one already queued."""
+        notification = channel, payload
+        if notification in self.notifications:
+            self.stats["coalesced"] += 1
+        else:
+            self.notifications[notification] = None
+            self.stats["queued"] += 1
+            self.stats["max_pending"] = max(
+                self.stats["max_pending"], len(self.notifications))
 
     def fileno(self):
         """Return the fileno of the connection."""
@@ -191,10 +226,16 @@ class PostgresListenerService(Service, object):
     def startReading(self):
         """Add this listener to the reactor."""
         self.connectionFileno = self.connection.connection.fileno()
+        self.readingPaused = False
         reactor.addReader(self)
 
     def stopReading(self):
         """Remove this listener from the reactor."""
+        if self.readingPaused:
+            # Already removed from the reactor by `pauseReading`.
+            self.readingPaused = False
+            self.connectionFileno = None
+            return
         try:
             reactor.removeReader(self)
         except IOError as error:
@@ -206,11 +247,34 @@ class PostgresListenerService(Service, object):
         finally:
             self.connectionFileno = None
 
-    def register(self, channel, handler):
+    def pauseReading(self):
+        """Stop reading notifications until the queue has drained.
+
+        See `MAX_PENDING_NOTIFICATIONS`.
+        """
+        if not self.readingPaused and self.connectionFileno is not None:
+            self.log.warn(
+                "Notification queue is full ({count} pending); pausing.",
+                count=len(self.notifications))
+            reactor.removeReader(self)
+            self.readingPaused = True
+            self.stats["paused"] += 1
+
+    def resumeReading(self):
+        """Resume reading notifications after `pauseReading`."""
+        if self.readingPaused:
+            self.readingPaused = False
+            reactor.addReader(self)
+
+    def register(self, channel, handler, batch=False):
         """Register listening for notifications from a channel.
 
         When a notification is received for that `channel` the `handler` will
         be called with the action and object id.
+
+        :param batch: If true, `handler` is instead called with the action and
+            a list of object ids: all those queued for `channel` and that
+            action at the time. Not supported for system channels.
         """
         handlers = self.listeners[channel]
         if self.isSystemChannel(channel) and len(handlers) > 0:
@@ -221,8 +285,13 @@ class PostgresListenerService(Service, object):
             # for all to resolve before continuing to the next event.
             raise PostgresListenerRegistrationError(
                 "System channel '%s' has already been registered." % channel)
+        elif self.isSystemChannel(channel) and batch:
+            raise PostgresListenerRegistrationError(
+                "System channel '%s' cannot have a batch handler." % channel)
         else:
             handlers.append(handler)
+            if batch:
+                self.batchHandlers.add((channel, handler))
         if self.registeredChannels and self.connection:
             # Channels have already been registered. Register the
             # new channel on the already existing connection.
@@ -239,6 +308,7 @@ class PostgresListenerService(Service, object):
         handlers = self.listeners[channel]
         if handler in handlers:
             handlers.remove(handler)
+            self.batchHandlers.discard((channel, handler))
         else:
             raise PostgresListenerUnregistrationError(
                 "Handler is not registered on that channel '%s'." % channel)
@@ -408,17 +478,40 @@ class PostgresListenerService(Service, object):
             return succeed(None)
 
     def handleNotifies(self, clock=reactor):
-        """Process all notify message in the notifications set."""
-        def gen_notifications(notifications):
-            while len(notifications) != 0:
-                yield notifications.pop()
-        return task.coiterate(
-            self.handleNotify(notification, clock=clock)
-            for notification in gen_notifications(self.notifications))
+        """Process the notify messages in the notifications queue.
 
-    def handleNotify(self, notification, clock=reactor):
-        """Process a notify message in the notifications set."""
-        channel, payload = notification
+        Notifications are grouped by channel and action so that a batch
+        handler is called once with all the object ids in a group. Groups are
+        dispatched in the order their first notification was received until
+        `HANDLE_NOTIFY_TIME_SLICE` has passed; the rest wait for the next
+        tick.
+        """
+        groups = OrderedDict()
+        for channel, payload in self.notifications:
+            groups.setdefault(channel, []).append(payload)
+        started = clock.seconds()
+
+        def gen_groups():
+            for channel, payloads in groups.items():
+                if clock.seconds() - started >= self.HANDLE_NOTIFY_TIME_SLICE:
+                    self.stats["deferred_to_next_tick"] += 1
+                    break
+                for payload in payloads:
+                    self.notifications.pop((channel, payload), None)
+                self.stats["dispatched"] += len(payloads)
+                yield self.handleNotifyGroup(channel, payloads, clock=clock)
+            if len(self.notifications) <= self.MAX_PENDING_NOTIFICATIONS // 2:
+                self.resumeReading()
+
+        return task.coiterate(gen_groups())
+
+    def handleNotifyGroup(self, channel, payloads, clock=reactor):
+        """Process notify messages for one channel in the notifications queue.
+
+        :param channel: The channel, as received from the database, i.e. with
+            the action as a suffix.
+        :param payloads: A list of payloads, in the order received.
+        """
         try:
             channel, action = self.convertChannel(channel)
         except PostgresListenerNotifyError:
@@ -429,12 +522,25 @@ class PostgresListenerService(Service, object):
         else:
             defers = []
             handlers = self.listeners[channel]
-            # XXX: There could be an arbitrary number of listeners. Should we
-            # limit concurrency here? Perhaps even do one at a time.
             for handler in handlers:
-                d = defer.maybeDeferred(handler, action, payload)
-                d.addErrback(lambda failure: self.log.failure(
-                    "Failure while handling notification to {channel!r}: "
-                    "{payload!r}", failure, channel=channel, payload=payload))
-                defers.append(d)
+                if (channel, handler) in self.batchHandlers:
+                    calls = [payloads]
+                    self.stats["batches"] += 1
+                else:
+                    calls = payloads
+                for payload in calls:
+                    d = defer.maybeDeferred(handler, action, payload)
+                    d.addErrback(partial(
+                        self._logHandlerFailure, channel, payload))
+                    defers.append(d)
             return defer.DeferredList(defers)
+
+    def _logHandlerFailure(self, channel, payload, failure):
+        self.log.failure(
+            "Failure while handling notification to {channel!r}: "
+            "{payload!r}", failure, channel=channel, payload=payload)
+
+    def handleNotify(self, notification, clock=reactor):
+        """Process a notify message in the notifications set."""
+        channel, payload = notification
+        return self.handleNotifyGroup(channel, [payload], clock=clock)
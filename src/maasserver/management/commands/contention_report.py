@@ -0,0 +1,110 @@
+# Copyright 2017 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Django command: report transactions retried because of contention."""
+
+__all__ = [
+    'Command',
+    ]
+
+from datetime import datetime
+import json
+
+from django.core.management.base import BaseCommand
+from maasserver.regiondservices.process_stats import read_process_stats
+from maasserver.utils.contention import merge_stats
+
+
+# The kinds of conflict counted for each callsite; see
+# `maasserver.utils.orm.get_conflict_kind`.
+CONFLICT_KINDS = ("serialization_failure", "deadlock", "unique_violation")
+
+
+def format_callsites(callsites):
+    """Yield lines describing each callsite, those losing most time first."""
+    yield "%-50s %7s %7s %8s %9s %6s %8s %6s" % (
+        "callsite", "calls", "retries", "failures", "lost (s)",
+        "serial", "deadlock", "unique")
+    ordered = sorted(
+        callsites.items(), key=lambda item: item[1].get("time_lost", 0),
+        reverse=True)
+    for callsite, counts in ordered:
+        yield "%-50s %7d %7d %8d %9.2f %6d %8d %6d" % (
+            (callsite, counts.get("calls", 0), counts.get("retries", 0),
+             counts.get("failures", 0), counts.get("time_lost", 0)) +
+            tuple(counts.get(kind, 0) for kind in CONFLICT_KINDS))
+
+
+def format_relations(relations):
+    """Yield lines describing the relations most often in conflict."""
+    yield "%-50s %9s" % ("relation", "conflicts")
+    ordered = sorted(
+        relations.items(), key=lambda item: item[1], reverse=True)
+    for relation, count in ordered:
+        yield "%-50s %9d" % (relation, count)
+
+
+def format_samples(samples):
+    """Yield lines describing each sampled conflict, most recent last."""
+    yield "%-19s %-21s %-30s %-20s %s" % (
+        "time", "kind", "relation", "row", "callsite")
+    for sample in samples:
+        yield "%-19s %-21s %-30s %-20s %s" % (
+            datetime.fromtimestamp(sample["time"]).strftime(
+                "%Y-%m-%d %H:%M:%S"),
+            sample["kind"], sample["relation"] or "-", sample["row"] or "-",
+            sample["callsite"])
+
+
+def format_limiters(processes):
+    """Yield lines describing the database limiter in each process."""
+    yield "%-8s %5s %6s %12s %12s %9s" % (
+        "pid", "limit", "in use", "latency (s)", "baseline (s)",
+        "conflicts")
+    for process in processes:
+        limiter = process["limiter"]
+        yield "%-8d %5d %6d %12s %12s %9d" % (
+            process["pid"], limiter["limit"], limiter["in_use"],
+            format_seconds(limiter["latency"]),
+            format_seconds(limiter["baseline"]), limiter["conflicts"])
+
+
+def format_seconds(seconds):
+    return "-" if seconds is None else "%.3f" % seconds
+
+
+class Command(BaseCommand):
+    help = (
+        "Report which code paths in the running region processes retry "
+        "transactions because of serialization failures, deadlocks, and "
+        "unique violations, how much time that loses, and, where sampled, "
+        "which relations the conflicts were on. Statistics are published "
+        "by each process every 30 seconds, and are reset when it restarts.")
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            '--json', action='store_true', dest='json', default=False,
+            help="Print the merged statistics as JSON.")
+        parser.add_argument(
+            '--samples', type=int, dest='samples', default=10,
+            help="Number of recently sampled conflicts to show. "
+                 "Defaults to 10.")
+
+    def handle(self, *args, **options):
+        processes = read_process_stats()
+        retries = merge_stats(
+            [process["retries"] for process in processes],
+            samples=options["samples"])
+        if options["json"]:
+            return json.dumps(retries, indent=2, sort_keys=True)
+        elif len(processes) == 0:
+            return "No statistics have been published by region processes."
+        else:
+            sections = [
+                format_callsites(retries["callsites"]),
+                format_relations(retries["relations"]),
+                format_samples(retries["samples"]),
+                format_limiters(processes),
+            ]
+            return "\n\n".join("\n".join(lines) for lines in sections)
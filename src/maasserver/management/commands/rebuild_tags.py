@@ -0,0 +1,57 @@
+# Copyright 2017 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Django command: reevaluate tags for all nodes."""
+
+__all__ = [
+    'Command',
+    ]
+
+import os
+
+from django.core.management.base import (
+    BaseCommand,
+    CommandError,
+)
+from django.db import transaction
+from maasserver.models import (
+    Node,
+    Tag,
+)
+from maasserver.populate_tags import rebuild_tags
+
+
+class Command(BaseCommand):
+    help = (
+        "Reevaluate the definitions of tags against the commissioning "
+        "details of every node, and update which nodes have each tag. The "
+        "work is spread across several processes. This is not normally "
+        "necessary: tags are evaluated when they are defined, and when a "
+        "node is commissioned.")
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            '--tag', action='append', dest='tags', metavar='NAME',
+            help="Name of a tag to reevaluate. This can be given more than "
+                 "once. Defaults to all tags.")
+        parser.add_argument(
+            '--workers', type=int, dest='workers', default=os.cpu_count(),
+            help="Number of processes to evaluate tags in. Defaults to the "
+                 "number of CPUs.")
+
+    def handle(self, *args, **options):
+        if options["workers"] < 1:
+            raise CommandError("--workers must be at least 1.")
+        with transaction.atomic():
+            tags = Tag.objects.all()
+            if options["tags"] is not None:
+                tags = tags.filter(name__in=options["tags"])
+                unknown = set(options["tags"]).difference(
+                    tags.values_list("name", flat=True))
+                if len(unknown) != 0:
+                    raise CommandError(
+                        "Unknown tag(s): %s" % ", ".join(sorted(unknown)))
+            rebuild_tags(
+                list(tags), Node.objects.all().order_by("id"),
+                workers=options["workers"])
@@ -0,0 +1,120 @@
+# Copyright 2017 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Django command: report latency and database queries of requests."""
+
+__all__ = [
+    'Command',
+    ]
+
+from datetime import datetime
+import json
+
+from django.core.management.base import BaseCommand
+from maasserver.regiondservices.process_stats import read_process_stats
+from maasserver.utils.latency import (
+    get_quantile,
+    merge_stats,
+)
+
+
+# The quantiles of latency to report for each operation.
+QUANTILES = (0.5, 0.95, 0.99)
+
+# The longest SQL statement to show in full.
+SQL_MAX = 200
+
+
+def format_operations(bounds, operations):
+    """Yield lines describing each operation, those taking most time first.
+
+    Each quantile of latency shown is the upper bound of the histogram bucket
+    in which it falls.
+    """
+    yield "%-50s %7s %8s %8s %8s %8s %8s %9s %9s" % (
+        "operation", "count", "p50 (s)", "p95 (s)", "p99 (s)", "mean (s)",
+        "max (s)", "queries", "query (s)")
+    ordered = sorted(
+        operations.items(), key=lambda item: item[1]["total"],
+        reverse=True)
+    for operation, histogram in ordered:
+        count = histogram["count"]
+        yield "%-50s %7d %8s %8s %8s %8.3f %8.3f %9.1f %9.3f" % (
+            (operation, count) + tuple(
+                format_quantile(bounds, histogram["buckets"], quantile)
+                for quantile in QUANTILES) + (
+                histogram["total"] / count, histogram["max"],
+                histogram["queries"] / count,
+                histogram["query_time"] / count))
+
+
+def format_slow(slow):
+    """Yield lines describing each slow request, most recent last.
+
+    Each is followed by the queries it ran, with the time each took.
+    """
+    yield "%-19s %-50s %8s %7s %9s" % (
+        "time", "operation", "time (s)", "queries", "query (s)")
+    for request in slow:
+        yield "%-19s %-50s %8.3f %7d %9.3f" % (
+            datetime.fromtimestamp(request["time"]).strftime(
+                "%Y-%m-%d %H:%M:%S"),
+            request["operation"], request["elapsed"],
+            request["query_count"], request["query_time"])
+        for query in request["queries"]:
+            yield "    %8.3f  %s" % (
+                float(query["time"]), format_sql(query["sql"]))
+        omitted = request["query_count"] - len(request["queries"])
+        if omitted > 0:
+            yield "    (%d more queries not captured)" % omitted
+
+
+def format_quantile(bounds, buckets, quantile):
+    bound = get_quantile(bounds, buckets, quantile)
+    return ">%.3f" % bounds[-1] if bound is None else "%.3f" % bound
+
+
+def format_sql(sql):
+    sql = " ".join(sql.split())
+    return sql if len(sql) <= SQL_MAX else sql[:SQL_MAX - 3] + "..."
+
+
+class Command(BaseCommand):
+    help = (
+        "Report the latency of web, API, and websocket requests to the "
+        "running region processes, by operation, with the number of "
+        "database queries they make and the time those take, and the SQL "
+        "run by recent slow requests. Only the fraction of requests given "
+        "by the telemetry_sample_rate setting, which is zero by default, "
+        "are recorded. Statistics are published by each process every 30 "
+        "seconds, and are reset when it restarts.")
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            '--json', action='store_true', dest='json', default=False,
+            help="Print the merged statistics as JSON.")
+        parser.add_argument(
+            '--slow', type=int, dest='slow', default=5,
+            help="Number of recent slow requests to show. Defaults to 5.")
+
+    def handle(self, *args, **options):
+        processes = read_process_stats()
+        requests = merge_stats(
+            [process["requests"] for process in processes],
+            slow=options["slow"])
+        if options["json"]:
+            return json.dumps(requests, indent=2, sort_keys=True)
+        elif len(processes) == 0:
+            return "No statistics have been published by region processes."
+        elif len(requests["operations"]) == 0:
+            return (
+                "No requests have been sampled. Set telemetry_sample_rate "
+                "with `maas-region local_config_set`.")
+        else:
+            sections = [
+                format_operations(
+                    requests["bounds"], requests["operations"]),
+                format_slow(requests["slow"]),
+            ]
+            return "\n\n".join("\n".join(lines) for lines in sections)
@@ -90,6 +90,8 @@ class TestConfigurationReset(MAASTestCase):
             # Give the option a random value.
             if isinstance(getattr(configuration, self.option), str):
                 value = factory.make_name("foobar")
+            elif isinstance(getattr(configuration, self.option), float):
+                value = 0.5
             else:
                 value = factory.pick_port()
             setattr(configuration, self.option, value)
@@ -115,6 +117,8 @@ class TestConfigurationSet(MAASTestCase):
         # Set the option to a random value.
         if self.option == "database_port":
             value = factory.pick_port()
+        elif self.option.startswith("telemetry_"):
+            value = 0.5
         else:
             value = factory.make_name("foobar")
 
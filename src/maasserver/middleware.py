@@ -7,6 +7,7 @@ __all__ = [
     "AccessMiddleware",
     "APIErrorsMiddleware",
     "ExceptionMiddleware",
+    "RequestTelemetryMiddleware",
     ]
 
 from abc import (
@@ -50,6 +51,10 @@ from maasserver.models.config import Config
 from maasserver.models.node import RackController
 from maasserver.rpc import getAllClients
 from maasserver.utils.django_urls import reverse
+from maasserver.utils.latency import (
+    get_operation_name,
+    request_telemetry,
+)
 from maasserver.utils.orm import is_retryable_failure
 from maasserver.views.combo import MERGE_VIEWS
 from provisioningserver.rpc.exceptions import (
@@ -121,6 +126,27 @@ class AccessMiddleware:
                 return None
 
 
+class RequestTelemetryMiddleware:
+    """Observe a sample of requests for `request_telemetry`.
+
+    This should be the first middleware so that its response processing runs
+    for every request that it has seen, and so that the time spent in other
+    middleware is included.
+    """
+
+    def process_request(self, request):
+        request.telemetry_observation = request_telemetry.start()
+        return None
+
+    def process_response(self, request, response):
+        observation = getattr(request, "telemetry_observation", None)
+        if observation is not None:
+            request.telemetry_observation = None
+            request_telemetry.finish(
+                observation, get_operation_name(request))
+        return response
+
+
 class ExternalComponentsMiddleware:
     """Middleware to check external components at regular intervals."""
 
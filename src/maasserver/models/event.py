@@ -19,7 +19,10 @@ from maasserver import DefaultMeta
 from maasserver.models.cleansave import CleanSave
 from maasserver.models.eventtype import EventType
 from maasserver.models.node import Node
-from maasserver.models.timestampedmodel import TimestampedModel
+from maasserver.models.timestampedmodel import (
+    now,
+    TimestampedModel,
+)
 from provisioningserver.events import EVENT_DETAILS
 from provisioningserver.logger import get_maas_logger
 from provisioningserver.utils.env import get_maas_id
@@ -48,6 +51,31 @@ class EventManager(Manager):
             node=node, type=event_type, action=event_action,
             description=event_description, created=created)
 
+    def register_events_and_event_types(self, events):
+        """Register several events with one multi-row ``INSERT``.
+
+        Event types are registered first if they do not exist.
+
+        :param events: An iterable of ``(node, type_name, type_description,
+            type_level, event_action, event_description, created)`` tuples.
+        :return: A list of the new `Event`s.
+        """
+        event_types = {}
+        new_events = []
+        for (node, type_name, type_description, type_level, event_action,
+             event_description, created) in events:
+            if type_name not in event_types:
+                event_types[type_name] = EventType.objects.register(
+                    type_name, type_description, type_level)
+            # bulk_create() does not call save(), so do its work here.
+            if created is None:
+                created = now()
+            new_events.append(Event(
+                node=node, type=event_types[type_name], action=event_action,
+                description=event_description, created=created,
+                updated=created))
+        return self.bulk_create(new_events)
+
     def create_node_event(
             self, system_id, event_type, event_action='',
             event_description=''):
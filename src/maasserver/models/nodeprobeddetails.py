@@ -9,6 +9,7 @@ topology information derived from LLDP.
 
 __all__ = [
     "get_probed_details",
+    "get_probed_details_keys",
     "get_single_probed_details",
     "script_output_nsmap",
 ]
@@ -94,3 +95,47 @@ def get_probed_details(nodes):
             stdout_decoded = base64.b64decode(stdout)
             ret[system_id][namespace] = stdout_decoded
     return ret
+
+
+def get_probed_details_keys(nodes):
+    """Return keys that identify the details of the nodes in the given list.
+
+    A node's key changes whenever the details that `get_probed_details`
+    would return for it change, so it can be used to cache those details, or
+    documents derived from them, without fetching them.
+
+    :return: A ``{system_id: key, ...}`` map, where each key is a tuple of
+        the IDs and modification times of the script results from which the
+        node's details come.
+    """
+    node_ids = {node.id: node for node in nodes}
+    ret = {node.system_id: [] for node in nodes}
+    if len(node_ids) != 0:
+        with connection.cursor() as cursor:
+            # See get_probed_details.
+            sql_query = """
+                SELECT
+                  script_set.node_id, script_result.id,
+                  script_result.updated
+                FROM
+                  metadataserver_scriptresult AS script_result,
+                  metadataserver_scriptset AS script_set,
+                  maasserver_node AS node
+                WHERE
+                  script_set.node_id IN %s AND
+                  script_set.id = script_result.script_set_id AND
+                  script_result.status = %s AND
+                  script_result.script_name IN %s AND
+                  script_set.id = node.current_commissioning_script_set_id;
+            """
+            cursor.execute(sql_query, [
+                tuple(node_ids), SCRIPT_STATUS.PASSED,
+                tuple(script_output_nsmap)
+            ])
+            for node_id, script_result_id, updated in cursor.fetchall():
+                system_id = node_ids[node_id].system_id
+                ret[system_id].append((script_result_id, updated))
+    return {
+        system_id: tuple(sorted(key))
+        for system_id, key in ret.items()
+    }
@@ -11,6 +11,7 @@ clients.
 """
 
 __all__ = [
+    'HostnameIPMappingSnapshot',
     'StaticIPAddress',
 ]
 
@@ -49,7 +50,10 @@ from maasserver.fields import MAASIPAddressField
 from maasserver.models.cleansave import CleanSave
 from maasserver.models.config import Config
 from maasserver.models.domain import Domain
-from maasserver.models.subnet import Subnet
+from maasserver.models.subnet import (
+    Subnet,
+    subnet_free_ip_cache,
+)
 from maasserver.models.timestampedmodel import TimestampedModel
 from maasserver.utils import orm
 from maasserver.utils.dns import get_ip_based_hostname
@@ -88,6 +92,168 @@ def convert_leases_to_dict(leases):
     return ip_leases
 
 
+def _map_special_rows(rows, default_domain_name):
+    """Map the rows of the special mappings query by hostname.
+
+    :param rows: Rows from `_get_special_mappings_query`.
+    :param default_domain_name: The domain in which to name addresses that
+        have no name of their own.
+    :return: a (default) dict of hostname: HostnameIPMapping entries.
+    """
+    mapping = defaultdict(HostnameIPMapping)
+    for (fqdn, system_id, node_type, ttl, ip, *_) in rows:
+        if fqdn is None or fqdn == '':
+            fqdn = "%s.%s" % (get_ip_based_hostname(ip), default_domain_name)
+        # It is possible that there are both Node and DNSResource entries
+        # for this fqdn.  If we have any system_id, preserve it.  Ditto for
+        # TTL.  It is left as an exercise for the admin to make sure that
+        # the any non-default TTL applied to the Node and DNSResource are
+        # equal.
+        if system_id is not None:
+            mapping[fqdn].node_type = node_type
+            mapping[fqdn].system_id = system_id
+        if ttl is not None:
+            mapping[fqdn].ttl = ttl
+        mapping[fqdn].ips.add(ip)
+    return mapping
+
+
+def _map_node_rows(mapping, node_rows, iface_rows):
+    """Add the addresses of nodes, and of their interfaces, to `mapping`.
+
+    :param mapping: The special mappings, from `_map_special_rows`.
+    :param node_rows: Rows from `_get_node_mappings_query`, at most one for
+        each hostname, boot interface flag, and address family.
+    :param iface_rows: Rows from `_get_interface_mappings_query`.
+    :return: `mapping`.
+    """
+    # All of the mappings that we got mean that we will only want to add
+    # addresses for the boot interface (is_boot == True).
+    iface_is_boot = defaultdict(bool, {
+        hostname: True for hostname in mapping.keys()
+    })
+    assigned_ips = defaultdict(bool)
+    # The records from the query provide, for each hostname (after
+    # stripping domain), the boot and non-boot interface ip address in ipv4
+    # and ipv6.  Our task: if there are boot interace IPs, they win.  If
+    # there are none, then whatever we got wins.  The ORDER BY means that
+    # we will see all of the boot interfaces before we see any non-boot
+    # interface IPs.  See Bug#1584850
+    for (fqdn, system_id, node_type, ttl, ip, is_boot, *_) in node_rows:
+        mapping[fqdn].node_type = node_type
+        mapping[fqdn].system_id = system_id
+        mapping[fqdn].ttl = ttl
+        if is_boot:
+            iface_is_boot[fqdn] = True
+        # If we have an IP on the right interface type, save it.
+        if is_boot == iface_is_boot[fqdn]:
+            mapping[fqdn].ips.add(ip)
+    # Next, get all the addresses, on all the interfaces, and add the ones
+    # that are not already present on the FQDN as $IFACE.$FQDN.  Exclude
+    # any discovered addresses once there are any non-discovered addresses.
+    for (fqdn, system_id, node_type, ttl,
+            ip, iface_name, assigned, *_) in iface_rows:
+        if assigned:
+            assigned_ips[fqdn] = True
+        # If this is an assigned IP, or there are NO assigned IPs on the
+        # node, then consider adding the IP.
+        if assigned or not assigned_ips[fqdn]:
+            if ip not in mapping[fqdn].ips:
+                name = "%s.%s" % (iface_name, fqdn)
+                mapping[name].node_type = node_type
+                mapping[name].system_id = system_id
+                mapping[name].ttl = ttl
+                mapping[name].ips.add(ip)
+    return mapping
+
+
+def _distinct_node_rows(rows):
+    """Yield the first of `rows` for each hostname, boot flag, and family.
+
+    This is what DISTINCT ON does in `_get_node_mappings_query`, for rows
+    that are already in that query's order.
+    """
+    seen = set()
+    for row in rows:
+        # (is_boot, hostname, family)
+        key = row[5:8]
+        if key not in seen:
+            seen.add(key)
+            yield row
+
+
+class HostnameIPMappingSnapshot:
+    """Hostname mappings for every domain, and for the reverse zones.
+
+    This is built by `StaticIPAddressManager.get_hostname_ip_mapping_snapshot`
+    from a single read of each of the queries behind
+    `get_hostname_ip_mapping`.  The rows are indexed by the domains they are
+    relevant to, using the same conditions that `get_hostname_ip_mapping`
+    puts in its WHERE clauses, so that `get_mapping(domain)` returns what
+    `get_hostname_ip_mapping(domain)` would.
+    """
+
+    def __init__(self, default_domain):
+        self.default_domain = default_domain
+        self.special_rows = defaultdict(list)
+        self.reverse_special_rows = []
+        self.node_rows = defaultdict(list)
+        self.all_node_rows = []
+        self.interface_rows = defaultdict(list)
+        self.all_interface_rows = []
+
+    def add_special_rows(self, rows):
+        """Index rows from `_get_special_mappings_query`."""
+        default_domain_id = self.default_domain.id
+        for row in rows:
+            alloc_type, has_dnsrr, has_node, *domain_ids = row[5:]
+            unnamed_reserved = (
+                alloc_type == IPADDRESS_TYPE.USER_RESERVED and
+                not has_dnsrr and not has_node)
+            if has_dnsrr:
+                # The parent and child domains both get glue.
+                for domain_id in set(domain_ids):
+                    if domain_id is not None:
+                        self.special_rows[domain_id].append(row)
+            elif unnamed_reserved:
+                self.special_rows[default_domain_id].append(row)
+            # Addresses linked to a node map back only to the node.
+            if unnamed_reserved or (has_dnsrr and not has_node):
+                self.reverse_special_rows.append(row)
+
+    def _add_rows(self, index, all_rows, rows):
+        for row in rows:
+            all_rows.append(row)
+            domain_id, domain2_id = row[-2:]
+            index[domain_id].append(row)
+            if domain2_id is not None and domain2_id != domain_id:
+                index[domain2_id].append(row)
+
+    def add_node_rows(self, rows):
+        """Index rows from `_get_node_mappings_query`."""
+        self._add_rows(self.node_rows, self.all_node_rows, rows)
+
+    def add_interface_rows(self, rows):
+        """Index rows from `_get_interface_mappings_query`."""
+        self._add_rows(self.interface_rows, self.all_interface_rows, rows)
+
+    def get_mapping(self, domain):
+        """Return the hostname mapping for the forward zone of `domain`."""
+        mapping = _map_special_rows(
+            self.special_rows.get(domain.id, ()), self.default_domain.name)
+        return _map_node_rows(
+            mapping, _distinct_node_rows(self.node_rows.get(domain.id, ())),
+            self.interface_rows.get(domain.id, ()))
+
+    def get_reverse_mapping(self):
+        """Return the hostname mapping for all of the reverse zones."""
+        mapping = _map_special_rows(
+            self.reverse_special_rows, self.default_domain.name)
+        return _map_node_rows(
+            mapping, _distinct_node_rows(self.all_node_rows),
+            self.all_interface_rows)
+
+
 class StaticIPAddressManager(Manager):
     """A utility to manage collections of IPAddresses."""
 
@@ -195,6 +361,9 @@ class StaticIPAddressManager(Manager):
                 # retry with the `address_allocation` lock. We can't take it
                 # here because we're already in a transaction; we need to exit
                 # the transaction, take the lock, and only then try again.
+                # The subnet's index of free addresses was wrong, so make
+                # sure it is built again.
+                subnet_free_ip_cache.forget(subnet.id)
                 orm.request_transaction_retry(locks.address_allocation)
             else:
                 raise
@@ -249,33 +418,14 @@ class StaticIPAddressManager(Manager):
             return self._attempt_allocation(
                 requested_address, alloc_type, user=user, subnet=subnet)
 
-    def _get_special_mappings(self, domain, raw_ttl=False):
-        """Get the special mappings, possibly limited to a single Domain.
-
-        This function is responsible for creating these mappings:
-        - any USER_RESERVED IP that has no name (dnsrr or node),
-        - any IP not associated with a Node,
-        - any IP associated with a DNSResource.
-
-        Addresses that are associated with both a Node and a DNSResource behave
-        thusly:
-        - Both forward mappings include the address
-        - The reverse mapping points only to the Node (and is the
-          responsibility of the caller.)
+    def _get_special_mappings_query(self, raw_ttl=False):
+        """Return the SQL for the special mappings, without a filter.
 
-        The caller is responsible for addresses otherwise derived from nodes.
-
-        Because of how the get hostname_ip_mapping code works, we actually need
-        to fetch ALL of the entries for subnets, but forward mappings are
-        domain-specific.
-
-        :param domain: limit return to just the given Domain.  If anything
-            other than a Domain is passed in (e.g., a Subnet or None), we
-            return all of the reverse mappings.
-        :param raw_ttl: Boolean, if True then just return the address_ttl,
-            otherwise, coalesce the address_ttl to be the correct answer for
-            zone generation.
-        :return: a (default) dict of hostname: HostnameIPMapping entries.
+        The query ends with an open WHERE clause to which a condition must be
+        appended.  Each row is `(fqdn, system_id, node_type, ttl, ip,
+        alloc_type, has_dnsrr, has_node, dnsrr_dom2_id, node_dom2_id,
+        dnsrr_domain_id, node_domain_id)`; the trailing columns are those
+        that decide which mappings a row belongs in.
         """
         default_ttl = "%d" % Config.objects.get_config('default_dns_ttl')
         # raw_ttl says that we don't coalesce, but we need to pick one, so we
@@ -294,13 +444,20 @@ class StaticIPAddressManager(Manager):
         # view of a DNSResource (and Node) that we need, and finally use
         # domain2 to handle the case where an FQDN is also the name of a domain
         # that we know.
-        sql_query = """
+        return """
             SELECT
                 COALESCE(dnsrr.fqdn, node.fqdn) AS fqdn,
                 node.system_id,
                 node.node_type,
                 """ + ttl_clause + """ AS ttl,
-                staticip.ip
+                staticip.ip,
+                staticip.alloc_type,
+                dnsrr.fqdn IS NOT NULL AS has_dnsrr,
+                node.fqdn IS NOT NULL AS has_node,
+                dnsrr.dom2_id,
+                node.dom2_id,
+                dnsrr.domain_id,
+                node.domain_id
             FROM
                 maasserver_staticipaddress AS staticip
             LEFT JOIN (
@@ -356,6 +513,35 @@ class StaticIPAddressManager(Manager):
                 (staticip.ip IS NOT NULL AND host(staticip.ip) != '') AND
                 """
 
+    def _get_special_mappings(self, domain, raw_ttl=False):
+        """Get the special mappings, possibly limited to a single Domain.
+
+        This function is responsible for creating these mappings:
+        - any USER_RESERVED IP that has no name (dnsrr or node),
+        - any IP not associated with a Node,
+        - any IP associated with a DNSResource.
+
+        Addresses that are associated with both a Node and a DNSResource behave
+        thusly:
+        - Both forward mappings include the address
+        - The reverse mapping points only to the Node (and is the
+          responsibility of the caller.)
+
+        The caller is responsible for addresses otherwise derived from nodes.
+
+        Because of how the get hostname_ip_mapping code works, we actually need
+        to fetch ALL of the entries for subnets, but forward mappings are
+        domain-specific.
+
+        :param domain: limit return to just the given Domain.  If anything
+            other than a Domain is passed in (e.g., a Subnet or None), we
+            return all of the reverse mappings.
+        :param raw_ttl: Boolean, if True then just return the address_ttl,
+            otherwise, coalesce the address_ttl to be the correct answer for
+            zone generation.
+        :return: a (default) dict of hostname: HostnameIPMapping entries.
+        """
+        sql_query = self._get_special_mappings_query(raw_ttl)
         query_parms = []
         if isinstance(domain, Domain):
             if domain.is_default():
@@ -408,40 +594,22 @@ class StaticIPAddressManager(Manager):
             query_parms += [IPADDRESS_TYPE.USER_RESERVED]
 
         default_domain = Domain.objects.get_default_domain()
-        mapping = defaultdict(HostnameIPMapping)
         cursor = connection.cursor()
         cursor.execute(sql_query, query_parms)
-        for (fqdn, system_id, node_type, ttl, ip) in cursor.fetchall():
-            if fqdn is None or fqdn == '':
-                fqdn = "%s.%s" % (
-                    get_ip_based_hostname(ip), default_domain.name)
-            # It is possible that there are both Node and DNSResource entries
-            # for this fqdn.  If we have any system_id, preserve it.  Ditto for
-            # TTL.  It is left as an exercise for the admin to make sure that
-            # the any non-default TTL applied to the Node and DNSResource are
-            # equal.
-            if system_id is not None:
-                mapping[fqdn].node_type = node_type
-                mapping[fqdn].system_id = system_id
-            if ttl is not None:
-                mapping[fqdn].ttl = ttl
-            mapping[fqdn].ips.add(ip)
-        return mapping
+        return _map_special_rows(cursor.fetchall(), default_domain.name)
 
-    def get_hostname_ip_mapping(self, domain_or_subnet, raw_ttl=False):
-        """Return hostname mappings for `StaticIPAddress` entries.
+    def _get_node_mappings_query(self, raw_ttl=False, distinct=True):
+        """Return the SQL for the addresses of nodes, without a filter.
 
-        Returns a mapping `{hostnames -> (ttl, [ips])}` corresponding to
-        current `StaticIPAddress` objects for the nodes in `domain`, or
-        `subnet`.
+        The WHERE clause starts with a `%s`, to be replaced with a condition
+        ending in AND, or with nothing; see `get_hostname_ip_mapping`.  Each
+        row is `(fqdn, system_id, node_type, ttl, ip, is_boot, hostname,
+        family, domain_id, domain2_id)`.
 
-        At most one IPv4 address and one IPv6 address will be returned per
-        node, each the one for whichever `Interface` was created first.
-
-        The returned name is an FQDN (no trailing dot.)
+        :param distinct: Return only the first row for each hostname, boot
+            interface flag, and address family.  Otherwise the caller must
+            do this, using `_distinct_node_rows`.
         """
-        cursor = connection.cursor()
-
         # DISTINCT ON returns the first matching row for any given
         # hostname, using the query's ordering.  Here, we're trying to
         # return the IPs for the oldest Interface address.
@@ -454,8 +622,20 @@ class StaticIPAddressManager(Manager):
                     node.address_ttl,
                     domain.ttl,
                     %s)""" % default_ttl
-        sql_query = """
+        if distinct:
+            select = """
             SELECT DISTINCT ON (node.hostname, is_boot, family(staticip.ip))
+            """
+        else:
+            select = """
+            SELECT
+            """
+        # The model has nodes in the parent domain, but they actually live
+        # in the child domain.  And the parent needs the glue.  So we
+        # return such nodes addresses in _BOTH_ the parent and the child
+        # domains. domain2.name will be non-null if this host's fqdn is the
+        # name of a domain in MAAS.
+        return select + """
                 CONCAT(node.hostname, '.', domain.name) AS fqdn,
                 node.system_id,
                 node.node_type,
@@ -468,7 +648,11 @@ class StaticIPAddressManager(Manager):
                         node.boot_interface_id = parent.id
                     ),
                     False
-                ) AS is_boot
+                ) AS is_boot,
+                node.hostname,
+                family(staticip.ip),
+                node.domain_id,
+                domain2.id
             FROM
                 maasserver_interface AS interface
             LEFT OUTER JOIN maasserver_interfacerelationship AS rel ON
@@ -483,32 +667,12 @@ class StaticIPAddressManager(Manager):
                 link.interface_id = interface.id
             JOIN maasserver_staticipaddress AS staticip ON
                 staticip.id = link.staticipaddress_id
-            """
-        if isinstance(domain_or_subnet, Domain):
-            # The model has nodes in the parent domain, but they actually live
-            # in the child domain.  And the parent needs the glue.  So we
-            # return such nodes addresses in _BOTH_ the parent and the child
-            # domains. domain2.name will be non-null if this host's fqdn is the
-            # name of a domain in MAAS.
-            sql_query += """
             LEFT JOIN maasserver_domain AS domain2 ON
                 /* Pick up another copy of domain looking for instances of
                  * nodes a the top of a domain.
                  */ domain2.name = CONCAT(node.hostname, '.', domain.name)
             WHERE
-                (domain2.id = %s OR node.domain_id = %s) AND
-            """
-            query_parms = [domain_or_subnet.id, domain_or_subnet.id, ]
-        else:
-            # For subnets, we need ALL the names, so that we can correctly
-            # identify which ones should have the FQDN.  dns/zonegenerator.py
-            # optimizes based on this, and only calls once with a subnet,
-            # expecting to get all the subnets back in one table.
-            sql_query += """
-            WHERE
-            """
-            query_parms = []
-        sql_query += """
+                %s
                 staticip.ip IS NOT NULL AND
                 host(staticip.ip) != ''
             ORDER BY
@@ -547,7 +711,25 @@ class StaticIPAddressManager(Manager):
                 interface.id,
                 inet 'fc00::/7' >> ip /* ULA after non-ULA */
             """
-        iface_sql_query = """
+
+    def _get_interface_mappings_query(self, raw_ttl=False):
+        """Return the SQL for the addresses of each interface of each node.
+
+        Like `_get_node_mappings_query`, a condition is substituted into
+        the WHERE clause.  Each row is `(fqdn, system_id, node_type, ttl, ip,
+        iface_name, assigned, domain_id, domain2_id)`.
+        """
+        default_ttl = "%d" % Config.objects.get_config('default_dns_ttl')
+        if raw_ttl:
+            ttl_clause = """node.address_ttl"""
+        else:
+            ttl_clause = """
+                COALESCE(
+                    node.address_ttl,
+                    domain.ttl,
+                    %s)""" % default_ttl
+        # This logic for domain2 is similar to that in the node query.
+        return """
             SELECT
                 CONCAT(node.hostname, '.', domain.name) AS fqdn,
                 node.system_id,
@@ -555,7 +737,9 @@ class StaticIPAddressManager(Manager):
                 """ + ttl_clause + """ AS ttl,
                 staticip.ip,
                 interface.name,
-                alloc_type != 6 /* DISCOVERED */ AS assigned
+                alloc_type != 6 /* DISCOVERED */ AS assigned,
+                node.domain_id,
+                domain2.id
             FROM
                 maasserver_interface AS interface
             JOIN maasserver_node AS node ON
@@ -566,10 +750,6 @@ class StaticIPAddressManager(Manager):
                 link.interface_id = interface.id
             JOIN maasserver_staticipaddress AS staticip ON
                 staticip.id = link.staticipaddress_id
-            """
-        if isinstance(domain_or_subnet, Domain):
-            # This logic is similar to the logic in sql_query above.
-            iface_sql_query += """
             LEFT JOIN maasserver_domain AS domain2 ON
                 /* Pick up another copy of domain looking for instances of
                  * the name as the top of a domain.
@@ -577,17 +757,7 @@ class StaticIPAddressManager(Manager):
                 domain2.name = CONCAT(
                     interface.name, '.', node.hostname, '.', domain.name)
             WHERE
-                (domain2.id = %s OR node.domain_id = %s) AND
-            """
-        else:
-            # For subnets, we need ALL the names, so that we can correctly
-            # identify which ones should have the FQDN.  dns/zonegenerator.py
-            # optimizes based on this, and only calls once with a subnet,
-            # expecting to get all the subnets back in one table.
-            iface_sql_query += """
-            WHERE
-            """
-        iface_sql_query += """
+                %s
                 staticip.ip IS NOT NULL AND
                 host(staticip.ip) != ''
             ORDER BY
@@ -595,50 +765,61 @@ class StaticIPAddressManager(Manager):
                 assigned DESC, /* Return all assigned IPs for a node first. */
                 interface.id
             """
+
+    def get_hostname_ip_mapping(self, domain_or_subnet, raw_ttl=False):
+        """Return hostname mappings for `StaticIPAddress` entries.
+
+        Returns a mapping `{hostnames -> (ttl, [ips])}` corresponding to
+        current `StaticIPAddress` objects for the nodes in `domain`, or
+        `subnet`.
+
+        At most one IPv4 address and one IPv6 address will be returned per
+        node, each the one for whichever `Interface` was created first.
+
+        The returned name is an FQDN (no trailing dot.)
+
+        To get the mappings for many domains use
+        `get_hostname_ip_mapping_snapshot` instead.
+        """
+        cursor = connection.cursor()
+        if isinstance(domain_or_subnet, Domain):
+            condition = "(domain2.id = %s OR node.domain_id = %s) AND"
+            query_parms = [domain_or_subnet.id, domain_or_subnet.id]
+        else:
+            # For subnets, we need ALL the names, so that we can correctly
+            # identify which ones should have the FQDN.  dns/zonegenerator.py
+            # optimizes based on this, and only calls once with a subnet,
+            # expecting to get all the subnets back in one table.
+            condition = ""
+            query_parms = []
+        sql_query = self._get_node_mappings_query(raw_ttl) % condition
+        iface_sql_query = (
+            self._get_interface_mappings_query(raw_ttl) % condition)
         # We get user reserved et al mappings first, so that we can overwrite
         # TTL as we process the return from the SQL horror above.
         mapping = self._get_special_mappings(domain_or_subnet, raw_ttl)
-        # All of the mappings that we got mean that we will only want to add
-        # addresses for the boot interface (is_boot == True).
-        iface_is_boot = defaultdict(bool, {
-            hostname: True for hostname in mapping.keys()
-        })
-        assigned_ips = defaultdict(bool)
         cursor.execute(sql_query, query_parms)
-        # The records from the query provide, for each hostname (after
-        # stripping domain), the boot and non-boot interface ip address in ipv4
-        # and ipv6.  Our task: if there are boot interace IPs, they win.  If
-        # there are none, then whatever we got wins.  The ORDER BY means that
-        # we will see all of the boot interfaces before we see any non-boot
-        # interface IPs.  See Bug#1584850
-        for (fqdn, system_id, node_type, ttl,
-                ip, is_boot) in cursor.fetchall():
-            mapping[fqdn].node_type = node_type
-            mapping[fqdn].system_id = system_id
-            mapping[fqdn].ttl = ttl
-            if is_boot:
-                iface_is_boot[fqdn] = True
-            # If we have an IP on the right interface type, save it.
-            if is_boot == iface_is_boot[fqdn]:
-                mapping[fqdn].ips.add(ip)
-        # Next, get all the addresses, on all the interfaces, and add the ones
-        # that are not already present on the FQDN as $IFACE.$FQDN.  Exclude
-        # any discovered addresses once there are any non-discovered addresses.
+        node_rows = cursor.fetchall()
         cursor.execute(iface_sql_query, query_parms)
-        for (fqdn, system_id, node_type, ttl,
-                ip, iface_name, assigned) in cursor.fetchall():
-            if assigned:
-                assigned_ips[fqdn] = True
-            # If this is an assigned IP, or there are NO assigned IPs on the
-            # node, then consider adding the IP.
-            if assigned or not assigned_ips[fqdn]:
-                if ip not in mapping[fqdn].ips:
-                    name = "%s.%s" % (iface_name, fqdn)
-                    mapping[name].node_type = node_type
-                    mapping[name].system_id = system_id
-                    mapping[name].ttl = ttl
-                    mapping[name].ips.add(ip)
-        return mapping
+        iface_rows = cursor.fetchall()
+        return _map_node_rows(mapping, node_rows, iface_rows)
+
+    def get_hostname_ip_mapping_snapshot(self, raw_ttl=False):
+        """Return a `HostnameIPMappingSnapshot` of every domain and subnet.
+
+        This runs the same three queries as `get_hostname_ip_mapping` but
+        once, without a filter, streaming the rows from server-side cursors
+        into an index by domain.  Consume it in the same transaction.
+        """
+        default_domain = Domain.objects.get_default_domain()
+        snapshot = HostnameIPMappingSnapshot(default_domain)
+        snapshot.add_special_rows(orm.stream_query(
+            self._get_special_mappings_query(raw_ttl) + "True"))
+        snapshot.add_node_rows(orm.stream_query(
+            self._get_node_mappings_query(raw_ttl, distinct=False) % ""))
+        snapshot.add_interface_rows(orm.stream_query(
+            self._get_interface_mappings_query(raw_ttl) % ""))
+        return snapshot
 
     def filter_by_ip_family(self, family):
         possible_families = map_enum_reverse(IPADDRESS_FAMILY)
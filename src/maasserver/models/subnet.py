@@ -8,7 +8,9 @@ __all__ = [
     'Subnet',
 ]
 
+from collections import Counter
 from operator import attrgetter
+import threading
 from typing import (
     Iterable,
     Optional,
@@ -20,6 +22,7 @@ from django.core.exceptions import (
     ValidationError,
 )
 from django.core.validators import RegexValidator
+from django.db import connection
 from django.db.models import (
     BooleanField,
     CharField,
@@ -58,6 +61,7 @@ from netaddr import (
 )
 from provisioningserver.logger import get_maas_logger
 from provisioningserver.utils.network import (
+    IPFreeRanges,
     IPRANGE_TYPE as MAASIPRANGE_TYPE,
     IPRangeStatistics,
     MAASIPSet,
@@ -114,6 +118,148 @@ def create_cidr(network, subnet_mask=None):
     return str(cidr)
 
 
+class SubnetFreeIPCache:
+    """Indexes of the free addresses in subnets, used to allocate addresses.
+
+    Calculating the free addresses in a subnet means fetching every address
+    allocated in it, which gets slow for large subnets. Instead, this keeps
+    an `IPFreeRanges` for each subnet and a summary of what it was built
+    from. The summary is cheap to query, and tells us whether the index is
+    still current, whether addresses have only been added since (in which
+    case they are marked as used in the index), or whether the index must be
+    built again.
+
+    This is a cache in the region process, so it must not be trusted across
+    transactions without checking the summary; `get_free_ranges` does so.
+    """
+
+    # A summary of everything the free addresses in a subnet depend on.
+    # For static IP addresses, which can be very many, the sums allow the
+    # addresses added since the summary was taken to be accounted for.
+    state_query = """\
+        SELECT
+            ips.count, ips.id_sum, ips.id_max, ips.ip_sum,
+            (SELECT STRING_AGG(
+                CONCAT_WS(' ', id, start_ip, end_ip, type), ',' ORDER BY id)
+             FROM maasserver_iprange WHERE subnet_id = %(subnet)s),
+            (SELECT STRING_AGG(
+                CONCAT_WS(' ', id, gateway_ip), ',' ORDER BY id)
+             FROM maasserver_staticroute WHERE source_id = %(subnet)s),
+            (SELECT ARRAY[COUNT(*), COALESCE(SUM(HASHTEXT(HOST(ip))), 0)]
+             FROM maasserver_discovery WHERE subnet_id = %(subnet)s)
+        FROM (
+            SELECT
+                COUNT(*) AS count,
+                COALESCE(SUM(id), 0) AS id_sum,
+                COALESCE(MAX(id), 0) AS id_max,
+                COALESCE(SUM(HASHTEXT(HOST(ip))), 0) AS ip_sum
+            FROM maasserver_staticipaddress
+            WHERE subnet_id = %(subnet)s
+        ) AS ips
+        """
+
+    # The static IP addresses added since a summary was taken.
+    added_ips_query = """\
+        SELECT id, ip, HASHTEXT(HOST(ip))
+        FROM maasserver_staticipaddress
+        WHERE subnet_id = %(subnet)s AND id > %(id_max)s
+        """
+
+    def __init__(self):
+        super(SubnetFreeIPCache, self).__init__()
+        # Subnet ID -> (state, ip_state, IPFreeRanges).
+        self.entries = {}
+        self.locks = {}
+        self.stats = Counter()
+
+    def _get_state(self, subnet, cursor):
+        cursor.execute(self.state_query, {"subnet": subnet.id})
+        count, id_sum, id_max, ip_sum, *others = cursor.fetchone()
+        state = (
+            str(subnet.cidr), subnet.gateway_ip, subnet.dns_servers,
+            subnet.managed, *others)
+        return state, (count, id_sum, id_max, ip_sum)
+
+    def _update(self, subnet, cursor, ip_state, new_ip_state, free):
+        """Mark the addresses added since `ip_state` as used in `free`.
+
+        :return: False if there are other changes, so `free` cannot be
+            brought up to date.
+        """
+        count, id_sum, id_max, ip_sum = ip_state
+        cursor.execute(
+            self.added_ips_query, {"subnet": subnet.id, "id_max": id_max})
+        added = cursor.fetchall()
+        for ip_id, _, ip_hash in added:
+            count += 1
+            id_sum += ip_id
+            id_max = max(id_max, ip_id)
+            ip_sum += 0 if ip_hash is None else ip_hash
+        if (count, id_sum, id_max, ip_sum) != new_ip_state:
+            # Addresses were also removed or changed.
+            return False
+        for _, ip, _ in added:
+            if ip is not None:
+                free.remove(IPAddress(ip))
+        return True
+
+    def _build(self, subnet):
+        return IPFreeRanges(
+            subnet.get_ipranges_not_in_use(with_neighbours=True).ranges)
+
+    def get_smallest_free_range(self, subnet, exclude_addresses=()):
+        """Return the smallest range of free addresses in `subnet`.
+
+        Addresses observed on the network are not free.
+
+        :param exclude_addresses: Addresses to treat as in use.
+        :return: A `(first, last)` tuple of integers, or `None` if there are
+            no free addresses.
+        """
+        lock = self.locks.setdefault(subnet.id, threading.Lock())
+        with lock, connection.cursor() as cursor:
+            state, ip_state = self._get_state(subnet, cursor)
+            entry = self.entries.get(subnet.id)
+            if entry is not None and entry[0] == state:
+                _, cached_ip_state, free = entry
+                if cached_ip_state == ip_state:
+                    self.stats["hits"] += 1
+                elif self._update(
+                        subnet, cursor, cached_ip_state, ip_state, free):
+                    self.stats["updates"] += 1
+                else:
+                    entry = None
+            else:
+                entry = None
+            if entry is None:
+                self.stats["builds"] += 1
+                free = self._build(subnet)
+            self.entries[subnet.id] = state, ip_state, free
+            # Exclude addresses by marking them used only while finding the
+            # smallest range; the index is shared.
+            network = subnet.get_ipnetwork()
+            excluded = [
+                address for address in exclude_addresses
+                if address in network and free.remove(IPAddress(address))
+            ]
+            try:
+                return free.get_smallest()
+            finally:
+                for address in excluded:
+                    free.add(IPAddress(address))
+
+    def forget(self, subnet_id):
+        """Discard the index for a subnet.
+
+        Do this if the index may not be current, like when an address from it
+        turned out to be already allocated.
+        """
+        self.entries.pop(subnet_id, None)
+
+
+subnet_free_ip_cache = SubnetFreeIPCache()
+
+
 class SubnetQueriesMixin(MAASQueriesMixin):
 
     find_subnets_with_ip_query = """
@@ -701,34 +847,34 @@ class Subnet(CleanSave, TimestampedModel):
         """
         if exclude_addresses is None:
             exclude_addresses = []
-        free_ranges = self.get_ipranges_not_in_use(
-            exclude_addresses=exclude_addresses,
-            with_neighbours=avoid_observed_neighbours)
-        if len(free_ranges) == 0 and avoid_observed_neighbours is True:
-            # Try again recursively, but this time consider neighbours to be
-            # "free" IP addresses. (We'll pick the least recently seen IP.)
+        if avoid_observed_neighbours is True:
+            # This is the common case, so find the smallest free range from
+            # an index that is kept up to date rather than built each time.
+            free_range = subnet_free_ip_cache.get_smallest_free_range(
+                self, exclude_addresses)
+            if free_range is not None:
+                return str(IPAddress(free_range[0]))
+            # Try again, but this time consider neighbours to be "free" IP
+            # addresses. (We'll pick the least recently seen IP.)
             return self.get_next_ip_for_allocation(
                 exclude_addresses, avoid_observed_neighbours=False)
-        elif len(free_ranges) == 0:
+        free_ranges = self.get_ipranges_not_in_use(
+            exclude_addresses=exclude_addresses, with_neighbours=False)
+        if len(free_ranges) == 0:
             raise StaticIPAddressExhaustion(
                 "No more IPs available in subnet: %s." % self.cidr)
-        # The first time through this function, we aren't trying to avoid
-        # observed neighbours. In fact, `free_ranges` only contains completely
-        # unused ranges. So we don't need to check for the least recently seen
-        # neighbour on the first pass.
-        if avoid_observed_neighbours is False:
-            # We tried considering neighbours as "in-use" addresses, but the
-            # subnet is still full. So make an educated guess about which IP
-            # address is least likely to be in-use.
-            discovery = self.get_least_recently_seen_unknown_neighbour()
-            if discovery is not None:
-                maaslog.warning(
-                    "Next IP address to allocate from '%s' has been observed "
-                    "previously: %s was last claimed by %s via %s at %s." % (
-                        self.label, discovery.ip, discovery.mac_address,
-                        discovery.observer_interface.get_log_string(),
-                        discovery.last_seen))
-                return str(discovery.ip)
+        # We tried considering neighbours as "in-use" addresses, but the
+        # subnet is still full. So make an educated guess about which IP
+        # address is least likely to be in-use.
+        discovery = self.get_least_recently_seen_unknown_neighbour()
+        if discovery is not None:
+            maaslog.warning(
+                "Next IP address to allocate from '%s' has been observed "
+                "previously: %s was last claimed by %s via %s at %s." % (
+                    self.label, discovery.ip, discovery.mac_address,
+                    discovery.observer_interface.get_log_string(),
+                    discovery.last_seen))
+            return str(discovery.ip)
         # The purpose of this is to that we ensure we always get an IP address
         # from the *smallest* free contiguous range. This way, larger ranges
         # can be preserved in case they need to be used for applications
@@ -85,6 +85,37 @@ class EventTest(MAASServerTestCase):
         # Check whether we created the event type.
         self.assertIsNotNone(EventType.objects.get(name=type_name))
 
+    def test_register_events_and_event_types_registers_events(self):
+        nodes = [factory.make_Node() for _ in range(3)]
+        event_type = factory.make_EventType()
+        new_type_name = factory.make_name('type_name')
+        created = factory.make_date()
+        events = Event.objects.register_events_and_event_types([
+            (node, type_name, factory.make_name('description'),
+             logging.INFO, factory.make_name('action'),
+             factory.make_name('description'), created)
+            for node in nodes
+            for type_name in (event_type.name, new_type_name)
+        ])
+        self.assertEqual(6, len(events))
+        for node in nodes:
+            self.assertItemsEqual(
+                [event_type.name, new_type_name],
+                Event.objects.filter(node=node).values_list(
+                    "type__name", flat=True))
+        self.assertItemsEqual(
+            [created], {event.created for event in Event.objects.all()})
+
+    def test_register_events_and_event_types_sets_created_if_missing(self):
+        node = factory.make_Node()
+        event_type = factory.make_EventType()
+        Event.objects.register_events_and_event_types([
+            (node, event_type.name, '', logging.INFO, '', '', None),
+        ])
+        event = Event.objects.get(node=node)
+        self.assertIsNotNone(event.created)
+        self.assertEqual(event.created, event.updated)
+
     def test_create_node_event_creates_event(self):
         # EventTypes that are currently being used for
         # create_node_event
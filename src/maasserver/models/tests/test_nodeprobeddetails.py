@@ -7,6 +7,7 @@ __all__ = []
 
 from maasserver.models.nodeprobeddetails import (
     get_probed_details,
+    get_probed_details_keys,
     get_single_probed_details,
     script_output_nsmap,
 )
@@ -89,3 +90,33 @@ class TestNodeDetail(MAASServerTestCase):
             # returned by get_probed_details.
             self.make_script_set_and_results(node, "new")
         self.assertDictEqual(expected, get_probed_details(nodes))
+
+    def test_get_probed_details_keys(self):
+        node = factory.make_Node()
+        self.make_script_set_and_results(node, "old")
+        script_set, script_results = self.make_script_set_and_results(node)
+        node.current_commissioning_script_set = script_set
+        node.save()
+        self.assertDictEqual(
+            {node.system_id: tuple(sorted(
+                (result.id, result.updated) for result in script_results))},
+            get_probed_details_keys([node]))
+
+    def test_get_probed_details_keys_changes_with_details(self):
+        node = factory.make_Node(with_empty_script_sets=True)
+        script_set = node.current_commissioning_script_set
+        script_set.find_script_result(
+            script_name=LSHW_OUTPUT_NAME).store_result(
+                exit_status=0, stdout=b"<lshw-data/>")
+        key = get_probed_details_keys([node])[node.system_id]
+        script_set.find_script_result(
+            script_name=LLDP_OUTPUT_NAME).store_result(
+                exit_status=0, stdout=b"<lldp-data/>")
+        self.assertNotEqual(
+            key, get_probed_details_keys([node])[node.system_id])
+
+    def test_get_probed_details_keys_without_details(self):
+        node = factory.make_Node()
+        self.assertDictEqual(
+            {node.system_id: ()}, get_probed_details_keys([node]))
+        self.assertDictEqual({}, get_probed_details_keys([]))
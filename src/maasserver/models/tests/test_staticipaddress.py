@@ -34,7 +34,10 @@ from maasserver.models.staticipaddress import (
     HostnameIPMapping,
     StaticIPAddress,
 )
-from maasserver.models.subnet import Subnet
+from maasserver.models.subnet import (
+    Subnet,
+    subnet_free_ip_cache,
+)
 from maasserver.testing.factory import factory
 from maasserver.testing.testcase import (
     MAASServerTestCase,
@@ -47,6 +50,8 @@ from maasserver.utils.orm import (
     transactional,
 )
 from maasserver.websockets.base import dehydrate_datetime
+from maastesting.djangotestcase import count_queries
+from maastesting.matchers import MockCalledOnceWith
 from netaddr import IPAddress
 from psycopg2.errorcodes import FOREIGN_KEY_VIOLATION
 from testtools import ExpectedException
@@ -298,6 +303,17 @@ class TestStaticIPAddressManager(MAASServerTestCase):
                 list(orm.retry_context.stack._cm_pending),
                 Equals([locks.address_allocation]))
 
+    def test_allocate_new_forgets_free_addresses_when_taken(self):
+        set_ip_address = self.patch(StaticIPAddress, "set_ip_address")
+        set_ip_address.side_effect = orm.make_unique_violation()
+        forget = self.patch(subnet_free_ip_cache, "forget")
+        subnet = factory.make_managed_Subnet()
+        with orm.retry_context:
+            self.assertRaises(
+                orm.RetryTransaction, StaticIPAddress.objects.allocate_new,
+                subnet=subnet)
+        self.assertThat(forget, MockCalledOnceWith(subnet.id))
+
     def test_allocate_new_propagates_other_integrity_errors(self):
         set_ip_address = self.patch(StaticIPAddress, "set_ip_address")
         set_ip_address.side_effect = orm.make_unique_violation()
@@ -983,6 +999,89 @@ class TestStaticIPAddressManagerMapping(MAASServerTestCase):
         }
 
 
+class TestHostnameIPMappingSnapshot(MAASServerTestCase):
+    """Tests for `get_hostname_ip_mapping_snapshot`."""
+
+    def make_addresses(self):
+        """Make nodes and DNS resources across several domains."""
+        default_domain = Domain.objects.get_default_domain()
+        parent = factory.make_Domain()
+        name = factory.make_name("child")
+        child = factory.make_Domain(name="%s.%s" % (name, parent.name))
+        subnet = factory.make_Subnet()
+        # Nodes in the default domain, in the parent, and at the top of the
+        # child domain, each with addresses on more than one interface.
+        nodes = [
+            factory.make_Node_with_Interface_on_Subnet(
+                subnet=subnet, interface_count=2),
+            factory.make_Node_with_Interface_on_Subnet(
+                subnet=subnet, domain=parent, interface_count=2),
+            factory.make_Node_with_Interface_on_Subnet(
+                subnet=subnet, domain=parent, hostname=name),
+        ]
+        for node in nodes:
+            for interface in node.interface_set.all():
+                factory.make_StaticIPAddress(
+                    alloc_type=IPADDRESS_TYPE.STICKY,
+                    interface=interface, subnet=subnet)
+        # A DNS resource shares an address with a node, and another has an
+        # address of its own.
+        node_ip = nodes[1].boot_interface.ip_addresses.first()
+        factory.make_DNSResource(
+            domain=parent, ip_addresses=[
+                node_ip, factory.make_StaticIPAddress(subnet=subnet)])
+        factory.make_DNSResource(
+            domain=child, ip_addresses=[
+                factory.make_StaticIPAddress(subnet=subnet)])
+        # A reserved address without a name.
+        factory.make_StaticIPAddress(
+            subnet=subnet, alloc_type=IPADDRESS_TYPE.USER_RESERVED)
+        return [default_domain, parent, child], subnet
+
+    def test__mapping_for_domain_matches_get_hostname_ip_mapping(self):
+        domains, _ = self.make_addresses()
+        snapshot = StaticIPAddress.objects.get_hostname_ip_mapping_snapshot()
+        for domain in domains:
+            self.assertEqual(
+                StaticIPAddress.objects.get_hostname_ip_mapping(domain),
+                snapshot.get_mapping(domain))
+
+    def test__reverse_mapping_matches_get_hostname_ip_mapping(self):
+        _, subnet = self.make_addresses()
+        snapshot = StaticIPAddress.objects.get_hostname_ip_mapping_snapshot()
+        self.assertEqual(
+            StaticIPAddress.objects.get_hostname_ip_mapping(subnet),
+            snapshot.get_reverse_mapping())
+
+    def test__honours_raw_ttl(self):
+        domains, _ = self.make_addresses()
+        snapshot = StaticIPAddress.objects.get_hostname_ip_mapping_snapshot(
+            raw_ttl=True)
+        self.assertEqual(
+            StaticIPAddress.objects.get_hostname_ip_mapping(
+                domains[1], raw_ttl=True),
+            snapshot.get_mapping(domains[1]))
+
+    def test__mapping_for_domain_without_addresses_is_empty(self):
+        self.make_addresses()
+        domain = factory.make_Domain()
+        snapshot = StaticIPAddress.objects.get_hostname_ip_mapping_snapshot()
+        self.assertEqual({}, snapshot.get_mapping(domain))
+
+    def test__query_count_does_not_depend_on_number_of_domains(self):
+        self.make_addresses()
+        count_few, _ = count_queries(
+            StaticIPAddress.objects.get_hostname_ip_mapping_snapshot)
+        for _ in range(3):
+            domain = factory.make_Domain()
+            factory.make_Node_with_Interface_on_Subnet(domain=domain)
+        count_many, snapshot = count_queries(
+            StaticIPAddress.objects.get_hostname_ip_mapping_snapshot)
+        self.assertEqual(count_few, count_many)
+        count_mapping, _ = count_queries(snapshot.get_mapping, domain)
+        self.assertEqual(0, count_mapping)
+
+
 class TestStaticIPAddress(MAASServerTestCase):
 
     def test_repr_with_valid_type(self):
@@ -36,6 +36,7 @@ from maasserver.models import (
 from maasserver.models.subnet import (
     create_cidr,
     Subnet,
+    SubnetFreeIPCache,
 )
 from maasserver.testing.factory import (
     factory,
@@ -1208,6 +1209,99 @@ class TestUnmanagedSubnets(MAASServerTestCase):
             subnet.get_next_ip_for_allocation()
 
 
+class TestSubnetFreeIPCache(MAASServerTestCase):
+
+    def setUp(self):
+        super(TestSubnetFreeIPCache, self).setUp()
+        self.cache = SubnetFreeIPCache()
+        self.subnet = factory.make_Subnet(
+            cidr="10.0.0.0/24", gateway_ip="10.0.0.1", dns_servers=[],
+            managed=True)
+
+    def get_smallest_free_range(self, *args, **kwargs):
+        free_range = self.cache.get_smallest_free_range(
+            self.subnet, *args, **kwargs)
+        if free_range is None:
+            return None
+        return tuple(str(IPAddress(address)) for address in free_range)
+
+    def test__builds_index_then_reuses_it(self):
+        self.assertEqual(
+            ("10.0.0.2", "10.0.0.254"), self.get_smallest_free_range())
+        self.assertEqual(
+            ("10.0.0.2", "10.0.0.254"), self.get_smallest_free_range())
+        self.assertEqual({"builds": 1, "hits": 1}, self.cache.stats)
+
+    def test__marks_added_addresses_as_used(self):
+        self.get_smallest_free_range()
+        factory.make_StaticIPAddress(ip="10.0.0.2", subnet=self.subnet)
+        factory.make_StaticIPAddress(ip="10.0.0.100", subnet=self.subnet)
+        self.assertEqual(
+            ("10.0.0.3", "10.0.0.99"), self.get_smallest_free_range())
+        self.assertEqual({"builds": 1, "updates": 1}, self.cache.stats)
+
+    def test__rebuilds_index_when_address_removed(self):
+        ip = factory.make_StaticIPAddress(ip="10.0.0.2", subnet=self.subnet)
+        self.get_smallest_free_range()
+        ip.delete()
+        self.assertEqual(
+            ("10.0.0.2", "10.0.0.254"), self.get_smallest_free_range())
+        self.assertEqual({"builds": 2}, self.cache.stats)
+
+    def test__rebuilds_index_when_address_changed(self):
+        ip = factory.make_StaticIPAddress(ip="10.0.0.2", subnet=self.subnet)
+        self.get_smallest_free_range()
+        ip.ip = "10.0.0.9"
+        ip.save()
+        self.assertEqual(
+            ("10.0.0.2", "10.0.0.8"), self.get_smallest_free_range())
+        self.assertEqual({"builds": 2}, self.cache.stats)
+
+    def test__rebuilds_index_when_range_added(self):
+        self.get_smallest_free_range()
+        factory.make_IPRange(
+            self.subnet, "10.0.0.100", "10.0.0.200",
+            type=IPRANGE_TYPE.RESERVED)
+        self.assertEqual(
+            ("10.0.0.201", "10.0.0.254"), self.get_smallest_free_range())
+        self.assertEqual({"builds": 2}, self.cache.stats)
+
+    def test__rebuilds_index_when_subnet_changed(self):
+        self.get_smallest_free_range()
+        self.subnet.gateway_ip = "10.0.0.254"
+        self.subnet.save()
+        self.assertEqual(
+            ("10.0.0.1", "10.0.0.253"), self.get_smallest_free_range())
+        self.assertEqual({"builds": 2}, self.cache.stats)
+
+    def test__rebuilds_index_when_neighbour_observed(self):
+        self.get_smallest_free_range()
+        rackif = factory.make_Interface(vlan=self.subnet.vlan)
+        factory.make_Discovery(ip="10.0.0.2", interface=rackif)
+        self.assertEqual(
+            ("10.0.0.3", "10.0.0.254"), self.get_smallest_free_range())
+        self.assertEqual({"builds": 2}, self.cache.stats)
+
+    def test__does_not_remember_excluded_addresses(self):
+        self.assertEqual(
+            ("10.0.0.3", "10.0.0.254"),
+            self.get_smallest_free_range(["10.0.0.2", "192.168.0.1"]))
+        self.assertEqual(
+            ("10.0.0.2", "10.0.0.254"), self.get_smallest_free_range())
+
+    def test__returns_none_when_no_addresses_free(self):
+        factory.make_IPRange(
+            self.subnet, "10.0.0.2", "10.0.0.254",
+            type=IPRANGE_TYPE.RESERVED)
+        self.assertIsNone(self.get_smallest_free_range())
+
+    def test__forget_discards_index(self):
+        self.get_smallest_free_range()
+        self.cache.forget(self.subnet.id)
+        self.get_smallest_free_range()
+        self.assertEqual({"builds": 2}, self.cache.stats)
+
+
 class TestSubnetIPExhaustionNotifications(MAASServerTestCase):
     """Tests the effects of the signal handlers on the StaticIPAddress and
     IPRange classes, which will cause the subnet notification creation or
@@ -4,13 +4,23 @@
 """Populate what nodes are associated with a tag."""
 
 __all__ = [
+    'evaluate_tags',
+    'get_details_documents',
+    'get_tag_xpath',
     'populate_tag_for_multiple_nodes',
     'populate_tags',
     'populate_tags_for_single_node',
+    'rebuild_tags',
 ]
 
-from functools import partial
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import (
+    lru_cache,
+    partial,
+)
 from math import ceil
+import threading
 
 from apiclient.creds import convert_tuple_to_string
 from lxml import etree
@@ -21,7 +31,7 @@ from maasserver.models.node import (
 )
 from maasserver.models.nodeprobeddetails import (
     get_probed_details,
-    get_single_probed_details,
+    get_probed_details_keys,
     script_output_nsmap,
 )
 from maasserver.models.user import (
@@ -62,6 +72,117 @@ tag_nsmap = {
     for namespace in script_output_nsmap.values()
 }
 
+# The most merged details documents to keep in `details_cache`. Parsed, the
+# details of a typical node take a few hundred kilobytes.
+DETAILS_CACHE_SIZE = 256
+
+
+@lru_cache(maxsize=1024)
+def get_tag_xpath(definition):
+    """Return a tag's `definition` compiled as an XPath expression.
+
+    Compiled expressions are cached so that a definition is compiled once,
+    not once for every node that it's evaluated against.
+
+    :raise etree.XPathSyntaxError: If `definition` is not valid.
+    """
+    return etree.XPath(definition, namespaces=tag_nsmap)
+
+
+def match_tag_definition(definition, document, logger=logger):
+    """Does the tag `definition` match the details `document`?
+
+    Invalid definitions are logged, and do not match.
+    """
+    try:
+        xpath = get_tag_xpath(definition)
+    except etree.XPathSyntaxError as error:
+        logger.warning("Invalid expression '%s': %s", definition, error)
+        return False
+    else:
+        return try_match_xpath(xpath, document, logger=logger)
+
+
+def evaluate_tags(tags, document, logger=logger):
+    """Evaluate the definitions of `tags` against one details `document`.
+
+    Tags without a definition are skipped.
+
+    :return: A tuple of lists of matching and non-matching tags.
+    """
+    return classify(
+        partial(match_tag_definition, document=document, logger=logger),
+        ((tag, tag.definition) for tag in tags if tag.is_defined))
+
+
+class DetailsDocumentCache:
+    """A cache of merged details documents, by node.
+
+    Each document is kept with the key, from `get_probed_details_keys`, of
+    the details that it was merged from, and is found only with that same
+    key. The least recently used documents are discarded first.
+
+    Documents are shared between threads and must not be modified.
+    """
+
+    def __init__(self, size=DETAILS_CACHE_SIZE):
+        super(DetailsDocumentCache, self).__init__()
+        self.size = size
+        self.documents = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, system_id, key):
+        """Return the document for `system_id` with `key`, or `None`."""
+        with self.lock:
+            cached = self.documents.get(system_id)
+            if cached is None or cached[0] != key:
+                return None
+            else:
+                self.documents.move_to_end(system_id)
+                return cached[1]
+
+    def put(self, system_id, key, document):
+        """Keep `document`, merged from details identified by `key`."""
+        with self.lock:
+            self.documents[system_id] = key, document
+            self.documents.move_to_end(system_id)
+            while len(self.documents) > self.size:
+                self.documents.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.documents.clear()
+
+
+# The global cache of merged details documents.
+details_cache = DetailsDocumentCache()
+
+
+def get_details_documents(nodes):
+    """Return merged details documents for `nodes`.
+
+    Documents are taken from `details_cache` when the details they were
+    merged from have not changed. Only the details of the other nodes are
+    fetched and merged, which includes parsing their XML.
+
+    :return: A ``{node: document, ...}`` map.
+    """
+    keys = get_probed_details_keys(nodes)
+    documents, missing = {}, []
+    for node in nodes:
+        document = details_cache.get(node.system_id, keys[node.system_id])
+        if document is None:
+            missing.append(node)
+        else:
+            documents[node] = document
+    if len(missing) != 0:
+        probed_details = get_probed_details(missing)
+        for node in missing:
+            document = merge_details(probed_details[node.system_id])
+            details_cache.put(node.system_id, keys[node.system_id], document)
+            documents[node] = document
+    return documents
+
 
 def chunk_list(items, num_chunks):
     """Split `items` into (at most) `num_chunks` lists.
@@ -194,13 +315,10 @@ def populate_tags_for_single_node(tags, node):
     nodes need reevaluating locally, i.e. when there are no rack controllers
     connected.
     """
-    probed_details = get_single_probed_details(node)
-    probed_details_doc = merge_details(probed_details)
-    # Same document, many queries: use XPathEvaluator.
-    evaluator = etree.XPathEvaluator(probed_details_doc, namespaces=tag_nsmap)
-    evaluator = partial(try_match_xpath, doc=evaluator, logger=logger)
-    tags_defined = ((tag, tag.definition) for tag in tags if tag.is_defined)
-    tags_matching, tags_nonmatching = classify(evaluator, tags_defined)
+    probed_details_docs_by_node = get_details_documents([node])
+    # Same document, many queries: evaluate compiled expressions against it.
+    tags_matching, tags_nonmatching = evaluate_tags(
+        tags, probed_details_docs_by_node[node])
     node.tags.remove(*tags_nonmatching)
     node.tags.add(*tags_matching)
 
@@ -215,16 +333,68 @@ def populate_tag_for_multiple_nodes(tag, nodes, batch_size=DEFAULT_BATCH_SIZE):
     locally, i.e. when there are no rack controllers connected.
     """
     # Same expression, multuple documents: compile expression with XPath.
-    xpath = etree.XPath(tag.definition, namespaces=tag_nsmap)
+    xpath = get_tag_xpath(tag.definition)
     # The XML details documents can be large so work in batches.
     for batch in gen_batches(nodes, batch_size):
-        probed_details = get_probed_details(batch)
-        probed_details_docs_by_node = {
-            node: merge_details(probed_details[node.system_id])
-            for node in batch
-        }
+        probed_details_docs_by_node = get_details_documents(batch)
         nodes_matching, nodes_nonmatching = classify(
             partial(try_match_xpath, xpath, logger=maaslog),
             probed_details_docs_by_node.items())
         tag.node_set.remove(*nodes_nonmatching)
         tag.node_set.add(*nodes_matching)
+
+
+def match_tag_definitions(definitions, details):
+    """Return the indexes of those `definitions` that match `details`.
+
+    This merges `details` then evaluates each definition against it. Its
+    arguments and return value are plain data so that it can be called in
+    a worker process.
+    """
+    document = merge_details(details)
+    return [
+        index for index, definition in enumerate(definitions)
+        if match_tag_definition(definition, document, maaslog)
+    ]
+
+
+@synchronous
+def rebuild_tags(tags, nodes, workers=1, batch_size=DEFAULT_BATCH_SIZE):
+    """Reevaluate all of `tags` for all of `nodes`, in this transaction.
+
+    Details are fetched in batches in this process, but merging them and
+    evaluating tags, which is bound by CPU, is spread across `workers`
+    processes. Each node's details are merged only once, however many tags
+    there are.
+
+    Worker processes are forked, which is unsafe in a threaded process such
+    as regiond, so this is for use by commands like ``rebuild_tags``. Use
+    `populate_tags` from regiond.
+    """
+    tags = [tag for tag in tags if tag.is_defined]
+    evaluate = partial(
+        match_tag_definitions, [tag.definition for tag in tags])
+    node_ids, matches = set(), [set() for _ in tags]
+    if workers > 1:
+        executor = ProcessPoolExecutor(workers)
+        evaluate_all = partial(
+            executor.map, evaluate,
+            chunksize=max(1, batch_size // (workers * 4)))
+    else:
+        executor = None
+        evaluate_all = partial(map, evaluate)
+    try:
+        for batch in gen_batches(nodes, batch_size):
+            probed_details = get_probed_details(batch)
+            results = evaluate_all(
+                [probed_details[node.system_id] for node in batch])
+            for node, indexes in zip(batch, results):
+                node_ids.add(node.id)
+                for index in indexes:
+                    matches[index].add(node.id)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    for tag, node_ids_matching in zip(tags, matches):
+        tag.node_set.remove(*(node_ids - node_ids_matching))
+        tag.node_set.add(*node_ids_matching)
@@ -16,6 +16,7 @@ __all__ = [
     ]
 
 from collections import namedtuple
+from copy import copy
 import json
 import os.path
 from pipes import quote
@@ -74,6 +75,7 @@ from provisioningserver.logger import (
 )
 from provisioningserver.rpc.exceptions import NoConnectionsAvailable
 from provisioningserver.utils import typed
+from provisioningserver.utils.templates import templates
 from provisioningserver.utils.url import compose_URL
 import tempita
 import yaml
@@ -673,8 +675,12 @@ def compose_filename(elements):
     return '_'.join(elements)
 
 
-def get_preseed_template(filenames):
-    """Get the path and content for the first template found.
+def find_preseed_template(filenames):
+    """Get the path and parsed `PreseedTemplate` for the first template found.
+
+    Templates come from the shared cache, so this does no I/O beyond
+    checking that the files have not changed. The template returned is
+    shared and must not be modified.
 
     :param filenames: An iterable of relative filenames.
     """
@@ -684,16 +690,28 @@ def get_preseed_template(filenames):
         for filename in filenames:
             filepath = os.path.join(location, filename)
             try:
-                with open(filepath, "r", encoding="utf-8") as stream:
-                    content = stream.read()
+                template = templates.get(filepath, PreseedTemplate)
             except IOError:
                 pass  # Ignore.
             else:
-                return filepath, content
+                if template is not None:
+                    return filepath, template
     else:
         return None, None
 
 
+def get_preseed_template(filenames):
+    """Get the path and content for the first template found.
+
+    :param filenames: An iterable of relative filenames.
+    """
+    filepath, template = find_preseed_template(filenames)
+    if template is None:
+        return None, None
+    else:
+        return filepath, template.content
+
+
 def get_escape_singleton():
     """Return a singleton containing methods to escape various formats used in
     the preseed templates.
@@ -741,13 +759,14 @@ def load_preseed_template(node, prefix, osystem='', release=''):
         """
         filenames = list(get_preseed_filenames(
             node, name, osystem, release, default))
-        filepath, content = get_preseed_template(filenames)
+        filepath, template = find_preseed_template(filenames)
         if filepath is None:
             raise TemplateNotFoundError(name)
-        # This is where the closure happens: pass `get_template` when
-        # instanciating PreseedTemplate.
-        return PreseedTemplate(
-            content, name=filepath, get_template=get_template)
+        # This is where the closure happens: give a copy of the shared
+        # template `get_template`. Copying does not parse it again.
+        template = copy(template)
+        template.get_template = get_template
+        return template
 
     return get_template(prefix, None, default=True)
 
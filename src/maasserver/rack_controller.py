@@ -29,7 +29,9 @@ DHCP:
     Once a 'watch_{id}' message is sent to this process it will start listening
     for messages on 'sys_dhcp_{id}' channel and set that rack controller as
     needing an update. Any time a message is received on this queue that rack
-    controller is marked as needing an update.
+    controller is marked as needing an update. The message is the ID of the
+    VLAN that has changed, or empty if any might have. Only the configuration
+    for that VLAN is rebuilt; see `DHCPConfigurationCache`.
 """
 
 __all__ = [
@@ -86,6 +88,7 @@ class RackControllerService(Service):
         self.processingDone = None
         self.watching = set()
         self.needsDHCPUpdate = set()
+        self.dhcpConfigCache = dhcp.DHCPConfigurationCache()
         self.postgresListener = postgresListener
         self.advertisingService = advertisingService
 
@@ -161,6 +164,7 @@ class RackControllerService(Service):
 
             self.watching = set()
             self.needsDHCPUpdate = set()
+            self.dhcpConfigCache = dhcp.DHCPConfigurationCache()
             self.starting = None
             if self.processing.running:
                 self.processing.stop()
@@ -183,11 +187,15 @@ class RackControllerService(Service):
                     "sys_dhcp_%s" % rack_id, self.dhcpHandler)
             self.needsDHCPUpdate.discard(rack_id)
             self.watching.discard(rack_id)
+            self.dhcpConfigCache.forget(rack_id)
         elif action == "watch":
             if rack_id not in self.watching:
                 self.postgresListener.register(
                     "sys_dhcp_%s" % rack_id, self.dhcpHandler)
             self.watching.add(rack_id)
+            # The rack controller may have (re)connected without the
+            # configuration it was last sent.
+            self.dhcpConfigCache.forget(rack_id)
             self.needsDHCPUpdate.add(rack_id)
             self.startProcessing()
         else:
@@ -198,6 +206,10 @@ class RackControllerService(Service):
         _, rack_id = channel.split("sys_dhcp_")
         rack_id = int(rack_id)
         if rack_id in self.watching:
+            if message == "":
+                self.dhcpConfigCache.invalidate(rack_id)
+            else:
+                self.dhcpConfigCache.invalidate(rack_id, {int(message)})
             self.needsDHCPUpdate.add(rack_id)
             self.startProcessing()
 
@@ -227,5 +239,5 @@ class RackControllerService(Service):
         """Process DHCP for the rack controller."""
         d = deferToDatabase(
             transactional(RackController.objects.get), id=rack_id)
-        d.addCallback(dhcp.configure_dhcp)
+        d.addCallback(dhcp.configure_dhcp, cache=self.dhcpConfigCache)
         return d
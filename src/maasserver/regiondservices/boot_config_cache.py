@@ -0,0 +1,209 @@
+# Copyright 2017 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Service that keeps the boot configuration cache up to date."""
+
+__all__ = [
+    "BootConfigCacheService"
+]
+
+from collections import defaultdict
+from datetime import timedelta
+
+from maasserver import is_master_process
+from maasserver.models import Interface
+from maasserver.rpc import getAllClients
+from maasserver.rpc.boot import boot_config_cache
+from maasserver.utils.orm import transactional
+from maasserver.utils.threads import deferToDatabase
+from provisioningserver.logger import LegacyLogger
+from provisioningserver.rpc.cluster import InvalidateKernelParams
+from provisioningserver.utils.twisted import suppress
+from twisted.application.internet import TimerService
+from twisted.internet import reactor
+from twisted.internet.defer import inlineCallbacks
+from twisted.protocols.amp import UnhandledCommand
+
+
+log = LegacyLogger()
+
+
+# How often to report the effectiveness of the cache.
+REPORT_INTERVAL = timedelta(minutes=10).total_seconds()
+
+# Channels whose notifications carry the system ID of a node for which
+# cached configurations must be invalidated.
+NODE_CHANNELS = ("machine", "controller")
+
+# Channels whose notifications can affect the configuration of any node.
+GLOBAL_CHANNELS = ("config", "domain", "tag")
+
+# How long, in seconds, to gather changes before passing them on to the
+# rack controllers. A burst of changes then costs each rack one call.
+RACK_INVALIDATION_DELAY = 1.0
+
+
+class BootConfigCacheService(TimerService):
+    """Enable `boot_config_cache` and invalidate it as the database changes.
+
+    Invalidation is driven by the node, interface, configuration, domain,
+    and tag triggers, via the `PostgresListenerService`. The master process
+    gathers invalidations for `RACK_INVALIDATION_DELAY` seconds then passes
+    them on to the connected rack controllers so that they too forget the
+    kernel parameters they have cached. The hit and miss counts for the
+    cache are logged every `REPORT_INTERVAL` seconds.
+
+    :ivar macs: The MAC addresses of each node, as last seen, by system ID.
+        Rack controllers are told to forget that they could not answer a
+        machine only when a node's MAC addresses have changed.
+    """
+
+    def __init__(self, postgresListener, cache=boot_config_cache,
+                 clock=reactor):
+        super().__init__(REPORT_INTERVAL, self.report)
+        self.clock = clock
+        self.listener = postgresListener
+        self.cache = cache
+        self.reported = self.cache.stats.copy()
+        self.macs = {}
+        self.pending = None
+        self.pending_call = None
+
+    def startService(self):
+        super().startService()
+        for channel in NODE_CHANNELS:
+            self.listener.register(
+                channel, self.invalidateNodes, batch=True)
+        for channel in GLOBAL_CHANNELS:
+            self.listener.register(channel, self.invalidateAll)
+        self.cache.clear()
+        self.cache.enabled = True
+
+    def stopService(self):
+        self.cache.enabled = False
+        self.cache.clear()
+        for channel in NODE_CHANNELS:
+            self.listener.unregister(channel, self.invalidateNodes)
+        for channel in GLOBAL_CHANNELS:
+            self.listener.unregister(channel, self.invalidateAll)
+        if self.pending_call is not None:
+            self.pending_call.cancel()
+            self.pending_call = None
+        return super().stopService()
+
+    def invalidateNodes(self, action, system_ids):
+        """Called with a batch of notifications for nodes."""
+        self.cache.invalidate(system_ids)
+        self.invalidateRacks(system_ids, no_response=(action == "create"))
+
+    def invalidateAll(self, action, obj_id):
+        """Called when something that any node might depend on changes."""
+        self.cache.clear()
+        self.invalidateRacks(None)
+
+    def invalidateRacks(self, system_ids, no_response=False):
+        """Have the rack controllers forget cached kernel parameters, soon.
+
+        Every region process receives the same notifications so only the
+        master process passes them on, after `RACK_INVALIDATION_DELAY`
+        seconds, together with any others that arrive in the meantime.
+
+        :param system_ids: The nodes that have changed, or `None` to have
+            the rack controllers forget everything.
+        :param no_response: Whether the rack controllers must also forget
+            that they could not answer a machine, even if the MAC addresses
+            of these nodes have not changed.
+        """
+        if not is_master_process():
+            return
+        if self.pending_call is None:
+            self.pending = set(), False
+            self.pending_call = self.clock.callLater(
+                RACK_INVALIDATION_DELAY, self.flushRacks)
+        pending_ids, pending_no_response = self.pending
+        if system_ids is None or pending_ids is None:
+            pending_ids = None
+        else:
+            pending_ids.update(system_ids)
+        self.pending = pending_ids, pending_no_response or no_response
+
+    @inlineCallbacks
+    def flushRacks(self):
+        """Pass the invalidations gathered so far on to the rack controllers.
+
+        The nodes' MAC addresses are compared to those last seen, to decide
+        whether the rack controllers must also forget the machines they
+        could not answer.
+        """
+        (system_ids, no_response), self.pending = self.pending, None
+        self.pending_call = None
+        if system_ids is not None:
+            try:
+                macs = yield deferToDatabase(self.getMACs, system_ids)
+            except Exception:
+                log.err(None, "Failed to find MAC addresses of nodes.")
+                no_response = True
+            else:
+                no_response = self.updateMACs(macs) or no_response
+            system_ids = sorted(system_ids)
+        for client in getAllClients():
+            if system_ids is None:
+                d = client(InvalidateKernelParams, system_ids=None)
+            else:
+                d = client(
+                    InvalidateKernelParams, system_ids=system_ids,
+                    no_response=no_response)
+            # Rack controllers from before 2.3 do not cache.
+            d.addErrback(suppress, UnhandledCommand)
+            d.addErrback(
+                log.err, "Failed to invalidate kernel parameters cached "
+                "by rack controller %s." % client.ident)
+
+    @transactional
+    def getMACs(self, system_ids):
+        """Return the MAC addresses of each of the given nodes.
+
+        :return: A mapping of system ID to a `frozenset` of MAC addresses,
+            for each of the given nodes, whether or not it exists.
+        """
+        macs = defaultdict(set)
+        interfaces = Interface.objects.filter(
+            node__system_id__in=system_ids, mac_address__isnull=False)
+        for system_id, mac in interfaces.values_list(
+                "node__system_id", "mac_address"):
+            macs[system_id].add(str(mac))
+        return {
+            system_id: frozenset(macs[system_id])
+            for system_id in system_ids
+        }
+
+    def updateMACs(self, macs):
+        """Remember nodes' MAC addresses; return whether any have changed.
+
+        A node that has not been seen before has changed if it has any MAC
+        addresses; one that has gone is forgotten.
+
+        :param macs: A mapping of system ID to a `frozenset` of MAC
+            addresses, as returned by `getMACs`.
+        """
+        changed = False
+        for system_id, node_macs in macs.items():
+            known_macs = self.macs.pop(system_id, frozenset())
+            if len(node_macs) != 0:
+                self.macs[system_id] = node_macs
+            changed = changed or node_macs != known_macs
+        return changed
+
+    def report(self):
+        """Log the hit and miss counts since the last report."""
+        stats = self.cache.stats.copy()
+        stats.subtract(self.reported)
+        self.reported = self.cache.stats.copy()
+        requests = stats["hits"] + stats["misses"]
+        if requests > 0:
+            log.msg(
+                "Boot configuration cache: %d hits, %d misses (%.0f%% hit "
+                "rate), %d invalidated, %d cached entries." % (
+                    stats["hits"], stats["misses"],
+                    100.0 * stats["hits"] / requests,
+                    stats["invalidations"], len(self.cache.entries)))
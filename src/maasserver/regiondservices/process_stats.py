@@ -0,0 +1,141 @@
+# Copyright 2017 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Service that publishes statistics about this region process.
+
+Statistics such as retry and request telemetry are kept in memory by each
+regiond process. This service periodically writes them, as JSON, to a file
+named for the process in `get_stats_dir`, where `maas-region` commands such
+as ``contention_report`` can find them. At the same time it reconfigures
+request telemetry from regiond.conf, so changes to its options take effect
+without a restart.
+"""
+
+__all__ = [
+    "configure_request_telemetry",
+    "get_process_stats",
+    "get_stats_dir",
+    "ProcessStatsService",
+    "read_process_stats",
+]
+
+from datetime import timedelta
+import json
+import os
+from time import time
+
+from maasserver.config import RegionConfiguration
+from maasserver.utils.contention import retry_telemetry
+from maasserver.utils.latency import request_telemetry
+from provisioningserver.logger import LegacyLogger
+from provisioningserver.path import (
+    get_data_path,
+    get_tentative_data_path,
+)
+from provisioningserver.utils.fs import atomic_write
+from twisted.application.internet import TimerService
+from twisted.internet import reactor
+from twisted.internet.threads import deferToThread
+
+
+log = LegacyLogger()
+
+
+# How often to publish statistics.
+PUBLISH_INTERVAL = timedelta(seconds=30).total_seconds()
+
+# Where to publish statistics, relative to MAAS_ROOT.
+STATS_DIR = "/var/lib/maas/stats"
+
+
+def get_stats_dir():
+    """Return the directory into which each process publishes statistics."""
+    return get_tentative_data_path(STATS_DIR)
+
+
+def get_process_stats():
+    """Return a JSON-compatible dict of statistics about this process.
+
+    This must be called in the reactor thread.
+    """
+    # Avoid circular imports.
+    from maasserver import concurrency
+    return {
+        "pid": os.getpid(),
+        "time": time(),
+        "retries": retry_telemetry.getStats(),
+        "requests": request_telemetry.getStats(),
+        "limiter": concurrency.database.getStats(),
+    }
+
+
+def write_process_stats(stats):
+    """Write `stats` to this process's file in `get_stats_dir`."""
+    path = get_data_path(STATS_DIR, "%d.json" % stats["pid"])
+    content = json.dumps(stats, sort_keys=True).encode("utf-8")
+    atomic_write(content, path, mode=0o644)
+
+
+def configure_request_telemetry():
+    """Configure `request_telemetry` from the region's configuration."""
+    with RegionConfiguration.open() as config:
+        request_telemetry.sample_rate = config.telemetry_sample_rate
+        request_telemetry.slow_threshold = config.telemetry_slow_request
+
+
+def is_running(pid):
+    """Is a process with the given ID running?"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # It's running as another user.
+        return True
+    else:
+        return True
+
+
+def read_process_stats(directory=None):
+    """Read the statistics published by each running region process.
+
+    Files left behind by processes that are no longer running are ignored.
+
+    :param directory: The directory to read from; `get_stats_dir` by default.
+    :return: A list of dicts, as returned by `get_process_stats`, ordered by
+        process ID.
+    """
+    if directory is None:
+        directory = get_stats_dir()
+    try:
+        filenames = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    processes = []
+    for filename in filenames:
+        pid, ext = os.path.splitext(filename)
+        if ext == ".json" and pid.isdigit() and is_running(int(pid)):
+            path = os.path.join(directory, filename)
+            try:
+                with open(path, "r", encoding="utf-8") as fd:
+                    processes.append(json.load(fd))
+            except (OSError, ValueError):
+                # It may have been removed, or it may be a partial write.
+                continue
+    return sorted(processes, key=lambda stats: stats["pid"])
+
+
+class ProcessStatsService(TimerService):
+    """Publish statistics about this process every `PUBLISH_INTERVAL`."""
+
+    def __init__(self, clock=reactor):
+        super().__init__(PUBLISH_INTERVAL, self.publish)
+        self.clock = clock
+
+    def publish(self):
+        d = deferToThread(configure_request_telemetry)
+        d.addErrback(log.err, "Failed to configure request telemetry.")
+        d.addCallback(lambda _: get_process_stats())
+        d.addCallback(lambda stats: deferToThread(write_process_stats, stats))
+        d.addErrback(log.err, "Failed to publish process statistics.")
+        return d
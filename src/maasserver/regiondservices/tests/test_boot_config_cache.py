@@ -0,0 +1,296 @@
+# Copyright 2017 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for the boot configuration cache service."""
+
+__all__ = []
+
+from unittest.mock import (
+    call,
+    Mock,
+)
+
+from maasserver.regiondservices import boot_config_cache
+from maasserver.regiondservices.boot_config_cache import (
+    BootConfigCacheService,
+)
+from maasserver.enum import INTERFACE_TYPE
+from maasserver.rpc.boot import BootConfigCache
+from maasserver.testing.factory import factory
+from maasserver.testing.testcase import MAASServerTestCase
+from maastesting.matchers import (
+    DocTestMatches,
+    MockCalledOnceWith,
+    MockCallsMatch,
+    MockNotCalled,
+)
+from maastesting.testcase import MAASTestCase
+from maastesting.twisted import TwistedLoggerFixture
+from provisioningserver.rpc.cluster import InvalidateKernelParams
+from testtools.matchers import MatchesStructure
+from twisted.internet.defer import (
+    fail,
+    maybeDeferred,
+    succeed,
+)
+from twisted.internet.task import Clock
+from twisted.protocols.amp import UnhandledCommand
+
+
+class TestBootConfigCacheService(MAASTestCase):
+
+    def make_service(self):
+        listener = Mock()
+        cache = BootConfigCache()
+        service = BootConfigCacheService(listener, cache, Clock())
+        return service, listener, cache
+
+    def put_entry(self, cache, machine_id=None):
+        request = (
+            factory.make_name("rack"), factory.make_mac_address(),
+            None, None)
+        if machine_id is None:
+            machine_id = factory.make_name("machine")
+        cache.put(
+            cache.generation, *request, machine_id=machine_id,
+            params={}, event_purpose="xinstall")
+        return request
+
+    def test_reports_periodically(self):
+        service, _, _ = self.make_service()
+        self.assertThat(service, MatchesStructure.byEquality(
+            call=(service.report, (), {}),
+            step=boot_config_cache.REPORT_INTERVAL))
+
+    def test_registers_and_unregisters_listener(self):
+        service, listener, _ = self.make_service()
+        service.startService()
+        self.assertThat(listener.register, MockCallsMatch(
+            call("machine", service.invalidateNodes, batch=True),
+            call("controller", service.invalidateNodes, batch=True),
+            call("config", service.invalidateAll),
+            call("domain", service.invalidateAll),
+            call("tag", service.invalidateAll),
+        ))
+        service.stopService()
+        self.assertThat(listener.unregister, MockCallsMatch(
+            call("machine", service.invalidateNodes),
+            call("controller", service.invalidateNodes),
+            call("config", service.invalidateAll),
+            call("domain", service.invalidateAll),
+            call("tag", service.invalidateAll),
+        ))
+
+    def test_enables_cache_only_while_running(self):
+        service, _, cache = self.make_service()
+        self.assertFalse(cache.enabled)
+        service.startService()
+        self.assertTrue(cache.enabled)
+        self.put_entry(cache)
+        service.stopService()
+        self.assertFalse(cache.enabled)
+        self.assertEqual({}, cache.entries)
+
+    def test_invalidateNodes_invalidates_given_nodes(self):
+        service, _, cache = self.make_service()
+        service.startService()
+        self.addCleanup(service.stopService)
+        request1 = self.put_entry(cache, "abcdef")
+        request2 = self.put_entry(cache, "ghijkl")
+        service.invalidateNodes("update", ["abcdef"])
+        self.assertIsNone(cache.get(*request1))
+        self.assertIsNotNone(cache.get(*request2))
+
+    def test_invalidateAll_clears_cache(self):
+        service, _, cache = self.make_service()
+        service.startService()
+        self.addCleanup(service.stopService)
+        self.put_entry(cache)
+        service.invalidateAll("update", 1)
+        self.assertEqual({}, cache.entries)
+
+    def patch_clients(self, *results, master=True):
+        self.patch(
+            boot_config_cache, "is_master_process").return_value = master
+        clients = []
+        for result in results:
+            client = Mock(ident=factory.make_name("rack"))
+            client.return_value = result
+            clients.append(client)
+        self.patch(boot_config_cache, "getAllClients").return_value = clients
+        return clients
+
+    def patch_macs(self, service, **macs):
+        """Have `service` find the given MAC addresses for nodes."""
+        self.patch(
+            boot_config_cache, "deferToDatabase",
+            lambda func, *args: maybeDeferred(func, *args))
+        self.patch(service, "getMACs").side_effect = lambda system_ids: {
+            system_id: frozenset(macs.get(system_id, ()))
+            for system_id in system_ids
+        }
+
+    def make_rack_service(self, *results, **macs):
+        service, _, _ = self.make_service()
+        clients = self.patch_clients(*results)
+        self.patch_macs(service, **macs)
+        return service, clients
+
+    def test_invalidateNodes_invalidates_racks_from_master(self):
+        service, clients = self.make_rack_service(succeed({}), succeed({}))
+        service.invalidateNodes("update", ["ghijkl", "abcdef"])
+        for client in clients:
+            self.assertThat(client, MockNotCalled())
+        service.clock.advance(boot_config_cache.RACK_INVALIDATION_DELAY)
+        for client in clients:
+            self.assertThat(client, MockCalledOnceWith(
+                InvalidateKernelParams, system_ids=["abcdef", "ghijkl"],
+                no_response=False))
+
+    def test_invalidateAll_invalidates_racks_from_master(self):
+        service, [client] = self.make_rack_service(succeed({}))
+        service.invalidateAll("update", 1)
+        service.clock.advance(boot_config_cache.RACK_INVALIDATION_DELAY)
+        self.assertThat(client, MockCalledOnceWith(
+            InvalidateKernelParams, system_ids=None))
+
+    def test_gathers_invalidations_for_racks(self):
+        service, [client] = self.make_rack_service(succeed({}))
+        service.invalidateNodes("update", ["abcdef"])
+        service.invalidateNodes("update", ["ghijkl", "abcdef"])
+        service.clock.advance(boot_config_cache.RACK_INVALIDATION_DELAY)
+        service.invalidateNodes("update", ["mnopqr"])
+        service.clock.advance(boot_config_cache.RACK_INVALIDATION_DELAY)
+        self.assertThat(client, MockCallsMatch(
+            call(
+                InvalidateKernelParams, system_ids=["abcdef", "ghijkl"],
+                no_response=False),
+            call(
+                InvalidateKernelParams, system_ids=["mnopqr"],
+                no_response=False),
+        ))
+
+    def test_invalidateAll_supersedes_gathered_invalidations(self):
+        service, [client] = self.make_rack_service(succeed({}))
+        service.invalidateNodes("create", ["abcdef"])
+        service.invalidateAll("update", 1)
+        service.invalidateNodes("update", ["ghijkl"])
+        service.clock.advance(boot_config_cache.RACK_INVALIDATION_DELAY)
+        self.assertThat(client, MockCalledOnceWith(
+            InvalidateKernelParams, system_ids=None))
+
+    def test_new_nodes_have_racks_forget_no_responses(self):
+        service, [client] = self.make_rack_service(succeed({}))
+        service.invalidateNodes("update", ["abcdef"])
+        service.invalidateNodes("create", ["ghijkl"])
+        service.clock.advance(boot_config_cache.RACK_INVALIDATION_DELAY)
+        self.assertThat(client, MockCalledOnceWith(
+            InvalidateKernelParams, system_ids=["abcdef", "ghijkl"],
+            no_response=True))
+
+    def test_changed_macs_have_racks_forget_no_responses(self):
+        mac1, mac2 = factory.make_mac_address(), factory.make_mac_address()
+        service, [client] = self.make_rack_service(
+            succeed({}), abcdef=[mac1])
+        for macs in [mac1], [mac1], [mac1, mac2], [mac2], [mac2]:
+            self.patch_macs(service, abcdef=macs)
+            service.invalidateNodes("update", ["abcdef"])
+            service.clock.advance(boot_config_cache.RACK_INVALIDATION_DELAY)
+        self.assertThat(client, MockCallsMatch(*(
+            call(
+                InvalidateKernelParams, system_ids=["abcdef"],
+                no_response=no_response)
+            for no_response in (True, False, True, True, False))))
+
+    def test_forgets_macs_of_nodes_that_have_gone(self):
+        service, _ = self.make_rack_service()
+        mac = factory.make_mac_address()
+        self.assertTrue(service.updateMACs({"abcdef": frozenset([mac])}))
+        self.assertEqual({"abcdef": frozenset([mac])}, service.macs)
+        self.assertTrue(service.updateMACs({"abcdef": frozenset()}))
+        self.assertEqual({}, service.macs)
+        self.assertFalse(service.updateMACs({"abcdef": frozenset()}))
+
+    def test_racks_forget_no_responses_when_macs_cannot_be_found(self):
+        service, [client] = self.make_rack_service(succeed({}))
+        service.getMACs.side_effect = factory.make_exception()
+        with TwistedLoggerFixture() as logger:
+            service.invalidateNodes("update", ["abcdef"])
+            service.clock.advance(boot_config_cache.RACK_INVALIDATION_DELAY)
+        self.assertThat(client, MockCalledOnceWith(
+            InvalidateKernelParams, system_ids=["abcdef"], no_response=True))
+        self.assertThat(logger.output, DocTestMatches(
+            "Failed to find MAC addresses of nodes.\n..."))
+
+    def test_stopService_cancels_pending_invalidations(self):
+        service, [client] = self.make_rack_service(succeed({}))
+        service.startService()
+        service.invalidateNodes("update", ["abcdef"])
+        service.stopService()
+        service.clock.advance(boot_config_cache.RACK_INVALIDATION_DELAY)
+        self.assertThat(client, MockNotCalled())
+
+    def test_does_not_invalidate_racks_from_other_processes(self):
+        service, _, _ = self.make_service()
+        [client] = self.patch_clients(succeed({}), master=False)
+        service.invalidateNodes("update", ["abcdef"])
+        service.invalidateAll("update", 1)
+        service.clock.advance(boot_config_cache.RACK_INVALIDATION_DELAY)
+        self.assertThat(client, MockNotCalled())
+
+    def test_ignores_racks_that_do_not_cache(self):
+        service, _ = self.make_rack_service(fail(UnhandledCommand()))
+        with TwistedLoggerFixture() as logger:
+            service.invalidateNodes("update", ["abcdef"])
+            service.clock.advance(boot_config_cache.RACK_INVALIDATION_DELAY)
+        self.assertEqual("", logger.output)
+
+    def test_logs_failures_to_invalidate_racks(self):
+        service, [client] = self.make_rack_service(
+            fail(factory.make_exception()))
+        with TwistedLoggerFixture() as logger:
+            service.invalidateNodes("update", ["abcdef"])
+            service.clock.advance(boot_config_cache.RACK_INVALIDATION_DELAY)
+        self.assertThat(logger.output, DocTestMatches(
+            "Failed to invalidate kernel parameters cached by rack "
+            "controller %s.\n..." % client.ident))
+
+    def test_report_logs_stats_since_last_report(self):
+        service, _, cache = self.make_service()
+        service.startService()
+        self.addCleanup(service.stopService)
+        request = self.put_entry(cache)
+        cache.get(*request)
+        cache.get(*request)
+        cache.get(factory.make_name("rack"), "00:00:00:00:00:00", None, None)
+        with TwistedLoggerFixture() as logger:
+            service.report()
+        self.assertThat(logger.output, DocTestMatches(
+            "Boot configuration cache: 2 hits, 1 misses (67% hit rate), "
+            "0 invalidated, 1 cached entries."))
+
+    def test_report_logs_nothing_without_requests(self):
+        service, _, _ = self.make_service()
+        service.startService()
+        self.addCleanup(service.stopService)
+        with TwistedLoggerFixture() as logger:
+            service.report()
+        self.assertEqual("", logger.output)
+
+
+class TestBootConfigCacheServiceGetMACs(MAASServerTestCase):
+
+    def test_returns_macs_of_given_nodes(self):
+        node1, node2, node3 = (factory.make_Node() for _ in range(3))
+        interface1 = factory.make_Interface(
+            INTERFACE_TYPE.PHYSICAL, node=node1)
+        interface2 = factory.make_Interface(
+            INTERFACE_TYPE.PHYSICAL, node=node1)
+        factory.make_Interface(INTERFACE_TYPE.PHYSICAL, node=node3)
+        service = BootConfigCacheService(Mock(), BootConfigCache(), Clock())
+        self.assertEqual({
+            node1.system_id: frozenset([
+                str(interface1.mac_address), str(interface2.mac_address)]),
+            node2.system_id: frozenset(),
+            "unknown": frozenset(),
+        }, service.getMACs([node1.system_id, node2.system_id, "unknown"]))
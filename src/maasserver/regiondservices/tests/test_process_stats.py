@@ -0,0 +1,121 @@
+# Copyright 2017 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for `maasserver.regiondservices.process_stats`."""
+
+__all__ = []
+
+import json
+import os
+
+from crochet import wait_for
+from maasserver import concurrency
+from maasserver.regiondservices import process_stats
+from maasserver.regiondservices.process_stats import (
+    configure_request_telemetry,
+    get_process_stats,
+    get_stats_dir,
+    ProcessStatsService,
+    read_process_stats,
+    write_process_stats,
+)
+from maasserver.testing.config import RegionConfigurationFixture
+from maasserver.utils.latency import RequestTelemetry
+from maastesting.fixtures import MAASRootFixture
+from maastesting.testcase import MAASTestCase
+from testtools.matchers import (
+    Equals,
+    FileExists,
+    StartsWith,
+)
+from twisted.internet.task import Clock
+
+
+wait_for_reactor = wait_for(30)  # 30 seconds.
+
+
+class TestProcessStats(MAASTestCase):
+    """Tests for publishing and reading process statistics."""
+
+    def setUp(self):
+        super(TestProcessStats, self).setUp()
+        self.root = self.useFixture(MAASRootFixture()).path
+
+    def test_get_stats_dir_is_within_maas_root(self):
+        self.assertThat(get_stats_dir(), StartsWith(self.root))
+
+    def test_get_process_stats_describes_this_process(self):
+        stats = get_process_stats()
+        self.assertThat(stats["pid"], Equals(os.getpid()))
+        self.assertThat(
+            stats["limiter"], Equals(concurrency.database.getStats()))
+        self.assertThat(
+            set(stats["retries"]),
+            Equals({"callsites", "relations", "samples"}))
+        self.assertThat(
+            set(stats["requests"]), Equals({"bounds", "operations", "slow"}))
+
+    def test_configure_request_telemetry_reads_region_configuration(self):
+        telemetry = RequestTelemetry()
+        self.patch(process_stats, "request_telemetry", telemetry)
+        self.useFixture(RegionConfigurationFixture(
+            telemetry_sample_rate=0.25, telemetry_slow_request=0.5))
+        configure_request_telemetry()
+        self.assertThat(telemetry.sample_rate, Equals(0.25))
+        self.assertThat(telemetry.slow_threshold, Equals(0.5))
+
+    def test_write_process_stats_writes_json_named_for_process(self):
+        stats = {"pid": os.getpid(), "things": [1, 2, 3]}
+        write_process_stats(stats)
+        path = os.path.join(get_stats_dir(), "%d.json" % os.getpid())
+        self.assertThat(path, FileExists())
+        with open(path, "r", encoding="utf-8") as fd:
+            self.assertThat(json.load(fd), Equals(stats))
+
+    def test_read_process_stats_reads_running_processes(self):
+        stats = {"pid": os.getpid()}
+        write_process_stats(stats)
+        self.assertThat(read_process_stats(), Equals([stats]))
+
+    def test_read_process_stats_ignores_processes_no_longer_running(self):
+        self.patch(process_stats, "is_running").return_value = False
+        write_process_stats({"pid": os.getpid()})
+        self.assertThat(read_process_stats(), Equals([]))
+
+    def test_read_process_stats_ignores_partial_files(self):
+        os.makedirs(get_stats_dir())
+        path = os.path.join(get_stats_dir(), "%d.json" % os.getpid())
+        with open(path, "w", encoding="utf-8") as fd:
+            fd.write("{")
+        self.assertThat(read_process_stats(), Equals([]))
+
+    def test_read_process_stats_without_directory(self):
+        self.assertThat(read_process_stats(), Equals([]))
+
+
+class TestProcessStatsService(MAASTestCase):
+    """Tests for `ProcessStatsService`."""
+
+    def setUp(self):
+        super(TestProcessStatsService, self).setUp()
+        self.useFixture(MAASRootFixture())
+
+    @wait_for_reactor
+    def test_publish_writes_process_stats(self):
+        service = ProcessStatsService(Clock())
+        d = service.publish()
+        d.addCallback(lambda _: self.assertThat(
+            [stats["pid"] for stats in read_process_stats()],
+            Equals([os.getpid()])))
+        return d
+
+    @wait_for_reactor
+    def test_publish_configures_request_telemetry(self):
+        telemetry = RequestTelemetry()
+        self.patch(process_stats, "request_telemetry", telemetry)
+        self.useFixture(RegionConfigurationFixture(telemetry_sample_rate=1))
+        service = ProcessStatsService(Clock())
+        d = service.publish()
+        d.addCallback(lambda _: self.assertThat(
+            telemetry.sample_rate, Equals(1)))
+        return d
@@ -4,11 +4,19 @@
 """RPC helpers for getting the configuration for a booting machine."""
 
 __all__ = [
+    "boot_config_cache",
     "get_config",
+    "record_boot_request",
 ]
 
+from collections import (
+    Counter,
+    defaultdict,
+)
 import re
 import shlex
+import threading
+import time
 
 from django.core.exceptions import (
     ObjectDoesNotExist,
@@ -38,6 +46,7 @@ from maasserver.server_address import get_maas_facing_server_host
 from maasserver.third_party_drivers import get_third_party_driver
 from maasserver.utils.orm import (
     get_one,
+    post_commit_do,
     transactional,
 )
 from maasserver.utils.osystems import validate_hwe_kernel
@@ -48,6 +57,109 @@ from provisioningserver.utils.twisted import synchronous
 
 DEFAULT_ARCH = 'i386'
 
+# How long, in seconds, a configuration is kept in `boot_config_cache`. Node,
+# interface, configuration, domain, and tag changes invalidate entries as
+# they happen; this bounds how long changes that are not notified, like those
+# to boot resources, can go unnoticed.
+BOOT_CONFIG_CACHE_TTL = 60
+
+
+class BootConfigCache:
+    """Cache of the configurations `get_config` returns for known machines.
+
+    Entries are keyed on the rack controller, MAC address, architecture, and
+    subarchitecture from the request. An entry holds the configuration along
+    with what is needed to replay the side-effects of the request later: see
+    `record_boot_request`.
+
+    The cache is only used while `enabled`, i.e. while the
+    `BootConfigCacheService` is listening for the changes that invalidate
+    it. It is used from the reactor and from database threads.
+    """
+
+    def __init__(self, ttl=BOOT_CONFIG_CACHE_TTL, clock=time.monotonic):
+        super(BootConfigCache, self).__init__()
+        self.ttl = ttl
+        self.clock = clock
+        self.enabled = False
+        # Incremented on every invalidation so that a configuration computed
+        # from data that has since changed is not cached; see `put`.
+        self.generation = 0
+        self.entries = {}
+        self.keys_by_node = defaultdict(set)
+        self.stats = Counter()
+        self.lock = threading.Lock()
+
+    def get(self, system_id, mac, arch, subarch):
+        """Return the cached configuration for a request, or `None`.
+
+        :return: A tuple of a copy of the configuration, the system ID of
+            the machine, and the purpose to record in its event log.
+        """
+        if not self.enabled or mac is None:
+            return None
+        key = (system_id, mac, arch, subarch)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            expires, machine_id, params, event_purpose = entry
+            if expires <= self.clock():
+                self._remove(key, machine_id)
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1
+            return dict(params), machine_id, event_purpose
+
+    def put(
+            self, generation, system_id, mac, arch, subarch, machine_id,
+            params, event_purpose):
+        """Cache the configuration for a request.
+
+        Nothing is cached if anything has been invalidated since
+        `generation` was read, before the configuration was computed.
+        """
+        key = (system_id, mac, arch, subarch)
+        with self.lock:
+            if not self.enabled or generation != self.generation:
+                self.stats["discarded"] += 1
+                return
+            self.entries[key] = (
+                self.clock() + self.ttl, machine_id, dict(params),
+                event_purpose)
+            self.keys_by_node[system_id].add(key)
+            self.keys_by_node[machine_id].add(key)
+
+    def invalidate(self, system_ids):
+        """Remove the entries for the given machines or rack controllers."""
+        with self.lock:
+            self.generation += 1
+            for system_id in system_ids:
+                for key in self.keys_by_node.pop(system_id, ()):
+                    entry = self.entries.pop(key, None)
+                    if entry is not None:
+                        self.keys_by_node[key[0]].discard(key)
+                        self.keys_by_node[entry[1]].discard(key)
+                        self.stats["invalidations"] += 1
+
+    def clear(self):
+        """Remove every entry."""
+        with self.lock:
+            self.generation += 1
+            self.stats["invalidations"] += len(self.entries)
+            self.entries.clear()
+            self.keys_by_node.clear()
+
+    def _remove(self, key, machine_id):
+        del self.entries[key]
+        self.keys_by_node[key[0]].discard(key)
+        self.keys_by_node[machine_id].discard(key)
+
+
+boot_config_cache = BootConfigCache()
+
 
 def get_node_from_mac_string(mac_string):
     """Get a Node object from a MAC address string.
@@ -171,6 +283,47 @@ def merge_kparams_with_extra(kparams, extra_kernel_opts):
     return final_params
 
 
+def update_boot_details(
+        machine, rack_controller, local_ip, mac, bios_boot_method):
+    """Record how `machine` is booting, and fix up its boot VLAN."""
+    # Update the last interface, last access cluster IP address, and
+    # the last used BIOS boot method. Only saving the fields that have
+    # changed on the machine.
+    update_fields = []
+    if (machine.boot_interface is None or
+            machine.boot_interface.mac_address != mac):
+        machine.boot_interface = PhysicalInterface.objects.get(
+            mac_address=mac)
+        update_fields.append("boot_interface")
+    if (machine.boot_cluster_ip is None or
+            machine.boot_cluster_ip != local_ip):
+        machine.boot_cluster_ip = local_ip
+        update_fields.append("boot_cluster_ip")
+    if machine.bios_boot_method != bios_boot_method:
+        machine.bios_boot_method = bios_boot_method
+        update_fields.append("bios_boot_method")
+    if len(update_fields) > 0:
+        machine.save(update_fields=update_fields)
+
+    # Update the VLAN of the boot interface to be the same VLAN for the
+    # interface on the rack controller that the machine communicated with,
+    # unless the VLAN is being relayed.
+    rack_interface = rack_controller.interface_set.filter(
+        ip_addresses__ip=local_ip).first()
+    if (rack_interface is not None and
+            machine.boot_interface.vlan != rack_interface.vlan):
+        # Rack controller and machine is not on the same VLAN, with DHCP
+        # relay this is possible. Lets ensure that the VLAN on the
+        # interface is setup to relay through the identified VLAN.
+        if not VLAN.objects.filter(
+                id=machine.boot_interface.vlan_id,
+                relay_vlan=rack_interface.vlan).exists():
+            # DHCP relay is not being performed for that VLAN. Set the VLAN
+            # to the VLAN of the rack controller.
+            machine.boot_interface.vlan = rack_interface.vlan
+            machine.boot_interface.save()
+
+
 @synchronous
 @transactional
 def get_config(
@@ -182,7 +335,14 @@ def get_config(
     for :py:class:`~provisioningserver.rpc.region.GetBootConfig`.
 
     Raises BootConfigNoResponse when booting machine should fail to next file.
+
+    The configuration for a known machine is also put into
+    `boot_config_cache` once the transaction has committed.
     """
+    # Read before anything else so that any change notified after this
+    # transaction's snapshot is taken prevents caching; see `put`.
+    generation = boot_config_cache.generation
+    cache_key = (system_id, mac, arch, subarch)
     rack_controller = RackController.objects.get(system_id=system_id)
     machine = get_node_from_mac_string(mac)
 
@@ -194,42 +354,8 @@ def get_config(
         raise BootConfigNoResponse()
 
     if machine is not None:
-        # Update the last interface, last access cluster IP address, and
-        # the last used BIOS boot method. Only saving the fields that have
-        # changed on the machine.
-        update_fields = []
-        if (machine.boot_interface is None or
-                machine.boot_interface.mac_address != mac):
-            machine.boot_interface = PhysicalInterface.objects.get(
-                mac_address=mac)
-            update_fields.append("boot_interface")
-        if (machine.boot_cluster_ip is None or
-                machine.boot_cluster_ip != local_ip):
-            machine.boot_cluster_ip = local_ip
-            update_fields.append("boot_cluster_ip")
-        if machine.bios_boot_method != bios_boot_method:
-            machine.bios_boot_method = bios_boot_method
-            update_fields.append("bios_boot_method")
-        if len(update_fields) > 0:
-            machine.save(update_fields=update_fields)
-
-        # Update the VLAN of the boot interface to be the same VLAN for the
-        # interface on the rack controller that the machine communicated with,
-        # unless the VLAN is being relayed.
-        rack_interface = rack_controller.interface_set.filter(
-            ip_addresses__ip=local_ip).first()
-        if (rack_interface is not None and
-                machine.boot_interface.vlan != rack_interface.vlan):
-            # Rack controller and machine is not on the same VLAN, with DHCP
-            # relay this is possible. Lets ensure that the VLAN on the
-            # interface is setup to relay through the identified VLAN.
-            if not VLAN.objects.filter(
-                    id=machine.boot_interface.vlan_id,
-                    relay_vlan=rack_interface.vlan).exists():
-                # DHCP relay is not being performed for that VLAN. Set the VLAN
-                # to the VLAN of the rack controller.
-                machine.boot_interface.vlan = rack_interface.vlan
-                machine.boot_interface.save()
+        update_boot_details(
+            machine, rack_controller, local_ip, mac, bios_boot_method)
 
         arch, subarch = machine.split_arch()
         preseed_url = compose_preseed_url(machine, rack_controller)
@@ -240,9 +366,10 @@ def get_config(
         # Log the request into the event log for that machine.
         if (machine.status == NODE_STATUS.ENTERING_RESCUE_MODE and
                 purpose == 'commissioning'):
-            event_log_pxe_request(machine, 'rescue')
+            event_purpose = 'rescue'
         else:
-            event_log_pxe_request(machine, purpose)
+            event_purpose = purpose
+        event_log_pxe_request(machine, event_purpose)
 
         # Get the correct operating system and series based on the purpose
         # of the booting machine.
@@ -384,4 +511,30 @@ def get_config(
     }
     if machine is not None:
         params["system_id"] = machine.system_id
+    if machine is not None and boot_config_cache.enabled:
+        post_commit_do(
+            boot_config_cache.put, generation, *cache_key,
+            machine_id=machine.system_id, params=params,
+            event_purpose=event_purpose)
     return params
+
+
+@synchronous
+@transactional
+def record_boot_request(
+        system_id, local_ip, machine_id, mac, bios_boot_method,
+        event_purpose):
+    """Perform the side-effects of a request answered from the cache.
+
+    These are the same as `get_config` performs for a known machine: the
+    details of how it is booting are recorded, and the request is logged.
+    """
+    rack_controller = RackController.objects.get(system_id=system_id)
+    machine = get_node_from_mac_string(mac)
+    if machine is None or machine.system_id != machine_id:
+        # The MAC address has moved on since the configuration was cached;
+        # the cache entry will have been invalidated by now.
+        return
+    update_boot_details(
+        machine, rack_controller, local_ip, mac, bios_boot_method)
+    event_log_pxe_request(machine, event_purpose)
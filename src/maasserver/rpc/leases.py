@@ -5,8 +5,10 @@
 
 __all__ = [
     "update_lease",
+    "update_leases",
 ]
 
+from collections import defaultdict
 from datetime import datetime
 
 from maasserver.enum import (
@@ -22,11 +24,18 @@ from maasserver.models import (
     UnknownInterface,
 )
 from maasserver.utils.orm import transactional
-from netaddr import IPAddress
+from netaddr import (
+    EUI,
+    IPAddress,
+)
+from provisioningserver.logger import get_maas_logger
 from provisioningserver.utils.network import coerce_to_valid_hostname
 from provisioningserver.utils.twisted import synchronous
 
 
+maaslog = get_maas_logger("rpc.leases")
+
+
 class LeaseUpdateError(Exception):
     """Raise when `update_lease` fails to update lease information."""
 
@@ -72,6 +81,92 @@ def update_lease(
 
     # Get the subnet for this IP address. If no subnet exists then something
     # is wrong as we should not be recieving message about unknown subnets.
+    subnet = _get_subnet_for_lease(ip, ip_family)
+
+    # We will recieve actions on all addresses in the subnet. We only want
+    # to update the addresses in the dynamic range.
+    dynamic_range = subnet.get_dynamic_range_for_ip(IPAddress(ip))
+    if dynamic_range is None:
+        # Do nothing.
+        return {}
+
+    interfaces = _get_interfaces_for_lease(
+        action, mac, subnet, list(Interface.objects.filter(mac_address=mac)))
+    if len(interfaces) == 0:
+        # No interfaces and not commit action so nothing needs to be done.
+        return {}
+
+    _apply_lease(
+        action, ip, subnet, interfaces, timestamp, lease_time, hostname)
+    return {}
+
+
+@synchronous
+@transactional
+def update_leases(leases):
+    """Update several DHCP leases from a cluster in one transaction.
+
+    The leases are applied in order, exactly as `update_lease` would apply
+    them one by one, but the lookups they share are done once for the whole
+    batch: the interfaces for all the MAC addresses are fetched together, and
+    the subnet for each IP address and the dynamic ranges for each subnet
+    are only found once.
+
+    A lease that cannot be applied because it is invalid is logged and
+    skipped; the rest of the batch is still applied.
+
+    :param leases: A list of dicts, each with the arguments to
+        `update_lease` as found in
+        :py:class`~provisioningserver.rpc.region.UpdateLeases`.
+    """
+    interfaces_by_mac = defaultdict(list)
+    for interface in Interface.objects.filter(
+            mac_address__in={lease["mac"] for lease in leases}):
+        interfaces_by_mac[EUI(str(interface.mac_address))].append(interface)
+    subnets_by_ip = {}
+    dynamic_ranges_by_subnet = {}
+
+    for lease in leases:
+        action, mac, ip = lease["action"], lease["mac"], lease["ip"]
+        try:
+            if action not in ["commit", "expiry", "release"]:
+                raise LeaseUpdateError("Unknown lease action: %s" % action)
+            if ip not in subnets_by_ip:
+                subnets_by_ip[ip] = _get_subnet_for_lease(
+                    ip, lease["ip_family"])
+        except LeaseUpdateError as error:
+            maaslog.error("Unable to update lease for %s: %s", ip, error)
+            continue
+        subnet = subnets_by_ip[ip]
+
+        if subnet.id not in dynamic_ranges_by_subnet:
+            dynamic_ranges_by_subnet[subnet.id] = [
+                iprange.netaddr_iprange
+                for iprange in subnet.get_dynamic_ranges()
+            ]
+        if not any(
+                IPAddress(ip) in dynamic_range
+                for dynamic_range in dynamic_ranges_by_subnet[subnet.id]):
+            continue
+
+        interfaces = interfaces_by_mac[EUI(mac)]
+        interfaces[:] = _get_interfaces_for_lease(
+            action, mac, subnet, interfaces)
+        if len(interfaces) == 0:
+            continue
+
+        _apply_lease(
+            action, ip, subnet, interfaces, lease["timestamp"],
+            lease.get("lease_time"), lease.get("hostname"))
+    return {}
+
+
+def _get_subnet_for_lease(ip, ip_family):
+    """Return the subnet for a lease of `ip`.
+
+    :raise LeaseUpdateError: If there is no such subnet or it is not of
+        `ip_family`.
+    """
     subnet = Subnet.objects.get_best_subnet_for_ip(ip)
     if subnet is None:
         raise LeaseUpdateError("No subnet exists for: %s" % ip)
@@ -84,26 +179,30 @@ def update_lease(
     elif ip_family == "ipv6" and subnet_family != IPADDRESS_FAMILY.IPv6:
         raise LeaseUpdateError(
             "Family for the subnet does not match. Expected: %s" % ip_family)
+    return subnet
 
-    # We will recieve actions on all addresses in the subnet. We only want
-    # to update the addresses in the dynamic range.
-    dynamic_range = subnet.get_dynamic_range_for_ip(IPAddress(ip))
-    if dynamic_range is None:
-        # Do nothing.
-        return {}
 
-    interfaces = list(Interface.objects.filter(mac_address=mac))
+def _get_interfaces_for_lease(action, mac, subnet, interfaces):
+    """Return the interfaces a lease applies to, given those with `mac`.
+
+    An unknown interface is created for a MAC address that is unknown to
+    MAAS but has been given an IP address.
+    """
     if len(interfaces) == 0 and action == "commit":
         # A MAC address that is unknown to MAAS was given an IP address. Create
         # an unknown interface for this lease.
         unknown_interface = UnknownInterface(
             name="eth0", mac_address=mac, vlan_id=subnet.vlan_id)
         unknown_interface.save()
-        interfaces = [unknown_interface]
-    elif len(interfaces) == 0:
-        # No interfaces and not commit action so nothing needs to be done.
-        return {}
+        return [unknown_interface]
+    else:
+        return interfaces
 
+
+def _apply_lease(
+        action, ip, subnet, interfaces, timestamp, lease_time, hostname):
+    """Update the DISCOVERED `StaticIPAddress` for a lease on `interfaces`."""
+    subnet_family = subnet.get_ipnetwork().version
     sip = None
     # Delete all discovered IP addresses attached to all interfaces of the same
     # IP address family.
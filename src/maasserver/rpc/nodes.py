@@ -6,6 +6,7 @@
 __all__ = [
     "mark_node_failed",
     "update_node_power_state",
+    "update_node_power_states",
     "commission_node",
     "create_node",
 ]
@@ -41,6 +42,7 @@ from provisioningserver.rpc.exceptions import (
     NoSuchCluster,
     NoSuchNode,
 )
+from provisioningserver.rpc.region import ListNodePowerParametersV2
 from provisioningserver.utils.twisted import synchronous
 
 
@@ -136,17 +138,42 @@ def _gen_up_to_json_limit(things, limit):
             break
 
 
+def _trim_to_compressed_limit(details, limit):
+    """Return as many of `details` as fit in `limit` bytes once compressed.
+
+    The list is halved until the compressed form of the ``nodes`` argument
+    of `ListNodePowerParametersV2` fits, so at least one detail is always
+    returned.
+    """
+    nodes_argument = dict(ListNodePowerParametersV2.response)[b"nodes"]
+    while len(details) > 1:
+        compressed = nodes_argument.toStringProto(details, None)
+        if len(compressed) <= limit:
+            break
+        details = details[:len(details) // 2]
+    return details
+
+
 @synchronous
 @transactional
-def list_cluster_nodes_power_parameters(system_id, limit=10):
+def list_cluster_nodes_power_parameters(
+        system_id, limit=10, json_limit=60 * (2 ** 10),
+        compressed_limit=None):
     """Return power parameters that a rack controller should power check,
     in priority order.
 
-    For :py:class:`~provisioningserver.rpc.region.ListNodePowerParameters`.
+    For :py:class:`~provisioningserver.rpc.region.ListNodePowerParameters`
+    and :py:class:`~provisioningserver.rpc.region.ListNodePowerParametersV2`.
 
     :param limit: Limit the number of nodes for which to return power
         parameters. Pass `None` to remove this numerical limit; there is still
         a limit on the quantity of power information that will be returned.
+    :param json_limit: The most power information to return, measured as
+        the size of its JSON dump. This defaults to 60kiB to fit inside a
+        single AMP value.
+    :param compressed_limit: The most power information to return,
+        measured as the size of the compressed ``nodes`` argument of
+        `ListNodePowerParametersV2`, or `None` for no such limit.
     """
     try:
         rack = RackController.objects.get(system_id=system_id)
@@ -157,8 +184,10 @@ def list_cluster_nodes_power_parameters(system_id, limit=10):
     nodes = rack.get_bmc_accessible_nodes()
     details = _gen_cluster_nodes_power_parameters(nodes)
     details = islice(details, limit)  # ... but never more than `limit`.
-    details = _gen_up_to_json_limit(details, 60 * (2 ** 10))  # 60kiB
+    details = _gen_up_to_json_limit(details, json_limit)
     details = list(details)
+    if compressed_limit is not None:
+        details = _trim_to_compressed_limit(details, compressed_limit)
 
     # Update the queried time on all of the nodes at once. So another
     # rack controller does not update them at the same time. This operation
@@ -187,6 +216,32 @@ def update_node_power_state(system_id, power_state):
     node.update_power_state(power_state)
 
 
+@synchronous
+@transactional
+def update_node_power_states(states):
+    """Update the power states of several nodes in one transaction.
+
+    For :py:class:`~provisioningserver.rpc.region.UpdateNodePowerStates`.
+
+    :param states: A list of dicts, each with a `system_id` and the
+        `power_state` of that node. They are applied in order.
+    :return: A list of the system IDs that do not match any node.
+    """
+    nodes = {
+        node.system_id: node
+        for node in Node.objects.filter(
+            system_id__in={state["system_id"] for state in states})
+    }
+    missing = []
+    for state in states:
+        system_id = state["system_id"]
+        if system_id in nodes:
+            nodes[system_id].update_power_state(state["power_state"])
+        elif system_id not in missing:
+            missing.append(system_id)
+    return missing
+
+
 @synchronous
 @transactional
 def create_node(
@@ -24,6 +24,7 @@ from socket import (
 import threading
 
 from maasserver import (
+    concurrency,
     eventloop,
     locks,
 )
@@ -57,12 +58,14 @@ from maasserver.rpc.nodes import (
 )
 from maasserver.rpc.services import update_services
 from maasserver.security import get_shared_secret
-from maasserver.utils import synchronised
+from maasserver.utils import (
+    synchronised,
+    threads,
+)
 from maasserver.utils.orm import (
     transactional,
     with_connection,
 )
-from maasserver.utils.threads import deferToDatabase
 from netaddr import (
     AddrConversionError,
     IPAddress,
@@ -111,6 +114,7 @@ from twisted.internet.defer import (
     fail,
     inlineCallbacks,
     maybeDeferred,
+    QueueOverflow,
     returnValue,
     succeed,
 )
@@ -126,6 +130,15 @@ from zope.interface import implementer
 log = LegacyLogger()
 
 
+def deferToDatabase(func, *args, **kwargs):
+    """Call `func` in a database thread once admitted as an RPC caller.
+
+    See `maasserver.concurrency.rpc`.
+    """
+    return concurrency.rpc.run(
+        threads.deferToDatabase, func, *args, **kwargs)
+
+
 # Number of regiond processes that should be running for a regiond.
 # XXX blake_r 2016-03-10 bug=1555901: It would be better to determine this
 # value from systemd or other means instead of hard coding the number.
@@ -199,6 +212,31 @@ class Region(RPCProtocol):
         # region recieves the message.
         return d
 
+    @region.UpdateLeases.responder
+    def update_leases(self, cluster_uuid, updates):
+        """update_leases(cluster_uuid, updates)
+
+        Implementation of
+        :py:class`~provisioningserver.rpc.region.UpdateLeases`.
+        """
+        dbtasks = eventloop.services.getServiceNamed("database-tasks")
+        d = dbtasks.deferTask(leases.update_leases, updates)
+
+        # Catch all errors except the NoSuchCluster failure. We want that to
+        # be sent back to the cluster.
+        def err_NoSuchCluster_passThrough(failure):
+            if failure.check(NoSuchCluster):
+                return failure
+            else:
+                log.err(failure, "Unhandled failure in updating leases.")
+                return {}
+        d.addErrback(err_NoSuchCluster_passThrough)
+
+        # Wait for the records to be handled, as for `update_lease`, so that
+        # batches are processed in order no matter which region receives
+        # them.
+        return d
+
     @amp.StartTLS.responder
     def get_tls_parameters(self):
         """get_tls_parameters()
@@ -223,7 +261,25 @@ class Region(RPCProtocol):
 
         Implementation of
         :py:class:`~provisioningserver.rpc.region.GetBootConfig`.
+
+        A configuration found in `boot.boot_config_cache` is returned without
+        touching the database; the side-effects of the request are queued as
+        a database task instead.
         """
+        cached = boot.boot_config_cache.get(system_id, mac, arch, subarch)
+        if cached is not None:
+            params, machine_id, event_purpose = cached
+            dbtasks = eventloop.services.getServiceNamed("database-tasks")
+            try:
+                dbtasks.addTask(
+                    boot.record_boot_request, system_id, local_ip,
+                    machine_id, mac, bios_boot_method, event_purpose)
+            except QueueOverflow:
+                # Fall back to doing everything now.
+                pass
+            else:
+                params["fs_host"] = local_ip
+                return succeed(params)
         return deferToDatabase(
             boot.get_config, system_id, local_ip, remote_ip,
             arch=arch, subarch=subarch, mac=mac,
@@ -297,6 +353,23 @@ class Region(RPCProtocol):
         d.addCallback(lambda nodes: {"nodes": nodes})
         return d
 
+    @region.ListNodePowerParametersV2.responder
+    def list_node_power_parameters_v2(self, uuid):
+        """list_node_power_parameters_v2()
+
+        Implementation of
+        :py:class:`~provisioningserver.rpc.region.ListNodePowerParametersV2`.
+        """
+        # The response is compressed so there's room for many more nodes
+        # than `ListNodePowerParameters` can return. Power parameters do not
+        # always compress well, so the compressed response is also limited
+        # to 60kiB to fit inside a single AMP value.
+        d = deferToDatabase(
+            nodes.list_cluster_nodes_power_parameters, uuid, limit=500,
+            json_limit=192 * (2 ** 10), compressed_limit=60 * (2 ** 10))
+        d.addCallback(lambda nodes: {"nodes": nodes})
+        return d
+
     @region.UpdateLastImageSync.responder
     def update_last_image_sync(self, system_id):
         """update_last_image_sync()
@@ -321,6 +394,17 @@ class Region(RPCProtocol):
         d.addCallback(lambda args: {})
         return d
 
+    @region.UpdateNodePowerStates.responder
+    def update_node_power_states(self, states):
+        """update_node_power_states()
+
+        Implementation of
+        :py:class:`~provisioningserver.rpc.region.UpdateNodePowerStates`.
+        """
+        d = deferToDatabase(nodes.update_node_power_states, states)
+        d.addCallback(lambda missing: {"missing": missing})
+        return d
+
     @region.RegisterEventType.responder
     def register_event_type(self, name, description, level):
         """register_event_type()
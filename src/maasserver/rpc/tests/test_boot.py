@@ -26,10 +26,12 @@ from maasserver.preseed import (
 )
 from maasserver.rpc import boot as boot_module
 from maasserver.rpc.boot import (
+    BootConfigCache,
     event_log_pxe_request,
     get_boot_filenames,
     get_config,
     merge_kparams_with_extra,
+    record_boot_request,
 )
 from maasserver.testing.architecture import make_usable_architecture
 from maasserver.testing.config import RegionConfigurationFixture
@@ -41,6 +43,7 @@ from maastesting.matchers import (
     MockCalledOnceWith,
     MockNotCalled,
 )
+from maastesting.testcase import MAASTestCase
 from netaddr import IPNetwork
 from provisioningserver.rpc.exceptions import BootConfigNoResponse
 from testtools.matchers import (
@@ -715,6 +718,229 @@ class TestGetConfig(MAASServerTestCase):
         self.assertEqual(commissioning_series, observed_config['release'])
 
 
+class TestGetConfigCaching(MAASServerTestCase):
+
+    def setUp(self):
+        super(TestGetConfigCaching, self).setUp()
+        self.useFixture(RegionConfigurationFixture())
+        self.cache = BootConfigCache()
+        self.patch(boot_module, "boot_config_cache", self.cache)
+        self.post_commit_do = self.patch(boot_module, "post_commit_do")
+
+    def make_node(self, **kwargs):
+        architecture = make_usable_architecture(self)
+        return factory.make_Node_with_Interface_on_Subnet(
+            architecture="%s/generic" % architecture.split('/')[0],
+            **kwargs)
+
+    def test__caches_config_for_known_node_after_commit(self):
+        self.cache.enabled = True
+        rack_controller = factory.make_RackController()
+        local_ip = factory.make_ip_address()
+        remote_ip = factory.make_ip_address()
+        node = self.make_node()
+        mac = node.get_boot_interface().mac_address
+        params = get_config(
+            rack_controller.system_id, local_ip, remote_ip, mac=mac)
+        self.assertThat(self.post_commit_do, MockCalledOnceWith(
+            self.cache.put, self.cache.generation,
+            rack_controller.system_id, mac, None, None,
+            machine_id=node.system_id, params=params,
+            event_purpose=node.get_boot_purpose()))
+
+    def test__caches_rescue_event_purpose(self):
+        self.cache.enabled = True
+        rack_controller = factory.make_RackController()
+        local_ip = factory.make_ip_address()
+        remote_ip = factory.make_ip_address()
+        node = self.make_node(status=NODE_STATUS.ENTERING_RESCUE_MODE)
+        mac = node.get_boot_interface().mac_address
+        get_config(rack_controller.system_id, local_ip, remote_ip, mac=mac)
+        _, kwargs = self.post_commit_do.call_args
+        self.assertEqual("rescue", kwargs["event_purpose"])
+
+    def test__doesnt_cache_when_disabled(self):
+        rack_controller = factory.make_RackController()
+        local_ip = factory.make_ip_address()
+        remote_ip = factory.make_ip_address()
+        node = self.make_node()
+        mac = node.get_boot_interface().mac_address
+        get_config(rack_controller.system_id, local_ip, remote_ip, mac=mac)
+        self.assertThat(self.post_commit_do, MockNotCalled())
+
+    def test__doesnt_cache_enlistment(self):
+        self.cache.enabled = True
+        rack_controller = factory.make_RackController()
+        local_ip = factory.make_ip_address()
+        remote_ip = factory.make_ip_address()
+        make_usable_architecture(self)
+        get_config(rack_controller.system_id, local_ip, remote_ip)
+        self.assertThat(self.post_commit_do, MockNotCalled())
+
+
+class TestRecordBootRequest(MAASServerTestCase):
+
+    def make_node(self, **kwargs):
+        architecture = make_usable_architecture(self)
+        return factory.make_Node_with_Interface_on_Subnet(
+            architecture="%s/generic" % architecture.split('/')[0],
+            **kwargs)
+
+    def test__updates_boot_details(self):
+        rack_controller = factory.make_RackController()
+        local_ip = factory.make_ip_address()
+        node = self.make_node()
+        nic = node.get_boot_interface()
+        node.boot_interface = None
+        node.save()
+        record_boot_request(
+            rack_controller.system_id, local_ip, node.system_id,
+            nic.mac_address, "uefi", "commissioning")
+        node = reload_object(node)
+        self.assertEqual(nic, node.boot_interface)
+        self.assertEqual(local_ip, node.boot_cluster_ip)
+        self.assertEqual("uefi", node.bios_boot_method)
+
+    def test__logs_pxe_request(self):
+        rack_controller = factory.make_RackController()
+        node = self.make_node()
+        mac = node.get_boot_interface().mac_address
+        event_log_pxe_request = self.patch_autospec(
+            boot_module, 'event_log_pxe_request')
+        record_boot_request(
+            rack_controller.system_id, factory.make_ip_address(),
+            node.system_id, mac, None, "rescue")
+        self.assertThat(
+            event_log_pxe_request, MockCalledOnceWith(node, 'rescue'))
+
+    def test__does_nothing_if_mac_moved_to_another_node(self):
+        rack_controller = factory.make_RackController()
+        node = self.make_node()
+        mac = node.get_boot_interface().mac_address
+        event_log_pxe_request = self.patch_autospec(
+            boot_module, 'event_log_pxe_request')
+        update_boot_details = self.patch_autospec(
+            boot_module, 'update_boot_details')
+        record_boot_request(
+            rack_controller.system_id, factory.make_ip_address(),
+            factory.make_name("system_id"), mac, None, "commissioning")
+        self.assertThat(event_log_pxe_request, MockNotCalled())
+        self.assertThat(update_boot_details, MockNotCalled())
+
+
+class TestBootConfigCache(MAASTestCase):
+
+    def make_cache(self, **kwargs):
+        self.now = 0
+        cache = BootConfigCache(clock=lambda: self.now, **kwargs)
+        cache.enabled = True
+        return cache
+
+    def make_request(self):
+        return (
+            factory.make_name("rack"), factory.make_mac_address(),
+            "amd64", "generic")
+
+    def test_get_returns_None_when_empty(self):
+        cache = self.make_cache()
+        self.assertIsNone(cache.get(*self.make_request()))
+        self.assertEqual(1, cache.stats["misses"])
+
+    def test_get_returns_copy_of_put(self):
+        cache = self.make_cache()
+        request = self.make_request()
+        params = {"arch": "amd64"}
+        cache.put(
+            cache.generation, *request, machine_id="abcdef",
+            params=params, event_purpose="xinstall")
+        cached = cache.get(*request)
+        self.assertEqual((params, "abcdef", "xinstall"), cached)
+        self.assertIsNot(params, cached[0])
+        self.assertEqual(1, cache.stats["hits"])
+
+    def test_get_returns_None_when_disabled(self):
+        cache = self.make_cache()
+        request = self.make_request()
+        cache.put(
+            cache.generation, *request, machine_id="abcdef",
+            params={}, event_purpose="xinstall")
+        cache.enabled = False
+        self.assertIsNone(cache.get(*request))
+
+    def test_get_returns_None_without_mac(self):
+        cache = self.make_cache()
+        self.assertIsNone(
+            cache.get(factory.make_name("rack"), None, None, None))
+
+    def test_get_expires_entries(self):
+        cache = self.make_cache(ttl=10)
+        request = self.make_request()
+        cache.put(
+            cache.generation, *request, machine_id="abcdef",
+            params={}, event_purpose="xinstall")
+        self.now = 9
+        self.assertIsNotNone(cache.get(*request))
+        self.now = 10
+        self.assertIsNone(cache.get(*request))
+        self.assertEqual({}, cache.entries)
+        self.assertEqual(1, cache.stats["expired"])
+
+    def test_put_discards_after_invalidation(self):
+        cache = self.make_cache()
+        request = self.make_request()
+        generation = cache.generation
+        cache.invalidate([factory.make_name("system_id")])
+        cache.put(
+            generation, *request, machine_id="abcdef",
+            params={}, event_purpose="xinstall")
+        self.assertIsNone(cache.get(*request))
+        self.assertEqual(1, cache.stats["discarded"])
+
+    def test_put_does_nothing_when_disabled(self):
+        cache = self.make_cache()
+        cache.enabled = False
+        cache.put(
+            cache.generation, *self.make_request(), machine_id="abcdef",
+            params={}, event_purpose="xinstall")
+        self.assertEqual({}, cache.entries)
+
+    def test_invalidate_removes_entries_for_machine(self):
+        cache = self.make_cache()
+        request1, request2 = self.make_request(), self.make_request()
+        cache.put(
+            cache.generation, *request1, machine_id="abcdef",
+            params={}, event_purpose="xinstall")
+        cache.put(
+            cache.generation, *request2, machine_id="ghijkl",
+            params={}, event_purpose="xinstall")
+        cache.invalidate(["abcdef"])
+        self.assertIsNone(cache.get(*request1))
+        self.assertIsNotNone(cache.get(*request2))
+        self.assertEqual(1, cache.stats["invalidations"])
+
+    def test_invalidate_removes_entries_for_rack(self):
+        cache = self.make_cache()
+        request = self.make_request()
+        cache.put(
+            cache.generation, *request, machine_id="abcdef",
+            params={}, event_purpose="xinstall")
+        cache.invalidate([request[0]])
+        self.assertIsNone(cache.get(*request))
+        self.assertNotIn("abcdef", {
+            node for node, keys in cache.keys_by_node.items() if keys})
+
+    def test_clear_removes_all_entries(self):
+        cache = self.make_cache()
+        generation = cache.generation
+        cache.put(
+            cache.generation, *self.make_request(), machine_id="abcdef",
+            params={}, event_purpose="xinstall")
+        cache.clear()
+        self.assertEqual({}, cache.entries)
+        self.assertEqual({}, cache.keys_by_node)
+        self.assertEqual(generation + 1, cache.generation)
+
+
 class TestGetBootFilenames(MAASServerTestCase):
 
     def test_get_filenames(self):
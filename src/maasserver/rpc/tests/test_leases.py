@@ -17,9 +17,11 @@ from maasserver.enum import (
 from maasserver.models import DNSResource
 from maasserver.models.interface import UnknownInterface
 from maasserver.models.staticipaddress import StaticIPAddress
+from maasserver.rpc import leases as leases_module
 from maasserver.rpc.leases import (
     LeaseUpdateError,
     update_lease,
+    update_leases,
 )
 from maasserver.testing.factory import factory
 from maasserver.testing.testcase import MAASServerTestCase
@@ -27,6 +29,7 @@ from maasserver.utils.orm import (
     get_one,
     reload_object,
 )
+from maastesting.djangotestcase import count_queries
 from netaddr import IPAddress
 from testtools.matchers import (
     Contains,
@@ -381,3 +384,122 @@ class TestUpdateLease(MAASServerTestCase):
         self.assertItemsEqual(
             [boot_interface.id],
             sip.interface_set.values_list("id", flat=True))
+
+
+class TestUpdateLeases(MAASServerTestCase):
+
+    make_kwargs = TestUpdateLease.make_kwargs
+
+    def make_dynamic_ip(self, subnet):
+        dynamic_range = subnet.get_dynamic_ranges()[0]
+        return factory.pick_ip_in_IPRange(dynamic_range)
+
+    def test_returns_empty_dict(self):
+        self.assertEquals({}, update_leases([]))
+
+    def test_applies_leases_in_order(self):
+        subnet = factory.make_ipv4_Subnet_with_IPRanges(
+            with_static_range=False, dhcp_on=True)
+        node = factory.make_Node_with_Interface_on_Subnet(subnet=subnet)
+        boot_interface = node.get_boot_interface()
+        ip = self.make_dynamic_ip(subnet)
+        update_leases([
+            self.make_kwargs(
+                action="commit", mac=boot_interface.mac_address, ip=ip),
+            self.make_kwargs(
+                action="release", mac=boot_interface.mac_address, ip=ip),
+        ])
+        sip = StaticIPAddress.objects.filter(
+            alloc_type=IPADDRESS_TYPE.DISCOVERED,
+            subnet=subnet, interface=boot_interface).first()
+        self.assertIsNotNone(sip)
+        self.assertIsNone(sip.ip)
+
+    def test_creates_leases_like_update_lease(self):
+        subnet = factory.make_ipv4_Subnet_with_IPRanges(
+            with_static_range=False, dhcp_on=True)
+        node = factory.make_Node_with_Interface_on_Subnet(subnet=subnet)
+        boot_interface = node.get_boot_interface()
+        ips = [self.make_dynamic_ip(subnet) for _ in range(2)]
+        leases = [
+            self.make_kwargs(
+                action="commit", mac=boot_interface.mac_address, ip=ips[0]),
+            self.make_kwargs(action="commit", ip=ips[1]),
+        ]
+        update_leases(leases)
+        sip = StaticIPAddress.objects.get(
+            alloc_type=IPADDRESS_TYPE.DISCOVERED, ip=ips[0])
+        self.assertThat(sip, MatchesStructure.byEquality(
+            subnet=subnet, lease_time=leases[0]["lease_time"]))
+        self.assertItemsEqual(
+            [boot_interface.id],
+            sip.interface_set.values_list("id", flat=True))
+        unknown_interface = UnknownInterface.objects.get(
+            mac_address=leases[1]["mac"])
+        self.assertEquals(subnet.vlan, unknown_interface.vlan)
+        self.assertEquals(
+            ips[1], str(unknown_interface.ip_addresses.first().ip))
+
+    def test_reuses_unknown_interface_created_earlier_in_batch(self):
+        subnet = factory.make_ipv4_Subnet_with_IPRanges(
+            with_static_range=False, dhcp_on=True)
+        mac = factory.make_mac_address()
+        update_leases([
+            self.make_kwargs(
+                action="commit", mac=mac, ip=self.make_dynamic_ip(subnet)),
+            self.make_kwargs(
+                action="commit", mac=mac, ip=self.make_dynamic_ip(subnet)),
+        ])
+        self.assertEquals(
+            1, UnknownInterface.objects.filter(mac_address=mac).count())
+
+    def test_ignores_leases_outside_dynamic_range(self):
+        subnet = factory.make_ipv4_Subnet_with_IPRanges(
+            with_static_range=False, dhcp_on=True)
+        ip = factory.pick_ip_in_Subnet(
+            subnet, but_not=[
+                str(address)
+                for iprange in subnet.get_dynamic_ranges()
+                for address in iprange.netaddr_iprange
+            ])
+        update_leases([self.make_kwargs(action="commit", ip=ip)])
+        self.assertIsNone(
+            StaticIPAddress.objects.filter(
+                alloc_type=IPADDRESS_TYPE.DISCOVERED, ip=ip).first())
+
+    def test_skips_and_logs_invalid_leases(self):
+        maaslog = self.patch(leases_module, "maaslog")
+        subnet = factory.make_ipv4_Subnet_with_IPRanges(
+            with_static_range=False, dhcp_on=True)
+        ip = self.make_dynamic_ip(subnet)
+        unknown = self.make_kwargs(action=factory.make_name("action"))
+        no_subnet = self.make_kwargs(action="commit")
+        valid = self.make_kwargs(action="commit", ip=ip)
+        update_leases([unknown, no_subnet, valid])
+        self.assertIsNotNone(
+            StaticIPAddress.objects.filter(
+                alloc_type=IPADDRESS_TYPE.DISCOVERED, ip=ip).first())
+        self.assertEquals(2, maaslog.error.call_count)
+
+    def test_shares_lookups_across_batch(self):
+        subnet = factory.make_ipv4_Subnet_with_IPRanges(
+            with_static_range=False, dhcp_on=True)
+        nodes = [
+            factory.make_Node_with_Interface_on_Subnet(subnet=subnet)
+            for _ in range(2)
+        ]
+        ips = [self.make_dynamic_ip(subnet) for _ in range(6)]
+        few = [
+            self.make_kwargs(
+                action="commit", ip=ips[0],
+                mac=nodes[0].get_boot_interface().mac_address),
+        ]
+        many = [
+            self.make_kwargs(
+                action="commit", ip=ips[index + 1],
+                mac=nodes[index % 2].get_boot_interface().mac_address)
+            for index in range(5)
+        ]
+        few_count, _ = count_queries(update_leases, few)
+        many_count, _ = count_queries(update_leases, many)
+        self.assertLess(many_count, few_count * len(many))
@@ -31,6 +31,7 @@ from maasserver.rpc.nodes import (
     mark_node_failed,
     request_node_info_by_mac_address,
     update_node_power_state,
+    update_node_power_states,
 )
 from maasserver.rpc.testing.fixtures import MockLiveRegionToClusterRPCFixture
 from maasserver.testing.architecture import make_usable_architecture
@@ -57,6 +58,7 @@ from provisioningserver.rpc.exceptions import (
     NoSuchCluster,
     NoSuchNode,
 )
+from provisioningserver.rpc.region import ListNodePowerParametersV2
 from testtools import ExpectedException
 from testtools.matchers import (
     Equals,
@@ -502,6 +504,54 @@ class TestListClusterNodesPowerParameters(MAASServerTestCase):
         expected_minimum = 50 * (2 ** 10)  # 50kiB
         self.expectThat(nodes_json_length, GreaterThan(expected_minimum - 1))
 
+    def test__returns_at_most_json_limit_of_JSON(self):
+        rack = factory.make_RackController(power_type='')
+        example_parameters = {"key%d" % i: "value%d" % i for i in range(50)}
+        for _ in range(5):
+            self.make_Node(
+                bmc_connected_to=rack, power_parameters=example_parameters)
+        # Enough for one node's power parameters but not two.
+        json_limit = len(json.dumps(
+            list_cluster_nodes_power_parameters(rack.system_id, limit=1)))
+        json_limit += json_limit // 2
+
+        # The first call marked one node as queried; four remain.
+        nodes = list_cluster_nodes_power_parameters(
+            rack.system_id, limit=None, json_limit=json_limit)
+
+        self.assertThat(nodes, HasLength(1))
+
+    def test__returns_at_most_compressed_limit(self):
+        rack = factory.make_RackController(power_type='')
+        nodes = [
+            self.make_Node(
+                bmc_connected_to=rack, power_parameters={
+                    # Random strings do not compress well.
+                    "power_pass": factory.make_string(1000)})
+            for _ in range(8)
+        ]
+        queried = {node.system_id: node.power_state_queried for node in nodes}
+        nodes_argument = dict(ListNodePowerParametersV2.response)[b"nodes"]
+        compressed_limit = 3000
+
+        details = list_cluster_nodes_power_parameters(
+            rack.system_id, limit=None, compressed_limit=compressed_limit)
+
+        self.assertThat(details, Not(HasLength(0)))
+        self.assertThat(details, Not(HasLength(len(nodes))))
+        self.assertThat(
+            len(nodes_argument.toStringProto(details, None)),
+            LessThan(compressed_limit + 1))
+        # Only the nodes returned are marked as queried.
+        system_ids = {detail["system_id"] for detail in details}
+        for node in map(reload_object, nodes):
+            if node.system_id in system_ids:
+                self.assertNotEqual(
+                    queried[node.system_id], node.power_state_queried)
+            else:
+                self.assertEqual(
+                    queried[node.system_id], node.power_state_queried)
+
     def test__limited_to_10_nodes_at_a_time_by_default(self):
         # Configure the rack controller subnet to be large enough.
         rack = factory.make_RackController(power_type='')
@@ -535,6 +585,39 @@ class TestUpdateNodePowerState(MAASServerTestCase):
         self.assertEqual(reload_object(node).power_state, POWER_STATE.ON)
 
 
+class TestUpdateNodePowerStates(MAASServerTestCase):
+
+    def test__updates_node_power_states(self):
+        node1 = factory.make_Node(power_state=POWER_STATE.OFF)
+        node2 = factory.make_Node(power_state=POWER_STATE.ON)
+        missing = update_node_power_states([
+            {"system_id": node1.system_id, "power_state": POWER_STATE.ON},
+            {"system_id": node2.system_id, "power_state": POWER_STATE.OFF},
+        ])
+        self.assertEqual([], missing)
+        self.assertEqual(reload_object(node1).power_state, POWER_STATE.ON)
+        self.assertEqual(reload_object(node2).power_state, POWER_STATE.OFF)
+
+    def test__applies_states_in_order(self):
+        node = factory.make_Node(power_state=POWER_STATE.OFF)
+        update_node_power_states([
+            {"system_id": node.system_id, "power_state": POWER_STATE.ON},
+            {"system_id": node.system_id, "power_state": POWER_STATE.ERROR},
+        ])
+        self.assertEqual(reload_object(node).power_state, POWER_STATE.ERROR)
+
+    def test__returns_missing_nodes_once(self):
+        node = factory.make_Node(power_state=POWER_STATE.OFF)
+        system_id = factory.make_name("system_id")
+        missing = update_node_power_states([
+            {"system_id": system_id, "power_state": POWER_STATE.ON},
+            {"system_id": node.system_id, "power_state": POWER_STATE.ON},
+            {"system_id": system_id, "power_state": POWER_STATE.OFF},
+        ])
+        self.assertEqual([system_id], missing)
+        self.assertEqual(reload_object(node).power_state, POWER_STATE.ON)
+
+
 class TestGetControllerType(MAASServerTestCase):
     """Tests for `get_controller_type`."""
 
@@ -24,7 +24,10 @@ from unittest.mock import (
 
 from crochet import wait_for
 from django.db import IntegrityError
-from maasserver import eventloop
+from maasserver import (
+    concurrency,
+    eventloop,
+)
 from maasserver.enum import (
     NODE_TYPE,
     SERVICE_STATUS,
@@ -162,6 +165,20 @@ class TestGetRegionID(MAASTestCase):
         self.assertThat(region_id.result, Is(sentinel.region_id))
 
 
+class TestDeferToDatabase(MAASTestCase):
+    """Tests for `regionservice.deferToDatabase`."""
+
+    def test__defers_to_database_through_rpc_gate(self):
+        run = self.patch(concurrency.rpc, "run")
+        run.return_value = sentinel.result
+        result = regionservice.deferToDatabase(
+            sentinel.func, sentinel.arg, kwarg=sentinel.kwarg)
+        self.assertThat(result, Is(sentinel.result))
+        self.assertThat(run, MockCalledOnceWith(
+            regionservice.threads.deferToDatabase, sentinel.func,
+            sentinel.arg, kwarg=sentinel.kwarg))
+
+
 class TestRegionServer(MAASTransactionServerTestCase):
 
     def test_interfaces(self):
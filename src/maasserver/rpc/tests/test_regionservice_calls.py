@@ -39,10 +39,12 @@ from maasserver.models.interface import PhysicalInterface
 from maasserver.models.signals import bootsources
 from maasserver.models.signals.testing import SignalsDisabled
 from maasserver.rpc import (
+    boot as boot_module,
     events as events_module,
     leases as leases_module,
     regionservice,
 )
+from maasserver.rpc.boot import BootConfigCache
 from maasserver.rpc.nodes import (
     get_controller_type,
     get_time_configuration,
@@ -64,6 +66,7 @@ from maastesting.matchers import (
     MockCalledOnce,
     MockCalledOnceWith,
     MockCalledWith,
+    MockNotCalled,
 )
 from maastesting.testcase import MAASTestCase
 from maastesting.twisted import TwistedLoggerFixture
@@ -84,6 +87,7 @@ from provisioningserver.rpc.region import (
     GetTimeConfiguration,
     Identify,
     ListNodePowerParameters,
+    ListNodePowerParametersV2,
     MarkNodeFailed,
     RegisterEventType,
     ReportBootImages,
@@ -95,7 +99,9 @@ from provisioningserver.rpc.region import (
     SendEventMACAddress,
     UpdateInterfaces,
     UpdateLease,
+    UpdateLeases,
     UpdateNodePowerState,
+    UpdateNodePowerStates,
     UpdateServices,
 )
 from provisioningserver.rpc.testing import (
@@ -298,6 +304,67 @@ class TestRegionProtocol_UpdateLease(MAASTransactionServerTestCase):
         # works as expected.
 
 
+class TestRegionProtocol_UpdateLeases(MAASTransactionServerTestCase):
+
+    def setUp(self):
+        super(TestRegionProtocol_UpdateLeases, self).setUp()
+        self.useFixture(RegionEventLoopFixture("database-tasks"))
+
+    def make_update(self):
+        return {
+            "action": "expiry",
+            "mac": factory.make_mac_address(),
+            "ip_family": "ipv4",
+            "ip": factory.make_ipv4_address(),
+            "timestamp": int(time.time()),
+        }
+
+    def test_update_leases_is_registered(self):
+        protocol = Region()
+        responder = protocol.locateResponder(UpdateLeases.commandName)
+        self.assertIsNotNone(responder)
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test__passes_updates_to_update_leases(self):
+        update_leases = self.patch(leases_module, "update_leases")
+        update_leases.return_value = {}
+        updates = [self.make_update() for _ in range(3)]
+
+        yield eventloop.start()
+        try:
+            response = yield call_responder(
+                Region(), UpdateLeases, {
+                    "cluster_uuid": factory.make_name("uuid"),
+                    "updates": updates,
+                    })
+        finally:
+            yield eventloop.reset()
+
+        self.assertEqual({}, response)
+        self.assertThat(update_leases, MockCalledOnceWith(updates))
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test__doesnt_raises_other_errors(self):
+        # Cause a random exception
+        self.patch(leases_module, "update_leases").side_effect = (
+            factory.make_exception())
+
+        yield eventloop.start()
+        try:
+            yield call_responder(
+                Region(), UpdateLeases, {
+                    "cluster_uuid": factory.make_name("uuid"),
+                    "updates": [self.make_update()],
+                    })
+        finally:
+            yield eventloop.reset()
+
+        # Test is that no exceptions are raised. If this test passes then all
+        # works as expected.
+
+
 class TestRegionProtocol_GetBootConfig(MAASTransactionServerTestCase):
 
     def test_get_boot_config_is_registered(self):
@@ -341,6 +408,94 @@ class TestRegionProtocol_GetBootConfig(MAASTransactionServerTestCase):
             ]))
 
 
+class TestRegionProtocol_GetBootConfig_Cached(MAASTransactionServerTestCase):
+
+    def setUp(self):
+        super(TestRegionProtocol_GetBootConfig_Cached, self).setUp()
+        self.useFixture(RegionEventLoopFixture("database-tasks"))
+        self.cache = BootConfigCache()
+        self.cache.enabled = True
+        self.patch(boot_module, "boot_config_cache", self.cache)
+
+    def make_params(self, system_id):
+        return {
+            "arch": "amd64",
+            "subarch": "generic",
+            "osystem": "ubuntu",
+            "release": "xenial",
+            "kernel": "boot-kernel",
+            "initrd": "boot-initrd",
+            "boot_dtb": None,
+            "purpose": "xinstall",
+            "hostname": factory.make_name("host"),
+            "domain": "maas",
+            "preseed_url": factory.make_simple_http_url(),
+            "fs_host": factory.make_ipv4_address(),
+            "log_host": factory.make_ipv4_address(),
+            "extra_opts": "",
+            "system_id": system_id,
+            "http_boot": True,
+        }
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test__returns_cached_config_and_queues_side_effects(self):
+        get_config = self.patch(boot_module, "get_config")
+        record_boot_request = self.patch(boot_module, "record_boot_request")
+        rack_id = factory.make_name("rack")
+        machine_id = factory.make_name("machine")
+        mac = factory.make_mac_address()
+        local_ip = factory.make_ipv4_address()
+        params = self.make_params(machine_id)
+        self.cache.put(
+            self.cache.generation, rack_id, mac, None, None,
+            machine_id=machine_id, params=params, event_purpose="xinstall")
+
+        yield eventloop.start()
+        try:
+            response = yield call_responder(
+                Region(), GetBootConfig, {
+                    "system_id": rack_id,
+                    "local_ip": local_ip,
+                    "remote_ip": factory.make_ipv4_address(),
+                    "mac": mac,
+                    "bios_boot_method": "pxe",
+                })
+            yield eventloop.services.getServiceNamed(
+                "database-tasks").syncTask()
+        finally:
+            yield eventloop.reset()
+
+        self.assertEqual(local_ip, response["fs_host"])
+        self.assertEqual(params["preseed_url"], response["preseed_url"])
+        self.assertThat(get_config, MockNotCalled())
+        self.assertThat(record_boot_request, MockCalledOnceWith(
+            rack_id, local_ip, machine_id, mac, "pxe", "xinstall"))
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test__calls_get_config_on_miss(self):
+        get_config = self.patch(boot_module, "get_config")
+        get_config.return_value = self.make_params(factory.make_name("m"))
+        rack_id = factory.make_name("rack")
+        local_ip = factory.make_ipv4_address()
+        remote_ip = factory.make_ipv4_address()
+        mac = factory.make_mac_address()
+
+        yield call_responder(
+            Region(), GetBootConfig, {
+                "system_id": rack_id,
+                "local_ip": local_ip,
+                "remote_ip": remote_ip,
+                "mac": mac,
+            })
+
+        self.assertThat(get_config, MockCalledOnceWith(
+            rack_id, local_ip, remote_ip, arch=None, subarch=None, mac=mac,
+            bios_boot_method=None))
+        self.assertEqual(1, self.cache.stats["misses"])
+
+
 class TestRegionProtocol_GetBootSources(MAASTransactionServerTestCase):
 
     def test_get_boot_sources_is_registered(self):
@@ -603,6 +758,70 @@ class TestRegionProtocol_ListNodePowerParameters(
         return assert_fails_with(d, NoSuchCluster)
 
 
+class TestRegionProtocol_ListNodePowerParametersV2(
+        MAASTransactionServerTestCase):
+
+    @transactional
+    def create_node(self, **kwargs):
+        node = factory.make_Node(**kwargs)
+        return node
+
+    @transactional
+    def create_rack_controller(self, **kwargs):
+        rack = factory.make_RackController(**kwargs)
+        return rack
+
+    @transactional
+    def get_node_power_parameters(self, node):
+        return node.get_effective_power_parameters()
+
+    def test__is_registered(self):
+        protocol = Region()
+        responder = protocol.locateResponder(
+            ListNodePowerParametersV2.commandName)
+        self.assertIsNotNone(responder)
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test__returns_more_than_10_nodes(self):
+        rack = yield deferToDatabase(
+            self.create_rack_controller, power_type='')
+
+        nodes = []
+        for _ in range(12):
+            node = yield deferToDatabase(
+                self.create_node,
+                power_type="virsh",
+                power_state_updated=None,
+                bmc_connected_to=rack)
+            power_params = yield deferToDatabase(
+                self.get_node_power_parameters, node)
+            nodes.append({
+                'system_id': node.system_id,
+                'hostname': node.hostname,
+                'power_state': node.power_state,
+                'power_type': node.get_effective_power_type(),
+                'context': power_params,
+                })
+
+        response = yield call_responder(
+            Region(), ListNodePowerParametersV2,
+            {'uuid': rack.system_id})
+
+        self.maxDiff = None
+        self.assertItemsEqual(nodes, response['nodes'])
+
+    @wait_for_reactor
+    def test__raises_exception_if_nodegroup_doesnt_exist(self):
+        uuid = factory.make_UUID()
+
+        d = call_responder(
+            Region(), ListNodePowerParametersV2,
+            {'uuid': uuid})
+
+        return assert_fails_with(d, NoSuchCluster)
+
+
 class TestRegionProtocol_UpdateNodePowerState(MAASTransactionServerTestCase):
 
     @transactional
@@ -653,6 +872,45 @@ class TestRegionProtocol_UpdateNodePowerState(MAASTransactionServerTestCase):
         return d.addErrback(check)
 
 
+class TestRegionProtocol_UpdateNodePowerStates(
+        MAASTransactionServerTestCase):
+
+    @transactional
+    def create_node(self, power_state):
+        node = factory.make_Node(power_state=power_state)
+        return node
+
+    @transactional
+    def get_node_power_state(self, system_id):
+        node = Node.objects.get(system_id=system_id)
+        return node.power_state
+
+    def test__is_registered(self):
+        protocol = Region()
+        responder = protocol.locateResponder(
+            UpdateNodePowerStates.commandName)
+        self.assertIsNotNone(responder)
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test__changes_power_states_and_returns_missing(self):
+        power_state = factory.pick_enum(POWER_STATE)
+        node = yield deferToDatabase(self.create_node, power_state)
+        system_id = factory.make_name('unknown-system-id')
+
+        new_state = factory.pick_enum(POWER_STATE, but_not=power_state)
+        response = yield call_responder(
+            Region(), UpdateNodePowerStates, {'states': [
+                {'system_id': node.system_id, 'power_state': new_state},
+                {'system_id': system_id, 'power_state': new_state},
+            ]})
+
+        self.assertEqual({'missing': [system_id]}, response)
+        db_state = yield deferToDatabase(
+            self.get_node_power_state, node.system_id)
+        self.assertEqual(new_state, db_state)
+
+
 class TestRegionProtocol_RegisterEventType(MAASTransactionServerTestCase):
 
     def test_register_event_type_is_registered(self):
@@ -7,6 +7,7 @@ __all__ = []
 
 from datetime import datetime
 from email.utils import format_datetime
+import hashlib
 import http.client
 from io import BytesIO
 import json
@@ -16,6 +17,8 @@ from os import environ
 import random
 from random import randint
 from subprocess import CalledProcessError
+import threading
+import time
 from unittest import skip
 from unittest.mock import (
     ANY,
@@ -34,6 +37,7 @@ from django.db import (
 from django.http import StreamingHttpResponse
 from django.test.client import Client
 from fixtures import (
+    EnvironmentVariable,
     FakeLogger,
     Fixture,
 )
@@ -42,13 +46,19 @@ from maasserver import (
     bootresources,
 )
 from maasserver.bootresources import (
+    boot_resource_file_cache,
+    BootResourceFileCache,
     BootResourceRepoWriter,
     BootResourceStore,
+    CachingContentWrapper,
     download_all_boot_resources,
     download_boot_resources,
     get_simplestream_endpoint,
+    parse_etags,
+    parse_range,
     set_global_default_releases,
     SimpleStreamsHandler,
+    skip_content,
 )
 from maasserver.clusterrpc.testing.boot_images import make_rpc_boot_image
 from maasserver.components import (
@@ -502,6 +512,255 @@ class TestSimpleStreamsHandler(MAASServerTestCase):
             os, arch, subarch, series, version, filename)
         self.assertIsInstance(response, StreamingHttpResponse)
 
+    def get_file_client_for(self, resource, resource_file, **extra):
+        _, _, os, arch, subarch, series = self.get_product_name_for_resource(
+            resource).split(':')
+        return self.client.get(
+            self.reverse_file_handler(
+                os, arch, subarch, series,
+                resource_file.resource_set.version, resource_file.filename),
+            **extra)
+
+    def make_cached_resource_file(self):
+        self.useFixture(EnvironmentVariable("MAAS_ROOT", self.make_dir()))
+        resource = factory.make_usable_boot_resource()
+        resource_file = resource.get_latest_complete_set().files.first()
+        largefile = resource_file.largefile
+        with largefile.content.open('rb') as stream:
+            content = stream.read()
+        path = boot_resource_file_cache.get_path(largefile.sha256)
+        with open(path, 'wb') as stream:
+            stream.write(content)
+        return resource, resource_file, content
+
+    def test_download_returns_etag(self):
+        product, resource = self.make_usable_product_boot_resource()
+        resource_file = resource.get_latest_complete_set().files.first()
+        response = self.get_file_client_for(resource, resource_file)
+        self.assertEqual(
+            '"%s"' % resource_file.largefile.sha256, response['ETag'])
+
+    def test_download_returns_not_modified_for_matching_etag(self):
+        product, resource = self.make_usable_product_boot_resource()
+        resource_file = resource.get_latest_complete_set().files.first()
+        etag = '"%s"' % resource_file.largefile.sha256
+        response = self.get_file_client_for(
+            resource, resource_file,
+            HTTP_IF_NONE_MATCH='"%s", %s' % (factory.make_name(), etag))
+        self.assertEqual(http.client.NOT_MODIFIED, response.status_code)
+        self.assertEqual(etag, response['ETag'])
+
+    def test_download_returns_content_for_other_etag(self):
+        product, resource = self.make_usable_product_boot_resource()
+        resource_file = resource.get_latest_complete_set().files.first()
+        response = self.get_file_client_for(
+            resource, resource_file,
+            HTTP_IF_NONE_MATCH='"%s"' % factory.make_name())
+        self.assertEqual(http.client.OK, response.status_code)
+
+    def test_download_returns_cached_file(self):
+        resource, resource_file, content = self.make_cached_resource_file()
+        self.patch(bootresources, 'ConnectionWrapper')
+        response = self.get_file_client_for(resource, resource_file)
+        self.assertEqual(http.client.OK, response.status_code)
+        self.assertEqual(content, b''.join(response.streaming_content))
+        self.assertEqual(str(len(content)), response['Content-Length'])
+        self.assertEqual('bytes', response['Accept-Ranges'])
+        self.assertThat(bootresources.ConnectionWrapper, MockNotCalled())
+
+    def test_download_returns_range_of_cached_file(self):
+        resource, resource_file, content = self.make_cached_resource_file()
+        response = self.get_file_client_for(
+            resource, resource_file, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(http.client.PARTIAL_CONTENT, response.status_code)
+        self.assertEqual(content[10:20], b''.join(response.streaming_content))
+        self.assertEqual('10', response['Content-Length'])
+        self.assertEqual(
+            'bytes 10-19/%d' % len(content), response['Content-Range'])
+
+    def test_download_refuses_unsatisfiable_range_of_cached_file(self):
+        resource, resource_file, content = self.make_cached_resource_file()
+        response = self.get_file_client_for(
+            resource, resource_file, HTTP_RANGE='bytes=%d-' % len(content))
+        self.assertEqual(
+            http.client.REQUESTED_RANGE_NOT_SATISFIABLE,
+            response.status_code)
+        self.assertEqual(
+            'bytes */%d' % len(content), response['Content-Range'])
+
+
+class TestParseETags(MAASTestCase):
+    """Tests for `parse_etags`."""
+
+    def test__returns_empty_set_for_empty_header(self):
+        self.assertEqual(set(), parse_etags(''))
+
+    def test__returns_entity_tags(self):
+        self.assertEqual(
+            {'"abc"', '"def"', '*'}, parse_etags('"abc", W/"def" ,*'))
+
+
+class TestParseRange(MAASTestCase):
+    """Tests for `parse_range`."""
+
+    scenarios = (
+        ("empty", {"header": "", "expected": None}),
+        ("bounded", {"header": "bytes=0-99", "expected": (0, 99)}),
+        ("open", {"header": "bytes=100-", "expected": (100, 999)}),
+        ("suffix", {"header": "bytes=-10", "expected": (990, 999)}),
+        ("long suffix", {"header": "bytes=-5000", "expected": (0, 999)}),
+        ("past end", {"header": "bytes=900-5000", "expected": (900, 999)}),
+        ("backwards", {"header": "bytes=5-2", "expected": None}),
+        ("multiple", {"header": "bytes=0-5,7-9", "expected": None}),
+        ("other unit", {"header": "items=0-1", "expected": None}),
+        ("malformed", {"header": "bytes=a-b", "expected": None}),
+        ("beyond end", {"header": "bytes=1000-", "expected": ValueError}),
+        ("empty suffix", {"header": "bytes=-0", "expected": ValueError}),
+    )
+
+    def test__parses_header(self):
+        if self.expected is ValueError:
+            self.assertRaises(ValueError, parse_range, self.header, 1000)
+        else:
+            self.assertEqual(self.expected, parse_range(self.header, 1000))
+
+
+class TestBootResourceFileCache(MAASServerTestCase):
+    """Tests for `BootResourceFileCache`."""
+
+    def setUp(self):
+        super(TestBootResourceFileCache, self).setUp()
+        self.useFixture(EnvironmentVariable("MAAS_ROOT", self.make_dir()))
+
+    def test_path_is_created_under_maas_root(self):
+        cache = BootResourceFileCache()
+        self.assertTrue(os.path.isdir(cache.path))
+        self.assertTrue(cache.path.startswith(os.environ["MAAS_ROOT"]))
+
+    def test_get_returns_None_when_not_cached(self):
+        cache = BootResourceFileCache()
+        self.assertIsNone(cache.get(factory.make_LargeFile()))
+
+    def test_get_returns_path_when_cached(self):
+        cache = BootResourceFileCache()
+        largefile = factory.make_LargeFile(size=10)
+        path = cache.get_path(largefile.sha256)
+        with open(path, "wb") as stream:
+            stream.write(factory.make_bytes(10))
+        self.assertEqual(path, cache.get(largefile))
+
+    def test_get_returns_None_when_cached_file_has_wrong_size(self):
+        cache = BootResourceFileCache()
+        largefile = factory.make_LargeFile(size=10)
+        with open(cache.get_path(largefile.sha256), "wb") as stream:
+            stream.write(factory.make_bytes(11))
+        self.assertIsNone(cache.get(largefile))
+
+    def test_fill_caches_complete_file_once_at_a_time(self):
+        cache = BootResourceFileCache()
+        largefile = factory.make_LargeFile()
+        content1 = cache.fill(largefile)
+        content2 = cache.fill(largefile)
+        self.assertIsInstance(content1, CachingContentWrapper)
+        self.assertIsInstance(content2, bootresources.ConnectionWrapper)
+        content1.close()
+        content2.close()
+        self.assertIsInstance(cache.fill(largefile), CachingContentWrapper)
+
+    def test_fill_does_not_cache_incomplete_file(self):
+        cache = BootResourceFileCache()
+        largefile = factory.make_LargeFile(size=10)
+        largefile.total_size = 20
+        self.assertIsInstance(
+            cache.fill(largefile), bootresources.ConnectionWrapper)
+
+    def test_prune_removes_files_not_given(self):
+        cache = BootResourceFileCache()
+        keep, remove = factory.make_name("keep"), factory.make_name("remove")
+        for sha256 in keep, remove:
+            open(cache.get_path(sha256), "wb").close()
+        cache.prune([keep])
+        self.assertItemsEqual([keep], os.listdir(cache.path))
+
+    def test_prune_removes_only_stale_partial_files(self):
+        cache = BootResourceFileCache()
+        fresh = factory.make_name("fresh") + ".partial"
+        stale = factory.make_name("stale") + ".partial"
+        for filename in fresh, stale:
+            open(os.path.join(cache.path, filename), "wb").close()
+        two_days_ago = time.time() - (2 * 24 * 60 * 60)
+        os.utime(
+            os.path.join(cache.path, stale), (two_days_ago, two_days_ago))
+        cache.prune([])
+        self.assertItemsEqual([fresh], os.listdir(cache.path))
+
+
+class FakeContent:
+    """Stand-in for `ConnectionWrapper` that yields the given chunks."""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.chunks)
+
+    def close(self):
+        self.closed = True
+
+
+class TestCachingContentWrapper(MAASTestCase):
+    """Tests for `CachingContentWrapper`."""
+
+    def setUp(self):
+        super(TestCachingContentWrapper, self).setUp()
+        self.useFixture(EnvironmentVariable("MAAS_ROOT", self.make_dir()))
+        self.cache = BootResourceFileCache()
+        self.patch(self.cache, "release")
+
+    def make_wrapper(self, chunks, sha256=None, total_size=None):
+        content = b"".join(chunks)
+        if sha256 is None:
+            sha256 = hashlib.sha256(content).hexdigest()
+        if total_size is None:
+            total_size = len(content)
+        largefile = Mock(sha256=sha256, total_size=total_size)
+        wrapped = FakeContent(chunks)
+        return CachingContentWrapper(wrapped, largefile, self.cache), wrapped
+
+    def test_caches_content_when_read_completely(self):
+        chunks = [factory.make_bytes(10) for _ in range(3)]
+        wrapper, wrapped = self.make_wrapper(chunks)
+        self.assertEqual(chunks, list(wrapper))
+        wrapper.close()
+        with open(self.cache.get_path(wrapper.sha256), "rb") as stream:
+            self.assertEqual(b"".join(chunks), stream.read())
+        self.assertTrue(wrapped.closed)
+        self.assertThat(
+            self.cache.release, MockCalledOnceWith(wrapper.sha256))
+
+    def test_does_not_cache_partially_read_content(self):
+        chunks = [factory.make_bytes(10) for _ in range(3)]
+        wrapper, wrapped = self.make_wrapper(chunks)
+        next(wrapper)
+        wrapper.close()
+        self.assertEqual([], os.listdir(self.cache.path))
+        self.assertTrue(wrapped.closed)
+        self.assertThat(
+            self.cache.release, MockCalledOnceWith(wrapper.sha256))
+
+    def test_does_not_cache_content_with_wrong_digest(self):
+        chunks = [factory.make_bytes(10) for _ in range(3)]
+        wrapper, _ = self.make_wrapper(chunks, sha256="0" * 64)
+        with FakeLogger("maas") as logger:
+            self.assertEqual(chunks, list(wrapper))
+        wrapper.close()
+        self.assertEqual([], os.listdir(self.cache.path))
+        self.assertThat(logger.output, Contains("Not caching"))
+
 
 class TestConnectionWrapper(MAASTransactionServerTestCase):
     """Tests the use of StreamingHttpResponse(ConnectionWrapper(stream)).
@@ -989,6 +1248,149 @@ class TestBootResourceStore(MAASServerTestCase):
             store.write_content_thread(rfile.id, reader)
         self.assertFalse(BootResourceFile.objects.filter(id=rfile.id).exists())
 
+    def make_small_store(self):
+        store = BootResourceStore()
+        store.read_size = 100
+        store.commit_size = 300
+        return store
+
+    def write_partial_content(self, rfile, content, size):
+        with rfile.largefile.content.open('wb') as stream:
+            stream.write(content)
+        rfile.largefile.size = size
+        rfile.largefile.save()
+
+    def read_content(self, rfile):
+        with rfile.largefile.content.open('rb') as stream:
+            return stream.read()
+
+    def test_write_content_thread_resumes_partial_content(self):
+        store = self.make_small_store()
+        rfile, reader, content = make_boot_resource_file_with_stream(size=1000)
+        self.write_partial_content(rfile, content[:350], 350)
+        store.write_content_thread(rfile.id, reader)
+        self.assertTrue(BootResourceFile.objects.filter(id=rfile.id).exists())
+        self.assertEqual(content, self.read_content(rfile))
+        self.assertEqual(1000, reload_object(rfile.largefile).size)
+
+    def test_write_content_thread_resumes_from_unseekable_reader(self):
+        store = self.make_small_store()
+        rfile, reader, content = make_boot_resource_file_with_stream(size=1000)
+        self.write_partial_content(rfile, content[:350], 350)
+        store.write_content_thread(rfile.id, Mock(read=reader.read, spec=[
+            "read"]))
+        self.assertTrue(BootResourceFile.objects.filter(id=rfile.id).exists())
+        self.assertEqual(content, self.read_content(rfile))
+
+    def test_write_content_thread_discards_unrecorded_content(self):
+        store = self.make_small_store()
+        rfile, reader, content = make_boot_resource_file_with_stream(size=1000)
+        self.write_partial_content(
+            rfile, content[:300] + factory.make_bytes(200), 300)
+        store.write_content_thread(rfile.id, reader)
+        self.assertTrue(BootResourceFile.objects.filter(id=rfile.id).exists())
+        self.assertEqual(content, self.read_content(rfile))
+
+    def test_write_content_thread_records_progress_when_cancelled(self):
+        store = self.make_small_store()
+        rfile, reader, content = make_boot_resource_file_with_stream(size=1000)
+        reads = []
+
+        def read(size):
+            reads.append(size)
+            if len(reads) == 4:
+                store._cancel_finalize = True
+            return reader.read(size)
+
+        store.write_content_thread(rfile.id, Mock(read=read, spec=["read"]))
+        self.assertEqual(content[:400], self.read_content(rfile))
+        self.assertEqual(400, reload_object(rfile.largefile).size)
+
+    def test_write_content_thread_logs_throughput(self):
+        store = self.make_small_store()
+        rfile, reader, content = make_boot_resource_file_with_stream(size=1000)
+        with FakeLogger("maas") as logger:
+            store.write_content_thread(rfile.id, reader)
+        self.assertThat(logger.output, Contains(
+            "Finalized boot image %s; wrote 1.0 kB in " %
+            store.get_resource_file_log_identifier(rfile)))
+
+    def test_write_queued_content_writes_everything_queued(self):
+        store = BootResourceStore()
+        write_content_thread = self.patch(store, 'write_content_thread')
+        store._content_to_finalize = {1: sentinel.reader1, 2: sentinel.reader2}
+        store.write_queued_content()
+        self.assertItemsEqual(
+            [call(1, sentinel.reader1), call(2, sentinel.reader2)],
+            write_content_thread.call_args_list)
+        self.assertEqual({}, store._content_to_finalize)
+
+    def test_write_queued_content_stops_when_cancelled(self):
+        store = BootResourceStore()
+
+        def write_content_thread(rid, reader):
+            store._cancel_finalize = True
+
+        self.patch(store, 'write_content_thread', write_content_thread)
+        store._content_to_finalize = {1: sentinel.reader1, 2: sentinel.reader2}
+        store.write_queued_content()
+        self.assertThat(store._content_to_finalize, HasLength(1))
+
+    def test_write_queued_content_continues_after_failure(self):
+        store = BootResourceStore()
+        exception = factory.make_exception()
+        written = []
+
+        def write_content_thread(rid, reader):
+            written.append(rid)
+            raise exception
+
+        self.patch(store, 'write_content_thread', write_content_thread)
+        store._content_to_finalize = {1: sentinel.reader1, 2: sentinel.reader2}
+        with FakeLogger("maas") as logger:
+            store.write_queued_content()
+        self.assertItemsEqual([1, 2], written)
+        self.assertEqual({}, store._content_to_finalize)
+        for rid in written:
+            self.assertThat(logger.output, Contains(
+                "Failed to write boot image content for boot resource "
+                "file %s: %s" % (rid, exception)))
+
+    def test_perform_write_uses_at_most_write_threads(self):
+        store = BootResourceStore()
+        store.write_threads = 2
+        lock = threading.Lock()
+        running = []
+        most_running = []
+        written = []
+
+        def write_content_thread(rid, reader):
+            with lock:
+                running.append(rid)
+                most_running.append(len(running))
+            time.sleep(0.01)
+            with lock:
+                running.remove(rid)
+                written.append(rid)
+
+        self.patch(store, 'write_content_thread', write_content_thread)
+        store._content_to_finalize = {
+            rid: sentinel.reader for rid in range(10)}
+        store.perform_write()
+        self.assertItemsEqual(range(10), written)
+        self.assertLessEqual(max(most_running), store.write_threads)
+
+    def test_perform_write_logs_errors(self):
+        store = BootResourceStore()
+        exception = factory.make_exception()
+        self.patch(store, 'write_content_thread').side_effect = exception
+        store._content_to_finalize = {1: sentinel.reader}
+        with FakeLogger("maas") as logger:
+            store.perform_write()
+        self.assertThat(logger.output, Contains(
+            "Failed to write boot image content for boot resource file 1: "
+            "%s" % exception))
+
     def test_delete_content_to_finalize_deletes_items(self):
         self.useFixture(SignalsDisabled("largefiles"))
         rfile_one, _, _ = make_boot_resource_file_with_stream()
@@ -1074,6 +1476,28 @@ class TestBootResourceStore(MAASServerTestCase):
         self.expectThat(mock_resource_set_cleaner, MockCalledOnceWith())
 
 
+class TestSkipContent(MAASTestCase):
+    """Tests for `skip_content`."""
+
+    def test__seeks_when_possible(self):
+        content = factory.make_bytes(100)
+        reader = BytesIO(content)
+        reader.read(10)
+        skip_content(reader, 50, 7)
+        self.assertEqual(content[60:], reader.read())
+
+    def test__reads_and_discards_otherwise(self):
+        content = factory.make_bytes(100)
+        reader = Mock(read=BytesIO(content).read, spec=["read"])
+        skip_content(reader, 50, 7)
+        self.assertEqual(content[50:], reader.read(100))
+
+    def test__stops_at_end_of_content(self):
+        reader = Mock(read=BytesIO(b"abc").read, spec=["read"])
+        skip_content(reader, 50, 7)
+        self.assertEqual(b"", reader.read(100))
+
+
 class TestBootResourceTransactional(MAASTransactionServerTestCase):
     """Test methods on `BootResourceStore` that manage their own transactions.
 
@@ -1220,6 +1644,37 @@ class TestBootResourceTransactional(MAASTransactionServerTestCase):
             mock_save_later,
             MockCalledOnceWith(rfile, sentinel.reader))
 
+    def test_insert_resumes_writing_incomplete_largefile(self):
+        name, architecture, product = make_product()
+        with transaction.atomic():
+            product, resource = make_boot_resource_group_from_product(product)
+            rfile = resource.sets.first().files.first()
+            rfile.largefile.size = rfile.largefile.total_size // 2
+            rfile.largefile.save()
+        store = BootResourceStore()
+        mock_save_later = self.patch(store, 'save_content_later')
+        store.insert(product, sentinel.reader)
+        self.assertThat(
+            mock_save_later,
+            MockCalledOnceWith(reload_object(rfile), sentinel.reader))
+
+    def test_insert_does_not_write_incomplete_largefile_twice(self):
+        name, architecture, product = make_product()
+        with transaction.atomic():
+            product, resource = make_boot_resource_group_from_product(product)
+            rfile = resource.sets.first().files.first()
+            largefile = rfile.largefile
+            largefile.size = largefile.total_size // 2
+            largefile.save()
+            other_rfile = factory.make_BootResourceFile(
+                factory.make_BootResourceSet(factory.make_BootResource()),
+                largefile)
+        store = BootResourceStore()
+        store.save_content_later(other_rfile, sentinel.other_reader)
+        mock_save_later = self.patch(store, 'save_content_later')
+        store.insert(product, sentinel.reader)
+        self.assertThat(mock_save_later, MockNotCalled())
+
     def test_insert_prints_error_when_breaking_resources(self):
         # Test case for bug 1419041: if the call to insert() makes
         # an existing complete resource incomplete: print an error in the
@@ -2038,6 +2493,21 @@ class TestImportResourcesProgressServiceAsync(MAASTransactionServerTestCase):
         error = get_persistent_error(COMPONENT.IMPORT_PXE_FILES)
         self.assertIsNone(error)
 
+    def test__prunes_boot_resource_file_cache(self):
+        with transaction.atomic():
+            largefile = factory.make_LargeFile()
+        prune = self.patch(bootresources.boot_resource_file_cache, "prune")
+
+        service = bootresources.ImportResourcesProgressService()
+        self.patch_are_functions(service, True, False)
+
+        check_boot_images = asynchronous(service.check_boot_images)
+        check_boot_images().wait(5)
+
+        self.assertThat(prune, MockCalledOnce())
+        [sha256s], _ = prune.call_args
+        self.assertItemsEqual([largefile.sha256], sha256s)
+
     def test__logs_all_errors(self):
         logger = self.useFixture(TwistedLoggerFixture())
 
@@ -0,0 +1,82 @@
+# Copyright 2017 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for the contention_report command."""
+
+__all__ = []
+
+from io import StringIO
+import json
+import os
+from time import time
+
+from django.core.management import call_command
+from maasserver.regiondservices.process_stats import write_process_stats
+from maastesting.fixtures import MAASRootFixture
+from maastesting.matchers import DocTestMatches
+from maastesting.testcase import MAASTestCase
+from testtools.matchers import Equals
+
+
+def make_process_stats(pid):
+    return {
+        "pid": pid,
+        "time": time(),
+        "retries": {
+            "callsites": {
+                "maasserver.rpc.leases.update_lease": {
+                    "calls": 5, "attempts": 8, "retries": 3, "failures": 1,
+                    "time_lost": 1.25, "serialization_failure": 3,
+                    "deadlock": 1,
+                },
+            },
+            "relations": {"maasserver_staticipaddress": 2},
+            "samples": [{
+                "relation": "maasserver_staticipaddress", "row": "(0,7)",
+                "constraint": None, "message": "deadlock detected",
+                "callsite": "maasserver.rpc.leases.update_lease",
+                "kind": "deadlock", "time": time(),
+            }],
+        },
+        "limiter": {
+            "limit": 4, "in_use": 1, "latency": 0.05, "baseline": None,
+            "conflicts": 4, "gates": {},
+        },
+    }
+
+
+class TestContentionReportCommand(MAASTestCase):
+
+    def setUp(self):
+        super(TestContentionReportCommand, self).setUp()
+        self.useFixture(MAASRootFixture())
+
+    def call_command(self, *args, **kwargs):
+        stdout = StringIO()
+        call_command("contention_report", *args, stdout=stdout, **kwargs)
+        return stdout.getvalue()
+
+    def test_reports_nothing_published(self):
+        self.assertThat(
+            self.call_command(), DocTestMatches(
+                "No statistics have been published by region processes."))
+
+    def test_reports_callsites_relations_samples_and_limiters(self):
+        write_process_stats(make_process_stats(os.getpid()))
+        self.assertThat(self.call_command(), DocTestMatches("""\
+        callsite calls retries failures lost (s) serial deadlock unique
+        maasserver.rpc.leases.update_lease 5 3 1 1.25 3 1 0
+        relation conflicts
+        maasserver_staticipaddress 2
+        time kind relation row callsite
+        ... deadlock maasserver_staticipaddress (0,7)
+        maasserver.rpc.leases.update_lease
+        pid limit in use latency (s) baseline (s) conflicts
+        ... 4 1 0.050 - 4
+        """))
+
+    def test_prints_json(self):
+        stats = make_process_stats(os.getpid())
+        write_process_stats(stats)
+        output = self.call_command(json=True)
+        self.assertThat(json.loads(output), Equals(stats["retries"]))
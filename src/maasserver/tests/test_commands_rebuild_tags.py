@@ -0,0 +1,54 @@
+# Copyright 2017 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for the rebuild_tags command."""
+
+__all__ = []
+
+from unittest.mock import ANY
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from maasserver.management.commands import rebuild_tags as command_module
+from maasserver.models import Node
+from maasserver.testing.factory import factory
+from maasserver.testing.testcase import MAASServerTestCase
+from maastesting.matchers import (
+    MockCalledOnceWith,
+    MockNotCalled,
+)
+from testtools.matchers import Equals
+
+
+class TestRebuildTagsCommand(MAASServerTestCase):
+
+    def setUp(self):
+        super(TestRebuildTagsCommand, self).setUp()
+        self.rebuild_tags = self.patch(command_module, "rebuild_tags")
+
+    def test_rebuilds_all_tags(self):
+        tags = [factory.make_Tag(populate=False) for _ in range(2)]
+        call_command("rebuild_tags", workers=3)
+        self.assertThat(
+            self.rebuild_tags, MockCalledOnceWith(ANY, ANY, workers=3))
+        [rebuilt, nodes], _ = self.rebuild_tags.call_args
+        self.assertItemsEqual(tags, rebuilt)
+        self.assertItemsEqual(Node.objects.all(), nodes)
+
+    def test_rebuilds_named_tags(self):
+        tags = [factory.make_Tag(populate=False) for _ in range(3)]
+        call_command("rebuild_tags", tags=[tags[0].name, tags[2].name])
+        [rebuilt, _], _ = self.rebuild_tags.call_args
+        self.assertItemsEqual([tags[0], tags[2]], rebuilt)
+
+    def test_rejects_unknown_tags(self):
+        tag = factory.make_Tag(populate=False)
+        error = self.assertRaises(
+            CommandError, call_command, "rebuild_tags",
+            tags=[tag.name, "unknown"])
+        self.assertThat(str(error), Equals("Unknown tag(s): unknown"))
+
+    def test_rejects_fewer_than_one_worker(self):
+        self.assertRaises(
+            CommandError, call_command, "rebuild_tags", workers=0)
+        self.assertThat(self.rebuild_tags, MockNotCalled())
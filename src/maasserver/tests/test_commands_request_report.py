@@ -0,0 +1,93 @@
+# Copyright 2017 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for the request_report command."""
+
+__all__ = []
+
+from io import StringIO
+import json
+import os
+from time import time
+
+from django.core.management import call_command
+from maasserver.regiondservices.process_stats import write_process_stats
+from maasserver.utils.latency import (
+    BUCKET_BOUNDS,
+    merge_stats,
+)
+from maastesting.fixtures import MAASRootFixture
+from maastesting.matchers import DocTestMatches
+from maastesting.testcase import MAASTestCase
+from testtools.matchers import Equals
+
+
+def make_process_stats(pid, operations=True):
+    buckets = [0] * (len(BUCKET_BOUNDS) + 1)
+    buckets[BUCKET_BOUNDS.index(0.05)] = 9
+    buckets[BUCKET_BOUNDS.index(2.5)] = 1
+    return {
+        "pid": pid,
+        "time": time(),
+        "requests": {
+            "bounds": list(BUCKET_BOUNDS),
+            "operations": {
+                "GET machines_handler": {
+                    "buckets": buckets, "count": 10, "total": 2.5,
+                    "max": 2.0, "queries": 40, "query_time": 0.5,
+                },
+            } if operations else {},
+            "slow": [{
+                "operation": "GET machines_handler", "time": time(),
+                "elapsed": 2.0, "query_count": 3, "query_time": 0.25,
+                "queries": [{
+                    "sql": "SELECT *\n  FROM maasserver_node",
+                    "time": "0.250",
+                }],
+            }] if operations else [],
+        },
+    }
+
+
+class TestRequestReportCommand(MAASTestCase):
+
+    def setUp(self):
+        super(TestRequestReportCommand, self).setUp()
+        self.useFixture(MAASRootFixture())
+
+    def call_command(self, *args, **kwargs):
+        stdout = StringIO()
+        call_command("request_report", *args, stdout=stdout, **kwargs)
+        return stdout.getvalue()
+
+    def test_reports_nothing_published(self):
+        self.assertThat(
+            self.call_command(), DocTestMatches(
+                "No statistics have been published by region processes."))
+
+    def test_reports_nothing_sampled(self):
+        write_process_stats(make_process_stats(os.getpid(), False))
+        self.assertThat(
+            self.call_command(), DocTestMatches(
+                "No requests have been sampled. Set telemetry_sample_rate "
+                "with `maas-region local_config_set`."))
+
+    def test_reports_operations_and_slow_requests(self):
+        write_process_stats(make_process_stats(os.getpid()))
+        self.assertThat(self.call_command(), DocTestMatches("""\
+        operation count p50 (s) p95 (s) p99 (s) mean (s) max (s)
+        queries query (s)
+        GET machines_handler 10 0.050 2.500 2.500 0.250 2.000 4.0 0.050
+        time operation time (s) queries query (s)
+        ... GET machines_handler 2.000 3 0.250
+        0.250 SELECT * FROM maasserver_node
+        (2 more queries not captured)
+        """))
+
+    def test_prints_json(self):
+        stats = make_process_stats(os.getpid())
+        write_process_stats(stats)
+        output = self.call_command(json=True)
+        self.assertThat(
+            json.loads(output),
+            Equals(merge_stats([stats["requests"]], slow=5)))
@@ -90,3 +90,33 @@ class TestRegionConfigurationDatabaseOptions(MAASTestCase):
         self.assertEqual(example_value, getattr(config, self.option))
         # It's also stored in the configuration database.
         self.assertEqual({self.option: example_value}, config.store)
+
+
+class TestRegionConfigurationTelemetryOptions(MAASTestCase):
+    """Tests for the telemetry options in `RegionConfiguration`."""
+
+    def test__default(self):
+        config = RegionConfiguration({})
+        self.assertEqual(0.0, config.telemetry_sample_rate)
+        self.assertEqual(2.0, config.telemetry_slow_request)
+
+    def test__set_and_get(self):
+        config = RegionConfiguration({})
+        config.telemetry_sample_rate = "0.25"
+        config.telemetry_slow_request = "0.5"
+        self.assertEqual(0.25, config.telemetry_sample_rate)
+        self.assertEqual(0.5, config.telemetry_slow_request)
+        self.assertEqual({
+            "telemetry_sample_rate": 0.25,
+            "telemetry_slow_request": 0.5,
+        }, config.store)
+
+    def test__sample_rate_rejects_values_greater_than_one(self):
+        config = RegionConfiguration({})
+        with ExpectedException(formencode.api.Invalid):
+            config.telemetry_sample_rate = "1.5"
+
+    def test__slow_request_rejects_negative_values(self):
+        config = RegionConfiguration({})
+        with ExpectedException(formencode.api.Invalid):
+            config.telemetry_slow_request = "-1"
@@ -7,7 +7,10 @@ __all__ = []
 
 from operator import itemgetter
 import random
-from unittest.mock import ANY
+from unittest.mock import (
+    ANY,
+    Mock,
+)
 
 from crochet import wait_for
 from django.core.exceptions import ValidationError
@@ -41,6 +44,7 @@ from maastesting.matchers import (
     MockCalledOnceWith,
     MockNotCalled,
 )
+from maastesting.testcase import MAASTestCase
 from maastesting.twisted import (
     always_fail_with,
     always_succeed_with,
@@ -1571,6 +1575,95 @@ class TestGetDHCPConfigureFor(MAASServerTestCase):
         self.assertEqual(primary_interface.name, observed_interface)
 
 
+class TestDHCPConfigurationCache(MAASTestCase):
+    """Tests for `DHCPConfigurationCache`."""
+
+    def make_config(self):
+        return (None, [{"subnet": factory.make_name("subnet")}], [], "eth0")
+
+    def test_get_returns_none_when_not_cached(self):
+        cache = dhcp.DHCPConfigurationCache()
+        self.assertIsNone(cache.get(1, 2, 4, ()))
+
+    def test_get_returns_copy_of_config_put(self):
+        cache = dhcp.DHCPConfigurationCache()
+        config = self.make_config()
+        cache.put(cache.get_generation(1), 1, 2, 4, ("inputs",), config)
+        observed = cache.get(1, 2, 4, ("inputs",))
+        self.assertEqual(config, observed)
+        observed[1][0]["subnet"] = factory.make_name("changed")
+        self.assertEqual(config, cache.get(1, 2, 4, ("inputs",)))
+
+    def test_get_returns_none_when_inputs_differ(self):
+        cache = dhcp.DHCPConfigurationCache()
+        cache.put(cache.get_generation(1), 1, 2, 4, ("a",), self.make_config())
+        self.assertIsNone(cache.get(1, 2, 4, ("b",)))
+        self.assertIsNone(cache.get(1, 2, 6, ("a",)))
+
+    def test_put_discards_config_when_invalidated_since_generation(self):
+        cache = dhcp.DHCPConfigurationCache()
+        generation = cache.get_generation(1)
+        cache.invalidate(1, {3})
+        cache.put(generation, 1, 2, 4, (), self.make_config())
+        self.assertIsNone(cache.get(1, 2, 4, ()))
+
+    def test_invalidate_removes_only_given_vlans(self):
+        cache = dhcp.DHCPConfigurationCache()
+        for rack_id, vlan_id in ((1, 2), (1, 3), (4, 2)):
+            cache.put(
+                cache.get_generation(rack_id), rack_id, vlan_id, 4, (),
+                self.make_config())
+        cache.invalidate(1, {2})
+        self.assertItemsEqual([(1, 3, 4), (4, 2, 4)], cache.entries)
+
+    def test_invalidate_removes_all_vlans_for_rack(self):
+        cache = dhcp.DHCPConfigurationCache()
+        for rack_id, vlan_id in ((1, 2), (1, 3), (4, 2)):
+            cache.put(
+                cache.get_generation(rack_id), rack_id, vlan_id, 4, (),
+                self.make_config())
+        cache.invalidate(1)
+        self.assertItemsEqual([(4, 2, 4)], cache.entries)
+
+    def test_is_current_after_set_current(self):
+        cache = dhcp.DHCPConfigurationCache()
+        self.assertFalse(cache.is_current(1, 4, "digest"))
+        cache.set_current(1, 4, "digest")
+        self.assertTrue(cache.is_current(1, 4, "digest"))
+        self.assertFalse(cache.is_current(1, 6, "digest"))
+        self.assertFalse(cache.is_current(1, 4, "other"))
+
+    def test_set_current_none_clears_digest(self):
+        cache = dhcp.DHCPConfigurationCache()
+        cache.set_current(1, 4, "digest")
+        cache.set_current(1, 4, None)
+        self.assertFalse(cache.is_current(1, 4, "digest"))
+
+    def test_forget_clears_entries_and_digests(self):
+        cache = dhcp.DHCPConfigurationCache()
+        cache.put(cache.get_generation(1), 1, 2, 4, (), self.make_config())
+        cache.set_current(1, 4, "digest4")
+        cache.set_current(1, 6, "digest6")
+        cache.forget(1)
+        self.assertEqual({}, cache.entries)
+        self.assertFalse(cache.is_current(1, 4, "digest4"))
+        self.assertFalse(cache.is_current(1, 6, "digest6"))
+
+
+class TestGetConfigDigest(MAASTestCase):
+    """Tests for `get_config_digest`."""
+
+    def test_digest_is_independent_of_key_order(self):
+        self.assertEqual(
+            dhcp.get_config_digest({"a": 1, "b": [IPAddress("10.0.0.1")]}),
+            dhcp.get_config_digest({"b": [IPAddress("10.0.0.1")], "a": 1}))
+
+    def test_digest_changes_with_config(self):
+        self.assertNotEqual(
+            dhcp.get_config_digest({"a": 1}),
+            dhcp.get_config_digest({"a": 2}))
+
+
 class TestGetDHCPConfiguration(MAASServerTestCase):
     """Tests for `get_dhcp_configuration`."""
 
@@ -1634,6 +1727,73 @@ class TestGetDHCPConfiguration(MAASServerTestCase):
         self.assertHasConfigurationForNTP(
             config.shared_networks_v6, addr6.subnet, [addr6.ip])
 
+    def test__reuses_cached_configuration_for_each_vlan(self):
+        rack, _ = self.make_RackController_ready_for_DHCP()
+        cache = dhcp.DHCPConfigurationCache()
+        expected = dhcp.get_dhcp_configuration(rack, cache=cache)
+        get_dhcp_configure_for = self.patch(dhcp, "get_dhcp_configure_for")
+        observed = dhcp.get_dhcp_configuration(rack, cache=cache)
+        self.assertThat(get_dhcp_configure_for, MockNotCalled())
+        self.assertEqual(expected, observed)
+
+    def test__cached_configuration_uses_fewer_queries(self):
+        rack, _ = self.make_RackController_ready_for_DHCP()
+        cache = dhcp.DHCPConfigurationCache()
+        uncached, _ = count_queries(
+            dhcp.get_dhcp_configuration, rack, cache=cache)
+        cached, _ = count_queries(
+            dhcp.get_dhcp_configuration, rack, cache=cache)
+        self.assertLess(cached, uncached)
+
+    def test__rebuilds_configuration_for_invalidated_vlan(self):
+        rack, (addr4, addr6) = self.make_RackController_ready_for_DHCP()
+        cache = dhcp.DHCPConfigurationCache()
+        dhcp.get_dhcp_configuration(rack, cache=cache)
+        get_dhcp_configure_for = self.patch(
+            dhcp, "get_dhcp_configure_for",
+            Mock(wraps=dhcp.get_dhcp_configure_for))
+        cache.invalidate(rack.id, {random.randint(10000, 20000)})
+        dhcp.get_dhcp_configuration(rack, cache=cache)
+        self.assertThat(get_dhcp_configure_for, MockNotCalled())
+        cache.invalidate(rack.id, {addr4.subnet.vlan_id})
+        dhcp.get_dhcp_configuration(rack, cache=cache)
+        self.assertThat(get_dhcp_configure_for.call_args_list, HasLength(2))
+
+    def test__rebuilds_configuration_when_subnet_added(self):
+        rack, (addr4, _) = self.make_RackController_ready_for_DHCP()
+        cache = dhcp.DHCPConfigurationCache()
+        dhcp.get_dhcp_configuration(rack, cache=cache)
+        subnet = factory.make_Subnet(
+            vlan=addr4.subnet.vlan, cidr="10.20.31.0/24")
+        config = dhcp.get_dhcp_configuration(rack, cache=cache)
+        [shared_network] = config.shared_networks_v4
+        self.assertItemsEqual(
+            [addr4.subnet.cidr, subnet.cidr], [
+                subnet_config["subnet_cidr"]
+                for subnet_config in shared_network["subnets"]
+            ])
+
+    def test__does_not_cache_configuration_invalidated_meanwhile(self):
+        rack, _ = self.make_RackController_ready_for_DHCP()
+        cache = dhcp.DHCPConfigurationCache()
+        get_dhcp_configure_for = dhcp.get_dhcp_configure_for
+
+        def invalidate_then_configure(*args, **kwargs):
+            cache.invalidate(rack.id)
+            return get_dhcp_configure_for(*args, **kwargs)
+
+        self.patch(
+            dhcp, "get_dhcp_configure_for", invalidate_then_configure)
+        dhcp.get_dhcp_configuration(rack, cache=cache)
+        self.assertEqual({}, cache.entries)
+
+    def test__does_not_use_cache_when_testing_snippet(self):
+        rack, _ = self.make_RackController_ready_for_DHCP()
+        cache = dhcp.DHCPConfigurationCache()
+        dhcp.get_dhcp_configuration(
+            rack, test_dhcp_snippet=factory.make_DHCPSnippet(), cache=cache)
+        self.assertEqual({}, cache.entries)
+
 
 class TestConfigureDHCP(MAASTransactionServerTestCase):
     """Tests for `configure_dhcp`."""
@@ -1895,6 +2055,66 @@ class TestConfigureDHCP(MAASTransactionServerTestCase):
                     status=SERVICE_STATUS.DEAD, status_info=ipv6_exc))
         yield deferToDatabase(service_status_updated)
 
+    @wait_for_reactor
+    @inlineCallbacks
+    def test__does_not_send_unchanged_configuration_again(self):
+        self.patch(dhcp.settings, "DHCP_CONNECT", True)
+        rack_controller, _ = yield deferToDatabase(
+            self.create_rack_controller)
+        protocol, ipv4_stub, ipv6_stub = yield deferToThread(
+            self.prepare_rpc, rack_controller)
+        ipv4_stub.side_effect = always_succeed_with({})
+        ipv6_stub.side_effect = always_succeed_with({})
+        cache = dhcp.DHCPConfigurationCache()
+
+        yield dhcp.configure_dhcp(rack_controller, cache=cache)
+        yield dhcp.configure_dhcp(rack_controller, cache=cache)
+
+        self.assertThat(ipv4_stub, MockCalledOnceWith(
+            ANY, omapi_key=ANY, failover_peers=ANY, shared_networks=ANY,
+            hosts=ANY, interfaces=ANY, global_dhcp_snippets=ANY))
+        self.assertThat(ipv6_stub, MockCalledOnceWith(
+            ANY, omapi_key=ANY, failover_peers=ANY, shared_networks=ANY,
+            hosts=ANY, interfaces=ANY, global_dhcp_snippets=ANY))
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test__sends_configuration_again_once_forgotten(self):
+        self.patch(dhcp.settings, "DHCP_CONNECT", True)
+        rack_controller, _ = yield deferToDatabase(
+            self.create_rack_controller)
+        protocol, ipv4_stub, ipv6_stub = yield deferToThread(
+            self.prepare_rpc, rack_controller)
+        ipv4_stub.side_effect = always_succeed_with({})
+        ipv6_stub.side_effect = always_succeed_with({})
+        cache = dhcp.DHCPConfigurationCache()
+
+        yield dhcp.configure_dhcp(rack_controller, cache=cache)
+        cache.forget(rack_controller.id)
+        yield dhcp.configure_dhcp(rack_controller, cache=cache)
+
+        self.assertThat(ipv4_stub.call_args_list, HasLength(2))
+        self.assertThat(ipv6_stub.call_args_list, HasLength(2))
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test__sends_configuration_again_after_failure(self):
+        self.patch(dhcp.settings, "DHCP_CONNECT", True)
+        rack_controller, _ = yield deferToDatabase(
+            self.create_rack_controller)
+        protocol, ipv4_stub, ipv6_stub = yield deferToThread(
+            self.prepare_rpc, rack_controller)
+        ipv4_stub.side_effect = always_fail_with(
+            CannotConfigureDHCP(factory.make_name("ipv4_failure")))
+        ipv6_stub.side_effect = always_succeed_with({})
+        cache = dhcp.DHCPConfigurationCache()
+
+        yield dhcp.configure_dhcp(rack_controller, cache=cache)
+        yield dhcp.configure_dhcp(rack_controller, cache=cache)
+
+        self.assertThat(ipv4_stub.call_args_list, HasLength(2))
+        self.assertThat(ipv6_stub.call_args_list, HasLength(1))
+
 
 class TestValidateDHCPConfig(MAASTransactionServerTestCase):
     """Tests for `validate_dhcp_config`."""
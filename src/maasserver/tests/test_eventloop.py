@@ -20,7 +20,11 @@ from maasserver import (
     webapp,
 )
 from maasserver.eventloop import DEFAULT_PORT
-from maasserver.regiondservices import service_monitor_service
+from maasserver.regiondservices import (
+    boot_config_cache,
+    process_stats,
+    service_monitor_service,
+)
 from maasserver.rpc import regionservice
 from maasserver.testing.eventloop import RegionEventLoopFixture
 from maasserver.testing.listener import FakePostgresListenerService
@@ -328,6 +332,36 @@ class TestFactories(MAASTestCase):
         self.assertFalse(
             eventloop.loop.factories["status-worker"]["only_on_master"])
 
+    def test_make_BootConfigCacheService(self):
+        service = eventloop.make_BootConfigCacheService(
+            FakePostgresListenerService())
+        self.assertThat(service, IsInstance(
+            boot_config_cache.BootConfigCacheService))
+        # It is registered as a factory in RegionEventLoop.
+        self.assertIs(
+            eventloop.make_BootConfigCacheService,
+            eventloop.loop.factories["boot-config-cache"]["factory"])
+        # Has a dependency of postgres-listener.
+        self.assertEquals(
+            ["postgres-listener"],
+            eventloop.loop.factories["boot-config-cache"]["requires"])
+        self.assertFalse(
+            eventloop.loop.factories["boot-config-cache"]["only_on_master"])
+
+    def test_make_ProcessStatsService(self):
+        service = eventloop.make_ProcessStatsService()
+        self.assertThat(service, IsInstance(
+            process_stats.ProcessStatsService))
+        # It is registered as a factory in RegionEventLoop.
+        self.assertIs(
+            eventloop.make_ProcessStatsService,
+            eventloop.loop.factories["process-stats"]["factory"])
+        # Has no dependencies.
+        self.assertEquals(
+            [], eventloop.loop.factories["process-stats"]["requires"])
+        self.assertFalse(
+            eventloop.loop.factories["process-stats"]["only_on_master"])
+
 
 class TestDisablingDatabaseConnections(MAASServerTestCase):
 
@@ -56,6 +56,7 @@ from twisted.internet.defer import (
     DeferredQueue,
     inlineCallbacks,
 )
+from twisted.internet.task import Clock
 from twisted.logger import LogLevel
 from twisted.python.failure import Failure
 
@@ -597,3 +598,112 @@ class TestPostgresListenerService(MAASServerTestCase):
                 call("UNLISTEN %s_create;" % channel),
                 call("UNLISTEN %s_delete;" % channel),
                 call("UNLISTEN %s_update;" % channel)))
+
+    def test_register_raises_error_for_batch_system_handler(self):
+        listener = PostgresListenerService()
+        with ExpectedException(PostgresListenerRegistrationError):
+            listener.register("sys_test", sentinel.handler, batch=True)
+
+    def test_unregister_removes_batch_handler(self):
+        listener = PostgresListenerService()
+        channel = factory.make_name("channel")
+        listener.register(channel, sentinel.handler, batch=True)
+        listener.unregister(channel, sentinel.handler)
+        self.assertEqual(set(), listener.batchHandlers)
+
+    def test__doRead_coalesces_notifications_in_order_received(self):
+        listener = PostgresListenerService()
+        notifications = [
+            FakeNotify(
+                channel=factory.make_name("channel_action"),
+                payload=factory.make_name("payload"))
+            for _ in range(3)
+            ]
+        connection = self.patch(listener, "connection")
+        connection.connection.poll.return_value = None
+        connection.connection.notifies = notifications + notifications
+        listener.doRead()
+        self.expectThat(list(listener.notifications), Equals(notifications))
+        self.expectThat(listener.stats["queued"], Equals(3))
+        self.expectThat(listener.stats["coalesced"], Equals(3))
+
+    def test__doRead_pauses_reading_when_queue_is_full(self):
+        listener = PostgresListenerService()
+        listener.MAX_PENDING_NOTIFICATIONS = 2
+        listener.connectionFileno = sentinel.fileno
+        self.patch(reactor, "removeReader")
+        connection = self.patch(listener, "connection")
+        connection.connection.poll.return_value = None
+        connection.connection.notifies = [
+            FakeNotify(channel="node_update", payload=str(i))
+            for i in range(2)
+            ]
+        listener.doRead()
+        self.expectThat(listener.readingPaused, Is(True))
+        self.expectThat(reactor.removeReader, MockCalledOnceWith(listener))
+        self.expectThat(listener.stats["paused"], Equals(1))
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test__handleNotifies_resumes_reading_once_drained(self):
+        listener = PostgresListenerService()
+        listener.register("node", lambda action, pk: None)
+        listener.readingPaused = True
+        self.patch(reactor, "addReader")
+        listener.queueNotification("node_update", "1")
+        yield listener.handleNotifies()
+        self.expectThat(listener.readingPaused, Is(False))
+        self.expectThat(reactor.addReader, MockCalledOnceWith(listener))
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test__handleNotifies_calls_batch_handler_once_per_action(self):
+        listener = PostgresListenerService()
+        batches = []
+        listener.register(
+            "node", lambda action, pks: batches.append((action, pks)),
+            batch=True)
+        for pk in ("1", "2", "3"):
+            listener.queueNotification("node_update", pk)
+        listener.queueNotification("node_delete", "4")
+        yield listener.handleNotifies()
+        self.expectThat(batches, Equals([
+            ("update", ["1", "2", "3"]),
+            ("delete", ["4"]),
+        ]))
+        self.expectThat(listener.notifications, HasLength(0))
+        self.expectThat(listener.stats["batches"], Equals(2))
+        self.expectThat(listener.stats["dispatched"], Equals(4))
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test__handleNotifies_calls_other_handlers_once_per_payload(self):
+        listener = PostgresListenerService()
+        calls = []
+        listener.register("node", lambda *args: calls.append(args))
+        for pk in ("1", "2"):
+            listener.queueNotification("node_update", pk)
+        yield listener.handleNotifies()
+        self.assertEqual([("update", "1"), ("update", "2")], calls)
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test__handleNotifies_leaves_remainder_once_time_slice_is_spent(self):
+        listener = PostgresListenerService()
+        clock = Clock()
+        calls = []
+
+        def handler(action, pk):
+            calls.append(pk)
+            clock.advance(listener.HANDLE_NOTIFY_TIME_SLICE)
+
+        listener.register("node", handler)
+        listener.register("zone", handler)
+        listener.queueNotification("node_update", "1")
+        listener.queueNotification("zone_update", "2")
+        yield listener.handleNotifies(clock=clock)
+        self.expectThat(calls, Equals(["1"]))
+        self.expectThat(
+            list(listener.notifications), Equals([("zone_update", "2")]))
+        yield listener.handleNotifies(clock=clock)
+        self.expectThat(calls, Equals(["1", "2"]))
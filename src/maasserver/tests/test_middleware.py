@@ -37,12 +37,14 @@ from maasserver.middleware import (
     DebuggingLoggerMiddleware,
     ExceptionMiddleware,
     ExternalComponentsMiddleware,
+    RequestTelemetryMiddleware,
     RPCErrorsMiddleware,
 )
 from maasserver.testing import extract_redirect
 from maasserver.testing.factory import factory
 from maasserver.testing.testcase import MAASServerTestCase
 from maasserver.utils.django_urls import reverse
+from maasserver.utils.latency import RequestTelemetry
 from maasserver.utils.orm import (
     make_deadlock_failure,
     make_serialization_failure,
@@ -57,6 +59,7 @@ from provisioningserver.utils.shell import ExternalProcessError
 from testtools.matchers import (
     Contains,
     Equals,
+    Is,
     Not,
 )
 
@@ -569,3 +572,39 @@ class CSRFHelperMiddlewareTest(MAASServerTestCase):
             factory.make_string(), 'GET', cookies=cookies)
         self.assertIsNone(middleware.process_request(request))
         self.assertIsNone(getattr(request, 'csrf_processing_done', None))
+
+
+class RequestTelemetryMiddlewareTest(MAASServerTestCase):
+    """Tests for the RequestTelemetryMiddleware."""
+
+    def patch_telemetry(self, sample_rate):
+        telemetry = RequestTelemetry(sample_rate=sample_rate)
+        self.patch(middleware_module, "request_telemetry", telemetry)
+        return telemetry
+
+    def test_records_sampled_request(self):
+        telemetry = self.patch_telemetry(1.0)
+        middleware = RequestTelemetryMiddleware()
+        request = factory.make_fake_request("/")
+        response = HttpResponse()
+        self.assertIsNone(middleware.process_request(request))
+        self.assertThat(
+            middleware.process_response(request, response), Is(response))
+        self.assertThat(
+            telemetry.getStats()["operations"]["GET unresolved"]["count"],
+            Equals(1))
+
+    def test_does_not_record_request_not_sampled(self):
+        telemetry = self.patch_telemetry(0.0)
+        middleware = RequestTelemetryMiddleware()
+        request = factory.make_fake_request("/")
+        middleware.process_request(request)
+        self.assertThat(request.telemetry_observation, Is(None))
+        middleware.process_response(request, HttpResponse())
+        self.assertThat(telemetry.getStats()["operations"], Equals({}))
+
+    def test_records_requests_to_views(self):
+        telemetry = self.patch_telemetry(1.0)
+        self.client.get(reverse("login"))
+        self.assertThat(
+            telemetry.getStats()["operations"], Contains("GET login"))
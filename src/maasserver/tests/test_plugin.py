@@ -93,6 +93,7 @@ class TestRegionServiceMaker(MAASTestCase):
         self.assertIsInstance(service, MultiService)
         expected_services = [
             "active-discovery",
+            "boot-config-cache",
             "database-tasks",
             "dns-publication-cleanup",
             "import-resources",
@@ -101,6 +102,7 @@ class TestRegionServiceMaker(MAASTestCase):
             "nonce-cleanup",
             "ntp",
             "postgres-listener",
+            "process-stats",
             "rack-controller",
             "region-controller",
             "reverse-dns",
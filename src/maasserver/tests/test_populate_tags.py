@@ -5,14 +5,18 @@
 
 __all__ = []
 
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import (
     ANY,
     call,
     create_autospec,
+    Mock,
+    sentinel,
 )
 
 from apiclient.creds import convert_tuple_to_string
 from fixtures import FakeLogger
+from lxml import etree
 from maasserver import (
     populate_tags as populate_tags_module,
     rpc as rpc_module,
@@ -29,9 +33,15 @@ from maasserver.models.user import (
 )
 from maasserver.populate_tags import (
     _do_populate_tags,
+    DetailsDocumentCache,
+    evaluate_tags,
+    get_details_documents,
+    get_tag_xpath,
+    match_tag_definitions,
     populate_tag_for_multiple_nodes,
     populate_tags,
     populate_tags_for_single_node,
+    rebuild_tags,
 )
 from maasserver.rpc.testing.fixtures import MockLiveRegionToClusterRPCFixture
 from maasserver.testing.eventloop import (
@@ -48,6 +58,7 @@ from maasserver.utils.threads import deferToDatabase
 from maastesting.matchers import (
     MockCalledOnceWith,
     MockCallsMatch,
+    MockNotCalled,
 )
 from maastesting.twisted import (
     always_fail_with,
@@ -64,12 +75,16 @@ from provisioningserver.refresh.node_info_scripts import (
 )
 from provisioningserver.rpc.cluster import EvaluateTag
 from provisioningserver.rpc.common import Client
+from provisioningserver.tags import merge_details
 from provisioningserver.utils.twisted import asynchronous
 from testtools.matchers import (
+    Equals,
     HasLength,
+    Is,
     IsInstance,
     MatchesAll,
     MatchesStructure,
+    Not,
 )
 from twisted.internet import reactor
 from twisted.internet.base import DelayedCall
@@ -377,3 +392,170 @@ class TestPopulateTagForMultipleNodes(MAASServerTestCase):
         self.assertItemsEqual(
             [node.hostname for node in nodes[0:2]],
             [node.hostname for node in Node.objects.filter(tags__name='bar')])
+
+
+class TestGetTagXPath(MAASServerTestCase):
+
+    def test_compiles_definition_once(self):
+        definition = "//lshw:%s" % factory.make_name("node")
+        xpath = get_tag_xpath(definition)
+        self.assertThat(xpath, IsInstance(etree.XPath))
+        self.assertThat(xpath.path, Equals(definition))
+        self.assertThat(get_tag_xpath(definition), Is(xpath))
+
+    def test_raises_syntax_error_for_invalid_definition(self):
+        self.assertRaises(etree.XPathSyntaxError, get_tag_xpath, "//[")
+
+
+class TestEvaluateTags(MAASServerTestCase):
+
+    def test_classifies_tags_against_one_document(self):
+        document = merge_details({"lshw": b"<foo/>", "lldp": b"<bar/>"})
+        tags = [
+            Tag(name="foo", definition="//lshw:foo"),
+            Tag(name="bar", definition="//lldp:bar"),
+            Tag(name="baz", definition="//lshw:baz"),
+            Tag(name="empty", definition=""),
+            ]
+        matching, nonmatching = evaluate_tags(tags, document)
+        self.assertSequenceEqual(tags[:2], matching)
+        self.assertSequenceEqual(tags[2:3], nonmatching)
+
+    def test_logs_invalid_definitions_and_does_not_match_them(self):
+        document = merge_details({"lshw": b"<foo/>"})
+        tags = [
+            Tag(name="foo", definition="//lshw:foo"),
+            Tag(name="bad", definition="//["),
+            ]
+        with FakeLogger("maasserver") as log:
+            matching, nonmatching = evaluate_tags(tags, document)
+        self.assertSequenceEqual(tags[:1], matching)
+        self.assertSequenceEqual(tags[1:], nonmatching)
+        self.assertIn("Invalid expression '//['", log.output)
+
+
+class TestDetailsDocumentCache(MAASServerTestCase):
+
+    def test_returns_document_with_the_same_key(self):
+        cache = DetailsDocumentCache()
+        cache.put("abc", (1, 2), sentinel.document)
+        self.assertThat(cache.get("abc", (1, 2)), Is(sentinel.document))
+
+    def test_returns_None_for_other_keys(self):
+        cache = DetailsDocumentCache()
+        cache.put("abc", (1, 2), sentinel.document)
+        self.assertThat(cache.get("abc", (1, 3)), Is(None))
+        self.assertThat(cache.get("def", (1, 2)), Is(None))
+
+    def test_discards_least_recently_used_documents(self):
+        cache = DetailsDocumentCache(size=2)
+        cache.put("abc", (), sentinel.abc)
+        cache.put("def", (), sentinel.def_)
+        cache.get("abc", ())
+        cache.put("ghi", (), sentinel.ghi)
+        self.assertThat(cache.get("abc", ()), Is(sentinel.abc))
+        self.assertThat(cache.get("def", ()), Is(None))
+        self.assertThat(cache.get("ghi", ()), Is(sentinel.ghi))
+
+    def test_clear_discards_everything(self):
+        cache = DetailsDocumentCache()
+        cache.put("abc", (), sentinel.document)
+        cache.clear()
+        self.assertThat(cache.get("abc", ()), Is(None))
+
+
+class TestGetDetailsDocuments(MAASServerTestCase):
+
+    def setUp(self):
+        super(TestGetDetailsDocuments, self).setUp()
+        self.patch(
+            populate_tags_module, "details_cache", DetailsDocumentCache())
+        self.get_probed_details = self.patch(
+            populate_tags_module, "get_probed_details",
+            create_autospec(
+                populate_tags_module.get_probed_details,
+                side_effect=populate_tags_module.get_probed_details))
+
+    def test_merges_details_of_each_node(self):
+        nodes = [factory.make_Node() for _ in range(2)]
+        make_lshw_result(nodes[0], b"<foo/>")
+        documents = get_details_documents(nodes)
+        self.assertItemsEqual(nodes, documents)
+        self.assertSequenceEqual(
+            [True, False], [
+                bool(documents[node].xpath("//lshw:foo", namespaces={
+                    "lshw": "lshw"}))
+                for node in nodes
+            ])
+
+    def test_reuses_documents_while_details_are_unchanged(self):
+        node = factory.make_Node()
+        make_lshw_result(node, b"<foo/>")
+        document = get_details_documents([node])[node]
+        self.get_probed_details.reset_mock()
+        self.assertThat(get_details_documents([node])[node], Is(document))
+        self.assertThat(self.get_probed_details, MockNotCalled())
+
+    def test_merges_details_again_when_they_change(self):
+        node = factory.make_Node()
+        make_lshw_result(node, b"<foo/>")
+        document = get_details_documents([node])[node]
+        make_lldp_result(node, b"<bar/>")
+        self.get_probed_details.reset_mock()
+        self.assertThat(get_details_documents([node])[node], Not(Is(document)))
+        self.assertThat(self.get_probed_details, MockCalledOnceWith([node]))
+
+
+class TestMatchTagDefinitions(MAASServerTestCase):
+
+    def test_returns_indexes_of_matching_definitions(self):
+        details = {"lshw": b"<foo/>", "lldp": b"<bar/>"}
+        definitions = ["//lshw:bar", "//lshw:foo", "//[", "//lldp:bar"]
+        with FakeLogger("maas"):
+            self.assertThat(
+                match_tag_definitions(definitions, details),
+                Equals([1, 3]))
+
+
+class TestRebuildTags(MAASServerTestCase):
+
+    def make_nodes_and_tags(self):
+        nodes = [factory.make_Node() for _ in range(4)]
+        make_lshw_result(nodes[0], b"<foo/>")
+        make_lshw_result(nodes[1], b"<foo/>")
+        make_lldp_result(nodes[1], b"<bar/>")
+        make_lldp_result(nodes[2], b"<bar/>")
+        tags = [
+            factory.make_Tag("foo", "//lshw:foo", populate=False),
+            factory.make_Tag("bar", "//lldp:bar", populate=False),
+            ]
+        # Nodes that no longer match lose their tags.
+        nodes[3].tags.add(*tags)
+        return nodes, tags
+
+    def assertTagsRebuilt(self, nodes, tags):
+        self.assertItemsEqual(
+            [nodes[0], nodes[1]], tags[0].node_set.all())
+        self.assertItemsEqual(
+            [nodes[1], nodes[2]], tags[1].node_set.all())
+
+    def test_rebuilds_tags_in_this_process(self):
+        nodes, tags = self.make_nodes_and_tags()
+        rebuild_tags(tags, Node.objects.all(), batch_size=3)
+        self.assertTagsRebuilt(nodes, tags)
+
+    def test_rebuilds_tags_with_workers(self):
+        # Threads stand in for processes, so nothing is forked in tests.
+        executor = self.patch(
+            populate_tags_module, "ProcessPoolExecutor",
+            Mock(side_effect=ThreadPoolExecutor))
+        nodes, tags = self.make_nodes_and_tags()
+        rebuild_tags(tags, Node.objects.all(), workers=2, batch_size=3)
+        self.assertTagsRebuilt(nodes, tags)
+        self.assertThat(executor, MockCalledOnceWith(2))
+
+    def test_ignores_tags_without_definition(self):
+        nodes, tags = self.make_nodes_and_tags()
+        rebuild_tags(
+            tags + [Tag(name="empty", definition="")], Node.objects.all())
+        self.assertTagsRebuilt(nodes, tags)
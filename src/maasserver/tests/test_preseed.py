@@ -92,6 +92,7 @@ from metadataserver.models import NodeKey
 from provisioningserver.drivers.osystem.ubuntu import UbuntuOS
 from provisioningserver.rpc.exceptions import NoConnectionsAvailable
 from provisioningserver.utils.enum import map_enum
+from provisioningserver.utils.templates import templates
 from testtools.matchers import (
     AllMatch,
     Contains,
@@ -439,6 +440,32 @@ class TestLoadPreseedTemplate(MAASServerTestCase):
         self.assertRaises(
             TemplateNotFoundError, template.substitute)
 
+    def test_load_preseed_template_parses_templates_once(self):
+        prefix = factory.make_string()
+        master_template_name = factory.make_string()
+        preseed_content = '{{inherit "%s"}}' % master_template_name
+        self.create_template(self.location, prefix, preseed_content)
+        master_content = self.create_template(
+            self.location, master_template_name)
+        node = factory.make_Node()
+        load_preseed_template(node, prefix).substitute()
+        loads = templates.loads
+        template = load_preseed_template(node, prefix)
+        self.assertEqual(master_content, template.substitute())
+        self.assertEqual(loads, templates.loads)
+
+    def test_load_preseed_template_reloads_changed_templates(self):
+        prefix = factory.make_string()
+        self.create_template(self.location, prefix)
+        node = factory.make_Node()
+        load_preseed_template(node, prefix)
+        content = self.create_template(self.location, prefix)
+        path = os.path.join(self.location, prefix)
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        template = load_preseed_template(node, prefix)
+        self.assertEqual(content, template.substitute())
+
 
 class TestPreseedContext(MAASServerTestCase):
     """Tests for `get_preseed_context`."""
@@ -252,6 +252,17 @@ class TestRackControllerService(MAASTransactionServerTestCase):
         self.assertEquals(set([rack_id]), service.needsDHCPUpdate)
         self.assertThat(mock_startProcessing, MockCalledOnceWith())
 
+    def test_coreHandler_watch_and_unwatch_forget_sent_configuration(self):
+        processId = random.randint(0, 100)
+        rack_id = random.randint(0, 100)
+        service = RackControllerService(Mock(), sentinel.advertiser)
+        service.processId = processId
+        self.patch(service, "startProcessing")
+        forget = self.patch(service.dhcpConfigCache, "forget")
+        service.coreHandler("sys_core_%d" % processId, "watch_%d" % rack_id)
+        service.coreHandler("sys_core_%d" % processId, "unwatch_%d" % rack_id)
+        self.assertThat(forget, MockCallsMatch(call(rack_id), call(rack_id)))
+
     def test_coreHandler_raises_ValueError_for_unknown_action(self):
         processId = random.randint(0, 100)
         rack_id = random.randint(0, 100)
@@ -274,6 +285,25 @@ class TestRackControllerService(MAASTransactionServerTestCase):
         self.assertEquals(set([rack_id]), service.needsDHCPUpdate)
         self.assertThat(mock_startProcessing, MockCalledOnceWith())
 
+    def test_dhcpHandler_invalidates_cached_configuration_for_vlan(self):
+        rack_id = random.randint(0, 100)
+        vlan_id = random.randint(0, 100)
+        service = RackControllerService(Mock(), sentinel.advertiser)
+        service.watching = set([rack_id])
+        self.patch(service, "startProcessing")
+        invalidate = self.patch(service.dhcpConfigCache, "invalidate")
+        service.dhcpHandler("sys_dhcp_%d" % rack_id, "%d" % vlan_id)
+        self.assertThat(invalidate, MockCalledOnceWith(rack_id, {vlan_id}))
+
+    def test_dhcpHandler_invalidates_all_cached_configuration(self):
+        rack_id = random.randint(0, 100)
+        service = RackControllerService(Mock(), sentinel.advertiser)
+        service.watching = set([rack_id])
+        self.patch(service, "startProcessing")
+        invalidate = self.patch(service.dhcpConfigCache, "invalidate")
+        service.dhcpHandler("sys_dhcp_%d" % rack_id, "")
+        self.assertThat(invalidate, MockCalledOnceWith(rack_id))
+
     def test_dhcpHandler_doesnt_add_to_needsDHCPUpdate(self):
         rack_id = random.randint(0, 100)
         listener = Mock()
@@ -374,4 +404,5 @@ class TestRackControllerService(MAASTransactionServerTestCase):
         mock_configure_dhcp.return_value = succeed(None)
         yield service.processDHCP(rack.id)
         self.assertThat(
-            mock_configure_dhcp, MockCalledOnceWith(rack))
+            mock_configure_dhcp, MockCalledOnceWith(
+                rack, cache=service.dhcpConfigCache))
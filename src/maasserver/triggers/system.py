@@ -265,23 +265,28 @@ CORE_REGIONRACKRPCONNECTION_DELETE = dedent("""\
 # Triggered when the VLAN is modified. When DHCP is turned off/on it will alert
 # the primary/secondary rack controller to update. If the primary rack or
 # secondary rack is changed it will alert the previous and new rack controller.
+# The payload is the ID of the VLAN whose configuration has changed.
 DHCP_VLAN_UPDATE = dedent("""\
     CREATE OR REPLACE FUNCTION sys_dhcp_vlan_update()
     RETURNS trigger as $$
     DECLARE
       relay_vlan maasserver_vlan;
+      payload text;
     BEGIN
+      payload := CAST(NEW.id AS text);
       -- DHCP was turned off.
       IF OLD.dhcp_on AND NOT NEW.dhcp_on THEN
-        PERFORM pg_notify(CONCAT('sys_dhcp_', OLD.primary_rack_id), '');
+        PERFORM pg_notify(CONCAT('sys_dhcp_', OLD.primary_rack_id), payload);
         IF OLD.secondary_rack_id IS NOT NULL THEN
-          PERFORM pg_notify(CONCAT('sys_dhcp_', OLD.secondary_rack_id), '');
+          PERFORM pg_notify(
+            CONCAT('sys_dhcp_', OLD.secondary_rack_id), payload);
         END IF;
       -- DHCP was turned on.
       ELSIF NOT OLD.dhcp_on AND NEW.dhcp_on THEN
-        PERFORM pg_notify(CONCAT('sys_dhcp_', NEW.primary_rack_id), '');
+        PERFORM pg_notify(CONCAT('sys_dhcp_', NEW.primary_rack_id), payload);
         IF NEW.secondary_rack_id IS NOT NULL THEN
-          PERFORM pg_notify(CONCAT('sys_dhcp_', NEW.secondary_rack_id), '');
+          PERFORM pg_notify(
+            CONCAT('sys_dhcp_', NEW.secondary_rack_id), payload);
         END IF;
       -- DHCP state was not changed but the rack controllers might have been.
       ELSIF NEW.dhcp_on AND (
@@ -293,16 +298,18 @@ DHCP_VLAN_UPDATE = dedent("""\
          OLD.secondary_rack_id != NEW.secondary_rack_id) THEN
         -- Send the message to the old primary if no longer the primary.
         IF OLD.primary_rack_id != NEW.primary_rack_id THEN
-          PERFORM pg_notify(CONCAT('sys_dhcp_', OLD.primary_rack_id), '');
+          PERFORM pg_notify(CONCAT('sys_dhcp_', OLD.primary_rack_id), payload);
         END IF;
         -- Always send the message to the primary as it has to be set.
-        PERFORM pg_notify(CONCAT('sys_dhcp_', NEW.primary_rack_id), '');
+        PERFORM pg_notify(CONCAT('sys_dhcp_', NEW.primary_rack_id), payload);
         -- Send message to both old and new secondary rack controller if set.
         IF OLD.secondary_rack_id IS NOT NULL THEN
-          PERFORM pg_notify(CONCAT('sys_dhcp_', OLD.secondary_rack_id), '');
+          PERFORM pg_notify(
+            CONCAT('sys_dhcp_', OLD.secondary_rack_id), payload);
         END IF;
         IF NEW.secondary_rack_id IS NOT NULL THEN
-          PERFORM pg_notify(CONCAT('sys_dhcp_', NEW.secondary_rack_id), '');
+          PERFORM pg_notify(
+            CONCAT('sys_dhcp_', NEW.secondary_rack_id), payload);
         END IF;
       END IF;
 
@@ -313,10 +320,10 @@ DHCP_VLAN_UPDATE = dedent("""\
         WHERE maasserver_vlan.id = NEW.relay_vlan_id;
         IF relay_vlan.primary_rack_id IS NOT NULL THEN
           PERFORM pg_notify(
-            CONCAT('sys_dhcp_', relay_vlan.primary_rack_id), '');
+            CONCAT('sys_dhcp_', relay_vlan.primary_rack_id), payload);
           IF relay_vlan.secondary_rack_id IS NOT NULL THEN
             PERFORM pg_notify(
-              CONCAT('sys_dhcp_', relay_vlan.secondary_rack_id), '');
+              CONCAT('sys_dhcp_', relay_vlan.secondary_rack_id), payload);
           END IF;
         END IF;
       -- Relay VLAN was unset when it was previously set.
@@ -326,10 +333,10 @@ DHCP_VLAN_UPDATE = dedent("""\
         WHERE maasserver_vlan.id = OLD.relay_vlan_id;
         IF relay_vlan.primary_rack_id IS NOT NULL THEN
           PERFORM pg_notify(
-            CONCAT('sys_dhcp_', relay_vlan.primary_rack_id), '');
+            CONCAT('sys_dhcp_', relay_vlan.primary_rack_id), payload);
           IF relay_vlan.secondary_rack_id IS NOT NULL THEN
             PERFORM pg_notify(
-              CONCAT('sys_dhcp_', relay_vlan.secondary_rack_id), '');
+              CONCAT('sys_dhcp_', relay_vlan.secondary_rack_id), payload);
           END IF;
         END IF;
       -- Relay VLAN has changed on the VLAN.
@@ -340,10 +347,10 @@ DHCP_VLAN_UPDATE = dedent("""\
         WHERE maasserver_vlan.id = OLD.relay_vlan_id;
         IF relay_vlan.primary_rack_id IS NOT NULL THEN
           PERFORM pg_notify(
-            CONCAT('sys_dhcp_', relay_vlan.primary_rack_id), '');
+            CONCAT('sys_dhcp_', relay_vlan.primary_rack_id), payload);
           IF relay_vlan.secondary_rack_id IS NOT NULL THEN
             PERFORM pg_notify(
-              CONCAT('sys_dhcp_', relay_vlan.secondary_rack_id), '');
+              CONCAT('sys_dhcp_', relay_vlan.secondary_rack_id), payload);
           END IF;
         END IF;
         -- Alert new VLAN if required.
@@ -352,10 +359,10 @@ DHCP_VLAN_UPDATE = dedent("""\
         WHERE maasserver_vlan.id = NEW.relay_vlan_id;
         IF relay_vlan.primary_rack_id IS NOT NULL THEN
           PERFORM pg_notify(
-            CONCAT('sys_dhcp_', relay_vlan.primary_rack_id), '');
+            CONCAT('sys_dhcp_', relay_vlan.primary_rack_id), payload);
           IF relay_vlan.secondary_rack_id IS NOT NULL THEN
             PERFORM pg_notify(
-              CONCAT('sys_dhcp_', relay_vlan.secondary_rack_id), '');
+              CONCAT('sys_dhcp_', relay_vlan.secondary_rack_id), payload);
           END IF;
         END IF;
       END IF;
@@ -364,17 +371,21 @@ DHCP_VLAN_UPDATE = dedent("""\
     $$ LANGUAGE plpgsql;
     """)
 
-# Helper that alerts the primary and secondary rack controller for a VLAN.
+# Helper that alerts the primary and secondary rack controller for a VLAN. The
+# payload is the ID of the VLAN so that only its configuration is rebuilt.
 DHCP_ALERT = dedent("""\
     CREATE OR REPLACE FUNCTION sys_dhcp_alert(vlan maasserver_vlan)
     RETURNS void AS $$
     DECLARE
       relay_vlan maasserver_vlan;
+      payload text;
     BEGIN
+      payload := CAST(vlan.id AS text);
       IF vlan.dhcp_on THEN
-        PERFORM pg_notify(CONCAT('sys_dhcp_', vlan.primary_rack_id), '');
+        PERFORM pg_notify(CONCAT('sys_dhcp_', vlan.primary_rack_id), payload);
         IF vlan.secondary_rack_id IS NOT NULL THEN
-          PERFORM pg_notify(CONCAT('sys_dhcp_', vlan.secondary_rack_id), '');
+          PERFORM pg_notify(
+            CONCAT('sys_dhcp_', vlan.secondary_rack_id), payload);
         END IF;
       END IF;
       IF vlan.relay_vlan_id IS NOT NULL THEN
@@ -383,10 +394,10 @@ DHCP_ALERT = dedent("""\
         WHERE maasserver_vlan.id = vlan.relay_vlan_id;
         IF relay_vlan.dhcp_on THEN
           PERFORM pg_notify(CONCAT(
-            'sys_dhcp_', relay_vlan.primary_rack_id), '');
+            'sys_dhcp_', relay_vlan.primary_rack_id), payload);
           IF relay_vlan.secondary_rack_id IS NOT NULL THEN
             PERFORM pg_notify(CONCAT(
-              'sys_dhcp_', relay_vlan.secondary_rack_id), '');
+              'sys_dhcp_', relay_vlan.secondary_rack_id), payload);
           END IF;
         END IF;
       END IF;
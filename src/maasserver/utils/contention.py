@@ -0,0 +1,169 @@
+# Copyright 2017 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Telemetry for transactions that are retried because of contention.
+
+Each sequence of attempts made by the retry machinery in
+`maasserver.utils.orm` is recorded against a callsite: the function wrapped
+by `retry_on_retryable_failure`, or the view that answered a web request.
+The counts are kept in memory for each process; see `RetryTelemetry`.
+"""
+
+__all__ = [
+    "merge_stats",
+    "retry_telemetry",
+    "RetryRecord",
+    "RetryTelemetry",
+]
+
+from collections import (
+    Counter,
+    defaultdict,
+    deque,
+)
+from itertools import chain
+import threading
+from time import (
+    monotonic,
+    time,
+)
+
+
+class RetryRecord:
+    """The attempts made during one sequence of attempts.
+
+    :ivar callsite: The name of the code that made the attempts. This can be
+        set at any time before the record is finished.
+    :ivar failed: Set this if the final attempt failed because of a conflict,
+        or because too many retries were requested.
+    """
+
+    def __init__(self, callsite, clock):
+        super(RetryRecord, self).__init__()
+        self.callsite = callsite
+        self.clock = clock
+        self.started = clock()
+        self.attempted = self.started
+        self.attempts = 0
+        self.failed = False
+        self.conflicts = []
+
+    def attempt(self):
+        """Note that an attempt is starting."""
+        self.attempted = self.clock()
+        self.attempts += 1
+
+    def conflicted(self, kind, sample=None):
+        """Note that an attempt failed because of a conflict.
+
+        :param kind: The kind of conflict, e.g. "deadlock".
+        :param sample: An optional dict describing the conflict.
+        """
+        self.conflicts.append((kind, sample))
+
+    def getTimeLost(self):
+        """Return the time lost to failed attempts and waiting between them.
+
+        If the final attempt failed because of a conflict, it's lost too.
+        """
+        if self.failed:
+            return self.clock() - self.started
+        else:
+            return self.attempted - self.started
+
+
+class RetryTelemetry:
+    """Counts of attempts, retries, and failures for each callsite.
+
+    Records can be started and finished in any thread.
+
+    :ivar sample_rate: The fraction of conflicts for which the conflicting
+        relation and row are sampled from the database error; see
+        `maasserver.utils.orm.describe_conflict`. Zero disables sampling.
+    """
+
+    def __init__(self, sample_rate=1.0, samples=100, clock=monotonic):
+        super(RetryTelemetry, self).__init__()
+        self.sample_rate = sample_rate
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.callsites = defaultdict(Counter)
+        self.relations = Counter()
+        self.samples = deque(maxlen=samples)
+
+    def start(self, callsite=None):
+        """Return a new `RetryRecord`."""
+        return RetryRecord(callsite, self.clock)
+
+    def finish(self, record):
+        """Add `record` to the counts."""
+        callsite = "unknown" if record.callsite is None else record.callsite
+        time_lost = record.getTimeLost()
+        with self.lock:
+            counts = self.callsites[callsite]
+            counts["calls"] += 1
+            counts["attempts"] += record.attempts
+            counts["retries"] += max(0, record.attempts - 1)
+            counts["failures"] += 1 if record.failed else 0
+            counts["time_lost"] += time_lost
+            for kind, sample in record.conflicts:
+                counts[kind] += 1
+                if sample is not None:
+                    self.relations[sample["relation"]] += 1
+                    self.samples.append(dict(
+                        sample, callsite=callsite, kind=kind, time=time()))
+
+    def getStats(self):
+        """Return a JSON-compatible dict of the counts.
+
+        This has keys "callsites", mapping each callsite to its counts,
+        "relations", mapping each sampled relation to the number of conflicts
+        on it, and "samples", the most recently sampled conflicts.
+        """
+        with self.lock:
+            return {
+                "callsites": {
+                    callsite: dict(counts)
+                    for callsite, counts in self.callsites.items()
+                },
+                "relations": {
+                    # JSON does not allow null keys.
+                    ("unknown" if relation is None else relation): count
+                    for relation, count in self.relations.items()
+                },
+                "samples": list(self.samples),
+            }
+
+    def reset(self):
+        """Discard all counts."""
+        with self.lock:
+            self.callsites.clear()
+            self.relations.clear()
+            self.samples.clear()
+
+
+def merge_stats(stats, samples=100):
+    """Merge `RetryTelemetry.getStats` results, from many processes perhaps.
+
+    :param samples: The number of the most recent samples to keep.
+    """
+    callsites = defaultdict(Counter)
+    relations = Counter()
+    for stat in stats:
+        for callsite, counts in stat["callsites"].items():
+            callsites[callsite].update(counts)
+        relations.update(stat["relations"])
+    merged = sorted(
+        chain.from_iterable(stat["samples"] for stat in stats),
+        key=lambda sample: sample["time"])
+    return {
+        "callsites": {
+            callsite: dict(counts) for callsite, counts in callsites.items()
+        },
+        "relations": dict(relations),
+        "samples": merged[-samples:] if samples > 0 else [],
+    }
+
+
+# The global retry telemetry.
+retry_telemetry = RetryTelemetry()
@@ -0,0 +1,267 @@
+# Copyright 2017 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Latency and database query telemetry for requests and websocket calls.
+
+A sample of web and API requests (see `RequestTelemetryMiddleware`) and of
+websocket handler calls (see `maasserver.websockets.base.Handler`) is
+observed. For each operation -- a view or API operation, or a websocket
+handler method -- a histogram of latency is kept, with the number of database
+queries and the time they took. Sampled requests that are slow have the SQL
+that they ran captured.
+
+Sampling is configured in regiond.conf; see `RegionConfiguration`. When the
+sample rate is zero, as it is by default, the cost to each request is only a
+comparison.
+"""
+
+__all__ = [
+    "get_operation_name",
+    "get_quantile",
+    "LatencyHistogram",
+    "merge_stats",
+    "request_telemetry",
+    "RequestTelemetry",
+]
+
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from random import random
+import threading
+from time import (
+    monotonic,
+    time,
+)
+
+from django.db import connection
+
+
+# The upper bounds of the histogram buckets, in seconds. A final bucket
+# holds everything slower than the last of these.
+BUCKET_BOUNDS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# The most queries to capture from a single slow request.
+SLOW_QUERIES_MAX = 100
+
+
+class LatencyHistogram:
+    """A histogram of latency, and totals of database queries."""
+
+    def __init__(self):
+        super(LatencyHistogram, self).__init__()
+        self.buckets = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.queries = 0
+        self.query_time = 0.0
+
+    def add(self, elapsed, queries=0, query_time=0.0):
+        self.buckets[bisect_left(BUCKET_BOUNDS, elapsed)] += 1
+        self.count += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+        self.queries += queries
+        self.query_time += query_time
+
+    def getStats(self):
+        return {
+            "buckets": list(self.buckets),
+            "count": self.count,
+            "total": self.total,
+            "max": self.max,
+            "queries": self.queries,
+            "query_time": self.query_time,
+        }
+
+
+class Observation:
+    """An observation of a request or call, in progress.
+
+    While observing, the database connection for this thread records each
+    query that it runs, as it does when Django's ``DEBUG`` is set. The log of
+    queries is cleared at the start and at the end, as Django does for each
+    request, so that it covers only this observation and is not left to grow.
+    """
+
+    def __init__(self, clock):
+        super(Observation, self).__init__()
+        self.clock = clock
+        self.force_debug_cursor = connection.force_debug_cursor
+        connection.force_debug_cursor = True
+        connection.queries_log.clear()
+        self.started = clock()
+
+    def stop(self):
+        """Stop observing.
+
+        :return: A tuple of the time elapsed and a list of the queries run,
+            each a dict with "sql" and "time" keys.
+        """
+        elapsed = self.clock() - self.started
+        queries = list(connection.queries_log)
+        connection.queries_log.clear()
+        connection.force_debug_cursor = self.force_debug_cursor
+        return elapsed, queries
+
+
+class RequestTelemetry:
+    """Latency histograms, by operation, for sampled requests and calls.
+
+    Observations can be made in any thread, but must start and finish in the
+    same thread.
+
+    :ivar sample_rate: The fraction of requests and calls to observe.
+    :ivar slow_threshold: The time, in seconds, at or above which an observed
+        request or call has its SQL captured.
+    """
+
+    def __init__(
+            self, sample_rate=0.0, slow_threshold=2.0, slow=20,
+            clock=monotonic):
+        super(RequestTelemetry, self).__init__()
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.operations = {}
+        self.slow = deque(maxlen=slow)
+
+    def start(self):
+        """Start an observation if this request or call is sampled.
+
+        :return: An `Observation`, or `None` if not sampled.
+        """
+        if self.sample_rate > 0 and random() < self.sample_rate:
+            return Observation(self.clock)
+        else:
+            return None
+
+    def finish(self, observation, operation):
+        """Finish `observation`, recording it against `operation`."""
+        elapsed, queries = observation.stop()
+        query_time = sum(float(query["time"]) for query in queries)
+        with self.lock:
+            histogram = self.operations.get(operation)
+            if histogram is None:
+                histogram = self.operations[operation] = LatencyHistogram()
+            histogram.add(elapsed, len(queries), query_time)
+            if elapsed >= self.slow_threshold:
+                self.slow.append({
+                    "operation": operation,
+                    "time": time(),
+                    "elapsed": elapsed,
+                    "query_count": len(queries),
+                    "query_time": query_time,
+                    "queries": queries[:SLOW_QUERIES_MAX],
+                })
+
+    @contextmanager
+    def observe(self, operation):
+        """Observe the enclosed block, if sampled, as `operation`."""
+        observation = self.start()
+        if observation is None:
+            yield
+        else:
+            try:
+                yield
+            finally:
+                self.finish(observation, operation)
+
+    def observed(self, operation, func):
+        """Return a function that calls `func` within `observe`."""
+        @wraps(func)
+        def call_observed(*args, **kwargs):
+            with self.observe(operation):
+                return func(*args, **kwargs)
+        return call_observed
+
+    def getStats(self):
+        """Return a JSON-compatible dict of the histograms.
+
+        This has keys "bounds", the upper bounds of the buckets in each
+        histogram, "operations", mapping each operation to its histogram, and
+        "slow", the most recent slow observations.
+        """
+        with self.lock:
+            return {
+                "bounds": list(BUCKET_BOUNDS),
+                "operations": {
+                    operation: histogram.getStats()
+                    for operation, histogram in self.operations.items()
+                },
+                "slow": list(self.slow),
+            }
+
+    def reset(self):
+        """Discard all histograms and slow observations."""
+        with self.lock:
+            self.operations.clear()
+            self.slow.clear()
+
+
+def get_operation_name(request):
+    """Return the name of the operation that answered `request`.
+
+    This is the method and the name of the view, and the API operation, if
+    any; e.g. "POST machines_handler op=allocate".
+    """
+    match = getattr(request, "resolver_match", None)
+    view_name = "unresolved" if match is None else match.view_name
+    op = request.GET.get("op")
+    if op is None:
+        return "%s %s" % (request.method, view_name)
+    else:
+        return "%s %s op=%s" % (request.method, view_name, op)
+
+
+def get_quantile(bounds, buckets, quantile):
+    """Estimate a quantile from a histogram's buckets.
+
+    :return: The upper bound of the bucket holding the quantile, or `None`
+        if it's in the final bucket, which has no upper bound.
+    """
+    target = quantile * sum(buckets)
+    seen = 0
+    for bound, count in zip(bounds, buckets):
+        seen += count
+        if seen >= target:
+            return bound
+    return None
+
+
+def merge_stats(stats, slow=20):
+    """Merge `RequestTelemetry.getStats` results, from many processes.
+
+    :param slow: The number of the most recent slow observations to keep.
+    """
+    operations = {}
+    for stat in stats:
+        for operation, histogram in stat["operations"].items():
+            merged = operations.get(operation)
+            if merged is None:
+                operations[operation] = dict(
+                    histogram, buckets=list(histogram["buckets"]))
+            else:
+                merged["buckets"] = [
+                    mine + theirs for mine, theirs in zip(
+                        merged["buckets"], histogram["buckets"])
+                ]
+                for key in "count", "total", "queries", "query_time":
+                    merged[key] += histogram[key]
+                merged["max"] = max(merged["max"], histogram["max"])
+    observations = sorted(
+        (observation for stat in stats for observation in stat["slow"]),
+        key=lambda observation: observation["time"])
+    return {
+        "bounds": list(BUCKET_BOUNDS),
+        "operations": operations,
+        "slow": observations[-slow:] if slow > 0 else [],
+    }
+
+
+# The global request telemetry.
+request_telemetry = RequestTelemetry()
@@ -0,0 +1,252 @@
+# Copyright 2017 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""An adaptive limit on concurrent work that holds database connections."""
+
+__all__ = [
+    "AdaptiveLimiter",
+    "LimiterGate",
+]
+
+from collections import (
+    Counter,
+    deque,
+)
+from operator import attrgetter
+import threading
+
+from provisioningserver.utils.twisted import callOut
+from twisted.internet import reactor
+from twisted.internet.defer import (
+    Deferred,
+    maybeDeferred,
+)
+
+
+class AdaptiveLimiter:
+    """Limit concurrent work, adjusting the limit to how the work fares.
+
+    This is additive-increase/multiplicative-decrease control, as TCP uses
+    for its congestion window. Work is observed in windows: a window ends
+    once as many pieces of work have completed as the limit allowed when it
+    began. At the end of a window the limit is:
+
+    - multiplied by `decrease` if a transaction failed with a conflict
+      during the window (see `conflicted`), or if the work took more than
+      `tolerance` times as long as the baseline, which is the quickest that
+      work has recently been done;
+
+    - otherwise increased by one if work was kept waiting during the
+      window.
+
+    The limit always stays between `minimum` and `maximum`.
+
+    Work is admitted through gates, one for each class of caller, in order
+    of their priority; see `gate`. Everything except `conflicted` must be
+    called in the reactor thread.
+
+    Work admitted through a gate with a fixed ceiling is counted by that
+    gate alone. It never takes room from the adaptive limit, nor counts
+    towards the windows by which the limit is adjusted, so work at other
+    gates is always admitted up to the limit however busy it is.
+    """
+
+    def __init__(
+            self, initial, minimum, maximum, *, tolerance=2.0,
+            decrease=0.75, drift=0.05, clock=reactor):
+        """
+        :param drift: The fraction of the difference by which the baseline
+            moves towards a slower window in which no work waited. This lets
+            it recover when work becomes slower for good, for example as the
+            database grows, but not merely because the limit has grown.
+        """
+        super(AdaptiveLimiter, self).__init__()
+        assert 1 <= minimum <= initial <= maximum
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.tolerance = tolerance
+        self.decrease = decrease
+        self.drift = drift
+        self.clock = clock
+        self.gates = []
+        self.in_use = 0
+        self.baseline = None
+        self.latency = None
+        # When each piece of work in use was admitted, oldest first. Work is
+        # released without saying which piece it was, so each release is
+        # matched with the oldest admission. Summed over a window this is
+        # close to the time that work actually took.
+        self.admitted = deque()
+        self.conflicts = 0
+        self.conflicts_lock = threading.Lock()
+        self.startWindow()
+
+    def gate(self, name, priority, *, ceiling=None):
+        """Return a new gate for one class of caller.
+
+        :param priority: Waiting work is admitted from gates with lower
+            priorities first.
+        :param ceiling: The most work that may be admitted through this
+            gate at once, counted apart from the adaptive limit. By default
+            work shares the adaptive limit with other gates; a gate for
+            callers that must not wait behind it can have a fixed ceiling
+            instead.
+        """
+        gate = LimiterGate(self, name, priority, ceiling)
+        self.gates.append(gate)
+        self.gates.sort(key=attrgetter("priority"))
+        return gate
+
+    def conflicted(self):
+        """Note that a transaction failed because of a conflict.
+
+        This can be called from any thread.
+        """
+        with self.conflicts_lock:
+            self.conflicts += 1
+
+    def acquire(self, gate):
+        """Return a `Deferred` that fires with `gate` once admitted."""
+        d = Deferred(canceller=gate.cancel)
+        gate.waiting.append((d, self.clock.seconds()))
+        self.admit()
+        return d
+
+    def release(self):
+        """Note that a piece of work is done, and admit others."""
+        assert self.in_use > 0, "Limiter released too many times."
+        self.in_use -= 1
+        self.completed += 1
+        self.window_time += self.clock.seconds() - self.admitted.popleft()
+        if self.completed >= self.window:
+            self.adjust()
+        self.admit()
+
+    def admit(self):
+        """Admit waiting work, in order of priority, while there is room."""
+        for gate in self.gates:
+            while len(gate.waiting) != 0 and gate.hasRoom():
+                d, queued = gate.waiting.popleft()
+                now = self.clock.seconds()
+                gate.stats["acquired"] += 1
+                gate.stats["wait_time"] += now - queued
+                gate.max_wait = max(gate.max_wait, now - queued)
+                if gate.ceiling is None:
+                    self.admitted.append(now)
+                    self.in_use += 1
+                else:
+                    gate.in_use += 1
+                d.callback(gate)
+            if len(gate.waiting) != 0 and gate.ceiling is None:
+                self.saturated = True
+
+    def adjust(self):
+        """Adjust the limit at the end of a window, and start another."""
+        latency = self.window_time / self.completed
+        with self.conflicts_lock:
+            conflicts = self.conflicts - self.window_conflicts
+        if self.baseline is None or latency < self.baseline:
+            self.baseline = latency
+        elif not self.saturated:
+            self.baseline += (latency - self.baseline) * self.drift
+        if conflicts != 0 or latency > self.baseline * self.tolerance:
+            self.limit = max(self.minimum, self.limit * self.decrease)
+        elif self.saturated:
+            self.limit = min(self.maximum, self.limit + 1)
+        self.latency = latency
+        self.startWindow()
+
+    def startWindow(self):
+        self.window = max(1, int(self.limit))
+        self.completed = 0
+        self.saturated = False
+        self.window_time = 0.0
+        with self.conflicts_lock:
+            self.window_conflicts = self.conflicts
+
+    def getStats(self):
+        """Return a dict describing the limiter and each of its gates.
+
+        Times are in seconds. `latency` is the mean time that work took in
+        the last complete window.
+        """
+        return {
+            "limit": int(self.limit),
+            "in_use": self.in_use,
+            "latency": self.latency,
+            "baseline": self.baseline,
+            "conflicts": self.conflicts,
+            "gates": {gate.name: gate.getStats() for gate in self.gates},
+        }
+
+
+class LimiterGate:
+    """Admission to an `AdaptiveLimiter` for one class of caller.
+
+    This can be used in place of a `DeferredSemaphore`.
+    """
+
+    def __init__(self, limiter, name, priority, ceiling=None):
+        super(LimiterGate, self).__init__()
+        self.limiter = limiter
+        self.name = name
+        self.priority = priority
+        self.ceiling = ceiling
+        self.in_use = 0
+        self.waiting = deque()
+        self.stats = Counter()
+        self.max_wait = 0.0
+
+    def hasRoom(self):
+        """Return whether this gate can admit more work now."""
+        if self.ceiling is None:
+            return self.limiter.in_use < int(self.limiter.limit)
+        else:
+            return self.in_use < self.ceiling
+
+    def acquire(self):
+        """Return a `Deferred` that fires with this gate once admitted."""
+        return self.limiter.acquire(self)
+
+    def release(self):
+        """Release work admitted through this gate."""
+        if self.ceiling is None:
+            self.limiter.release()
+        else:
+            assert self.in_use > 0, "Gate released too many times."
+            self.in_use -= 1
+            self.limiter.admit()
+
+    def cancel(self, d):
+        """Stop `d` from waiting to be admitted."""
+        for waiter in self.waiting:
+            if waiter[0] is d:
+                self.waiting.remove(waiter)
+                break
+
+    def run(self, func, *args, **kwargs):
+        """Call `func` once admitted, and release when it's done.
+
+        :return: A `Deferred` that fires with the result of `func`.
+        """
+        def execute(gate):
+            d = maybeDeferred(func, *args, **kwargs)
+            return d.addBoth(callOut, self.release)
+
+        return self.acquire().addCallback(execute)
+
+    def getStats(self):
+        """Return a dict describing this gate.
+
+        Times are in seconds.
+        """
+        acquired = self.stats["acquired"]
+        return {
+            "waiting": len(self.waiting),
+            "acquired": acquired,
+            "wait_time": self.stats["wait_time"],
+            "mean_wait": (
+                self.stats["wait_time"] / acquired if acquired else 0.0),
+            "max_wait": self.max_wait,
+        }
@@ -4,6 +4,7 @@
 """ORM-related utilities."""
 
 __all__ = [
+    'describe_conflict',
     'disable_all_database_connections',
     'enable_all_database_connections',
     'ExclusivelyConnected',
@@ -27,6 +28,7 @@ __all__ = [
     'retry_context',
     'retry_on_retryable_failure',
     'savepoint',
+    'stream_query',
     'TotallyDisconnected',
     'transactional',
     'validate_in_transaction',
@@ -35,16 +37,19 @@ __all__ = [
 
 from collections import deque
 from contextlib import (
+    closing,
     contextmanager,
     ExitStack,
 )
 from functools import wraps
 from itertools import (
     chain,
+    count,
     islice,
     repeat,
     takewhile,
 )
+from random import random
 import re
 import threading
 from time import sleep
@@ -73,6 +78,7 @@ from maasserver.exceptions import (
     MAASAPIForbidden,
 )
 from maasserver.utils.async import DeferredHooks
+from maasserver.utils.contention import retry_telemetry
 from provisioningserver.utils import flatten
 from provisioningserver.utils.backoff import (
     exponential_growth,
@@ -340,6 +346,62 @@ def make_unique_violation():
     return exception
 
 
+def get_conflict_kind(exception):
+    """Return the kind of retryable failure that `exception` represents.
+
+    :return: One of "serialization_failure", "deadlock", "unique_violation",
+        or `None` if `exception` is not a retryable failure.
+    """
+    if is_serialization_failure(exception):
+        return "serialization_failure"
+    elif is_deadlock_failure(exception):
+        return "deadlock"
+    elif is_unique_violation(exception):
+        return "unique_violation"
+    else:
+        return None
+
+
+def describe_conflict(exception):
+    """Describe where the transaction that raised `exception` conflicted.
+
+    PostgreSQL reports the table and constraint for unique violations, and
+    the relation and tuple being locked or updated (in the error's context)
+    for deadlocks and some serialization failures. Serialization failures
+    found by predicate locking do not say where they conflicted.
+
+    :return: A dict with "relation", "row", "constraint", and "message" keys,
+        any of which may be `None`, or `None` if `exception` was not raised
+        by PostgreSQL.
+    """
+    exception = get_psycopg2_exception(exception)
+    if exception is None:
+        return None
+    diag = exception.diag
+    context = "" if diag.context is None else diag.context
+    match = re.search(r'tuple (\(\d+,\d+\)) in relation "([^"]+)"', context)
+    if diag.table_name is not None:
+        relation = diag.table_name
+    elif match is not None:
+        relation = match.group(2)
+    else:
+        relation = None
+    detail = "" if diag.message_detail is None else diag.message_detail
+    if match is not None:
+        row = match.group(1)
+    elif detail.startswith("Key "):
+        # e.g. "Key (name)=(foo) already exists."
+        row = detail.partition(" already exists")[0]
+    else:
+        row = None
+    return {
+        "relation": relation,
+        "row": row,
+        "constraint": diag.constraint_name,
+        "message": diag.message_primary,
+    }
+
+
 class RetryStack(ExitStack):
     """An exit stack specialised to the retry machinery."""
 
@@ -374,14 +436,16 @@ class RetryStack(ExitStack):
 class RetryContext(threading.local):
     """A thread-local context managed by the retry machinery.
 
-    At present it manages only an exit stack (see `contextlib.ExitStack` and
-    `RetryStack`) but is a convenient place to put context that's relevant to
-    a whole sequence of attempts.
+    It manages an exit stack (see `contextlib.ExitStack` and `RetryStack`)
+    and a record of the attempts made, for telemetry (see `RetryRecord`). It
+    is a convenient place to put context that's relevant to a whole sequence
+    of attempts.
     """
 
     def __init__(self):
         super(RetryContext, self).__init__()
         self.stack = None
+        self.record = None
 
     @property
     def active(self) -> bool:
@@ -391,14 +455,23 @@ class RetryContext(threading.local):
     def __enter__(self):
         assert not self.active, "Retry context already active."
         self.stack = RetryStack().__enter__()
+        self.record = retry_telemetry.start()
 
     def __exit__(self, *exc_info):
         assert self.active, "Retry context not active."
         _stack, self.stack = self.stack, None
+        _record, self.record = self.record, None
+        exc_value = exc_info[1]
+        if isinstance(exc_value, TooManyRetries):
+            _record.failed = True
+        elif isinstance(exc_value, DatabaseError):
+            _record.failed = is_retryable_failure(exc_value)
+        retry_telemetry.finish(_record)
         return _stack.__exit__(*exc_info)
 
     def prepare(self):
         """Prepare for the first or subsequent retry."""
+        self.record.attempt()
         self.stack.enter_pending_contexts()
 
 
@@ -475,6 +548,34 @@ def noop():
     """Do nothing."""
 
 
+def note_conflict(exception):
+    """Note that a transaction failed with `exception`, a retryable failure.
+
+    This tells the region's concurrency limiter (see
+    `maasserver.concurrency.database`) and, if the retry context is active,
+    records the conflict, sampled according to `retry_telemetry`.
+    """
+    # Avoid circular imports.
+    from maasserver import concurrency
+    concurrency.database.conflicted()
+    if retry_context.active:
+        if random() < retry_telemetry.sample_rate:
+            sample = describe_conflict(exception)
+        else:
+            sample = None
+        retry_context.record.conflicted(
+            get_conflict_kind(exception), sample)
+
+
+def get_callsite(func):
+    """Return a name for `func` for use in telemetry."""
+    name = getattr(func, "__qualname__", None)
+    if name is None:
+        return repr(func)
+    else:
+        return "%s.%s" % (func.__module__, name)
+
+
 def retry_on_retryable_failure(func, reset=noop):
     """Retry the wrapped function when it raises a retryable failure.
 
@@ -493,10 +594,15 @@ def retry_on_retryable_failure(func, reset=noop):
         with a retryable failure it will *not* be called. If an attempt
         fails with a non-retryable failure, it will *not* be called.
 
+    Attempts, retries, and failures are counted against `func` in
+    `retry_telemetry`.
     """
+    callsite = get_callsite(func)
+
     @wraps(func)
     def retrier(*args, **kwargs):
         with retry_context:
+            retry_context.record.callsite = callsite
             intervals = gen_retry_intervals()
             for _ in range(9):
                 retry_context.prepare()
@@ -507,6 +613,7 @@ def retry_on_retryable_failure(func, reset=noop):
                     sleep(next(intervals))
                 except DatabaseError as error:
                     if is_retryable_failure(error):
+                        note_conflict(error)
                         reset()  # Which may do nothing.
                         sleep(next(intervals))
                     else:
@@ -519,6 +626,10 @@ def retry_on_retryable_failure(func, reset=noop):
                     raise TooManyRetries(
                         "This transaction has already been attempted "
                         "multiple times; giving up.")
+                except DatabaseError as error:
+                    if is_retryable_failure(error):
+                        note_conflict(error)
+                    raise
     return retrier
 
 
@@ -732,6 +843,39 @@ def in_transaction(_connection=None):
         return _connection.in_atomic_block
 
 
+# Numbers for naming the server-side cursors opened by `stream_query`.
+_stream_query_numbers = count(1)
+
+
+def stream_query(sql, params=None, itersize=2000):
+    """Yield the rows returned by `sql`, fetching `itersize` at a time.
+
+    Within a transaction this uses a server-side (named) cursor so that a
+    large result does not need to be held in memory all at once, by either
+    psycopg2 or the caller; the rows must be consumed before the transaction
+    ends. Outside of a transaction, where a named cursor cannot be used,
+    this falls back to an ordinary cursor.
+    """
+    if not in_transaction():
+        with closing(connection.cursor()) as cursor:
+            cursor.execute(sql, params)
+            yield from cursor
+        return
+    connection.ensure_connection()
+    name = "stream_query_%d" % next(_stream_query_numbers)
+    cursor = connection.connection.cursor(name=name)
+    cursor.itersize = itersize
+    # Wrap the cursor as Django does so that the query is logged and any
+    # database errors are translated.
+    if connection.queries_logged:
+        cursor = connection.make_debug_cursor(cursor)
+    else:
+        cursor = connection.make_cursor(cursor)
+    with closing(cursor):
+        cursor.execute(sql, params)
+        yield from cursor
+
+
 def validate_in_transaction(connection):
     """Ensure that `connection` is within a transaction.
 
@@ -0,0 +1,173 @@
+# Copyright 2017 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for `maasserver.utils.contention`."""
+
+__all__ = []
+
+from unittest.mock import ANY
+
+from maasserver.utils.contention import (
+    merge_stats,
+    RetryTelemetry,
+)
+from maastesting.testcase import MAASTestCase
+from testtools.matchers import (
+    Equals,
+    HasLength,
+)
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_sample(relation="maasserver_node", row="(0,1)"):
+    return {
+        "relation": relation, "row": row, "constraint": None,
+        "message": None,
+    }
+
+
+class TestRetryRecord(MAASTestCase):
+    """Tests for `RetryRecord`."""
+
+    def setUp(self):
+        super(TestRetryRecord, self).setUp()
+        self.clock = FakeClock()
+        self.telemetry = RetryTelemetry(clock=self.clock)
+
+    def test__time_lost_is_time_before_final_attempt(self):
+        record = self.telemetry.start("alice")
+        record.attempt()
+        self.clock.now += 2.0
+        record.attempt()
+        self.clock.now += 5.0
+        self.assertThat(record.getTimeLost(), Equals(2.0))
+
+    def test__time_lost_includes_final_attempt_if_failed(self):
+        record = self.telemetry.start("alice")
+        record.attempt()
+        self.clock.now += 2.0
+        record.attempt()
+        self.clock.now += 5.0
+        record.failed = True
+        self.assertThat(record.getTimeLost(), Equals(7.0))
+
+
+class TestRetryTelemetry(MAASTestCase):
+    """Tests for `RetryTelemetry`."""
+
+    def setUp(self):
+        super(TestRetryTelemetry, self).setUp()
+        self.clock = FakeClock()
+        self.telemetry = RetryTelemetry(clock=self.clock)
+
+    def record(self, callsite, attempts, conflicts=(), failed=False):
+        record = self.telemetry.start(callsite)
+        for _ in range(attempts):
+            record.attempt()
+            self.clock.now += 1.0
+        for kind, sample in conflicts:
+            record.conflicted(kind, sample)
+        record.failed = failed
+        self.telemetry.finish(record)
+
+    def test__starts_off_empty(self):
+        self.assertThat(self.telemetry.getStats(), Equals({
+            "callsites": {}, "relations": {}, "samples": []}))
+
+    def test__counts_attempts_retries_and_failures_per_callsite(self):
+        self.record("alice", 1)
+        self.record("alice", 3, [("deadlock", None)] * 2)
+        self.record("bob", 2, [("deadlock", None)] * 2, failed=True)
+        self.assertThat(self.telemetry.getStats()["callsites"], Equals({
+            "alice": {
+                "calls": 2, "attempts": 4, "retries": 2, "failures": 0,
+                "time_lost": 2.0, "deadlock": 2,
+            },
+            "bob": {
+                "calls": 1, "attempts": 2, "retries": 1, "failures": 1,
+                "time_lost": 2.0, "deadlock": 2,
+            },
+        }))
+
+    def test__counts_callsite_as_unknown_when_not_set(self):
+        self.record(None, 1)
+        self.assertThat(
+            self.telemetry.getStats()["callsites"], Equals({
+                "unknown": {
+                    "calls": 1, "attempts": 1, "retries": 0,
+                    "failures": 0, "time_lost": 0.0,
+                },
+            }))
+
+    def test__keeps_samples_and_counts_relations(self):
+        self.record("alice", 2, [
+            ("deadlock", make_sample("maasserver_node")),
+            ("unique_violation", make_sample(None)),
+        ])
+        stats = self.telemetry.getStats()
+        self.assertThat(stats["relations"], Equals({
+            "maasserver_node": 1, "unknown": 1}))
+        self.assertThat(stats["samples"], Equals([
+            dict(make_sample("maasserver_node"), callsite="alice",
+                 kind="deadlock", time=ANY),
+            dict(make_sample(None), callsite="alice",
+                 kind="unique_violation", time=ANY),
+        ]))
+
+    def test__keeps_only_recent_samples(self):
+        telemetry = RetryTelemetry(samples=2)
+        for _ in range(3):
+            record = telemetry.start("alice")
+            record.conflicted("deadlock", make_sample())
+            telemetry.finish(record)
+        self.assertThat(telemetry.getStats()["samples"], HasLength(2))
+        self.assertThat(
+            telemetry.getStats()["relations"],
+            Equals({"maasserver_node": 3}))
+
+    def test__reset_discards_everything(self):
+        self.record("alice", 2, [("deadlock", make_sample())])
+        self.telemetry.reset()
+        self.assertThat(self.telemetry.getStats(), Equals({
+            "callsites": {}, "relations": {}, "samples": []}))
+
+
+class TestMergeStats(MAASTestCase):
+    """Tests for `merge_stats`."""
+
+    def test__sums_counts_and_orders_samples(self):
+        stats = [
+            {
+                "callsites": {"alice": {"calls": 1, "time_lost": 1.5}},
+                "relations": {"maasserver_node": 2},
+                "samples": [{"time": 2}],
+            },
+            {
+                "callsites": {
+                    "alice": {"calls": 2, "time_lost": 1.0},
+                    "bob": {"calls": 1},
+                },
+                "relations": {"maasserver_node": 1, "maasserver_tag": 1},
+                "samples": [{"time": 1}, {"time": 3}],
+            },
+        ]
+        self.assertThat(merge_stats(stats, samples=2), Equals({
+            "callsites": {
+                "alice": {"calls": 3, "time_lost": 2.5},
+                "bob": {"calls": 1},
+            },
+            "relations": {"maasserver_node": 3, "maasserver_tag": 1},
+            "samples": [{"time": 2}, {"time": 3}],
+        }))
+
+    def test__merges_nothing(self):
+        self.assertThat(merge_stats([]), Equals({
+            "callsites": {}, "relations": {}, "samples": []}))
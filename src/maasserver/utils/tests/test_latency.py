@@ -0,0 +1,235 @@
+# Copyright 2017 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for `maasserver.utils.latency`."""
+
+__all__ = []
+
+from unittest.mock import sentinel
+
+from django.db import connection
+from django.test.client import RequestFactory
+from maasserver.testing.testcase import MAASServerTestCase
+from maasserver.utils import latency
+from maasserver.utils.django_urls import get_resolver
+from maasserver.utils.latency import (
+    BUCKET_BOUNDS,
+    get_operation_name,
+    get_quantile,
+    LatencyHistogram,
+    merge_stats,
+    RequestTelemetry,
+)
+from maastesting.matchers import MockNotCalled
+from maastesting.testcase import MAASTestCase
+from testtools.matchers import (
+    Equals,
+    HasLength,
+    Is,
+    IsInstance,
+)
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLatencyHistogram(MAASTestCase):
+    """Tests for `LatencyHistogram`."""
+
+    def test__buckets_by_upper_bound(self):
+        histogram = LatencyHistogram()
+        histogram.add(0.001)
+        histogram.add(0.005)
+        histogram.add(0.3)
+        histogram.add(60.0)
+        expected = [0] * (len(BUCKET_BOUNDS) + 1)
+        expected[0] = 2
+        expected[BUCKET_BOUNDS.index(0.5)] = 1
+        expected[-1] = 1
+        self.assertThat(histogram.buckets, Equals(expected))
+
+    def test__sums_time_and_queries(self):
+        histogram = LatencyHistogram()
+        histogram.add(0.25, 3, 0.125)
+        histogram.add(0.5, 2, 0.25)
+        self.assertThat(histogram.getStats(), Equals({
+            "buckets": histogram.buckets, "count": 2, "total": 0.75,
+            "max": 0.5, "queries": 5, "query_time": 0.375,
+        }))
+
+
+class TestRequestTelemetry(MAASServerTestCase):
+    """Tests for `RequestTelemetry`."""
+
+    def setUp(self):
+        super(TestRequestTelemetry, self).setUp()
+        self.clock = FakeClock()
+
+    def test__does_not_sample_when_sample_rate_is_zero(self):
+        random = self.patch(latency, "random")
+        telemetry = RequestTelemetry(sample_rate=0.0)
+        self.assertThat(telemetry.start(), Is(None))
+        self.assertThat(random, MockNotCalled())
+
+    def test__samples_the_given_fraction(self):
+        self.patch(latency, "random").side_effect = [0.2, 0.3]
+        telemetry = RequestTelemetry(sample_rate=0.25)
+        self.assertThat(telemetry.start(), IsInstance(latency.Observation))
+        self.assertThat(telemetry.start(), Is(None))
+
+    def test__observation_restores_debug_cursor(self):
+        telemetry = RequestTelemetry(sample_rate=1.0)
+        self.patch(connection, "force_debug_cursor", False)
+        observation = telemetry.start()
+        self.assertTrue(connection.force_debug_cursor)
+        telemetry.finish(observation, "alice")
+        self.assertFalse(connection.force_debug_cursor)
+
+    def test__records_latency_and_queries_by_operation(self):
+        telemetry = RequestTelemetry(sample_rate=1.0, clock=self.clock)
+        with telemetry.observe("alice"):
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+                cursor.execute("SELECT 2")
+            self.clock.now += 0.25
+        [(operation, histogram)] = telemetry.getStats()["operations"].items()
+        self.assertThat(operation, Equals("alice"))
+        self.assertThat(
+            histogram["buckets"].index(1),
+            Equals(BUCKET_BOUNDS.index(0.25)))
+        self.assertThat(
+            (histogram["count"], histogram["total"], histogram["queries"]),
+            Equals((1, 0.25, 2)))
+
+    def test__captures_sql_of_slow_observations(self):
+        telemetry = RequestTelemetry(
+            sample_rate=1.0, slow_threshold=1.0, clock=self.clock)
+        with telemetry.observe("alice"):
+            self.clock.now += 0.5
+        with telemetry.observe("bob"):
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            self.clock.now += 1.0
+        [slow] = telemetry.getStats()["slow"]
+        self.assertThat(slow["operation"], Equals("bob"))
+        self.assertThat(slow["elapsed"], Equals(1.0))
+        self.assertThat(slow["query_count"], Equals(1))
+        self.assertThat(
+            [query["sql"] for query in slow["queries"]],
+            Equals(["SELECT 1"]))
+
+    def test__keeps_only_recent_slow_observations(self):
+        telemetry = RequestTelemetry(
+            sample_rate=1.0, slow_threshold=0.0, slow=2)
+        for _ in range(3):
+            with telemetry.observe("alice"):
+                pass
+        self.assertThat(telemetry.getStats()["slow"], HasLength(2))
+
+    def test__observed_calls_function_within_observation(self):
+        telemetry = RequestTelemetry(sample_rate=1.0)
+        func = telemetry.observed("alice", lambda thing: thing)
+        self.assertThat(func(sentinel.thing), Is(sentinel.thing))
+        self.assertThat(
+            telemetry.getStats()["operations"]["alice"]["count"], Equals(1))
+
+    def test__records_observations_that_fail(self):
+        telemetry = RequestTelemetry(sample_rate=1.0)
+        with self.assertRaises(ZeroDivisionError):
+            with telemetry.observe("alice"):
+                0 / 0
+        self.assertThat(
+            telemetry.getStats()["operations"]["alice"]["count"], Equals(1))
+
+    def test__reset_discards_everything(self):
+        telemetry = RequestTelemetry(sample_rate=1.0, slow_threshold=0.0)
+        with telemetry.observe("alice"):
+            pass
+        telemetry.reset()
+        self.assertThat(telemetry.getStats(), Equals({
+            "bounds": list(BUCKET_BOUNDS), "operations": {}, "slow": []}))
+
+
+class TestGetOperationName(MAASServerTestCase):
+    """Tests for `get_operation_name`."""
+
+    def test__names_unresolved_requests(self):
+        request = RequestFactory().get("/")
+        self.assertThat(get_operation_name(request), Equals("GET unresolved"))
+
+    def test__names_method_and_view(self):
+        request = RequestFactory().get("/")
+        request.resolver_match = get_resolver(None).resolve("/")
+        self.assertThat(get_operation_name(request), Equals("GET index"))
+
+    def test__names_api_operation(self):
+        request = RequestFactory().post("/?op=allocate")
+        request.resolver_match = get_resolver(None).resolve("/")
+        self.assertThat(
+            get_operation_name(request), Equals("POST index op=allocate"))
+
+
+class TestGetQuantile(MAASTestCase):
+    """Tests for `get_quantile`."""
+
+    def test__returns_upper_bound_of_bucket_holding_quantile(self):
+        bounds = [1, 2, 3]
+        buckets = [5, 4, 1, 0]
+        self.assertThat(get_quantile(bounds, buckets, 0.5), Equals(1))
+        self.assertThat(get_quantile(bounds, buckets, 0.9), Equals(2))
+        self.assertThat(get_quantile(bounds, buckets, 0.95), Equals(3))
+
+    def test__returns_None_for_final_bucket(self):
+        self.assertThat(get_quantile([1], [1, 9], 0.5), Is(None))
+
+
+class TestMergeStats(MAASTestCase):
+    """Tests for `merge_stats`."""
+
+    def make_histogram(self, count, total, queries):
+        return {
+            "buckets": [count, 0], "count": count, "total": total,
+            "max": total, "queries": queries, "query_time": total / 2,
+        }
+
+    def test__sums_histograms_and_orders_slow_requests(self):
+        stats = [
+            {
+                "operations": {"alice": self.make_histogram(1, 1.0, 2)},
+                "slow": [{"time": 2}],
+            },
+            {
+                "operations": {
+                    "alice": self.make_histogram(2, 3.0, 4),
+                    "bob": self.make_histogram(1, 0.5, 1),
+                },
+                "slow": [{"time": 1}, {"time": 3}],
+            },
+        ]
+        self.assertThat(merge_stats(stats, slow=2), Equals({
+            "bounds": list(BUCKET_BOUNDS),
+            "operations": {
+                "alice": {
+                    "buckets": [3, 0], "count": 3, "total": 4.0,
+                    "max": 3.0, "queries": 6, "query_time": 2.0,
+                },
+                "bob": self.make_histogram(1, 0.5, 1),
+            },
+            "slow": [{"time": 2}, {"time": 3}],
+        }))
+
+    def test__does_not_modify_given_stats(self):
+        histogram = self.make_histogram(1, 1.0, 2)
+        stats = [{"operations": {"alice": histogram}, "slow": []}] * 2
+        merge_stats(stats)
+        self.assertThat(histogram, Equals(self.make_histogram(1, 1.0, 2)))
+
+    def test__merges_nothing(self):
+        self.assertThat(merge_stats([]), Equals({
+            "bounds": list(BUCKET_BOUNDS), "operations": {}, "slow": []}))
@@ -0,0 +1,209 @@
+# Copyright 2017 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for `maasserver.utils.limiter`."""
+
+__all__ = []
+
+from unittest.mock import sentinel
+
+from maasserver.utils.limiter import AdaptiveLimiter
+from maastesting.factory import factory
+from maastesting.testcase import MAASTestCase
+from testtools.matchers import (
+    Equals,
+    MatchesStructure,
+)
+from twisted.internet.defer import (
+    CancelledError,
+    Deferred,
+    fail,
+)
+from twisted.internet.task import Clock
+
+
+class TestAdaptiveLimiter(MAASTestCase):
+    """Tests for `AdaptiveLimiter` and `LimiterGate`."""
+
+    def make_limiter(self, initial=2, minimum=1, maximum=4, **kwargs):
+        self.clock = Clock()
+        return AdaptiveLimiter(
+            initial, minimum, maximum, clock=self.clock, **kwargs)
+
+    def hold(self, gate, count):
+        """Acquire `gate` `count` times, returning the `Deferred`s."""
+        return [gate.acquire() for _ in range(count)]
+
+    def test__admits_up_to_limit(self):
+        limiter = self.make_limiter(initial=2)
+        gate = limiter.gate("api", 0)
+        acquired = self.hold(gate, 3)
+        self.assertEqual(
+            [True, True, False], [d.called for d in acquired])
+        self.assertEqual(2, limiter.in_use)
+        self.assertEqual(1, gate.getStats()["waiting"])
+
+    def test__acquire_fires_with_gate(self):
+        limiter = self.make_limiter()
+        gate = limiter.gate("api", 0)
+        self.assertIs(gate, self.successResultOf(gate.acquire()))
+
+    def test__release_admits_waiting_work(self):
+        limiter = self.make_limiter(initial=1)
+        gate = limiter.gate("api", 0)
+        first, second = self.hold(gate, 2)
+        self.clock.advance(3)
+        gate.release()
+        self.assertTrue(second.called)
+        self.assertEqual(1, limiter.in_use)
+        self.assertThat(gate.getStats(), Equals({
+            "waiting": 0, "acquired": 2, "wait_time": 3.0,
+            "mean_wait": 1.5, "max_wait": 3.0}))
+
+    def test__admits_in_order_of_priority(self):
+        limiter = self.make_limiter(initial=1, maximum=1)
+        low = limiter.gate("low", 2)
+        high = limiter.gate("high", 1)
+        self.hold(low, 1)
+        [low_waiting] = self.hold(low, 1)
+        [high_waiting] = self.hold(high, 1)
+        low.release()
+        self.assertTrue(high_waiting.called)
+        self.assertFalse(low_waiting.called)
+
+    def test__gate_with_ceiling_is_not_held_back_by_limit(self):
+        limiter = self.make_limiter(initial=1)
+        api = limiter.gate("api", 1)
+        rpc = limiter.gate("rpc", 0, ceiling=3)
+        self.hold(api, 1)
+        acquired = self.hold(rpc, 4)
+        self.assertEqual(
+            [True, True, True, False], [d.called for d in acquired])
+        self.assertEqual((1, 3), (limiter.in_use, rpc.in_use))
+        rpc.release()
+        self.assertTrue(acquired[-1].called)
+
+    def test__webapp_is_admitted_while_rpc_is_saturated(self):
+        limiter = self.make_limiter(initial=2)
+        rpc = limiter.gate("rpc", 0, ceiling=3)
+        webapp = limiter.gate("webapp", 2)
+        [rpc_waiting] = self.hold(rpc, 4)[3:]
+        self.assertFalse(rpc_waiting.called)
+        self.assertEqual(
+            [True, True], [d.called for d in self.hold(webapp, 2)])
+        self.assertFalse(limiter.saturated)
+
+    def test__gate_with_ceiling_does_not_count_towards_windows(self):
+        limiter = self.make_limiter(initial=1)
+        rpc = limiter.gate("rpc", 0, ceiling=3)
+        self.hold(rpc, 1)
+        self.clock.advance(60)
+        rpc.release()
+        self.assertEqual(0, limiter.completed)
+        self.assertIsNone(limiter.baseline)
+
+    def test__cancelling_stops_waiting(self):
+        limiter = self.make_limiter(initial=1)
+        gate = limiter.gate("api", 0)
+        _, waiting = self.hold(gate, 2)
+        waiting.cancel()
+        self.failureResultOf(waiting, CancelledError)
+        gate.release()
+        self.assertEqual(0, limiter.in_use)
+
+    def test__release_too_many_times_crashes(self):
+        limiter = self.make_limiter()
+        gate = limiter.gate("api", 0)
+        self.assertRaises(AssertionError, gate.release)
+
+    def test__run_calls_function_and_releases(self):
+        limiter = self.make_limiter()
+        gate = limiter.gate("api", 0)
+        d = gate.run(lambda *args, **kwargs: (args, kwargs), 1, two=2)
+        self.assertEqual(((1,), {"two": 2}), self.successResultOf(d))
+        self.assertEqual(0, limiter.in_use)
+
+    def test__run_releases_when_function_fails(self):
+        limiter = self.make_limiter()
+        gate = limiter.gate("api", 0)
+        exception_type = factory.make_exception_type()
+        d = gate.run(lambda: fail(exception_type()))
+        self.failureResultOf(d, exception_type)
+        self.assertEqual(0, limiter.in_use)
+
+    def test__run_waits_for_deferred_result(self):
+        limiter = self.make_limiter()
+        gate = limiter.gate("api", 0)
+        result = Deferred()
+        d = gate.run(lambda: result)
+        self.assertEqual(1, limiter.in_use)
+        result.callback(sentinel.result)
+        self.assertIs(sentinel.result, self.successResultOf(d))
+        self.assertEqual(0, limiter.in_use)
+
+    def release_all(self, gate, count):
+        for _ in range(count):
+            gate.release()
+
+    def test__increases_limit_when_work_waits_and_is_prompt(self):
+        limiter = self.make_limiter(initial=2, maximum=4)
+        gate = limiter.gate("api", 0)
+        self.hold(gate, 3)
+        self.release_all(gate, 2)
+        self.assertEqual(3, limiter.limit)
+
+    def test__does_not_increase_limit_when_nothing_waits(self):
+        limiter = self.make_limiter(initial=2, maximum=4)
+        gate = limiter.gate("api", 0)
+        self.hold(gate, 2)
+        self.release_all(gate, 2)
+        self.assertEqual(2, limiter.limit)
+
+    def test__does_not_increase_limit_beyond_maximum(self):
+        limiter = self.make_limiter(initial=2, maximum=2)
+        gate = limiter.gate("api", 0)
+        self.hold(gate, 3)
+        self.release_all(gate, 2)
+        self.assertEqual(2, limiter.limit)
+
+    def test__decreases_limit_after_conflict(self):
+        limiter = self.make_limiter(initial=4, maximum=4, decrease=0.5)
+        gate = limiter.gate("api", 0)
+        self.hold(gate, 5)
+        limiter.conflicted()
+        self.release_all(gate, 4)
+        self.assertEqual(2, limiter.limit)
+        self.assertEqual(1, limiter.getStats()["conflicts"])
+
+    def test__decreases_limit_when_work_slows(self):
+        limiter = self.make_limiter(initial=2, maximum=4, drift=0.0)
+        gate = limiter.gate("api", 0)
+        # Two pieces of work taking one second each set the baseline.
+        self.hold(gate, 2)
+        self.clock.advance(1)
+        self.release_all(gate, 2)
+        self.assertThat(limiter, MatchesStructure.byEquality(
+            limit=2, baseline=1.0, latency=1.0))
+        # The next two take three seconds each.
+        self.hold(gate, 2)
+        self.clock.advance(3)
+        self.release_all(gate, 2)
+        self.assertThat(limiter, MatchesStructure.byEquality(
+            limit=1.5, baseline=1.0, latency=3.0))
+        self.assertEqual(1, limiter.getStats()["limit"])
+
+    def test__does_not_decrease_limit_below_minimum(self):
+        limiter = self.make_limiter(initial=2, minimum=2)
+        gate = limiter.gate("api", 0)
+        self.hold(gate, 2)
+        limiter.conflicted()
+        self.release_all(gate, 2)
+        self.assertEqual(2, limiter.limit)
+
+    def test__getStats_describes_limiter_and_gates(self):
+        limiter = self.make_limiter(initial=1)
+        gate = limiter.gate("api", 0)
+        self.hold(gate, 2)
+        self.assertThat(limiter.getStats(), Equals({
+            "limit": 1, "in_use": 1, "latency": None, "baseline": None,
+            "conflicts": 0, "gates": {"api": gate.getStats()}}))
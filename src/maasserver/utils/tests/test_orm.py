@@ -11,6 +11,7 @@ from itertools import (
     repeat,
 )
 from random import randint
+from types import SimpleNamespace
 import unittest
 from unittest.mock import (
     ANY,
@@ -31,6 +32,7 @@ from django.db.utils import (
     IntegrityError,
     OperationalError,
 )
+from maasserver import concurrency
 from maasserver.models import Node
 from maasserver.testing.testcase import (
     MAASServerTestCase,
@@ -39,7 +41,9 @@ from maasserver.testing.testcase import (
     UniqueViolationTestCase,
 )
 from maasserver.utils import orm
+from maasserver.utils.contention import RetryTelemetry
 from maasserver.utils.orm import (
+    describe_conflict,
     disable_all_database_connections,
     DisabledDatabaseConnection,
     enable_all_database_connections,
@@ -64,6 +68,7 @@ from maasserver.utils.orm import (
     request_transaction_retry,
     retry_on_retryable_failure,
     savepoint,
+    stream_query,
     TotallyDisconnected,
     validate_in_transaction,
 )
@@ -97,6 +102,7 @@ from testtools.matchers import (
     IsInstance,
     MatchesPredicate,
     Not,
+    StartsWith,
 )
 from twisted.internet.defer import (
     CancelledError,
@@ -492,6 +498,41 @@ class TestRetryOnRetryableFailure(SerializationFailureTestCase, NoSleepMixin):
         self.assertEqual(sentinel.result, function_wrapped())
         self.assertThat(function, MockCallsMatch(call(), call()))
 
+    def test_notes_conflict_before_retrying(self):
+        note_conflict = self.patch(orm, "note_conflict")
+        error = orm.make_deadlock_failure()
+        function = self.make_mock_function()
+        function.side_effect = [error, sentinel.result]
+        function_wrapped = retry_on_retryable_failure(function)
+        self.assertEqual(sentinel.result, function_wrapped())
+        self.assertThat(note_conflict, MockCalledOnceWith(error))
+
+    def test_records_attempts_in_telemetry(self):
+        telemetry = self.patch(orm, "retry_telemetry", RetryTelemetry())
+        function = self.make_mock_function()
+        function.side_effect = [orm.make_deadlock_failure(), sentinel.result]
+        function_wrapped = retry_on_retryable_failure(function)
+        self.assertEqual(sentinel.result, function_wrapped())
+        self.assertThat(telemetry.getStats()["callsites"], Equals({
+            orm.get_callsite(function): {
+                "calls": 1, "attempts": 2, "retries": 1, "failures": 0,
+                "time_lost": ANY, "deadlock": 1,
+            },
+        }))
+
+    def test_records_final_failure_in_telemetry(self):
+        telemetry = self.patch(orm, "retry_telemetry", RetryTelemetry())
+        function = self.make_mock_function()
+        function.side_effect = orm.make_deadlock_failure()
+        function_wrapped = retry_on_retryable_failure(function)
+        self.assertRaises(OperationalError, function_wrapped)
+        self.assertThat(telemetry.getStats()["callsites"], Equals({
+            orm.get_callsite(function): {
+                "calls": 1, "attempts": 10, "retries": 9, "failures": 1,
+                "time_lost": ANY, "deadlock": 10,
+            },
+        }))
+
     def test_retries_on_deadlock_failure(self):
         function = self.make_mock_function()
         function.side_effect = orm.make_deadlock_failure()
@@ -757,6 +798,41 @@ class TestRetryContext(MAASTestCase):
         self.assertThat(context.stack, Is(None))
         self.assertThat(names, Equals([]))
 
+    def test_records_attempts_on_exit(self):
+        telemetry = self.patch(orm, "retry_telemetry", RetryTelemetry())
+        context = orm.RetryContext()
+        with context:
+            context.record.callsite = "alice"
+            context.prepare()
+            context.prepare()
+        self.assertThat(context.record, Is(None))
+        self.assertThat(telemetry.getStats()["callsites"], Equals({
+            "alice": {
+                "calls": 1, "attempts": 2, "retries": 1, "failures": 0,
+                "time_lost": ANY,
+            },
+        }))
+
+    def test_records_failure_on_exit_after_too_many_retries(self):
+        telemetry = self.patch(orm, "retry_telemetry", RetryTelemetry())
+        context = orm.RetryContext()
+        with ExpectedException(orm.TooManyRetries):
+            with context:
+                context.prepare()
+                raise orm.TooManyRetries()
+        stats = telemetry.getStats()["callsites"]
+        self.assertThat(stats["unknown"]["failures"], Equals(1))
+
+    def test_does_not_record_failure_on_exit_after_other_crash(self):
+        telemetry = self.patch(orm, "retry_telemetry", RetryTelemetry())
+        context = orm.RetryContext()
+        with ExpectedException(ZeroDivisionError):
+            with context:
+                context.prepare()
+                0 / 0
+        stats = telemetry.getStats()["callsites"]
+        self.assertThat(stats["unknown"]["failures"], Equals(0))
+
     def test_destroys_stack_on_exit_even_when_there_is_a_crash(self):
         names = []
         context = orm.RetryContext()
@@ -830,6 +906,83 @@ class TestGenRetryIntervals(MAASTestCase):
         self.assertThat(intervals[:-1], AllMatch(LessThanOrEqual(maximum)))
 
 
+class TestNoteConflict(MAASTestCase):
+    """Tests for `note_conflict`."""
+
+    def setUp(self):
+        super(TestNoteConflict, self).setUp()
+        self.conflicted = self.patch(concurrency.database, "conflicted")
+        self.telemetry = self.patch(orm, "retry_telemetry", RetryTelemetry())
+
+    def test__tells_database_limiter(self):
+        orm.note_conflict(orm.make_deadlock_failure())
+        self.assertThat(self.conflicted, MockCalledOnceWith())
+
+    def test__records_sampled_conflict_in_retry_context(self):
+        with orm.retry_context:
+            orm.retry_context.prepare()
+            orm.note_conflict(orm.make_unique_violation())
+        stats = self.telemetry.getStats()
+        counts = stats["callsites"]["unknown"]
+        self.assertThat(counts["unique_violation"], Equals(1))
+        self.assertThat(stats["samples"], HasLength(1))
+
+    def test__does_not_sample_when_sample_rate_is_zero(self):
+        self.telemetry.sample_rate = 0.0
+        with orm.retry_context:
+            orm.retry_context.prepare()
+            orm.note_conflict(orm.make_serialization_failure())
+        stats = self.telemetry.getStats()
+        counts = stats["callsites"]["unknown"]
+        self.assertThat(counts["serialization_failure"], Equals(1))
+        self.assertThat(stats["samples"], Equals([]))
+
+    def test__does_not_need_retry_context(self):
+        orm.note_conflict(orm.make_deadlock_failure())
+        self.assertThat(self.telemetry.getStats()["callsites"], Equals({}))
+
+
+class TestDescribeConflict(MAASTestCase):
+    """Tests for `describe_conflict`."""
+
+    def make_error(self, **diag):
+        fields = dict.fromkeys((
+            "context", "constraint_name", "message_detail",
+            "message_primary", "table_name"))
+        fields.update(diag)
+        cause_type = type("Error", (psycopg2.OperationalError,), {
+            "pgcode": DEADLOCK_DETECTED, "diag": SimpleNamespace(**fields)})
+        error = OperationalError()
+        error.__cause__ = cause_type()
+        return error
+
+    def test__returns_None_without_database_error(self):
+        self.assertThat(describe_conflict(factory.make_exception()), Is(None))
+
+    def test__describes_tuple_in_relation_from_context(self):
+        error = self.make_error(
+            message_primary="deadlock detected",
+            context='while updating tuple (0,5) in relation "maasserver_node"')
+        self.assertThat(describe_conflict(error), Equals({
+            "relation": "maasserver_node", "row": "(0,5)",
+            "constraint": None, "message": "deadlock detected"}))
+
+    def test__describes_key_of_unique_violation(self):
+        error = self.make_error(
+            table_name="maasserver_domain", constraint_name="name_key",
+            message_detail="Key (name)=(foo) already exists.")
+        self.assertThat(describe_conflict(error), Equals({
+            "relation": "maasserver_domain", "row": "Key (name)=(foo)",
+            "constraint": "name_key", "message": None}))
+
+    def test__describes_nothing_when_database_says_nothing(self):
+        error = self.make_error(
+            message_detail="Reason code: Canceled on identification.")
+        self.assertThat(describe_conflict(error), Equals({
+            "relation": None, "row": None, "constraint": None,
+            "message": None}))
+
+
 class TestPostCommitHooks(MAASTestCase):
     """Tests for the `post_commit_hooks` singleton."""
 
@@ -1211,6 +1364,33 @@ class TestValidateInTransaction(MAASTransactionServerTestCase):
             validate_in_transaction, connection)
 
 
+class TestStreamQuery(MAASTransactionServerTestCase):
+    """Tests for `stream_query`."""
+
+    sql = "SELECT generate_series(1, %s)"
+
+    def test__yields_rows_within_transaction(self):
+        with transaction.atomic():
+            rows = list(stream_query(self.sql, [5], itersize=2))
+        self.assertEqual([(1,), (2,), (3,), (4,), (5,)], rows)
+
+    def test__uses_server_side_cursor_within_transaction(self):
+        with transaction.atomic():
+            rows = stream_query(self.sql, [3])
+            next(rows)
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT name FROM pg_cursors")
+                names = [name for name, in cursor.fetchall()]
+            rows.close()
+        self.assertThat(names, HasLength(1))
+        self.assertThat(names[0], StartsWith("stream_query_"))
+
+    def test__yields_rows_outside_of_transaction(self):
+        self.assertFalse(in_transaction())
+        rows = list(stream_query(self.sql, [3]))
+        self.assertEqual([(1,), (2,), (3,)], rows)
+
+
 class TestPsqlArray(MAASTestCase):
 
     def test__returns_empty_array(self):
@@ -36,7 +36,11 @@ from maasserver.testing.testcase import (
     MAASServerTestCase,
     SerializationFailureTestCase,
 )
-from maasserver.utils import views
+from maasserver.utils import (
+    orm,
+    views,
+)
+from maasserver.utils.contention import RetryTelemetry
 from maasserver.utils.django_urls import get_resolver
 from maasserver.utils.orm import (
     make_deadlock_failure,
@@ -238,6 +242,16 @@ class TestWebApplicationHandler(SerializationFailureTestCase):
             handler._WebApplicationHandler__retry,
             Contains(response))
 
+    def test__handle_uncaught_exception_notes_conflict(self):
+        note_conflict = self.patch(views, "note_conflict")
+        handler = views.WebApplicationHandler()
+        request = make_request()
+        request.path = factory.make_name("path")
+        failure = self.capture_serialization_failure()
+        handler.handle_uncaught_exception(
+            request=request, resolver=get_resolver(None), exc_info=failure)
+        self.assertThat(note_conflict, MockCalledOnceWith(failure[1]))
+
     def test__handle_uncaught_exception_does_not_note_other_failure(self):
         handler = views.WebApplicationHandler()
         request = make_request()
@@ -408,6 +422,38 @@ class TestWebApplicationHandler(SerializationFailureTestCase):
             response.reason_phrase,
             Equals(http.client.responses[http.client.CONFLICT]))
 
+    def test__get_response_records_attempts_in_telemetry(self):
+        telemetry = self.patch(orm, "retry_telemetry", RetryTelemetry())
+        handler = views.WebApplicationHandler(3)
+        responses = iter((sentinel.r1, sentinel.r2, sentinel.r3))
+
+        def set_retry(request):
+            response = next(responses)
+            handler._WebApplicationHandler__retry.add(response)
+            return response
+
+        get_response = self.patch(WSGIHandler, "get_response")
+        get_response.side_effect = set_retry
+
+        reset_request = self.patch_autospec(views, "reset_request")
+        reset_request.side_effect = lambda request: request
+
+        request = make_request()
+        request.path = factory.make_name("path")
+        handler.get_response(request)
+
+        self.assertThat(telemetry.getStats()["callsites"], Equals({
+            "view:unresolved": {
+                "calls": 1, "attempts": 3, "retries": 2, "failures": 1,
+                "time_lost": ANY,
+            },
+        }))
+
+    def test__get_view_name_uses_resolved_view_name(self):
+        request = make_request()
+        request.resolver_match = get_resolver(None).resolve("/")
+        self.assertThat(views.get_view_name(request), Equals("view:index"))
+
     def test__get_response_prepare_retry_context_before_each_try(self):
 
         class ObserveContext:
@@ -23,6 +23,7 @@ from maasserver.utils.django_urls import get_resolver
 from maasserver.utils.orm import (
     gen_retry_intervals,
     is_retryable_failure,
+    note_conflict,
     post_commit_hooks,
     retry_context,
     RetryTransaction,
@@ -53,6 +54,18 @@ def log_final_failed_attempt(request, attempt, elapsed):
         attempt, request.path, elapsed)
 
 
+def get_view_name(request):
+    """Return the name of the view that answered `request`.
+
+    This is used as the callsite for retry telemetry.
+    """
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "view:unresolved"
+    else:
+        return "view:%s" % match.view_name
+
+
 def delete_oauth_nonce(request):
     """Delete the OAuth nonce for the given request from the database.
 
@@ -152,6 +165,7 @@ class WebApplicationHandler(WSGIHandler):
         if isinstance(exc_value, RetryTransaction):
             self.__retry.add(response)
         elif is_retryable_failure(exc_value):
+            note_conflict(exc_value)
             self.__retry.add(response)
         elif isinstance(exc_value, MAASAPIException):
             return exc_value.make_http_response()
@@ -232,10 +246,12 @@ class WebApplicationHandler(WSGIHandler):
             for attempt in count(1):
                 retry_context.prepare()
                 response = get_response(request)
+                retry_context.record.callsite = get_view_name(request)
                 if response in retry_set:
                     elapsed, remaining, wait = next(retry_details)
                     if attempt == retry_attempts or wait == 0:
                         # Time's up: this was the final attempt.
+                        retry_context.record.failed = True
                         log_final_failed_attempt(request, attempt, elapsed)
                         conflict_response = HttpResponseConflict(response)
                         conflict_response.render()
@@ -19,6 +19,7 @@ from django.http import HttpRequest
 from django.utils.encoding import is_protected_type
 from maasserver import concurrency
 from maasserver.utils.forms import get_QueryDict
+from maasserver.utils.latency import request_telemetry
 from maasserver.utils.orm import transactional
 from maasserver.utils.threads import deferToDatabase
 from provisioningserver.utils.twisted import (
@@ -155,6 +156,11 @@ class Handler(metaclass=HandlerMetaclass):
 
     """
 
+    #: Cache shared between the handlers of every client that is processing
+    #: the same notification. This is set by the `WebSocketFactory` when it
+    #: fans out a notification, and is `None` otherwise.
+    notify_cache = None
+
     def __init__(self, user, cache):
         self.user = user
         self.cache = cache
@@ -329,9 +335,13 @@ class Handler(metaclass=HandlerMetaclass):
                     return method(params)
                 else:
                     # This is going to block and hold a database connection so
-                    # we limit its concurrency.
-                    return concurrency.webapp.run(
-                        deferToDatabase, transactional(method), params)
+                    # we limit its concurrency. A sample of calls is observed,
+                    # including retries, for request telemetry.
+                    operation = "websocket %s.%s" % (
+                        self._meta.handler_name, method_name)
+                    return concurrency.websocket.run(
+                        deferToDatabase, request_telemetry.observed(
+                            operation, transactional(method)), params)
         else:
             raise HandlerNoSuchMethodError(method_name)
 
@@ -459,10 +469,7 @@ class Handler(metaclass=HandlerMetaclass):
             else:
                 return None
 
-        try:
-            obj = self.listen(channel, action, pk)
-        except HandlerDoesNotExistError:
-            obj = None
+        obj = self.listen_shared(channel, action, pk)
         if action == "create" and obj is not None:
             if pk in self.cache['loaded_pks']:
                 # The user already knows about this node, so its not a create
@@ -503,7 +510,7 @@ class Handler(metaclass=HandlerMetaclass):
             return (
                 self._meta.handler_name,
                 action,
-                self.full_dehydrate(obj, for_list=False),
+                self.full_dehydrate_shared(obj, pk, for_list=False),
                 )
         else:
             # Not active so only send the data like it was comming from
@@ -511,9 +518,57 @@ class Handler(metaclass=HandlerMetaclass):
             return (
                 self._meta.handler_name,
                 action,
-                self.full_dehydrate(obj, for_list=True),
+                self.full_dehydrate_shared(obj, pk, for_list=True),
                 )
 
+    def get_notify_permission_key(self):
+        """Return the permission class of this handler's user.
+
+        Users in the same permission class see the same results from `listen`
+        and `full_dehydrate`, so those are only computed once per notification
+        and then shared through `notify_cache`. All administrators share one
+        class; every other user is a class of their own.
+
+        Override if what the handler sends depends on more than that.
+        """
+        if self.user.is_superuser:
+            return "admin"
+        else:
+            return "user:%d" % self.user.id
+
+    def _get_or_compute_shared(self, key, compute):
+        """Return the value of `compute()`, sharing it via `notify_cache`."""
+        if self.notify_cache is None:
+            return compute()
+        key = (self.get_notify_permission_key(),) + key
+        if key not in self.notify_cache:
+            self.notify_cache[key] = compute()
+        return self.notify_cache[key]
+
+    def listen_shared(self, channel, action, pk):
+        """Call `listen`, sharing the object between handlers in the same
+        permission class that are processing the same notification.
+
+        :return: The object, or `None` if it does not exist.
+        """
+        def compute():
+            try:
+                return self.listen(channel, action, pk)
+            except HandlerDoesNotExistError:
+                return None
+        return self._get_or_compute_shared(
+            ("listen", channel, action, pk), compute)
+
+    def full_dehydrate_shared(self, obj, pk, for_list=False):
+        """Call `full_dehydrate`, sharing the data between handlers in the
+        same permission class that are processing the same notification.
+
+        The returned data is shared so it must not be modified.
+        """
+        return self._get_or_compute_shared(
+            ("dehydrate", pk, for_list),
+            lambda: self.full_dehydrate(obj, for_list=for_list))
+
     def listen(self, channel, action, pk):
         """Called when the handler listens for events on channels with
         `Meta.listen_channels`.
@@ -30,6 +30,11 @@ class NotificationHandler(TimestampedModelHandler):
         data["message"] = obj.render()
         return data
 
+    def get_notify_permission_key(self):
+        """Notifications are relevant to, and dismissed by, individual users,
+        so results are never shared between users; see `Handler`."""
+        return "user:%d" % self.user.id
+
     def dismiss(self, params):
         """Dismiss the given notification(s).
 
@@ -26,7 +26,11 @@ from django.contrib.auth import (
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from maasserver.eventloop import services
-from maasserver.utils.orm import transactional
+from maasserver.utils.orm import (
+    is_retryable_failure,
+    savepoint,
+    transactional,
+)
 from maasserver.utils.threads import deferToDatabase
 from maasserver.websockets import handlers
 from maasserver.websockets.websockets import STATUSES
@@ -411,19 +415,73 @@ class WebSocketFactory(Factory):
         for handler in self.handlers.values():
             for channel in handler._meta.listen_channels:
                 self.listener.register(
-                    channel, partial(self.onNotify, handler, channel))
+                    channel, partial(self.onNotifyBatch, handler, channel),
+                    batch=True)
 
-    @inlineCallbacks
     def onNotify(self, handler_class, channel, action, obj_id):
-        for client in self.clients:
-            handler = client.buildHandler(handler_class)
-            data = yield deferToDatabase(
-                self.processNotify, handler, channel, action, obj_id)
-            if data is not None:
+        """Fan out a notification to all the connected clients.
+
+        See `onNotifyBatch`.
+        """
+        return self.onNotifyBatch(handler_class, channel, action, [obj_id])
+
+    @inlineCallbacks
+    def onNotifyBatch(self, handler_class, channel, action, obj_ids):
+        """Fan out notifications for `obj_ids` to all the connected clients.
+
+        The notifications are processed for every client in a single trip to
+        the database. Each object is fetched and dehydrated once for each
+        permission class of user, rather than once for each client; see
+        `Handler.get_notify_permission_key`.
+        """
+        clients = list(self.clients)
+        if len(clients) == 0:
+            return
+        results = yield deferToDatabase(
+            self.processNotifiesForClients, clients,
+            handler_class, channel, action, obj_ids)
+        for client, data in results:
+            # The client may have disconnected while in the database.
+            if data is not None and client in self.clients:
                 (name, client_action, data) = data
                 client.sendNotify(name, client_action, data)
 
     @transactional
+    def processNotifiesForClients(
+            self, clients, handler_class, channel, action, obj_ids):
+        """Process the notifications for `obj_ids` for each of `clients`.
+
+        Each notification is processed for every client in a savepoint, so
+        one that fails -- the object may be gone, for example -- is logged
+        and skipped without losing the others. Failures that can be retried
+        are not caught, so the whole batch is tried again.
+
+        :return: A list of ``(client, data)`` tuples, where `data` is the
+            result of `Handler.on_listen` for that client, or `None` if it
+            failed.
+        """
+        results = []
+        for obj_id in obj_ids:
+            notify_cache = {}
+            obj_results = []
+            try:
+                with savepoint():
+                    for client in clients:
+                        handler = client.buildHandler(handler_class)
+                        handler.notify_cache = notify_cache
+                        data = self.processNotify(
+                            handler, channel, action, obj_id)
+                        obj_results.append((client, data))
+            except Exception as error:
+                if is_retryable_failure(error):
+                    raise
+                log.err(
+                    None, "Failed to process %s notification for %s "
+                    "%r." % (action, channel, obj_id))
+                obj_results = [(client, None) for client in clients]
+            results.extend(obj_results)
+        return results
+
     def processNotify(self, handler, channel, action, obj_id):
         return handler.on_listen(channel, action, obj_id)
 
@@ -23,6 +23,7 @@ from maasserver.models.zone import Zone
 from maasserver.testing.architecture import make_usable_architecture
 from maasserver.testing.factory import factory
 from maasserver.testing.testcase import MAASServerTestCase
+from maasserver.utils.latency import RequestTelemetry
 from maasserver.utils.orm import reload_object
 from maasserver.websockets import base
 from maasserver.websockets.base import (
@@ -343,6 +344,23 @@ class TestHandler(MAASServerTestCase):
         [func, _] = base.deferToDatabase.call_args[0]
         self.assertThat(func.func, Equals(handler.get))
 
+    def test_execute_observes_method_for_request_telemetry(self):
+        telemetry = RequestTelemetry(sample_rate=1.0)
+        self.patch(base, "request_telemetry", telemetry)
+        handler = self.make_nodes_handler(handler_name="testing")
+        node = factory.make_Node()
+        params = {"system_id": node.system_id}
+        self.patch(base, "deferToDatabase").return_value = sentinel.thing
+        handler.execute("get", params).wait(30)
+        [func, _] = base.deferToDatabase.call_args[0]
+        self.assertThat(telemetry.getStats()["operations"], Equals({}))
+        # The observation is made in the database thread, when the method
+        # is called; here it's called directly.
+        func(params)
+        operations = telemetry.getStats()["operations"]
+        self.assertThat(
+            operations["websocket testing.get"]["count"], Equals(1))
+
     def test_execute_calls_asynchronous_method_with_params(self):
         # An asynchronous method -- decorated with @asynchronous -- is called
         # directly, not in a thread.
@@ -719,6 +737,59 @@ class TestHandler(MAASServerTestCase):
             mock_dehydrate,
             MockCalledOnceWith(node, for_list=False))
 
+    def test_on_listen_shares_listen_and_dehydrate_via_notify_cache(self):
+        node = factory.make_Node()
+        notify_cache = {}
+        handlers = [
+            self.make_nodes_handler(fields=['hostname'])
+            for _ in range(3)
+        ]
+        admin = factory.make_admin()
+        for handler in handlers:
+            handler.user = admin
+            handler.notify_cache = notify_cache
+            handler.cache["loaded_pks"].add(node.system_id)
+        mock_listen = self.patch(Handler, "listen")
+        mock_listen.return_value = node
+        mock_dehydrate = self.patch(Handler, "full_dehydrate")
+        mock_dehydrate.return_value = sentinel.data
+        results = [
+            handler.on_listen(sentinel.channel, "update", node.system_id)
+            for handler in handlers
+        ]
+        self.expectThat(
+            results, Equals([
+                (handlers[0]._meta.handler_name, "update", sentinel.data),
+            ] * 3))
+        self.expectThat(mock_listen.call_count, Equals(1))
+        self.expectThat(mock_dehydrate.call_count, Equals(1))
+
+    def test_on_listen_does_not_share_between_permission_classes(self):
+        node = factory.make_Node()
+        notify_cache = {}
+        handlers = [
+            self.make_nodes_handler(fields=['hostname'])
+            for _ in range(2)
+        ]
+        for handler in handlers:
+            handler.notify_cache = notify_cache
+        mock_listen = self.patch(Handler, "listen")
+        mock_listen.return_value = node
+        for handler in handlers:
+            handler.on_listen(sentinel.channel, "update", node.system_id)
+        self.assertThat(mock_listen.call_count, Equals(2))
+
+    def test_get_notify_permission_key_is_shared_by_admins(self):
+        handler = self.make_nodes_handler()
+        handler.user = factory.make_admin()
+        self.assertEqual("admin", handler.get_notify_permission_key())
+
+    def test_get_notify_permission_key_is_per_user_for_non_admins(self):
+        handler = self.make_nodes_handler()
+        self.assertEqual(
+            "user:%d" % handler.user.id,
+            handler.get_notify_permission_key())
+
     def test_listen_calls_get_object_with_pk_on_other_actions(self):
         handler = self.make_nodes_handler()
         mock_get_object = self.patch(handler, "get_object")
@@ -8,6 +8,7 @@ from collections import deque
 import json
 import random
 from unittest.mock import (
+    call,
     MagicMock,
     sentinel,
 )
@@ -19,7 +20,10 @@ from maasserver.eventloop import services
 from maasserver.testing.factory import factory as maas_factory
 from maasserver.testing.listener import FakePostgresListenerService
 from maasserver.testing.testcase import MAASTransactionServerTestCase
-from maasserver.utils.orm import transactional
+from maasserver.utils.orm import (
+    make_serialization_failure,
+    transactional,
+)
 from maasserver.utils.threads import deferToDatabase
 from maasserver.websockets import protocol as protocol_module
 from maasserver.websockets.base import Handler
@@ -38,6 +42,8 @@ from maastesting.matchers import (
     IsFiredDeferred,
     MockCalledOnceWith,
     MockCalledWith,
+    MockCallsMatch,
+    MockNotCalled,
 )
 from maastesting.testcase import MAASTestCase
 from maastesting.twisted import TwistedLoggerFixture
@@ -45,6 +51,7 @@ from provisioningserver.refresh.node_info_scripts import LSHW_OUTPUT_NAME
 from provisioningserver.utils.twisted import synchronous
 from testtools.matchers import (
     Equals,
+    HasLength,
     Is,
 )
 from twisted.internet import defer
@@ -816,6 +823,12 @@ class TestWebSocketFactory(MAASTestCase, MakeProtocolFactoryMixin):
         self.assertItemsEqual(
             ALL_NOTIFIERS, factory.listener.listeners.keys())
 
+    def test_registerNotifiers_registers_batch_handlers(self):
+        factory = self.make_factory()
+        self.assertItemsEqual(
+            ALL_NOTIFIERS, {
+                channel for channel, _ in factory.listener.batchHandlers})
+
 
 class TestWebSocketFactoryTransactional(
         MAASTransactionServerTestCase, MakeProtocolFactoryMixin):
@@ -884,6 +897,138 @@ class TestWebSocketFactoryTransactional(
         self.assertThat(
             mock_sendNotify, MockCalledWith(name, action, data))
 
+    def add_client_to_factory(self, factory, user):
+        protocol = factory.buildProtocol(None)
+        protocol.transport = MagicMock()
+        protocol.user = user
+        factory.clients.append(protocol)
+        self.addCleanup(lambda: protocol.connectionLost(""))
+        return protocol
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test_onNotify_processes_all_clients_in_one_database_call(self):
+        user = yield deferToDatabase(self.make_user)
+        protocol, factory = self.make_protocol_with_factory(user=user)
+        other_protocol = self.add_client_to_factory(factory, user)
+        mock_deferToDatabase = self.patch(protocol_module, "deferToDatabase")
+        mock_deferToDatabase.side_effect = deferToDatabase
+        mock_class = MagicMock()
+        mock_class.return_value.on_listen.return_value = (
+            sentinel.name, sentinel.action, sentinel.data)
+        mock_sendNotify = self.patch(protocol, "sendNotify")
+        mock_other_sendNotify = self.patch(other_protocol, "sendNotify")
+        yield factory.onNotify(
+            mock_class, sentinel.channel, sentinel.action, sentinel.obj_id)
+        self.expectThat(mock_deferToDatabase.call_count, Equals(1))
+        self.expectThat(
+            mock_sendNotify, MockCalledOnceWith(
+                sentinel.name, sentinel.action, sentinel.data))
+        self.expectThat(
+            mock_other_sendNotify, MockCalledOnceWith(
+                sentinel.name, sentinel.action, sentinel.data))
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test_onNotify_shares_notify_cache_between_clients(self):
+        user = yield deferToDatabase(self.make_user)
+        protocol, factory = self.make_protocol_with_factory(user=user)
+        self.add_client_to_factory(factory, user)
+        handlers = []
+
+        def make_handler(user, cache):
+            handler = MagicMock()
+            handler.on_listen.return_value = None
+            handlers.append(handler)
+            return handler
+
+        mock_class = MagicMock(side_effect=make_handler)
+        yield factory.onNotify(
+            mock_class, sentinel.channel, sentinel.action, sentinel.obj_id)
+        self.assertThat(handlers, HasLength(2))
+        self.assertIs(handlers[0].notify_cache, handlers[1].notify_cache)
+        self.assertEqual({}, handlers[0].notify_cache)
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test_onNotifyBatch_sends_notifies_in_order(self):
+        user = yield deferToDatabase(self.make_user)
+        protocol, factory = self.make_protocol_with_factory(user=user)
+        mock_class = MagicMock()
+        mock_class.return_value.on_listen.side_effect = (
+            lambda channel, action, obj_id: ("name", action, obj_id))
+        mock_sendNotify = self.patch(protocol, "sendNotify")
+        yield factory.onNotifyBatch(
+            mock_class, sentinel.channel, "update", [1, 2, 3])
+        self.assertThat(
+            mock_sendNotify, MockCallsMatch(
+                call("name", "update", 1),
+                call("name", "update", 2),
+                call("name", "update", 3)))
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test_onNotifyBatch_sends_other_notifies_when_one_fails(self):
+        user = yield deferToDatabase(self.make_user)
+        protocol1, factory = self.make_protocol_with_factory(user=user)
+        protocol2 = self.add_client_to_factory(factory, user)
+
+        def on_listen(channel, action, obj_id):
+            if obj_id == 2:
+                raise maas_factory.make_exception()
+            return ("name", action, obj_id)
+
+        mock_class = MagicMock()
+        mock_class.return_value.on_listen.side_effect = on_listen
+        mock_sendNotify1 = self.patch(protocol1, "sendNotify")
+        mock_sendNotify2 = self.patch(protocol2, "sendNotify")
+        with TwistedLoggerFixture() as logger:
+            yield factory.onNotifyBatch(
+                mock_class, sentinel.channel, "update", [1, 2, 3])
+        for mock_sendNotify in (mock_sendNotify1, mock_sendNotify2):
+            self.assertThat(
+                mock_sendNotify, MockCallsMatch(
+                    call("name", "update", 1),
+                    call("name", "update", 3)))
+        self.assertIn(
+            "Failed to process update notification", logger.output)
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test_onNotifyBatch_retries_batch_on_retryable_failure(self):
+        user = yield deferToDatabase(self.make_user)
+        protocol1, factory = self.make_protocol_with_factory(user=user)
+        protocol2 = self.add_client_to_factory(factory, user)
+        failures = [make_serialization_failure()]
+
+        def on_listen(channel, action, obj_id):
+            if obj_id == 2 and len(failures) != 0:
+                raise failures.pop()
+            return ("name", action, obj_id)
+
+        mock_class = MagicMock()
+        mock_class.return_value.on_listen.side_effect = on_listen
+        mock_sendNotify1 = self.patch(protocol1, "sendNotify")
+        mock_sendNotify2 = self.patch(protocol2, "sendNotify")
+        yield factory.onNotifyBatch(
+            mock_class, sentinel.channel, "update", [1, 2, 3])
+        for mock_sendNotify in (mock_sendNotify1, mock_sendNotify2):
+            self.assertThat(
+                mock_sendNotify, MockCallsMatch(
+                    call("name", "update", 1),
+                    call("name", "update", 2),
+                    call("name", "update", 3)))
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test_onNotify_does_nothing_without_clients(self):
+        factory = self.make_factory()
+        mock_deferToDatabase = self.patch(protocol_module, "deferToDatabase")
+        mock_class = MagicMock()
+        yield factory.onNotify(
+            mock_class, sentinel.channel, sentinel.action, sentinel.obj_id)
+        self.assertThat(mock_deferToDatabase, MockNotCalled())
+
     @wait_for_reactor
     @inlineCallbacks
     def test_updateRackController_calls_onNotify_for_controller_update(self):
@@ -175,9 +175,8 @@ def check_version(version):
         raise UnknownMetadataVersion("Unknown metadata version: %s" % version)
 
 
-def add_event_to_node_event_log(
-        node, origin, action, description, result=None, created=None):
-    """Add an entry to the node's event log."""
+def get_node_event_type_name(node, result=None):
+    """Return the name of the event type to log a status message under."""
     if node.status == NODE_STATUS.COMMISSIONING:
         if result in ['SUCCESS', None]:
             type_name = EVENT_TYPES.NODE_COMMISSIONING_EVENT
@@ -201,7 +200,13 @@ def add_event_to_node_event_log(
         type_name = EVENT_TYPES.REQUEST_CONTROLLER_REFRESH
     else:
         type_name = EVENT_TYPES.NODE_STATUS_EVENT
+    return type_name
 
+
+def add_event_to_node_event_log(
+        node, origin, action, description, result=None, created=None):
+    """Add an entry to the node's event log."""
+    type_name = get_node_event_type_name(node, result)
     event_details = EVENT_DETAILS[type_name]
     return Event.objects.register_event_and_event_type(
         node.system_id, type_name, type_level=event_details.level,
@@ -210,6 +215,26 @@ def add_event_to_node_event_log(
         event_description="'%s' %s" % (origin, description), created=created)
 
 
+def add_events_to_node_event_log(events):
+    """Add entries to the event logs of several nodes at once.
+
+    :param events: A mapping of nodes to lists of ``(origin, action,
+        description, result, created)`` tuples, as the arguments to
+        `add_event_to_node_event_log`.
+    """
+    def gen_events():
+        for node, node_events in events.items():
+            for origin, action, description, result, created in node_events:
+                type_name = get_node_event_type_name(node, result)
+                event_details = EVENT_DETAILS[type_name]
+                yield (
+                    node, type_name, event_details.description,
+                    event_details.level, action,
+                    "'%s' %s" % (origin, description), created)
+
+    return Event.objects.register_events_and_event_types(gen_events())
+
+
 def process_file(results, script_set, script_name, content, request):
     """Process a file sent to MAAS over the metadata service."""
 
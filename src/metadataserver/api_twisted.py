@@ -5,9 +5,14 @@
 
 import base64
 import bz2
-from collections import defaultdict
+from collections import (
+    Counter,
+    defaultdict,
+    OrderedDict,
+)
 from datetime import datetime
 import json
+from time import monotonic
 
 from django.db import DatabaseError
 from maasserver.api.utils import extract_oauth_key_from_auth_header
@@ -27,6 +32,7 @@ from maasserver.utils.threads import deferToDatabase
 from metadataserver import logger
 from metadataserver.api import (
     add_event_to_node_event_log,
+    add_events_to_node_event_log,
     process_file,
 )
 from metadataserver.enum import SCRIPT_STATUS
@@ -38,6 +44,7 @@ from provisioningserver.logger import LegacyLogger
 from provisioningserver.utils.twisted import deferred
 from twisted.application.internet import TimerService
 from twisted.internet import reactor
+from twisted.internet.threads import deferToThread
 from twisted.web.resource import Resource
 from twisted.web.server import NOT_DONE_YET
 
@@ -181,17 +188,25 @@ class StatusHandlerResource(Resource):
 
 
 class StatusWorkerService(TimerService, object):
-    """Service to update nodes from recieved status messages."""
+    """Service to update nodes from recieved status messages.
+
+    :ivar batch: When true, all the messages queued in each interval are
+        processed together in one transaction; see `_processMessagesBatch`.
+        Otherwise each message is processed in its own transaction.
+    :ivar stats: Counts of messages and batches processed.
+    """
 
     check_interval = 60  # Every second.
 
-    def __init__(self, dbtasks, clock=reactor):
+    def __init__(self, dbtasks, clock=reactor, batch=True):
         # Call self._tryUpdateNodes() every self.check_interval.
         super(StatusWorkerService, self).__init__(
             self.check_interval, self._tryUpdateNodes)
         self.dbtasks = dbtasks
         self.clock = clock
+        self.batch = batch
         self.queue = defaultdict(list)
+        self.stats = Counter()
 
     def _tryUpdateNodes(self):
         if len(self.queue) != 0:
@@ -220,8 +235,77 @@ class StatusWorkerService(TimerService, object):
         # We're not going to wait for them to be processed because we can't /
         # don't apply back-pressure to those systems that are producing these
         # messages anyway.
+        if self.batch:
+            if len(tasks) != 0:
+                self.dbtasks.addTask(self._processMessagesBatch, tasks)
+        else:
+            for node, messages in tasks:
+                self.dbtasks.addTask(self._processMessages, node, messages)
+
+    def _processMessagesBatch(self, tasks):
+        # Push the messages for all nodes into the database together. This
+        # should be called in a non-reactor thread with a pre-existing
+        # connection (e.g. via deferToDatabase).
+        if in_transaction():
+            raise TransactionManagementError(
+                "_processMessagesBatch must be called from "
+                "outside of a transaction.")
+        started = monotonic()
+        try:
+            self._processMessageBatch(tasks)
+        except:
+            log.err(
+                None, "Failed to process batch of status messages; "
+                "processing them one at a time instead.")
+            for node, messages in tasks:
+                self._processMessages(node, messages)
+        else:
+            for node, messages in tasks:
+                try:
+                    self._updateLastPing(node, messages[-1])
+                except:
+                    log.err(
+                        None,
+                        "Failed to update last ping "
+                        "for node: %s" % node.hostname)
+        self._recordBatch(tasks, monotonic() - started)
+
+    def _recordBatch(self, tasks, elapsed):
+        """Record statistics for a batch of messages processed together."""
+        count = sum(len(messages) for _, messages in tasks)
+        self.stats["batches"] += 1
+        self.stats["messages"] += count
+        self.stats["largest_batch"] = max(self.stats["largest_batch"], count)
+        self.stats["seconds"] += elapsed
+        log.debug(
+            "Processed {count} status messages for {nodes} nodes in "
+            "{elapsed:.3f}s ({rate:.0f} messages/sec).", count=count,
+            nodes=len(tasks), elapsed=elapsed,
+            rate=(count / elapsed if elapsed > 0 else 0))
+
+    @transactional
+    def _processMessageBatch(self, tasks):
+        """Process the messages for several nodes in one transaction.
+
+        The events for all the messages are inserted together, then each
+        node's messages are processed in order, as they would be one at a
+        time, so that no status transition is missed.
+        """
+        events = OrderedDict()
         for node, messages in tasks:
-            self.dbtasks.addTask(self._processMessages, node, messages)
+            events[node] = [
+                (message['origin'], message['name'],
+                 message['description'], message.get('result', None),
+                 message['timestamp'])
+                for message in messages
+            ]
+        add_events_to_node_event_log(events)
+        for node, messages in tasks:
+            for message in messages:
+                if len(message.get('files', [])) > 0:
+                    self._processFiles(node, message)
+                if self._is_top_level(message['name']):
+                    self._processStatusTransition(node, message)
 
     def _processMessages(self, node, messages):
         # Push the messages into the database, recording them for this node.
@@ -299,6 +383,11 @@ class StatusWorkerService(TimerService, object):
             node, origin, activity_name, description, result,
             message['timestamp'])
 
+        self._processFiles(node, message)
+        self._processStatusTransition(node, message)
+
+    def _processFiles(self, node, message):
+        """Store the files sent in `message` with their `ScriptResult`."""
         # Group files together with the ScriptResult they belong.
         results = {}
         for sent_file in message.get('files', []):
@@ -320,16 +409,26 @@ class StatusWorkerService(TimerService, object):
                     "Invalid status for saving files: %d" % node.status)
 
             script_name = sent_file['path']
-            content = self._retrieve_content(
-                compression=sent_file.get('compression', None),
-                encoding=sent_file['encoding'],
-                content=sent_file['content'])
+            content = sent_file.get('decoded_content', None)
+            if content is None:
+                content = self._retrieve_content(
+                    compression=sent_file.get('compression', None),
+                    encoding=sent_file['encoding'],
+                    content=sent_file['content'])
             process_file(results, script_set, script_name, content, sent_file)
 
         # Commit results to the database.
         for script_result, args in results.items():
             script_result.store_result(**args)
 
+    def _processStatusTransition(self, node, message):
+        """Change the status of `node` if `message` ends a top-level event."""
+        event_type = message['event_type']
+        origin = message['origin']
+        activity_name = message['name']
+        description = message['description']
+        result = message.get('result', None)
+
         # At the end of a top-level event, we change the node status.
         save_node = False
         if self._is_top_level(activity_name) and event_type == 'finish':
@@ -386,6 +485,24 @@ class StatusWorkerService(TimerService, object):
 
         return decompress(decode(content.encode("ascii")))
 
+    def _decodeFiles(self, message):
+        """Decode the files sent in `message` ahead of processing it.
+
+        Decompressing and decoding large files is slow, so this is done here,
+        outside of a database thread. Each decoded file is stored with the
+        key ``decoded_content``. Files that cannot be decoded are left alone;
+        the error is raised when the message is processed.
+        """
+        for sent_file in message.get('files', []):
+            try:
+                sent_file['decoded_content'] = self._retrieve_content(
+                    compression=sent_file.get('compression', None),
+                    encoding=sent_file['encoding'],
+                    content=sent_file['content'])
+            except Exception:
+                pass
+        return message
+
     def _is_top_level(self, activity_name):
         """Top-level events do not have slashes in their names."""
         return '/' not in activity_name
@@ -433,8 +550,14 @@ class StatusWorkerService(TimerService, object):
             message['event_type'] == 'finish')
         has_files = len(message.get('files', [])) > 0
         if is_starting_event or is_final_event or has_files:
-            d = deferToDatabase(
-                self._processMessageNow, authorization, message)
+            if has_files:
+                d = deferToThread(self._decodeFiles, message)
+                d.addCallback(
+                    lambda message: deferToDatabase(
+                        self._processMessageNow, authorization, message))
+            else:
+                d = deferToDatabase(
+                    self._processMessageNow, authorization, message)
             d.addErrback(
                 log.err, "Failed to process status message instantly.")
             return d
@@ -11,6 +11,7 @@ from datetime import datetime
 from io import BytesIO
 import json
 from unittest.mock import (
+    ANY,
     call,
     Mock,
     sentinel,
@@ -41,6 +42,7 @@ from maastesting.matchers import (
     MockNotCalled,
 )
 from maastesting.testcase import MAASTestCase
+from maastesting.twisted import TwistedLoggerFixture
 from metadataserver import api
 from metadataserver.api_twisted import (
     StatusHandlerResource,
@@ -207,7 +209,7 @@ class TestStatusWorkerServiceTransactional(MAASTransactionServerTestCase):
         }
         dbtasks = Mock()
         dbtasks.addTask = Mock()
-        worker = StatusWorkerService(dbtasks)
+        worker = StatusWorkerService(dbtasks, batch=False)
         for node, token in nodes_with_tokens:
             for message in node_messages[node]:
                 worker.queueMessage(token.key, message)
@@ -221,6 +223,81 @@ class TestStatusWorkerServiceTransactional(MAASTransactionServerTestCase):
             for node, messages in node_messages.items()
         ]))
 
+    @wait_for_reactor
+    @inlineCallbacks
+    def test__tryUpdateNodes_sends_one_batch_to_dbtasks(self):
+        nodes_with_tokens = yield deferToDatabase(self.make_nodes_with_tokens)
+        node_messages = {
+            node: [
+                self.make_message()
+                for _ in range(3)
+            ]
+            for node, _ in nodes_with_tokens
+        }
+        dbtasks = Mock()
+        dbtasks.addTask = Mock()
+        worker = StatusWorkerService(dbtasks)
+        for node, token in nodes_with_tokens:
+            for message in node_messages[node]:
+                worker.queueMessage(token.key, message)
+        yield worker._tryUpdateNodes()
+        self.assertThat(
+            dbtasks.addTask, MockCalledOnceWith(
+                worker._processMessagesBatch, ANY))
+        [tasks] = dbtasks.addTask.call_args[0][1:]
+        self.assertThat(tasks, MatchesSetwise(*[
+            MatchesListwise([Equals(node), Equals(messages)])
+            for node, messages in node_messages.items()
+        ]))
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test__processMessagesBatch_fails_when_in_transaction(self):
+        worker = StatusWorkerService(sentinel.dbtasks)
+        with ExpectedException(TransactionManagementError):
+            yield deferToDatabase(
+                transactional(worker._processMessagesBatch),
+                [(sentinel.node, [sentinel.message])])
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test__processMessagesBatch_updates_last_ping_and_stats(self):
+        worker = StatusWorkerService(sentinel.dbtasks)
+        mock_processMessageBatch = self.patch(worker, "_processMessageBatch")
+        mock_updateLastPing = self.patch(worker, "_updateLastPing")
+        tasks = [
+            (sentinel.node1, [sentinel.message1, sentinel.message2]),
+            (sentinel.node2, [sentinel.message3]),
+        ]
+        yield deferToDatabase(worker._processMessagesBatch, tasks)
+        self.expectThat(
+            mock_processMessageBatch, MockCalledOnceWith(tasks))
+        self.expectThat(
+            mock_updateLastPing, MockCallsMatch(
+                call(sentinel.node1, sentinel.message2),
+                call(sentinel.node2, sentinel.message3)))
+        self.expectThat(worker.stats["batches"], Equals(1))
+        self.expectThat(worker.stats["messages"], Equals(3))
+        self.expectThat(worker.stats["largest_batch"], Equals(3))
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test__processMessagesBatch_falls_back_to_one_at_a_time(self):
+        worker = StatusWorkerService(sentinel.dbtasks)
+        mock_processMessageBatch = self.patch(worker, "_processMessageBatch")
+        mock_processMessageBatch.side_effect = factory.make_exception()
+        mock_processMessages = self.patch(worker, "_processMessages")
+        tasks = [
+            (sentinel.node1, [sentinel.message1]),
+            (sentinel.node2, [sentinel.message2]),
+        ]
+        with TwistedLoggerFixture():
+            yield deferToDatabase(worker._processMessagesBatch, tasks)
+        self.assertThat(
+            mock_processMessages, MockCallsMatch(
+                call(sentinel.node1, [sentinel.message1]),
+                call(sentinel.node2, [sentinel.message2])))
+
     @wait_for_reactor
     @inlineCallbacks
     def test__processMessages_fails_when_in_transaction(self):
@@ -543,6 +620,105 @@ class TestStatusWorkerService(MAASServerTestCase):
             NODE_STATUS.FAILED_DISK_ERASING, reload_object(node).status)
         self.assertEqual(user, node.owner)
 
+    def test_processMessageBatch_inserts_events_for_all_nodes(self):
+        nodes = [
+            factory.make_Node(status=NODE_STATUS.DEPLOYING)
+            for _ in range(3)
+        ]
+        worker = StatusWorkerService(sentinel.dbtasks)
+        tasks = [
+            (node, [
+                {
+                    'event_type': 'progress',
+                    'origin': 'curtin',
+                    'name': 'cmd-install/stage-%d' % index,
+                    'description': 'Installing',
+                    'timestamp': datetime.utcnow(),
+                }
+                for index in range(2)
+            ])
+            for node in nodes
+        ]
+        worker._processMessageBatch(tasks)
+        for node in nodes:
+            self.assertItemsEqual(
+                ['cmd-install/stage-0', 'cmd-install/stage-1'],
+                Event.objects.filter(node=node).values_list(
+                    'action', flat=True))
+
+    def test_processMessageBatch_applies_final_status_transition(self):
+        node = factory.make_Node(
+            interface=True, status=NODE_STATUS.COMMISSIONING)
+        worker = StatusWorkerService(sentinel.dbtasks)
+        messages = [
+            {
+                'event_type': 'finish',
+                'result': result,
+                'origin': 'curtin',
+                'name': 'commissioning',
+                'description': 'Commissioning',
+                'timestamp': datetime.utcnow(),
+            }
+            for result in ('SUCCESS', 'FAILURE')
+        ]
+        worker._processMessageBatch([(node, messages)])
+        self.assertEqual(
+            NODE_STATUS.FAILED_COMMISSIONING, reload_object(node).status)
+
+    def test_processMessageBatch_applies_every_status_transition(self):
+        node = factory.make_Node(interface=True, status=NODE_STATUS.DEPLOYING)
+        worker = StatusWorkerService(sentinel.dbtasks)
+        messages = [
+            {
+                'event_type': 'finish',
+                'result': 'FAILURE',
+                'origin': 'curtin',
+                'name': 'cmd-install',
+                'description': 'Command Install',
+                'timestamp': datetime.utcnow(),
+            },
+            {
+                'event_type': 'start',
+                'origin': 'curtin',
+                'name': 'cmd-erase',
+                'description': 'Erasing disk',
+                'timestamp': datetime.utcnow(),
+            },
+        ]
+        worker._processMessageBatch([(node, messages)])
+        self.assertEqual(
+            NODE_STATUS.FAILED_DEPLOYMENT, reload_object(node).status)
+
+    def test_decodeFiles_stores_decoded_content(self):
+        contents = b'These are the contents of the file.'
+        message = {
+            'files': [
+                {
+                    "path": "sample.txt",
+                    "encoding": "base64",
+                    "compression": "bzip2",
+                    "content": encode_as_base64(bz2.compress(contents)),
+                }
+            ]
+        }
+        worker = StatusWorkerService(sentinel.dbtasks)
+        worker._decodeFiles(message)
+        self.assertEqual(contents, message['files'][0]['decoded_content'])
+
+    def test_decodeFiles_leaves_undecodable_files(self):
+        message = {
+            'files': [
+                {
+                    "path": "sample.txt",
+                    "encoding": "uuencode",
+                    "content": factory.make_name("content"),
+                }
+            ]
+        }
+        worker = StatusWorkerService(sentinel.dbtasks)
+        worker._decodeFiles(message)
+        self.assertNotIn('decoded_content', message['files'][0])
+
     def test_status_with_file_bad_encoder_fails(self):
         node = factory.make_Node(
             interface=True, status=NODE_STATUS.COMMISSIONING)
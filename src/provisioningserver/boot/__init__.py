@@ -12,7 +12,6 @@ from abc import (
     ABCMeta,
     abstractproperty,
 )
-from errno import ENOENT
 from io import BytesIO
 import os
 from typing import Dict
@@ -37,8 +36,8 @@ from provisioningserver.utils.fs import (
 )
 from provisioningserver.utils.network import find_mac_via_arp
 from provisioningserver.utils.registry import Registry
+from provisioningserver.utils.templates import templates
 from provisioningserver.utils.twisted import asynchronous
-import tempita
 from tftp.backend import IReader
 from twisted.internet.defer import (
     inlineCallbacks,
@@ -290,23 +289,22 @@ class BootMethod(metaclass=ABCMeta):
     def get_template(self, purpose, arch, subarch):
         """Gets the best avaliable template for the boot method.
 
-        Templates are loaded each time here so that they can be changed on
-        the fly without restarting the provisioning server.
+        Templates are cached, but are reloaded when their files change, so
+        that they can be changed on the fly without restarting the
+        provisioning server.
 
         :param purpose: The boot purpose, e.g. "local".
         :param arch: Main machine architecture.
         :param subarch: Sub-architecture, or "generic" if there is none.
-        :return: `tempita.Template`
+        :return: `tempita.Template`, which is shared and must not be
+            modified.
         """
         pxe_templates_dir = self.get_template_dir()
         for filename in gen_template_filenames(purpose, arch, subarch):
             template_name = os.path.join(pxe_templates_dir, filename)
-            try:
-                return tempita.Template.from_filename(
-                    template_name, encoding="UTF-8")
-            except IOError as error:
-                if error.errno != ENOENT:
-                    raise
+            template = templates.get(template_name)
+            if template is not None:
+                return template
         else:
             error = (
                 "No PXE template found in %r for:\n"
@@ -38,6 +38,7 @@ from provisioningserver.utils.fs import (
     atomic_symlink,
     tempdir,
 )
+from provisioningserver.utils.templates import templates
 import tempita
 from twisted.internet.defer import (
     inlineCallbacks,
@@ -97,10 +98,12 @@ class TestBootMethod(MAASTestCase):
         self.assertSequenceEqual(expected, list(observed))
 
     def test_get_pxe_template(self):
+        templates_dir = self.make_dir()
         method = FakeBootMethod()
+        method.get_template_dir = lambda: templates_dir
         purpose = factory.make_name("purpose")
         arch, subarch = factory.make_names("arch", "subarch")
-        filename = factory.make_name("filename")
+        filename = os.path.basename(factory.make_file(templates_dir))
         # Set up the mocks that we've patched in.
         gen_filenames = self.patch(boot, "gen_template_filenames")
         gen_filenames.return_value = [filename]
@@ -131,6 +134,17 @@ class TestBootMethod(MAASTestCase):
             generic_template,
             method.get_template(purpose, arch, subarch).name)
 
+    def test_get_template_parses_template_once(self):
+        templates_dir = self.make_dir()
+        method = FakeBootMethod()
+        method.get_template_dir = lambda: templates_dir
+        factory.make_file(templates_dir, 'config.template')
+        names = factory.make_names("purpose", "arch", "subarch")
+        template = method.get_template(*names)
+        loads = templates.loads
+        self.assertIs(template, method.get_template(*names))
+        self.assertEqual(loads, templates.loads)
+
     def test_get_template_not_found(self):
         mock_try_send_rack_event = self.patch(boot, 'try_send_rack_event')
         # It is a critical and unrecoverable error if the default template
@@ -0,0 +1,524 @@
+# Copyright 2017 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Client for the OMAPI protocol, for amending objects in the DHCP server.
+
+This speaks the protocol that `omshell` does, directly, so that many host
+maps can be changed over one authenticated connection without starting a
+process for each. Requests are pipelined: several are written before their
+responses are read.
+"""
+
+__all__ = [
+    "OmapiClient",
+    "OmapiConnectionError",
+    "OmapiError",
+    ]
+
+from base64 import b64decode
+import hashlib
+import hmac
+import random
+import socket
+import struct
+
+from netaddr import (
+    EUI,
+    IPAddress,
+)
+from provisioningserver.logger import get_maas_logger
+from provisioningserver.utils import typed
+
+
+maaslog = get_maas_logger("dhcp.omapi")
+
+
+OMAPI_PROTOCOL_VERSION = 100
+OMAPI_HEADER_SIZE = 24
+
+# Operations.
+OMAPI_OP_OPEN = 1
+OMAPI_OP_REFRESH = 2
+OMAPI_OP_UPDATE = 3
+OMAPI_OP_NOTIFY = 4
+OMAPI_OP_STATUS = 5
+OMAPI_OP_DELETE = 6
+
+# Result codes from ISC's libisc that are of interest.
+ISC_R_SUCCESS = 0
+ISC_R_EXISTS = 18
+ISC_R_NOTFOUND = 23
+ISC_R_IOERROR = 26
+
+# The name of the only algorithm that the DHCP server's OMAPI supports.
+HMAC_MD5_ALGORITHM = b"hmac-md5.SIG-ALG.REG.INT."
+
+# The name of the key in the DHCP server's configuration; see `Omshell`.
+OMAPI_KEY_NAME = b"omapi_key"
+
+
+class OmapiError(Exception):
+    """The DHCP server refused an OMAPI request.
+
+    :ivar result: The ISC result code, or `None`.
+    """
+
+    def __init__(self, message, result=None):
+        super(OmapiError, self).__init__(message)
+        self.result = result
+
+
+class OmapiConnectionError(OmapiError):
+    """The DHCP server could not be reached, or the connection failed."""
+
+
+def pack_int(value):
+    """Pack `value` as a value in an OMAPI name-value list."""
+    return struct.pack("!I", value)
+
+
+def pack_name_values(items):
+    """Pack the `(name, value)` pairs in `items` as an OMAPI list."""
+    data = []
+    for name, value in items:
+        data.append(struct.pack("!H", len(name)))
+        data.append(name)
+        data.append(struct.pack("!I", len(value)))
+        data.append(value)
+    data.append(struct.pack("!H", 0))
+    return b"".join(data)
+
+
+class OmapiMessage:
+    """A message in the OMAPI protocol.
+
+    :ivar message: A list of `(name, value)` pairs about the request.
+    :ivar obj: A list of `(name, value)` pairs for the object's attributes.
+    """
+
+    def __init__(
+            self, opcode, handle=0, tid=0, rid=0, message=(), obj=(),
+            authid=0, signature=b""):
+        self.opcode = opcode
+        self.handle = handle
+        self.tid = tid
+        self.rid = rid
+        self.message = list(message)
+        self.obj = list(obj)
+        self.authid = authid
+        self.signature = signature
+
+    def get_message(self, name, default=None):
+        return dict(self.message).get(name, default)
+
+    def get_obj(self, name, default=None):
+        return dict(self.obj).get(name, default)
+
+    def pack(self, authenticator=None):
+        """Return the message as sent on the wire.
+
+        :param authenticator: Sign with this `OmapiAuthenticator`, if given.
+        """
+        if authenticator is None:
+            authid, authlen = 0, 0
+        else:
+            authid, authlen = authenticator.authid, authenticator.size
+        signed = b"".join((
+            struct.pack(
+                "!IIIII", authlen, self.opcode, self.handle,
+                self.tid, self.rid),
+            pack_name_values(self.message),
+            pack_name_values(self.obj),
+        ))
+        if authenticator is None:
+            signature = b""
+        else:
+            signature = authenticator.sign(signed)
+        return struct.pack("!I", authid) + signed + signature
+
+
+class OmapiAuthenticator:
+    """Sign OMAPI messages with an HMAC-MD5 shared key."""
+
+    size = 16
+
+    def __init__(self, shared_key, name=OMAPI_KEY_NAME):
+        self.name = name
+        self.key = b64decode(shared_key)
+        self.authid = 0
+
+    def sign(self, data):
+        return hmac.new(self.key, data, hashlib.md5).digest()
+
+
+def make_host_name(mac_address):
+    """Return the name under which MAAS keeps the host map for a MAC.
+
+    The "name" is not a host name; it's an identifier used within the DHCP
+    server. See `Omshell.create` for why the MAC address is used.
+    """
+    return mac_address.replace(':', '-').encode("ascii")
+
+
+class OmapiClient:
+    """A client for the DHCP server's OMAPI.
+
+    The connection is made when first needed and is kept open until `close`
+    is called, or the client is used as a context manager and the context
+    exits. The `*_hosts` methods pipeline their requests, `window` at a time,
+    and return a list with an `OmapiError` or `None` for each host in the
+    order given. They raise `OmapiConnectionError` if the DHCP server cannot
+    be reached.
+
+    :param server_address: The address for the DHCP server (ip or hostname)
+    :param shared_key: An HMAC-MD5 key, as described for `Omshell`.
+    :param server_port: The port on which the DHCP server listens for OMAPI
+        connections; by default the one that MAAS configures.
+    """
+
+    def __init__(
+            self, server_address, shared_key, ipv6=False, server_port=None,
+            window=64, timeout=30.0):
+        self.server_address = server_address
+        self.shared_key = shared_key
+        self.ipv6 = ipv6
+        if server_port is not None:
+            self.server_port = server_port
+        elif ipv6 is True:
+            self.server_port = 7912
+        else:
+            self.server_port = 7911
+        self.window = window
+        self.timeout = timeout
+        self._socket = None
+        self._buffer = b""
+        self._authenticator = None
+        self._tid = random.getrandbits(31)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Close the connection to the DHCP server, if it is open."""
+        if self._socket is not None:
+            try:
+                self._socket.close()
+            finally:
+                self._socket = None
+                self._buffer = b""
+                self._authenticator = None
+
+    def connect(self, authenticate=True):
+        """Connect to the DHCP server, if not already connected."""
+        if self._socket is not None:
+            return
+        try:
+            self._socket = socket.create_connection(
+                (self.server_address, self.server_port), self.timeout)
+            self._socket.setsockopt(
+                socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._socket.sendall(struct.pack(
+                "!II", OMAPI_PROTOCOL_VERSION, OMAPI_HEADER_SIZE))
+            version, header_size = struct.unpack("!II", self._recv(8))
+        except OSError as error:
+            self.close()
+            raise OmapiConnectionError(
+                "Could not connect to the DHCP server: %s" % error)
+        if (version != OMAPI_PROTOCOL_VERSION or
+                header_size != OMAPI_HEADER_SIZE):
+            self.close()
+            raise OmapiConnectionError(
+                "Unsupported OMAPI protocol version %d." % version)
+        if authenticate:
+            self._authenticate()
+
+    def _authenticate(self):
+        authenticator = OmapiAuthenticator(self.shared_key)
+        [response] = self._pipeline([OmapiMessage(
+            OMAPI_OP_OPEN, message=[(b"type", b"authenticator")],
+            obj=[(b"name", authenticator.name),
+                 (b"algorithm", HMAC_MD5_ALGORITHM)])])
+        if response.opcode != OMAPI_OP_UPDATE or response.handle == 0:
+            self.close()
+            raise OmapiConnectionError(
+                "The DHCP server did not accept the OMAPI key.")
+        authenticator.authid = response.handle
+        self._authenticator = authenticator
+
+    def _recv(self, size):
+        """Receive exactly `size` bytes."""
+        while len(self._buffer) < size:
+            data = self._socket.recv(max(size - len(self._buffer), 65536))
+            if len(data) == 0:
+                raise ConnectionResetError(
+                    "The DHCP server closed the connection.")
+            self._buffer += data
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def _recv_name_values(self, raw):
+        items = []
+        while True:
+            data = self._recv(2)
+            raw.append(data)
+            [name_length] = struct.unpack("!H", data)
+            if name_length == 0:
+                return items
+            name = self._recv(name_length)
+            data = self._recv(4)
+            [value_length] = struct.unpack("!I", data)
+            value = self._recv(value_length)
+            raw.extend((name, data, value))
+            items.append((name, value))
+
+    def _recv_message(self):
+        header = self._recv(OMAPI_HEADER_SIZE)
+        authid, authlen, opcode, handle, tid, rid = struct.unpack(
+            "!IIIIII", header)
+        raw = [header[4:]]
+        message = self._recv_name_values(raw)
+        obj = self._recv_name_values(raw)
+        signature = self._recv(authlen)
+        authenticator = self._authenticator
+        if authenticator is not None and authid == authenticator.authid:
+            expected = authenticator.sign(b"".join(raw))
+            if not hmac.compare_digest(expected, signature):
+                raise ConnectionAbortedError(
+                    "The DHCP server's response was not signed correctly.")
+        return OmapiMessage(
+            opcode, handle, tid, rid, message, obj, authid, signature)
+
+    def _next_tid(self):
+        self._tid = (self._tid + 1) & 0x7fffffff
+        return self._tid
+
+    def _pipeline(self, messages):
+        """Send `messages`, returning the responses in the same order.
+
+        No more than `window` requests are outstanding at any time, so that
+        neither side blocks writing while the other is not reading.
+        """
+        responses = [None] * len(messages)
+        pending = {}
+        sent = 0
+        try:
+            while sent < len(messages) or len(pending) > 0:
+                data = []
+                while sent < len(messages) and len(pending) < self.window:
+                    message = messages[sent]
+                    message.tid = self._next_tid()
+                    pending[message.tid] = sent
+                    data.append(message.pack(self._authenticator))
+                    sent += 1
+                if len(data) > 0:
+                    self._socket.sendall(b"".join(data))
+                response = self._recv_message()
+                # Anything else, like a notification, is not for us.
+                if response.rid in pending:
+                    responses[pending.pop(response.rid)] = response
+        except OSError as error:
+            self.close()
+            raise OmapiConnectionError(
+                "Lost connection to the DHCP server: %s" % error)
+        return responses
+
+    def _request(self, messages, retry=True):
+        """Send `messages` over an authenticated connection.
+
+        If a connection that was already open has since been closed by the
+        DHCP server, perhaps because it has restarted, connect again and
+        send them once more, unless `retry` is false. That is safe for the
+        requests made here, which all have the same effect if repeated, but
+        not for those that refer to handles from the earlier connection.
+        """
+        if len(messages) == 0:
+            return []
+        reconnect = retry and self._socket is not None
+        self.connect()
+        try:
+            return self._pipeline(messages)
+        except OmapiConnectionError:
+            if not reconnect:
+                raise
+        self.connect()
+        return self._pipeline(messages)
+
+    def _open(self, object_type, obj, create=False):
+        """Return a message that opens, or creates, an object."""
+        message = [(b"type", object_type)]
+        if create:
+            message = [
+                (b"create", pack_int(1)),
+                (b"exclusive", pack_int(1)),
+            ] + message
+        return OmapiMessage(OMAPI_OP_OPEN, message=message, obj=obj)
+
+    def _get_error(self, response, *ignore):
+        """Return an `OmapiError` for a failed request, or `None`.
+
+        :param ignore: Result codes that are to be considered a success.
+        """
+        if response.opcode != OMAPI_OP_STATUS:
+            return None
+        result = response.get_message(b"result")
+        if result is not None:
+            [result] = struct.unpack("!I", result)
+        if result == ISC_R_SUCCESS or result in ignore:
+            return None
+        text = response.get_message(b"message", b"")
+        text = text.decode("ascii", "replace")
+        if len(text) == 0:
+            text = "OMAPI request failed with result %r." % (result,)
+        return OmapiError(text, result)
+
+    def _open_then(self, opens, make_second, *ignore):
+        """Open objects, then send a second request for each one found.
+
+        :param opens: Messages to open the objects.
+        :param make_second: Called with the index in `opens` and the handle
+            of each opened object to return the message to send for it.
+        :param ignore: Result codes that are considered a success when
+            opening, in which case no second request is sent.
+        :return: A list of errors, as described for `OmapiClient`.
+        """
+        errors = [None] * len(opens)
+        seconds, indexes = [], []
+        for index, response in enumerate(self._request(opens)):
+            if response.opcode == OMAPI_OP_UPDATE:
+                seconds.append(make_second(index, response.handle))
+                indexes.append(index)
+            else:
+                errors[index] = self._get_error(response, *ignore)
+        # Handles are only valid on the connection that opened them.
+        seconds = self._request(seconds, retry=False)
+        for index, response in zip(indexes, seconds):
+            errors[index] = self._get_error(response)
+            if errors[index] is None and response.opcode not in (
+                    OMAPI_OP_UPDATE, OMAPI_OP_STATUS):
+                errors[index] = OmapiError(
+                    "Unexpected OMAPI response %d." % response.opcode)
+        return errors
+
+    def try_connection(self):
+        """Return whether the DHCP server can be reached."""
+        try:
+            self.connect(authenticate=False)
+        except OmapiConnectionError:
+            return False
+        else:
+            return True
+        finally:
+            self.close()
+
+    def create_hosts(self, hosts):
+        """Create host maps.
+
+        It is not an error if a host map already exists.
+
+        :param hosts: A list of `(mac_address, ip_address)` tuples.
+        """
+        for mac_address, ip_address in hosts:
+            maaslog.debug(
+                "Creating host mapping %s->%s" % (mac_address, ip_address))
+        responses = self._request([
+            self._open(b"host", create=True, obj=[
+                (b"hardware-address", EUI(mac_address).packed),
+                (b"hardware-type", pack_int(1)),
+                (b"ip-address", IPAddress(ip_address).packed),
+                (b"name", make_host_name(mac_address)),
+            ])
+            for mac_address, ip_address in hosts
+        ])
+        # The DHCP server reports an existing host map as an I/O error.
+        return [
+            self._get_error(response, ISC_R_EXISTS, ISC_R_IOERROR)
+            for response in responses
+        ]
+
+    def modify_hosts(self, hosts):
+        """Modify host maps.
+
+        :param hosts: A list of `(mac_address, ip_address)` tuples.
+        """
+        for mac_address, ip_address in hosts:
+            maaslog.debug(
+                "Modifing host mapping %s->%s" % (mac_address, ip_address))
+        opens = [
+            self._open(b"host", obj=[(b"name", make_host_name(mac_address))])
+            for mac_address, _ in hosts
+        ]
+
+        def make_update(index, handle):
+            mac_address, ip_address = hosts[index]
+            return OmapiMessage(OMAPI_OP_UPDATE, handle=handle, obj=[
+                (b"ip-address", IPAddress(ip_address).packed),
+                (b"hardware-address", EUI(mac_address).packed),
+                (b"hardware-type", pack_int(1)),
+            ])
+
+        return self._open_then(opens, make_update)
+
+    def remove_hosts(self, mac_addresses):
+        """Remove host maps.
+
+        It is not an error if a host map does not exist.
+
+        :param mac_addresses: A list of MAC addresses.
+        """
+        for mac_address in mac_addresses:
+            maaslog.debug("Removing host mapping key=%s" % mac_address)
+        opens = [
+            self._open(b"host", obj=[(b"name", make_host_name(mac_address))])
+            for mac_address in mac_addresses
+        ]
+        return self._open_then(
+            opens, lambda index, handle: OmapiMessage(
+                OMAPI_OP_DELETE, handle=handle),
+            ISC_R_NOTFOUND)
+
+    def nullify_leases(self, ip_addresses):
+        """Reset existing leases so they're no longer valid.
+
+        Leases cannot be deleted, so their expiry is set to the epoch
+        instead. It is not an error if a lease does not exist.
+
+        :param ip_addresses: A list of IP addresses.
+        """
+        opens = [
+            self._open(b"lease", obj=[
+                (b"ip-address", IPAddress(ip_address).packed)])
+            for ip_address in ip_addresses
+        ]
+        return self._open_then(
+            opens, lambda index, handle: OmapiMessage(
+                OMAPI_OP_UPDATE, handle=handle,
+                obj=[(b"ends", pack_int(0))]),
+            ISC_R_NOTFOUND)
+
+    def _raise_error(self, errors):
+        [error] = errors
+        if error is not None:
+            raise error
+
+    @typed
+    def create(self, ip_address: str, mac_address: str):
+        """Create a host map; see `create_hosts`."""
+        self._raise_error(self.create_hosts([(mac_address, ip_address)]))
+
+    @typed
+    def modify(self, ip_address: str, mac_address: str):
+        """Modify a host map; see `modify_hosts`."""
+        self._raise_error(self.modify_hosts([(mac_address, ip_address)]))
+
+    @typed
+    def remove(self, mac_address: str):
+        """Remove a host map; see `remove_hosts`."""
+        self._raise_error(self.remove_hosts([mac_address]))
+
+    @typed
+    def nullify_lease(self, ip_address: str):
+        """Reset a lease; see `nullify_leases`."""
+        self._raise_error(self.nullify_leases([ip_address]))
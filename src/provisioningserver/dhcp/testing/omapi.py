@@ -0,0 +1,249 @@
+# Copyright 2017 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""A fake DHCP server's OMAPI, for testing `OmapiClient`."""
+
+__all__ = [
+    "FakeOmapiServer",
+]
+
+from base64 import b64encode
+from itertools import count
+import os
+import socketserver
+import struct
+import threading
+
+from fixtures import Fixture
+from netaddr import (
+    EUI,
+    IPAddress,
+)
+from provisioningserver.dhcp.omapi import (
+    HMAC_MD5_ALGORITHM,
+    ISC_R_IOERROR,
+    ISC_R_NOTFOUND,
+    ISC_R_SUCCESS,
+    OMAPI_HEADER_SIZE,
+    OMAPI_KEY_NAME,
+    OMAPI_OP_DELETE,
+    OMAPI_OP_OPEN,
+    OMAPI_OP_STATUS,
+    OMAPI_OP_UPDATE,
+    OMAPI_PROTOCOL_VERSION,
+    OmapiAuthenticator,
+    OmapiMessage,
+    pack_int,
+)
+
+# The result the DHCP server gives when a request is not authenticated.
+ISC_R_NOPERM = 6
+
+
+class FakeOmapiHandler(socketserver.BaseRequestHandler):
+    """Handle one OMAPI connection to a `FakeOmapiServer`."""
+
+    def setup(self):
+        self.rfile = self.request.makefile("rb")
+        self.authenticator = None
+        self.tids = count(1)
+
+    def finish(self):
+        self.rfile.close()
+
+    def read(self, size):
+        data = self.rfile.read(size)
+        if len(data) < size:
+            raise EOFError()
+        return data
+
+    def read_name_values(self, raw):
+        items = []
+        while True:
+            data = self.read(2)
+            raw.append(data)
+            [name_length] = struct.unpack("!H", data)
+            if name_length == 0:
+                return items
+            name = self.read(name_length)
+            data = self.read(4)
+            [value_length] = struct.unpack("!I", data)
+            value = self.read(value_length)
+            raw.extend((name, data, value))
+            items.append((name, value))
+
+    def read_message(self):
+        header = self.read(OMAPI_HEADER_SIZE)
+        authid, authlen, opcode, handle, tid, rid = struct.unpack(
+            "!IIIIII", header)
+        raw = [header[4:]]
+        message = self.read_name_values(raw)
+        obj = self.read_name_values(raw)
+        signature = self.read(authlen)
+        if authid != 0:
+            if (self.authenticator is None or
+                    authid != self.authenticator.authid or
+                    self.authenticator.sign(b"".join(raw)) != signature):
+                raise EOFError("Bad signature.")
+        return OmapiMessage(
+            opcode, handle, tid, rid, message, obj, authid, signature)
+
+    def handle(self):
+        server = self.server.fake
+        try:
+            self.read(8)
+            self.request.sendall(struct.pack(
+                "!II", OMAPI_PROTOCOL_VERSION, OMAPI_HEADER_SIZE))
+            while True:
+                request = self.read_message()
+                with server.lock:
+                    server.requests += 1
+                    if server.requests == server.disconnect_at:
+                        return
+                    response = self.respond(server, request)
+                response.tid = next(self.tids)
+                response.rid = request.tid
+                if request.authid == 0:
+                    self.request.sendall(response.pack())
+                else:
+                    self.request.sendall(response.pack(self.authenticator))
+        except (EOFError, OSError):
+            pass
+
+    def status(self, result, text=b""):
+        return OmapiMessage(OMAPI_OP_STATUS, message=[
+            (b"result", pack_int(result)), (b"message", text)])
+
+    def respond(self, server, request):
+        if request.opcode == OMAPI_OP_OPEN:
+            object_type = request.get_message(b"type")
+            if object_type == b"authenticator":
+                return self.authenticate(server, request)
+            elif request.authid == 0:
+                return self.status(ISC_R_NOPERM, b"permission denied")
+            elif object_type == b"host":
+                return self.open_host(server, request)
+            elif object_type == b"lease":
+                return self.open_lease(server, request)
+            else:
+                return self.status(ISC_R_NOTFOUND, b"not found")
+        elif request.authid == 0:
+            return self.status(ISC_R_NOPERM, b"permission denied")
+        elif request.handle not in server.handles:
+            return self.status(ISC_R_NOTFOUND, b"not found")
+        elif request.opcode == OMAPI_OP_UPDATE:
+            objects, key = server.handles[request.handle]
+            objects[key].update(request.obj)
+            return OmapiMessage(
+                OMAPI_OP_UPDATE, handle=request.handle,
+                obj=sorted(objects[key].items()))
+        elif request.opcode == OMAPI_OP_DELETE:
+            objects, key = server.handles.pop(request.handle)
+            del objects[key]
+            return self.status(ISC_R_SUCCESS)
+        else:
+            return self.status(ISC_R_NOTFOUND, b"not found")
+
+    def authenticate(self, server, request):
+        if (request.get_obj(b"name") != OMAPI_KEY_NAME or
+                request.get_obj(b"algorithm") != HMAC_MD5_ALGORITHM):
+            return self.status(ISC_R_NOTFOUND, b"not found")
+        self.authenticator = OmapiAuthenticator(server.shared_key)
+        self.authenticator.authid = next(server.handle_ids)
+        return OmapiMessage(
+            OMAPI_OP_UPDATE, handle=self.authenticator.authid)
+
+    def open_object(self, server, objects, key, request):
+        handle = next(server.handle_ids)
+        server.handles[handle] = objects, key
+        return OmapiMessage(
+            OMAPI_OP_UPDATE, handle=handle,
+            obj=sorted(objects[key].items()))
+
+    def open_host(self, server, request):
+        name = request.get_obj(b"name")
+        if request.get_message(b"create") == pack_int(1):
+            if name in server.hosts:
+                # As the ISC DHCP server does for an existing host.
+                return self.status(ISC_R_IOERROR, b"I/O error")
+            server.hosts[name] = dict(request.obj)
+        elif name not in server.hosts:
+            return self.status(ISC_R_NOTFOUND, b"not found")
+        return self.open_object(server, server.hosts, name, request)
+
+    def open_lease(self, server, request):
+        ip_address = request.get_obj(b"ip-address")
+        if ip_address not in server.leases:
+            return self.status(ISC_R_NOTFOUND, b"not found")
+        return self.open_object(server, server.leases, ip_address, request)
+
+
+class FakeOmapiServer(Fixture):
+    """Serve a fake OMAPI on an ephemeral port on the loopback interface.
+
+    Host maps and leases are kept in memory, keyed by their names and their
+    packed IP addresses respectively. Requests must be signed with
+    `shared_key`, as they must be for the DHCP server.
+
+    :ivar disconnect_at: Drop the connection instead of responding to the
+        request with this number, counting from 1 across all connections.
+    """
+
+    def __init__(self, shared_key=None):
+        super(FakeOmapiServer, self).__init__()
+        if shared_key is None:
+            shared_key = b64encode(os.urandom(16)).decode("ascii")
+        self.shared_key = shared_key
+        self.lock = threading.Lock()
+        self.hosts = {}
+        self.leases = {}
+        self.handles = {}
+        self.handle_ids = count(1)
+        self.requests = 0
+        self.disconnect_at = None
+
+    def _setUp(self):
+        self.server = socketserver.ThreadingTCPServer(
+            ("127.0.0.1", 0), FakeOmapiHandler)
+        self.server.daemon_threads = True
+        self.server.fake = self
+        self.addCleanup(self.server.server_close)
+        # Poll often so that shutting down does not hold up each test.
+        thread = threading.Thread(
+            target=self.server.serve_forever, kwargs={"poll_interval": 0.01})
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.shutdown)
+        self.address, self.port = self.server.server_address
+
+    def add_host(self, mac_address, ip_address):
+        """Add a host map as MAAS would have created it."""
+        self.hosts[mac_address.replace(":", "-").encode("ascii")] = {
+            b"name": mac_address.replace(":", "-").encode("ascii"),
+            b"hardware-address": EUI(mac_address).packed,
+            b"hardware-type": pack_int(1),
+            b"ip-address": IPAddress(ip_address).packed,
+        }
+
+    def add_lease(self, ip_address, ends=0x7fffffff):
+        self.leases[IPAddress(ip_address).packed] = {
+            b"ip-address": IPAddress(ip_address).packed,
+            b"ends": pack_int(ends),
+        }
+
+    def get_hosts(self):
+        """Return a dict of MAC address to IP address for each host map."""
+        with self.lock:
+            hosts = list(self.hosts.values())
+        return {
+            ":".join("%02x" % octet for octet in host[b"hardware-address"]):
+            str(IPAddress(int.from_bytes(host[b"ip-address"], "big")))
+            for host in hosts
+        }
+
+    def get_lease_ends(self, ip_address):
+        with self.lock:
+            lease = self.leases[IPAddress(ip_address).packed]
+        [ends] = struct.unpack("!I", lease[b"ends"])
+        return ends
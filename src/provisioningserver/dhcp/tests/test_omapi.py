@@ -0,0 +1,240 @@
+# Copyright 2017 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for the OMAPI client."""
+
+__all__ = []
+
+from base64 import b64encode
+import hashlib
+import hmac
+import os
+import socket
+import struct
+
+from maastesting.factory import factory
+from maastesting.testcase import MAASTestCase
+from netaddr import IPAddress
+from provisioningserver.dhcp import omapi
+from provisioningserver.dhcp.omapi import (
+    ISC_R_NOTFOUND,
+    OMAPI_OP_OPEN,
+    OmapiAuthenticator,
+    OmapiClient,
+    OmapiConnectionError,
+    OmapiError,
+    OmapiMessage,
+    pack_name_values,
+)
+from provisioningserver.dhcp.testing.omapi import FakeOmapiServer
+from testtools.matchers import (
+    AllMatch,
+    Equals,
+    HasLength,
+    Is,
+    MatchesStructure,
+)
+
+
+class TestOmapiMessage(MAASTestCase):
+
+    def test_pack_name_values(self):
+        self.assertEqual(
+            b"\x00\x04name\x00\x00\x00\x05value\x00\x00",
+            pack_name_values([(b"name", b"value")]))
+
+    def test_pack_unsigned(self):
+        message = OmapiMessage(
+            OMAPI_OP_OPEN, handle=2, tid=3, rid=4,
+            message=[(b"type", b"host")])
+        self.assertEqual(
+            struct.pack("!IIIIII", 0, 0, OMAPI_OP_OPEN, 2, 3, 4) +
+            pack_name_values([(b"type", b"host")]) + pack_name_values([]),
+            message.pack())
+
+    def test_pack_signed_covers_everything_but_authid(self):
+        key = os.urandom(16)
+        authenticator = OmapiAuthenticator(b64encode(key))
+        authenticator.authid = 7
+        message = OmapiMessage(
+            OMAPI_OP_OPEN, tid=3, obj=[(b"name", b"foo")])
+        signed = (
+            struct.pack("!IIIII", 16, OMAPI_OP_OPEN, 0, 3, 0) +
+            pack_name_values([]) + pack_name_values([(b"name", b"foo")]))
+        self.assertEqual(
+            struct.pack("!I", 7) + signed +
+            hmac.new(key, signed, hashlib.md5).digest(),
+            message.pack(authenticator))
+
+
+class TestOmapiClient(MAASTestCase):
+
+    def setUp(self):
+        super(TestOmapiClient, self).setUp()
+        self.server = self.useFixture(FakeOmapiServer())
+
+    def make_client(self, **kwargs):
+        client = OmapiClient(
+            self.server.address, self.server.shared_key,
+            server_port=self.server.port, **kwargs)
+        self.addCleanup(client.close)
+        return client
+
+    def make_unreachable_client(self):
+        # Find a port on which nothing is listening.
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            _, port = sock.getsockname()
+        return OmapiClient("127.0.0.1", "", server_port=port)
+
+    def make_hosts(self, count):
+        return [
+            (factory.make_mac_address(), factory.make_ipv4_address())
+            for _ in range(count)
+        ]
+
+    def test_uses_default_ports(self):
+        self.assertEqual(7911, OmapiClient("127.0.0.1", "").server_port)
+        self.assertEqual(
+            7912, OmapiClient("127.0.0.1", "", ipv6=True).server_port)
+
+    def test_try_connection(self):
+        self.assertTrue(self.make_client().try_connection())
+
+    def test_try_connection_fails_when_server_not_listening(self):
+        client = self.make_unreachable_client()
+        self.assertFalse(client.try_connection())
+
+    def test_create_hosts(self):
+        hosts = self.make_hosts(5)
+        errors = self.make_client().create_hosts(hosts)
+        self.assertThat(errors, AllMatch(Is(None)))
+        self.assertEqual(dict(hosts), self.server.get_hosts())
+
+    def test_create_hosts_ignores_existing_hosts(self):
+        hosts = self.make_hosts(2)
+        self.server.add_host(*hosts[0])
+        errors = self.make_client().create_hosts(hosts)
+        self.assertEqual([None, None], errors)
+        self.assertEqual(dict(hosts), self.server.get_hosts())
+
+    def test_create_hosts_pipelines_beyond_window(self):
+        hosts = self.make_hosts(50)
+        errors = self.make_client(window=4).create_hosts(hosts)
+        self.assertThat(errors, AllMatch(Is(None)))
+        self.assertEqual(dict(hosts), self.server.get_hosts())
+
+    def test_create_hosts_with_ipv6_addresses(self):
+        hosts = [(factory.make_mac_address(), factory.make_ipv6_address())]
+        self.make_client().create_hosts(hosts)
+        self.assertEqual(
+            {hosts[0][0]: str(IPAddress(hosts[0][1]))},
+            self.server.get_hosts())
+
+    def test_modify_hosts(self):
+        hosts = self.make_hosts(3)
+        for mac_address, _ in hosts:
+            self.server.add_host(mac_address, factory.make_ipv4_address())
+        errors = self.make_client().modify_hosts(hosts)
+        self.assertEqual([None, None, None], errors)
+        self.assertEqual(dict(hosts), self.server.get_hosts())
+
+    def test_modify_hosts_reports_missing_hosts(self):
+        hosts = self.make_hosts(3)
+        self.server.add_host(hosts[0][0], factory.make_ipv4_address())
+        self.server.add_host(hosts[2][0], factory.make_ipv4_address())
+        errors = self.make_client().modify_hosts(hosts)
+        self.assertThat(errors[0], Is(None))
+        self.assertThat(errors[1], MatchesStructure(
+            result=Equals(ISC_R_NOTFOUND)))
+        self.assertThat(errors[2], Is(None))
+        self.assertEqual(
+            {hosts[0][0]: hosts[0][1], hosts[2][0]: hosts[2][1]},
+            self.server.get_hosts())
+
+    def test_remove_hosts(self):
+        hosts = self.make_hosts(3)
+        for host in hosts:
+            self.server.add_host(*host)
+        errors = self.make_client().remove_hosts(
+            [mac_address for mac_address, _ in hosts[:2]])
+        self.assertEqual([None, None], errors)
+        self.assertEqual(dict(hosts[2:]), self.server.get_hosts())
+
+    def test_remove_hosts_ignores_missing_hosts(self):
+        errors = self.make_client().remove_hosts(
+            [factory.make_mac_address()])
+        self.assertEqual([None], errors)
+
+    def test_nullify_leases(self):
+        ip_address = factory.make_ipv4_address()
+        self.server.add_lease(ip_address)
+        errors = self.make_client().nullify_leases(
+            [ip_address, factory.make_ipv4_address()])
+        self.assertEqual([None, None], errors)
+        self.assertEqual(0, self.server.get_lease_ends(ip_address))
+
+    def test_operations_share_one_connection(self):
+        create_connection = socket.create_connection
+        connect = self.patch(omapi.socket, "create_connection")
+        connect.side_effect = create_connection
+        client = self.make_client()
+        client.create_hosts(self.make_hosts(3))
+        client.remove_hosts([factory.make_mac_address()])
+        client.modify_hosts(self.make_hosts(1))
+        self.assertThat(connect.call_args_list, HasLength(1))
+
+    def test_empty_batches_do_not_connect(self):
+        client = self.make_unreachable_client()
+        self.assertEqual([], client.create_hosts([]))
+        self.assertEqual([], client.modify_hosts([]))
+        self.assertEqual([], client.remove_hosts([]))
+
+    def test_reconnects_when_server_drops_connection(self):
+        client = self.make_client()
+        client.create_hosts(self.make_hosts(1))
+        self.server.disconnect_at = self.server.requests + 1
+        hosts = self.make_hosts(2)
+        self.assertEqual([None, None], client.create_hosts(hosts))
+        self.assertThat(self.server.get_hosts(), HasLength(3))
+
+    def test_does_not_reconnect_a_new_connection(self):
+        # The request after authentication is dropped.
+        self.server.disconnect_at = 2
+        self.assertRaises(
+            OmapiConnectionError, self.make_client().create_hosts,
+            self.make_hosts(1))
+
+    def test_raises_connection_error_when_server_not_listening(self):
+        self.assertRaises(
+            OmapiConnectionError,
+            self.make_unreachable_client().create_hosts,
+            self.make_hosts(1))
+
+    def test_raises_connection_error_when_key_is_wrong(self):
+        client = OmapiClient(
+            self.server.address, b64encode(os.urandom(16)).decode("ascii"),
+            server_port=self.server.port)
+        self.addCleanup(client.close)
+        self.assertRaises(
+            OmapiConnectionError, client.create_hosts, self.make_hosts(1))
+        self.assertEqual({}, self.server.get_hosts())
+
+    def test_single_operations(self):
+        client = self.make_client()
+        [(mac_address, ip_address)] = self.make_hosts(1)
+        client.create(ip_address, mac_address)
+        self.assertEqual(
+            {mac_address: ip_address}, self.server.get_hosts())
+        new_ip_address = factory.make_ipv4_address()
+        client.modify(new_ip_address, mac_address)
+        self.assertEqual(
+            {mac_address: new_ip_address}, self.server.get_hosts())
+        client.remove(mac_address)
+        self.assertEqual({}, self.server.get_hosts())
+
+    def test_single_operations_raise_errors(self):
+        error = self.assertRaises(
+            OmapiError, self.make_client().modify,
+            factory.make_ipv4_address(), factory.make_mac_address())
+        self.assertEqual(ISC_R_NOTFOUND, error.result)
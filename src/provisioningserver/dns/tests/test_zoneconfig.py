@@ -242,6 +242,22 @@ class TestDNSForwardZoneConfig(MAASTestCase):
             )
         )
 
+    def test_get_zone_parameters_returns_lists(self):
+        domain = factory.make_string()
+        ttl = random.randint(10, 300)
+        ipv4_ip = factory.make_ipv4_address()
+        mapping = {
+            "host": HostnameIPMapping(None, ttl, {ipv4_ip}),
+        }
+        dns_zone_config = DNSForwardZoneConfig(
+            domain, serial=random.randint(1, 100), mapping=mapping)
+        [(zone_info, parameters)] = dns_zone_config.get_zone_parameters()
+        self.assertEqual(domain, zone_info.zone_name)
+        self.assertEqual(
+            [("host", ttl, ipv4_ip)], parameters['mappings']['A'])
+        self.assertEqual([], parameters['mappings']['AAAA'])
+        self.assertEqual([], parameters['other_mapping'])
+
     def test_writes_dns_zone_config_with_NS_record(self):
         target_dir = patch_dns_config_path(self)
         addr_ttl = random.randint(10, 100)
@@ -477,6 +493,24 @@ class TestDNSReverseZoneConfig(MAASTestCase):
             expected,
             DNSReverseZoneConfig.get_PTR_mapping(mapping, network))
 
+    def test_get_zone_parameters_returns_each_zone(self):
+        network = IPNetwork('192.168.0.1/22')
+        ttl = random.randint(10, 300)
+        ip = '192.168.1.20'
+        mapping = {
+            "host": HostnameIPMapping(None, ttl, {ip}),
+        }
+        dns_zone_config = DNSReverseZoneConfig(
+            factory.make_string(), serial=random.randint(1, 100),
+            mapping=mapping, network=network)
+        zones = list(dns_zone_config.get_zone_parameters())
+        self.assertEqual(
+            dns_zone_config.zone_info,
+            [zone_info for zone_info, _ in zones])
+        self.assertEqual(
+            [[], [("20", ttl, "host.")], [], []],
+            [parameters['mappings']['PTR'] for _, parameters in zones])
+
     def test_writes_dns_zone_config_with_NS_record(self):
         target_dir = patch_dns_config_path(self)
         network = factory.make_ipv4_network()
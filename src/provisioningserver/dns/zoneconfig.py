@@ -163,6 +163,16 @@ class DomainConfigBase:
             'ns_host_name': self.ns_host_name,
         }
 
+    def get_zone_parameters(self):
+        """Generate `(zone_info, parameters)` for each zone file."""
+        raise NotImplementedError()
+
+    def write_config(self):
+        """Write the zone files."""
+        for zi, parameters in self.get_zone_parameters():
+            self.write_zone_file(
+                zi.target_path, self.make_parameters(), parameters)
+
     @classmethod
     def write_zone_file(cls, output_file, *parameters):
         """Write a zone file based on the zone file template.
@@ -292,8 +302,12 @@ class DNSForwardZoneConfig(DomainConfigBase):
         return sorted(
             generate_directives, key=lambda directive: directive[2])
 
-    def write_config(self):
-        """Write the zone file."""
+    def get_zone_parameters(self):
+        """Generate `(zone_info, parameters)` for each zone file.
+
+        The parameters are those specific to the zone file; see
+        `make_parameters` for those common to all.
+        """
         # Create GENERATE directives for IPv4 ranges.
         for zi in self.zone_info:
             generate_directives = list(
@@ -302,21 +316,19 @@ class DNSForwardZoneConfig(DomainConfigBase):
                     for dynamic_range in self._dynamic_ranges
                     if dynamic_range.version == 4
                 ))
-            self.write_zone_file(
-                zi.target_path, self.make_parameters(),
-                {
-                    'mappings': {
-                        'A': self.get_A_mapping(
-                            self._mapping, self._ipv4_ttl),
-                        'AAAA': self.get_AAAA_mapping(
-                            self._mapping, self._ipv6_ttl),
-                    },
-                    'other_mapping': enumerate_rrset_mapping(
-                        self._other_mapping),
-                    'generate_directives': {
-                        'A': generate_directives,
-                    }
-                })
+            yield zi, {
+                'mappings': {
+                    'A': list(self.get_A_mapping(
+                        self._mapping, self._ipv4_ttl)),
+                    'AAAA': list(self.get_AAAA_mapping(
+                        self._mapping, self._ipv6_ttl)),
+                },
+                'other_mapping': list(enumerate_rrset_mapping(
+                    self._other_mapping)),
+                'generate_directives': {
+                    'A': generate_directives,
+                }
+            }
 
 
 class DNSReverseZoneConfig(DomainConfigBase):
@@ -530,8 +542,12 @@ class DNSReverseZoneConfig(DomainConfigBase):
                 generate_directives.add((iterator, '${0,1,x}', hostname))
         return sorted(generate_directives)
 
-    def write_config(self):
-        """Write the zone file."""
+    def get_zone_parameters(self):
+        """Generate `(zone_info, parameters)` for each zone file.
+
+        The parameters are those specific to the zone file; see
+        `make_parameters` for those common to all.
+        """
         # Create GENERATE directives for IPv4 ranges.
         for zi in self.zone_info:
             generate_directives = list(
@@ -543,20 +559,17 @@ class DNSReverseZoneConfig(DomainConfigBase):
                     for dynamic_range in self._dynamic_ranges
                     if dynamic_range.version == 4
                 ))
-            self.write_zone_file(
-                zi.target_path, self.make_parameters(),
-                {
-                    'mappings': {
-                        'PTR': self.get_PTR_mapping(
-                            self._mapping, zi.subnetwork),
-                    },
-                    'other_mapping': [],
-                    'generate_directives': {
-                        'PTR': generate_directives,
-                        'CNAME': self.get_rfc2317_GENERATE_directives(
-                            zi.subnetwork,
-                            self._rfc2317_ranges,
-                            self.domain),
-                    }
+            yield zi, {
+                'mappings': {
+                    'PTR': list(self.get_PTR_mapping(
+                        self._mapping, zi.subnetwork)),
+                },
+                'other_mapping': [],
+                'generate_directives': {
+                    'PTR': generate_directives,
+                    'CNAME': self.get_rfc2317_GENERATE_directives(
+                        zi.subnetwork,
+                        self._rfc2317_ranges,
+                        self.domain),
                 }
-            )
+            }
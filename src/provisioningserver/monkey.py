@@ -30,6 +30,9 @@ def fix_tftp_requests():
        Specifically, look at addr[0] and pass iface to listenUDP based on that.
 
        See https://bugs.launchpad.net/ubuntu/+source/python-tx-tftp/1614581
+
+       Files are also sent with `WindowedReadSession`, which negotiates the
+       RFC 7440 `windowsize` option.
     """
     import tftp.protocol
 
@@ -43,10 +46,7 @@ def fix_tftp_requests():
         OP_RRQ,
         ERR_FILE_NOT_FOUND
     )
-    from tftp.bootstrap import (
-        RemoteOriginWriteSession,
-        RemoteOriginReadSession,
-    )
+    from tftp.bootstrap import RemoteOriginWriteSession
     from tftp.netascii import NetasciiReceiverProxy, NetasciiSenderProxy
     from twisted.internet import reactor
     from twisted.internet.defer import inlineCallbacks, returnValue
@@ -59,6 +59,9 @@ def fix_tftp_requests():
         FileNotFound,
     )
     from netaddr import IPAddress
+    from provisioningserver.rackdservices.tftp_session import (
+        WindowedReadSession,
+    )
 
     @inlineCallbacks
     def new_startSession(self, datagram, addr, mode):
@@ -110,7 +113,7 @@ def fix_tftp_requests():
             elif datagram.opcode == OP_RRQ:
                 if mode == b'netascii':
                     fs_interface = NetasciiSenderProxy(fs_interface)
-                session = RemoteOriginReadSession(
+                session = WindowedReadSession(
                     addr, fs_interface, datagram.options, _clock=self._clock)
                 reactor.listenUDP(0, session, iface)
                 returnValue(session)
@@ -42,9 +42,7 @@ class ProvisioningServiceMaker:
         self.description = description
 
     def _makeImageService(self, resource_root):
-        from provisioningserver.rackdservices.image import (
-            BootImageEndpointService)
-        from twisted.internet.endpoints import AdoptedStreamServerEndpoint
+        from provisioningserver.rackdservices.image import BootImageService
         port = 5248  # config["port"]
         # Make a socket with SO_REUSEPORT set so that we can run multiple we
         # applications. This is easier to do from outside of Twisted as there's
@@ -65,14 +63,8 @@ class ProvisioningServiceMaker:
         s.bind(('::', port))
         # Use a backlog of 50, which seems to be fairly common.
         s.listen(50)
-        # Adopt this socket into Twisted's reactor.
-        site_endpoint = AdoptedStreamServerEndpoint(
-            reactor, s.fileno(), s.family)
-        site_endpoint.port = port  # Make it easy to get the port number.
-        site_endpoint.socket = s  # Prevent garbage collection.
-
-        image_service = BootImageEndpointService(
-            resource_root=resource_root, endpoint=site_endpoint)
+        # Images are served from threads, not from Twisted's reactor.
+        image_service = BootImageService(resource_root=resource_root, sock=s)
         image_service.setName("image_service")
         return image_service
 
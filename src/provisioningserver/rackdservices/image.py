@@ -1,33 +1,475 @@
-# Copyright 2015 Canonical Ltd.  This software is licensed under the
+# Copyright 2015-2017 Canonical Ltd.  This software is licensed under the
 # GNU Affero General Public License version 3 (see the file LICENSE).
 
-"""Twisted Application Plugin for the MAAS Boot Image server"""
+"""Service for the MAAS boot image HTTP server.
+
+Boot images -- kernels, initrds, and squashfs root filesystems of a few
+hundred megabytes -- are served from the TFTP root under ``/images/``. When
+hundreds of machines boot at once, serving these from the reactor delays
+everything else that rackd does, so they are served from threads instead,
+and sent with ``sendfile(2)`` so that their contents are never copied into
+this process.
+"""
 
 __all__ = [
-    "BootImageEndpointService",
+    "BootImageService",
     ]
 
-from provisioningserver.utils.twisted import reducedWebLogFormatter
-from twisted.application.internet import StreamServerEndpointService
-from twisted.web.resource import Resource
-from twisted.web.server import Site
-from twisted.web.static import File
+from collections import Counter
+from email.utils import (
+    formatdate,
+    mktime_tz,
+    parsedate_tz,
+)
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler
+import os
+from queue import Queue
+import re
+import socket
+import socketserver
+import stat
+import struct
+import threading
+from urllib.parse import (
+    unquote,
+    urlsplit,
+)
+
+from netaddr import (
+    AddrFormatError,
+    IPAddress,
+)
+from provisioningserver.logger import LegacyLogger
+from twisted.application.service import Service
+from twisted.internet.threads import deferToThread
+
+
+log = LegacyLogger()
+
+# The most images to send at once. Each is sent by its own thread.
+MAX_WORKERS = 64
 
+# The most images that one client can fetch at once. Further requests are
+# refused, with a "503 Service Unavailable" response.
+MAX_PER_CLIENT = 4
 
-class BootImageEndpointService(StreamServerEndpointService):
-    """Service for serving images to the TFTP server via HTTP
+# The time, in seconds, to wait for a client to send a request or receive
+# part of a response.
+CLIENT_TIMEOUT = 60
 
-    :ivar site: The twisted site resource
+# Only single ranges of bytes are supported; requests with other ranges are
+# answered with the whole file, as RFC 7233 allows.
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
 
+
+class RangeNotSatisfiable(Exception):
+    """The range requested is not within the file."""
+
+
+def parse_range(header, size):
+    """Parse the value of a ``Range`` header for a file of `size` bytes.
+
+    :return: A tuple of the first and last (inclusive) offsets requested, or
+        `None` if the header is not a single range of bytes and must be
+        ignored.
+    :raise RangeNotSatisfiable: If the range begins beyond the file.
     """
+    match = RANGE_PATTERN.match(header.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if first == "" and last == "":
+        return None
+    elif first == "":
+        # A suffix range: the final `last` bytes.
+        length = int(last)
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiable()
+        return max(0, size - length), size - 1
+    else:
+        first = int(first)
+        last = size - 1 if last == "" else int(last)
+        if match.group(2) != "" and last < first:
+            return None
+        elif first >= size:
+            raise RangeNotSatisfiable()
+        else:
+            return first, min(last, size - 1)
+
 
-    def __init__(self, resource_root, endpoint):
+def parse_http_date(value):
+    """Return the time in an HTTP date header, or `None` if it's invalid."""
+    parsed = parsedate_tz(value)
+    if parsed is None:
+        return None
+    else:
+        return mktime_tz(parsed)
+
+
+def make_etag(stat_result):
+    """Return a strong entity tag for a file with the given status."""
+    return '"%x-%x-%x"' % (
+        stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns)
+
+
+def normalise_address(address):
+    """Normalise an IP address, as `reducedWebLogFormatter` does."""
+    try:
+        address = IPAddress(address)
+    except AddrFormatError:
+        return address  # Hostname?
+    else:
+        if address.is_ipv4_mapped():
+            return str(address.ipv4())
+        else:
+            return str(address)
+
+
+def send_file(sock, stream, offset, count):
+    """Send `count` bytes of `stream`, from `offset`, with ``sendfile(2)``.
+
+    The socket is made blocking, with a kernel timeout for sending, so
+    that each transfer is done in as few calls as possible, all without
+    holding the GIL; `socket.sendfile` instead returns to Python to wait
+    for the socket between each part.
+
+    :raise socket.timeout: If the client does not receive any of the file
+        for `CLIENT_TIMEOUT` seconds.
+    """
+    sock.settimeout(None)
+    sock.setsockopt(
+        socket.SOL_SOCKET, socket.SO_SNDTIMEO,
+        struct.pack("ll", CLIENT_TIMEOUT, 0))
+    while count > 0:
+        try:
+            sent = os.sendfile(
+                sock.fileno(), stream.fileno(), offset, count)
+        except BlockingIOError:
+            raise socket.timeout("timed out")
+        if sent == 0:
+            break  # The file has been truncated.
+        offset += sent
+        count -= sent
+
+
+class ClientLimiter:
+    """Count requests in progress from each client, up to a limit."""
+
+    def __init__(self, limit):
+        super(ClientLimiter, self).__init__()
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.active = Counter()
+
+    def acquire(self, client):
+        """Start a request from `client`, if under the limit.
+
+        :return: True if the request can proceed, in which case `release`
+            must be called when it's done, otherwise False.
         """
-        :param resource_root: The root directory for the Image server.
-        :param endpoint: The endpoint on which the server should listen.
+        with self.lock:
+            if self.active[client] >= self.limit:
+                return False
+            else:
+                self.active[client] += 1
+                return True
+
+    def release(self, client):
+        """Finish a request from `client`."""
+        with self.lock:
+            self.active[client] -= 1
+            if self.active[client] <= 0:
+                del self.active[client]
+
+
+class ImageRequestHandler(BaseHTTPRequestHandler):
+    """Serve files from the server's resource root under ``/images/``.
 
+    ``GET`` and ``HEAD`` are supported, with ``Range`` and ``If-Range`` for
+    single ranges of bytes, and ``If-None-Match`` and ``If-Modified-Since``.
+    Each connection serves one request.
+    """
+
+    protocol_version = "HTTP/1.1"
+    timeout = CLIENT_TIMEOUT
+
+    def do_GET(self):
+        self.send_image(body=True)
+
+    def do_HEAD(self):
+        self.send_image(body=False)
+
+    def get_image_path(self):
+        """Return the filesystem path for the request, or `None`.
+
+        Path segments are not allowed to be empty, nor to be ``.`` or
+        ``..``, so paths stay within the resource root, though symlinks
+        within it are followed.
         """
-        resource = Resource()
-        resource.putChild(b'images', File(resource_root))
-        self.site = Site(resource, logFormatter=reducedWebLogFormatter)
-        super(BootImageEndpointService, self).__init__(endpoint, self.site)
+        segments = urlsplit(self.path).path.split("/")
+        if segments[:2] != ["", "images"] or len(segments) < 3:
+            return None
+        segments = [unquote(segment) for segment in segments[2:]]
+        for segment in segments:
+            if segment in ("", ".", "..") or "/" in segment:
+                return None
+            if "\0" in segment:
+                return None
+        return os.path.join(self.server.resource_root, *segments)
+
+    def send_image(self, body):
+        self.close_connection = True
+        path = self.get_image_path()
+        if path is None:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        try:
+            stream = open(path, "rb")
+        except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+            self.send_error(HTTPStatus.NOT_FOUND)
+        except PermissionError:
+            self.send_error(HTTPStatus.FORBIDDEN)
+        else:
+            with stream:
+                stat_result = os.fstat(stream.fileno())
+                if stat.S_ISREG(stat_result.st_mode):
+                    self.send_stream(stream, stat_result, body)
+                else:
+                    self.send_error(HTTPStatus.NOT_FOUND)
+
+    def send_stream(self, stream, stat_result, body):
+        size = stat_result.st_size
+        etag = make_etag(stat_result)
+        modified = int(stat_result.st_mtime)
+        if self.is_not_modified(etag, modified):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_validators(etag, modified)
+            self.end_headers()
+            return
+        try:
+            requested = self.get_range(etag, modified, size)
+        except RangeNotSatisfiable:
+            self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+            self.send_header("Content-Range", "bytes */%d" % size)
+            self.send_header("Content-Length", "0")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            return
+        if requested is None:
+            offset, count = 0, size
+            self.send_response(HTTPStatus.OK)
+        else:
+            first, last = requested
+            offset, count = first, last - first + 1
+            self.send_response(HTTPStatus.PARTIAL_CONTENT)
+            self.send_header(
+                "Content-Range", "bytes %d-%d/%d" % (first, last, size))
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(count))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_validators(etag, modified)
+        self.end_headers()
+        if body and count > 0:
+            send_file(self.connection, stream, offset, count)
+
+    def send_validators(self, etag, modified):
+        self.send_header("Connection", "close")
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", formatdate(modified, usegmt=True))
+
+    def is_not_modified(self, etag, modified):
+        """Do the request's conditions show the client has this file?"""
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            etags = [tag.strip() for tag in if_none_match.split(",")]
+            # Weak comparison, as RFC 7232 requires for If-None-Match.
+            return "*" in etags or any(
+                tag[2:] == etag if tag.startswith("W/") else tag == etag
+                for tag in etags)
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since is not None:
+            since = parse_http_date(if_modified_since)
+            return since is not None and modified <= since
+        return False
+
+    def get_range(self, etag, modified, size):
+        """Return the range of bytes to send, or `None` for the whole file.
+
+        :raise RangeNotSatisfiable: If the requested range is not within
+            the file.
+        """
+        requested = self.headers.get("Range")
+        if requested is None:
+            return None
+        if_range = self.headers.get("If-Range")
+        if if_range is not None:
+            if_range = if_range.strip()
+            if if_range.startswith(('"', "W/")):
+                if if_range != etag:
+                    return None
+            elif parse_http_date(if_range) != modified:
+                return None
+        return parse_range(requested, size)
+
+    def handle_one_request(self):
+        try:
+            super(ImageRequestHandler, self).handle_one_request()
+        except (ConnectionError, socket.timeout):
+            # The client went away or stalled.
+            self.close_connection = True
+
+    def log_request(self, code="-", size="-"):
+        # Malformed requests are answered before their headers are read.
+        headers = getattr(self, "headers", None) or {}
+        log.info(
+            "{origin} {method} {uri} {proto} --> {status} "
+            "(referrer: {referrer}; agent: {agent})",
+            origin=normalise_address(self.client_address[0]),
+            method=self.command, uri=self.path,
+            proto=self.request_version, status=int(code),
+            referrer=headers.get("Referer", "-"),
+            agent=headers.get("User-Agent", "-"))
+
+    def log_error(self, format, *args):
+        """Do not log errors separately.
+
+        Every response, including those for errors, is logged by
+        `log_request`, as the web server in the reactor used to do.
+        """
+
+
+class ImageHTTPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """Serve boot images from a fixed pool of threads.
+
+    Connections are accepted in the thread running `serve_forever` and are
+    queued for `max_workers` worker threads. Each client can have at most
+    `max_per_client` connections being served at once; further connections
+    get a "503 Service Unavailable" response.
+
+    :ivar resource_root: The directory from which ``/images/`` is served.
+    """
+
+    def __init__(
+            self, sock, resource_root, max_workers=MAX_WORKERS,
+            max_per_client=MAX_PER_CLIENT):
+        # Use the given socket, which is already listening, rather than
+        # letting TCPServer create one.
+        socketserver.BaseServer.__init__(
+            self, sock.getsockname(), ImageRequestHandler)
+        self.socket = sock
+        self.resource_root = resource_root
+        self.clients = ClientLimiter(max_per_client)
+        self.requests = Queue()
+        self.max_workers = max_workers
+        self.workers = []
+
+    def serve_forever(self, poll_interval=0.5):
+        # Start the workers the first time around. They wait for requests
+        # even while the server is shut down, so are not started again.
+        while len(self.workers) < self.max_workers:
+            worker = threading.Thread(
+                target=self.work, daemon=True,
+                name="image-server-%d" % len(self.workers))
+            worker.start()
+            self.workers.append(worker)
+        super(ImageHTTPServer, self).serve_forever(poll_interval)
+
+    def process_request(self, request, client_address):
+        self.requests.put((request, client_address))
+
+    def server_close(self):
+        """Close the listening socket, and stop the workers.
+
+        Requests already queued are served first, so this can wait for as
+        long as they take.
+        """
+        super(ImageHTTPServer, self).server_close()
+        # Tell the workers to exit once they have finished their requests.
+        for _ in self.workers:
+            self.requests.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers.clear()
+
+    def work(self):
+        while True:
+            item = self.requests.get()
+            if item is None:
+                break
+            request, client_address = item
+            client = client_address[0]
+            if self.clients.acquire(client):
+                try:
+                    self.process_request_thread(request, client_address)
+                finally:
+                    self.clients.release(client)
+            else:
+                self.refuse_request(request)
+
+    def refuse_request(self, request):
+        """Tell the client to try again later, and hang up."""
+        try:
+            request.settimeout(CLIENT_TIMEOUT)
+            request.sendall(
+                b"HTTP/1.1 503 Service Unavailable\r\n"
+                b"Retry-After: 1\r\n"
+                b"Content-Length: 0\r\n"
+                b"Connection: close\r\n\r\n")
+        except OSError:
+            pass  # The client has gone.
+        finally:
+            self.shutdown_request(request)
+
+    def handle_error(self, request, client_address):
+        log.err(None, "Failed to serve boot image to %s." % (
+            normalise_address(client_address[0]),))
+
+
+class BootImageService(Service):
+    """Service for serving boot images over HTTP.
+
+    The server runs in its own threads, not in the reactor.
+
+    :ivar server: The `ImageHTTPServer`.
+    """
+
+    def __init__(
+            self, resource_root, sock, max_workers=MAX_WORKERS,
+            max_per_client=MAX_PER_CLIENT):
+        """
+        :param resource_root: The root directory for the Image server.
+        :param sock: A listening socket on which to serve images.
+        :param max_workers: See `ImageHTTPServer`.
+        :param max_per_client: See `ImageHTTPServer`.
+        """
+        super(BootImageService, self).__init__()
+        self.server = ImageHTTPServer(
+            sock, resource_root, max_workers=max_workers,
+            max_per_client=max_per_client)
+        self.thread = None
+
+    def startService(self):
+        super(BootImageService, self).startService()
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, name="image-server",
+            daemon=True)
+        self.thread.start()
+
+    def stopService(self):
+        if self.thread is None:
+            return super(BootImageService, self).stopService()
+
+        def stop():
+            # Stop accepting connections, then close the socket once those
+            # in progress have finished. This waits for `serve_forever` to
+            # return, and for the workers, so it is done in a thread.
+            self.server.shutdown()
+            self.thread.join()
+            self.server.server_close()
+
+        d = deferToThread(stop)
+        d.addCallback(lambda _: setattr(self, "thread", None))
+        d.addCallback(
+            lambda _: super(BootImageService, self).stopService())
+        return d
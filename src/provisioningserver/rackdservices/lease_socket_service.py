@@ -14,7 +14,10 @@ import os
 from provisioningserver.logger import get_maas_logger
 from provisioningserver.path import get_data_path
 from provisioningserver.rpc.exceptions import NoConnectionsAvailable
-from provisioningserver.rpc.region import UpdateLease
+from provisioningserver.rpc.region import (
+    UpdateLease,
+    UpdateLeases,
+)
 from provisioningserver.utils.twisted import (
     pause,
     retries,
@@ -26,11 +29,18 @@ from twisted.internet import (
 )
 from twisted.internet.defer import inlineCallbacks
 from twisted.internet.protocol import DatagramProtocol
+from twisted.protocols.amp import UnhandledCommand
 
 
 maaslog = get_maas_logger("lease_socket_service")
 
 
+# The most notifications to send to the region in one `UpdateLeases` call.
+# Each update is compressed to a few tens of bytes, keeping each call well
+# within the 64kB limit on the size of AMP values.
+MAX_LEASES_PER_UPDATE = 100
+
+
 def get_socket_path():
     """Return path to dhcpd.sock."""
     return os.path.join(get_data_path("/var/lib/maas"), "dhcpd.sock")
@@ -92,32 +102,65 @@ class LeaseSocketService(Service, DatagramProtocol):
         self.notifications.append(notification)
 
     def processNotifications(self, clock=reactor):
-        """Process all notifications."""
-        def gen_notifications(notifications):
+        """Process all notifications.
+
+        Notifications are sent to the region in batches of up to
+        `MAX_LEASES_PER_UPDATE`, in the order they were received.
+        """
+        def gen_batches(notifications):
             while len(notifications) != 0:
-                yield notifications.popleft()
+                yield [
+                    notifications.popleft()
+                    for _ in range(min(
+                        len(notifications), MAX_LEASES_PER_UPDATE))
+                ]
         return task.coiterate(
-            self.processNotification(notification, clock=clock)
-            for notification in gen_notifications(self.notifications))
+            self.processNotificationBatch(batch, clock=clock)
+            for batch in gen_batches(self.notifications))
+
+    @inlineCallbacks
+    def processNotificationBatch(self, notifications, clock=reactor):
+        """Send a batch of notifications to the region.
+
+        Regions that do not know about `UpdateLeases` are sent each
+        notification in turn with `UpdateLease` instead.
+        """
+        client = yield self._getClient(clock)
+        if client is None:
+            return
+        try:
+            yield client(
+                UpdateLeases, cluster_uuid=client.localIdent,
+                updates=notifications)
+        except UnhandledCommand:
+            # The region is older than 2.3.
+            for notification in notifications:
+                yield self.processNotification(notification, clock=clock)
 
     @inlineCallbacks
     def processNotification(self, notification, clock=reactor):
         """Send a notification to the region."""
-        client = None
+        client = yield self._getClient(clock)
+        if client is None:
+            return
+
+        # Notification contains all the required data except for the cluster
+        # UUID. Add that into the notification and send the information to
+        # the region for processing.
+        notification["cluster_uuid"] = client.localIdent
+        yield client(UpdateLease, **notification)
+
+    @inlineCallbacks
+    def _getClient(self, clock):
+        """Return a client to the region, or `None` if there is none."""
         for elapsed, remaining, wait in retries(30, 10, clock):
             try:
                 client = yield self.client_service.getClientNow()
-                break
+                return client
             except NoConnectionsAvailable:
                 yield pause(wait, self.clock)
         else:
             maaslog.error(
                 "Can't send DHCP lease information, no RPC "
                 "connection to region.")
-            return
-
-        # Notification contains all the required data except for the cluster
-        # UUID. Add that into the notification and send the information to
-        # the region for processing.
-        notification["cluster_uuid"] = client.localIdent
-        yield client(UpdateLease, **notification)
+            return None
@@ -19,11 +19,23 @@ from provisioningserver.rpc.exceptions import (
     NoConnectionsAvailable,
     NoSuchCluster,
 )
-from provisioningserver.rpc.power import query_all_nodes
-from provisioningserver.rpc.region import ListNodePowerParameters
+from provisioningserver.rpc.power import (
+    PowerQueryScheduler,
+    PowerStateUpdates,
+    query_all_nodes,
+)
+from provisioningserver.rpc.region import (
+    ListNodePowerParameters,
+    ListNodePowerParametersV2,
+)
 from twisted.application.internet import TimerService
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet import reactor
+from twisted.internet.defer import (
+    inlineCallbacks,
+    returnValue,
+)
 from twisted.internet.error import ConnectionDone
+from twisted.protocols.amp import UnhandledCommand
 
 
 maaslog = get_maas_logger("power_monitor_service")
@@ -31,16 +43,23 @@ log = LegacyLogger()
 
 
 class NodePowerMonitorService(TimerService, object):
-    """Service to monitor the power status of all nodes in this cluster."""
+    """Service to monitor the power status of all nodes in this cluster.
+
+    Queries are spread across BMCs by a `PowerQueryScheduler`, and the
+    resulting power states are sent back to the region in batches.
+    """
 
     check_interval = timedelta(seconds=15).total_seconds()
-    max_nodes_at_once = 5
 
     def __init__(self, clock=None):
         # Call self.query_nodes() every self.check_interval.
         super(NodePowerMonitorService, self).__init__(
             self.check_interval, self.try_query_nodes)
         self.clock = clock
+        self.scheduler = PowerQueryScheduler(
+            clock=reactor if clock is None else clock)
+        # Regions from before 2.3 do not have ListNodePowerParametersV2.
+        self.list_command = ListNodePowerParametersV2
 
     def try_query_nodes(self):
         """Attempt to query nodes' power states.
@@ -58,20 +77,39 @@ class NodePowerMonitorService(TimerService, object):
             d.addErrback(self.query_nodes_failed, client.localIdent)
             return d
 
+    @inlineCallbacks
+    def list_nodes(self, client):
+        """Get the next page of nodes' power parameters from the region."""
+        if self.list_command is ListNodePowerParametersV2:
+            try:
+                response = yield client(
+                    ListNodePowerParametersV2, uuid=client.localIdent)
+            except UnhandledCommand:
+                self.list_command = ListNodePowerParameters
+            else:
+                returnValue(response['nodes'])
+        response = yield client(
+            ListNodePowerParameters, uuid=client.localIdent)
+        returnValue(response['nodes'])
+
     @inlineCallbacks
     def query_nodes(self, client):
         # Get the nodes' power parameters from the region. Keep getting more
         # power parameters until the region returns an empty list.
-        while True:
-            response = yield client(
-                ListNodePowerParameters, uuid=client.localIdent)
-            power_parameters = response['nodes']
-            if len(power_parameters) > 0:
-                yield query_all_nodes(
-                    power_parameters, max_concurrency=self.max_nodes_at_once,
-                    clock=self.clock)
-            else:
-                break
+        updates = PowerStateUpdates(
+            clock=reactor if self.clock is None else self.clock)
+        try:
+            while True:
+                power_parameters = yield self.list_nodes(client)
+                if len(power_parameters) > 0:
+                    yield query_all_nodes(
+                        power_parameters, clock=self.clock, updates=updates,
+                        scheduler=self.scheduler)
+                else:
+                    break
+        finally:
+            yield updates.flush()
+            self.scheduler.finishSweep()
 
     def query_nodes_failed(self, failure, localIdent):
         if failure.check(NoSuchCluster):
@@ -0,0 +1,218 @@
+# Copyright 2017 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for `provisioningserver.rackdservices.image`."""
+
+__all__ = []
+
+from email.utils import formatdate
+import http.client
+import os
+import socket
+import threading
+
+from maastesting.factory import factory
+from maastesting.testcase import (
+    MAASTestCase,
+    MAASTwistedRunTest,
+)
+from provisioningserver.rackdservices.image import (
+    BootImageService,
+    ClientLimiter,
+    ImageHTTPServer,
+    parse_range,
+    RangeNotSatisfiable,
+)
+from testtools.matchers import (
+    Equals,
+    Is,
+)
+from twisted.internet.defer import inlineCallbacks
+
+
+def make_socket():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    sock.listen(5)
+    return sock
+
+
+class TestParseRange(MAASTestCase):
+    """Tests for `parse_range`."""
+
+    def test__parses_ranges(self):
+        self.assertThat(parse_range("bytes=0-9", 100), Equals((0, 9)))
+        self.assertThat(parse_range("bytes=10-", 100), Equals((10, 99)))
+        self.assertThat(parse_range("bytes=-10", 100), Equals((90, 99)))
+
+    def test__limits_ranges_to_the_file(self):
+        self.assertThat(parse_range("bytes=90-200", 100), Equals((90, 99)))
+        self.assertThat(parse_range("bytes=-200", 100), Equals((0, 99)))
+
+    def test__ignores_other_ranges(self):
+        for header in ("bytes=0-1,5-6", "bytes=9-5", "bytes=-", "lines=1-2"):
+            self.assertThat(parse_range(header, 100), Is(None), header)
+
+    def test__raises_when_range_is_beyond_file(self):
+        self.assertRaises(RangeNotSatisfiable, parse_range, "bytes=100-", 100)
+        self.assertRaises(RangeNotSatisfiable, parse_range, "bytes=-0", 100)
+        self.assertRaises(RangeNotSatisfiable, parse_range, "bytes=-1", 0)
+
+
+class TestClientLimiter(MAASTestCase):
+    """Tests for `ClientLimiter`."""
+
+    def test__limits_requests_per_client(self):
+        limiter = ClientLimiter(2)
+        self.assertTrue(limiter.acquire("alice"))
+        self.assertTrue(limiter.acquire("alice"))
+        self.assertFalse(limiter.acquire("alice"))
+        self.assertTrue(limiter.acquire("bob"))
+        limiter.release("alice")
+        self.assertTrue(limiter.acquire("alice"))
+
+    def test__forgets_idle_clients(self):
+        limiter = ClientLimiter(1)
+        limiter.acquire("alice")
+        limiter.release("alice")
+        self.assertThat(limiter.active, Equals({}))
+
+
+class TestImageHTTPServer(MAASTestCase):
+    """Tests for `ImageHTTPServer`."""
+
+    def setUp(self):
+        super(TestImageHTTPServer, self).setUp()
+        self.resource_root = self.make_dir()
+        os.mkdir(os.path.join(self.resource_root, "ubuntu"))
+        self.content = factory.make_bytes(10000)
+        self.filename = factory.make_file(
+            os.path.join(self.resource_root, "ubuntu"), "squashfs",
+            self.content)
+        self.server = ImageHTTPServer(
+            make_socket(), self.resource_root, max_workers=3,
+            max_per_client=2)
+        self.addCleanup(self.server.server_close)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.shutdown)
+
+    def request(self, path="/images/ubuntu/squashfs", method="GET", **kw):
+        host, port = self.server.server_address
+        connection = http.client.HTTPConnection(host, port, timeout=5)
+        self.addCleanup(connection.close)
+        connection.request(method, path, headers=kw)
+        response = connection.getresponse()
+        return response, response.read()
+
+    def test__serves_files(self):
+        response, body = self.request()
+        self.assertThat(
+            (response.status, response.getheader("Content-Length"), body),
+            Equals((200, "10000", self.content)))
+        self.assertThat(response.getheader("Accept-Ranges"), Equals("bytes"))
+
+    def test__serves_headers_for_HEAD(self):
+        response, body = self.request(method="HEAD")
+        self.assertThat(
+            (response.status, response.getheader("Content-Length"), body),
+            Equals((200, "10000", b"")))
+
+    def test__serves_ranges(self):
+        response, body = self.request(Range="bytes=100-199")
+        self.assertThat(response.status, Equals(206))
+        self.assertThat(
+            response.getheader("Content-Range"),
+            Equals("bytes 100-199/10000"))
+        self.assertThat(body, Equals(self.content[100:200]))
+
+    def test__rejects_unsatisfiable_ranges(self):
+        response, body = self.request(Range="bytes=20000-")
+        self.assertThat(response.status, Equals(416))
+        self.assertThat(
+            response.getheader("Content-Range"), Equals("bytes */10000"))
+
+    def test__serves_ranges_if_unchanged(self):
+        response, _ = self.request()
+        etag = response.getheader("ETag")
+        response, body = self.request(Range="bytes=0-9", **{"If-Range": etag})
+        self.assertThat(response.status, Equals(206))
+        response, body = self.request(
+            Range="bytes=0-9", **{"If-Range": '"changed"'})
+        self.assertThat((response.status, body), Equals((200, self.content)))
+
+    def test__answers_not_modified_for_matching_etag(self):
+        response, _ = self.request()
+        etag = response.getheader("ETag")
+        response, body = self.request(**{"If-None-Match": etag})
+        self.assertThat((response.status, body), Equals((304, b"")))
+
+    def test__answers_not_modified_if_not_modified_since(self):
+        modified = os.stat(self.filename).st_mtime
+        response, body = self.request(**{
+            "If-Modified-Since": formatdate(modified + 1, usegmt=True)})
+        self.assertThat((response.status, body), Equals((304, b"")))
+        response, body = self.request(**{
+            "If-Modified-Since": formatdate(modified - 60, usegmt=True)})
+        self.assertThat(response.status, Equals(200))
+
+    def test__does_not_serve_outside_images(self):
+        for path in (
+                "/images/ubuntu", "/images/../images/ubuntu/squashfs",
+                "/images/ubuntu/%2e%2e/ubuntu/squashfs", "/images/",
+                "/images/ubuntu//squashfs", "/other/ubuntu/squashfs",
+                "/images/ubuntu/missing"):
+            response, _ = self.request(path)
+            self.assertThat(response.status, Equals(404), path)
+
+    def test__refuses_clients_over_their_limit(self):
+        # Use up this client's allowance, as two requests in progress would.
+        for _ in range(2):
+            self.server.clients.acquire("127.0.0.1")
+        response, _ = self.request()
+        self.assertThat(response.status, Equals(503))
+        self.assertThat(response.getheader("Retry-After"), Equals("1"))
+
+
+class TestBootImageService(MAASTestCase):
+    """Tests for `BootImageService`."""
+
+    run_tests_with = MAASTwistedRunTest.make_factory(timeout=5)
+
+    @inlineCallbacks
+    def test__serves_while_running(self):
+        resource_root = self.make_dir()
+        factory.make_file(resource_root, "kernel", b"kernel")
+        service = BootImageService(resource_root, make_socket())
+        self.addCleanup(service.server.server_close)
+        service.startService()
+        try:
+            host, port = service.server.server_address
+            connection = http.client.HTTPConnection(host, port, timeout=5)
+            connection.request("GET", "/images/kernel")
+            self.assertThat(
+                connection.getresponse().read(), Equals(b"kernel"))
+            connection.close()
+        finally:
+            yield service.stopService()
+        self.assertFalse(service.running)
+        self.assertThat(service.thread, Is(None))
+
+    @inlineCallbacks
+    def test__closes_socket_and_stops_workers_when_stopped(self):
+        sock = make_socket()
+        address = sock.getsockname()
+        service = BootImageService(self.make_dir(), sock, max_workers=3)
+        service.startService()
+        yield service.stopService()
+        self.assertThat(sock.fileno(), Equals(-1))
+        self.assertThat(service.server.workers, Equals([]))
+        self.assertThat([
+            thread.name for thread in threading.enumerate()
+            if thread.name.startswith("image-server")
+        ], Equals([]))
+        # The address can be listened on again straight away.
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.addCleanup(sock.close)
+        sock.bind(address)
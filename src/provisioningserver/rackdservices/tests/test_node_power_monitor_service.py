@@ -14,7 +14,10 @@ from unittest.mock import (
 
 from fixtures import FakeLogger
 from maastesting.factory import factory
-from maastesting.matchers import MockCalledOnceWith
+from maastesting.matchers import (
+    MockCalledOnceWith,
+    MockNotCalled,
+)
 from maastesting.testcase import (
     MAASTestCase,
     MAASTwistedRunTest,
@@ -31,6 +34,7 @@ from provisioningserver.rpc import (
     getRegionClient,
     region,
 )
+from provisioningserver.rpc.power import PowerStateUpdates
 from provisioningserver.rpc.testing import MockClusterToRegionRPCFixture
 from testtools.matchers import MatchesStructure
 from twisted.internet.defer import (
@@ -73,9 +77,49 @@ class TestNodePowerMonitorService(MAASTestCase):
             proto_region.ListNodePowerParameters,
             MockCalledOnceWith(ANY, uuid=client.localIdent))
 
+    def test_query_nodes_calls_the_region_with_V2(self):
+        service = self.make_monitor_service()
+
+        rpc_fixture = self.useFixture(MockClusterToRegionRPCFixture())
+        proto_region, io = rpc_fixture.makeEventLoop(
+            region.ListNodePowerParameters, region.ListNodePowerParametersV2)
+        proto_region.ListNodePowerParametersV2.return_value = succeed(
+            {"nodes": []})
+
+        client = getRegionClient()
+        d = service.query_nodes(client)
+        io.flush()
+
+        self.assertEqual(None, extract_result(d))
+        self.assertThat(
+            proto_region.ListNodePowerParametersV2,
+            MockCalledOnceWith(ANY, uuid=client.localIdent))
+        self.assertThat(
+            proto_region.ListNodePowerParameters, MockNotCalled())
+
+    def test_query_nodes_remembers_when_V2_is_unavailable(self):
+        service = self.make_monitor_service()
+
+        rpc_fixture = self.useFixture(MockClusterToRegionRPCFixture())
+        proto_region, io = rpc_fixture.makeEventLoop(
+            region.ListNodePowerParameters)
+        proto_region.ListNodePowerParameters.return_value = succeed(
+            {"nodes": []})
+
+        client = getRegionClient()
+        d = service.query_nodes(client)
+        io.flush()
+        self.assertEqual(None, extract_result(d))
+        self.assertIs(region.ListNodePowerParameters, service.list_command)
+
+        d = service.query_nodes(client)
+        io.flush()
+        self.assertEqual(None, extract_result(d))
+        self.assertEqual(
+            2, proto_region.ListNodePowerParameters.call_count)
+
     def test_query_nodes_calls_query_all_nodes(self):
         service = self.make_monitor_service()
-        service.max_nodes_at_once = sentinel.max_nodes_at_once
 
         example_power_parameters = {
             "system_id": factory.make_UUID(),
@@ -102,9 +146,33 @@ class TestNodePowerMonitorService(MAASTestCase):
         self.assertThat(
             query_all_nodes,
             MockCalledOnceWith(
-                [example_power_parameters],
-                max_concurrency=sentinel.max_nodes_at_once,
-                clock=service.clock))
+                [example_power_parameters], clock=service.clock,
+                updates=ANY, scheduler=service.scheduler))
+        updates = query_all_nodes.call_args[1]["updates"]
+        self.assertIsInstance(updates, PowerStateUpdates)
+
+    def test_query_nodes_flushes_updates_and_finishes_sweep(self):
+        service = self.make_monitor_service()
+        client = Mock(return_value=succeed({"nodes": []}))
+        flush = self.patch(PowerStateUpdates, "flush")
+        flush.return_value = succeed(None)
+        finishSweep = self.patch(service.scheduler, "finishSweep")
+
+        d = service.query_nodes(client)
+
+        self.assertEqual(None, extract_result(d))
+        self.assertThat(flush, MockCalledOnceWith())
+        self.assertThat(finishSweep, MockCalledOnceWith())
+
+    def test_query_nodes_finishes_sweep_on_failure(self):
+        service = self.make_monitor_service()
+        client = Mock(return_value=fail(ZeroDivisionError()))
+        finishSweep = self.patch(service.scheduler, "finishSweep")
+
+        d = service.query_nodes(client)
+
+        self.assertRaises(ZeroDivisionError, extract_result, d)
+        self.assertThat(finishSweep, MockCalledOnceWith())
 
     def test_query_nodes_copes_with_NoSuchCluster(self):
         service = self.make_monitor_service()
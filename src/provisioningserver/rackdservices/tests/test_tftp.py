@@ -41,13 +41,16 @@ from provisioningserver.boot.tests.test_pxe import compose_config_path
 from provisioningserver.events import EVENT_TYPES
 from provisioningserver.rackdservices import tftp as tftp_module
 from provisioningserver.rackdservices.tftp import (
+    BootFileCache,
     get_boot_image,
+    KernelParamsCache,
     log_request,
     Port,
     TFTPBackend,
     TFTPService,
     UDPServer,
 )
+from provisioningserver.rpc import boot_images as boot_images_module
 from provisioningserver.rpc.exceptions import BootConfigNoResponse
 from provisioningserver.rpc.region import GetBootConfig
 from provisioningserver.testing.boot_images import (
@@ -66,7 +69,10 @@ from testtools.matchers import (
     MatchesAll,
     MatchesStructure,
 )
-from tftp.backend import IReader
+from tftp.backend import (
+    FilesystemReader,
+    IReader,
+)
 from tftp.errors import (
     BackendError,
     FileNotFound,
@@ -81,12 +87,15 @@ from twisted.internet.address import (
 )
 from twisted.internet.defer import (
     fail,
+    gatherResults,
     inlineCallbacks,
+    returnValue,
     succeed,
 )
 from twisted.internet.protocol import Protocol
 from twisted.internet.task import Clock
 from twisted.python import context
+from twisted.python.filepath import FilePath
 from zope.interface.verify import verifyObject
 
 
@@ -116,7 +125,8 @@ class TestGetBootImage(MAASTestCase):
         return images, return_image
 
     def patch_list_boot_images(self, images):
-        self.patch(tftp_module, "list_boot_images").return_value = images
+        self.patch(
+            boot_images_module, "list_boot_images").return_value = images
 
     def get_params_from_boot_image(self, image):
         return {
@@ -172,6 +182,34 @@ class TestGetBootImage(MAASTestCase):
         params["subarch"] = subarch
         self.assertEquals(expected_image, get_boot_image(params))
 
+    def test_prefers_exact_subarch_over_supported_subarches(self):
+        params = make_boot_image_params()
+        supporting = self.make_boot_image(
+            params, "xinstall", subarch="generic",
+            subarches="generic,%s" % params["subarchitecture"])
+        exact = self.make_boot_image(params, "xinstall")
+        self.patch_list_boot_images([supporting, exact])
+        self.assertEquals(
+            exact, get_boot_image(self.get_params_from_boot_image(exact)))
+
+    def test_returns_first_matching_image(self):
+        params = make_boot_image_params()
+        images = [self.make_boot_image(params, "xinstall") for _ in range(3)]
+        for index, image in enumerate(images):
+            image["label"] = "label%d" % index
+        self.patch_list_boot_images(images)
+        self.assertIs(
+            images[0],
+            get_boot_image(self.get_params_from_boot_image(images[0])))
+
+    def test_uses_reloaded_images(self):
+        images, expected_image = self.make_all_boot_images("xinstall")
+        self.patch_list_boot_images([])
+        params = self.get_params_from_boot_image(expected_image)
+        self.assertIsNone(get_boot_image(params))
+        self.patch_list_boot_images(images)
+        self.assertEquals(expected_image, get_boot_image(params))
+
     def test_returns_None_if_missing_image(self):
         images, _ = self.make_all_boot_images(None)
         self.patch_list_boot_images(images)
@@ -244,6 +282,20 @@ class TestTFTPBackend(MAASTestCase):
         self.assertEqual(data, reader.read(len(data)))
         self.assertEqual(b"", reader.read(1))
 
+    @inlineCallbacks
+    def test_get_reader_serves_regular_files_from_memory(self):
+        self.patch(tftp_module, 'get_remote_mac')
+        data = factory.make_bytes()
+        temp_file = self.make_file(name="example", contents=data)
+        backend = TFTPBackend(os.path.dirname(temp_file), Mock())
+        reader1 = yield backend.get_reader(b"example")
+        reader2 = yield backend.get_reader(b"example")
+        self.addCleanup(reader1.finish)
+        self.addCleanup(reader2.finish)
+        self.assertEqual(data, reader2.read(len(data)))
+        self.assertEqual(
+            {"hits": 1, "misses": 1}, backend.boot_file_cache.stats)
+
     @inlineCallbacks
     def test_get_reader_handles_backslashes_in_path(self):
         self.patch(tftp_module, 'get_remote_mac')
@@ -403,7 +455,9 @@ class TestTFTPBackend(MAASTestCase):
             "supported_subarches": "",
             "label": fake_params["label"],
         }
-        self.patch(tftp_module, "list_boot_images").return_value = [boot_image]
+        self.patch(
+            boot_images_module, "list_boot_images").return_value = [
+                boot_image]
         del fake_params["label"]
 
         # Stub RPC call to return the fake configuration parameters.
@@ -491,7 +545,7 @@ class TestTFTPBackend(MAASTestCase):
         fake_params = fake_kernel_params._asdict()
 
         # Stub the output of list_boot_images so no images exist.
-        self.patch(tftp_module, "list_boot_images").return_value = []
+        self.patch(boot_images_module, "list_boot_images").return_value = []
         del fake_params["label"]
 
         # Stub RPC call to return the fake configuration parameters.
@@ -547,7 +601,9 @@ class TestTFTPBackend(MAASTestCase):
             "supported_subarches": "",
             "label": fake_params["label"],
         }
-        self.patch(tftp_module, "list_boot_images").return_value = [boot_image]
+        self.patch(
+            boot_images_module, "list_boot_images").return_value = [
+                boot_image]
 
         del fake_params["label"]
 
@@ -640,6 +696,326 @@ class TestTFTPBackend(MAASTestCase):
                 client, GetBootConfig, **params_okay))
 
 
+class TestTFTPBackendKernelParamsCache(MAASTestCase):
+    """Tests for the caching of kernel parameters by `TFTPBackend`."""
+
+    run_tests_with = MAASTwistedRunTest.make_factory(timeout=5)
+
+    def setUp(self):
+        super(TestTFTPBackendKernelParamsCache, self).setUp()
+        self.patch(boot_images_module, "list_boot_images").return_value = []
+
+    def make_backend(self, *responses):
+        client = Mock()
+        client.localIdent = factory.make_name("rack")
+        client.side_effect = responses
+        client_service = Mock()
+        client_service.getClientNow.return_value = succeed(client)
+        backend = TFTPBackend(self.make_dir(), client_service)
+        return backend, client
+
+    def make_params(self):
+        return {
+            "local_ip": factory.make_ipv4_address(),
+            "remote_ip": factory.make_ipv4_address(),
+            "mac": factory.make_mac_address("-"),
+            "arch": factory.make_name("arch"),
+            "subarch": factory.make_name("subarch"),
+            "bios_boot_method": "pxe",
+        }
+
+    def make_response(self, **parms):
+        response = make_kernel_parameters(
+            purpose="local", label="local", **parms)._asdict()
+        response["system_id"] = factory.make_name("system_id")
+        return response
+
+    @inlineCallbacks
+    def test_reuses_kernel_params_for_same_request(self):
+        response = self.make_response()
+        backend, client = self.make_backend(succeed(response))
+        params = self.make_params()
+        kernel_params1 = yield backend.get_kernel_params(dict(params))
+        # A retry over a different remote address is the same request.
+        params["remote_ip"] = factory.make_ipv4_address()
+        kernel_params2 = yield backend.get_kernel_params(dict(params))
+        self.assertIs(kernel_params1, kernel_params2)
+        self.assertEqual(1, client.call_count)
+        self.assertEqual(
+            {"hits": 1, "misses": 1}, backend.kernel_params_cache.stats)
+
+    @inlineCallbacks
+    def test_asks_region_for_different_requests(self):
+        backend, client = self.make_backend(
+            succeed(self.make_response()), succeed(self.make_response()))
+        yield backend.get_kernel_params(self.make_params())
+        yield backend.get_kernel_params(self.make_params())
+        self.assertEqual(2, client.call_count)
+
+    @inlineCallbacks
+    def test_remembers_no_response(self):
+        backend, client = self.make_backend(fail(BootConfigNoResponse()))
+        params = self.make_params()
+        with ExpectedException(BootConfigNoResponse):
+            yield backend.get_kernel_params(dict(params))
+        with ExpectedException(BootConfigNoResponse):
+            yield backend.get_kernel_params(dict(params))
+        self.assertEqual(1, client.call_count)
+
+    @inlineCallbacks
+    def test_does_not_remember_other_failures(self):
+        exception_type = factory.make_exception_type()
+        response = self.make_response()
+        backend, client = self.make_backend(
+            fail(exception_type()), succeed(response))
+        params = self.make_params()
+        with ExpectedException(exception_type):
+            yield backend.get_kernel_params(dict(params))
+        kernel_params = yield backend.get_kernel_params(dict(params))
+        self.assertEqual(response["hostname"], kernel_params.hostname)
+        self.assertEqual(2, client.call_count)
+
+    @inlineCallbacks
+    def test_asks_region_again_after_invalidation(self):
+        response = self.make_response()
+        backend, client = self.make_backend(
+            succeed(dict(response)), succeed(dict(response)))
+        params = self.make_params()
+        yield backend.get_kernel_params(dict(params))
+        backend.kernel_params_cache.invalidate([response["system_id"]])
+        yield backend.get_kernel_params(dict(params))
+        self.assertEqual(2, client.call_count)
+
+
+class TestKernelParamsCache(MAASTestCase):
+    """Tests for `KernelParamsCache`."""
+
+    def setUp(self):
+        super(TestKernelParamsCache, self).setUp()
+        self.patch(boot_images_module, "list_boot_images").return_value = []
+
+    def make_cache(self, **kwargs):
+        clock = Clock()
+        return KernelParamsCache(clock=clock, **kwargs), clock
+
+    def make_key(self):
+        return KernelParamsCache.make_key({
+            "local_ip": factory.make_ipv4_address(),
+            "mac": factory.make_mac_address("-"),
+        })
+
+    def test_make_key_ignores_remote_ip(self):
+        params = {
+            "local_ip": factory.make_ipv4_address(),
+            "remote_ip": factory.make_ipv4_address(),
+            "mac": factory.make_mac_address("-"),
+            "arch": factory.make_name("arch"),
+            "subarch": factory.make_name("subarch"),
+            "bios_boot_method": "pxe",
+        }
+        key = KernelParamsCache.make_key(params)
+        params["remote_ip"] = factory.make_ipv4_address()
+        self.assertEqual(key, KernelParamsCache.make_key(params))
+
+    def test_get_returns_None_when_not_cached(self):
+        cache, _ = self.make_cache()
+        self.assertIsNone(cache.get(self.make_key()))
+        self.assertEqual({"misses": 1}, cache.stats)
+
+    def test_get_returns_kernel_params(self):
+        cache, _ = self.make_cache()
+        key = self.make_key()
+        cache.put(key, "abcdef", sentinel.kernel_params)
+        self.assertIs(sentinel.kernel_params, cache.get(key))
+        self.assertEqual({"hits": 1}, cache.stats)
+
+    def test_get_returns_NO_RESPONSE(self):
+        cache, _ = self.make_cache()
+        key = self.make_key()
+        cache.put_no_response(key)
+        self.assertIs(KernelParamsCache.NO_RESPONSE, cache.get(key))
+
+    def test_entries_expire(self):
+        cache, clock = self.make_cache(ttl=10, no_response_ttl=5)
+        key1, key2 = self.make_key(), self.make_key()
+        cache.put(key1, "abcdef", sentinel.kernel_params)
+        cache.put_no_response(key2)
+        clock.advance(5)
+        self.assertIsNone(cache.get(key2))
+        self.assertIsNotNone(cache.get(key1))
+        clock.advance(5)
+        self.assertIsNone(cache.get(key1))
+        self.assertEqual({}, cache.entries)
+        self.assertEqual({}, cache.keys_by_node)
+
+    def test_zero_ttl_disables_caching(self):
+        cache, _ = self.make_cache(ttl=0, no_response_ttl=0)
+        key = self.make_key()
+        cache.put(key, "abcdef", sentinel.kernel_params)
+        cache.put_no_response(key)
+        self.assertEqual({}, cache.entries)
+
+    def test_entries_are_dropped_when_boot_images_change(self):
+        cache, _ = self.make_cache()
+        key = self.make_key()
+        cache.put(key, "abcdef", sentinel.kernel_params)
+        boot_images_module.list_boot_images.return_value = [make_image(
+            make_boot_image_params(), "xinstall")]
+        self.assertIsNone(cache.get(key))
+
+    def test_put_forgets_expired_entries_when_full(self):
+        cache, clock = self.make_cache(ttl=10, size=2)
+        key1, key2, key3 = self.make_key(), self.make_key(), self.make_key()
+        cache.put(key1, "abcdef", sentinel.kernel_params)
+        clock.advance(5)
+        cache.put(key2, "ghijkl", sentinel.kernel_params)
+        clock.advance(5)
+        cache.put(key3, "mnopqr", sentinel.kernel_params)
+        self.assertItemsEqual([key2, key3], cache.entries)
+
+    def test_put_forgets_oldest_entry_when_full_of_fresh_entries(self):
+        cache, _ = self.make_cache(size=2)
+        key1, key2, key3 = self.make_key(), self.make_key(), self.make_key()
+        cache.put(key1, "abcdef", sentinel.kernel_params)
+        cache.put(key2, "ghijkl", sentinel.kernel_params)
+        cache.put(key3, "mnopqr", sentinel.kernel_params)
+        self.assertItemsEqual([key2, key3], cache.entries)
+        self.assertItemsEqual(["ghijkl", "mnopqr"], cache.keys_by_node)
+
+    def test_invalidate_forgets_given_nodes_and_no_responses(self):
+        cache, _ = self.make_cache()
+        key1, key2, key3 = self.make_key(), self.make_key(), self.make_key()
+        cache.put(key1, "abcdef", sentinel.kernel_params)
+        cache.put(key2, "ghijkl", sentinel.kernel_params)
+        cache.put_no_response(key3)
+        cache.invalidate(["abcdef"])
+        self.assertItemsEqual([key2], cache.entries)
+        self.assertEqual(2, cache.stats["invalidations"])
+
+    def test_invalidate_can_keep_no_responses(self):
+        cache, _ = self.make_cache()
+        key1, key2 = self.make_key(), self.make_key()
+        cache.put(key1, "abcdef", sentinel.kernel_params)
+        cache.put_no_response(key2)
+        cache.invalidate(["abcdef"], no_response=False)
+        self.assertItemsEqual([key2], cache.entries)
+        self.assertEqual(1, cache.stats["invalidations"])
+
+    def test_invalidate_forgets_everything_without_system_ids(self):
+        cache, _ = self.make_cache()
+        key1, key2 = self.make_key(), self.make_key()
+        cache.put(key1, "abcdef", sentinel.kernel_params)
+        cache.put_no_response(key2)
+        cache.invalidate(None)
+        self.assertEqual({}, cache.entries)
+        self.assertEqual({}, cache.keys_by_node)
+        self.assertEqual(2, cache.stats["invalidations"])
+
+
+class TestBootFileCache(MAASTestCase):
+    """Tests for `BootFileCache`."""
+
+    run_tests_with = MAASTwistedRunTest.make_factory(timeout=5)
+
+    def setUp(self):
+        super(TestBootFileCache, self).setUp()
+        self.patch(boot_images_module, "list_boot_images").return_value = []
+        self.directory = self.make_dir()
+
+    def make_boot_file(self, name, size):
+        return factory.make_file(
+            self.directory, name, factory.make_bytes(size))
+
+    def open(self, path):
+        reader = FilesystemReader(FilePath(path))
+        self.addCleanup(reader.finish)
+        return reader
+
+    @inlineCallbacks
+    def get_data(self, cache, path):
+        reader = yield cache.get_reader(path, self.open(path))
+        data = reader.read(reader.size + 1)
+        reader.finish()
+        returnValue(data)
+
+    @inlineCallbacks
+    def test_reads_files_once(self):
+        path = self.make_boot_file("kernel", 100)
+        with open(path, "rb") as stream:
+            data = stream.read()
+        cache = BootFileCache()
+        readers = yield gatherResults([
+            cache.get_reader(path, self.open(path)),
+            cache.get_reader(path, self.open(path)),
+        ])
+        reader = yield cache.get_reader(path, self.open(path))
+        readers.append(reader)
+        for reader in readers:
+            self.addCleanup(reader.finish)
+            verifyObject(IReader, reader)
+            self.assertEqual(100, reader.size)
+            self.assertEqual(data[:60], reader.read(60))
+            self.assertEqual(data[60:], reader.read(60))
+            self.assertEqual(b"", reader.read(60))
+        self.assertEqual({"hits": 2, "misses": 1}, cache.stats)
+
+    @inlineCallbacks
+    def test_reads_files_again_when_they_change(self):
+        path = self.make_boot_file("kernel", 100)
+        cache = BootFileCache()
+        yield self.get_data(cache, path)
+        data = factory.make_bytes(50)
+        factory.make_file(self.directory, "kernel", data)
+        self.assertEqual(data, (yield self.get_data(cache, path)))
+        self.assertEqual({"misses": 2}, cache.stats)
+
+    @inlineCallbacks
+    def test_drops_files_when_boot_images_change(self):
+        path = self.make_boot_file("kernel", 100)
+        cache = BootFileCache()
+        yield self.get_data(cache, path)
+        boot_images_module.list_boot_images.return_value = [make_image(
+            make_boot_image_params(), "xinstall")]
+        yield self.get_data(cache, path)
+        self.assertEqual(
+            {"misses": 2, "invalidations": 1}, cache.stats)
+
+    @inlineCallbacks
+    def test_does_not_keep_large_files(self):
+        path = self.make_boot_file("initrd", 101)
+        cache = BootFileCache(max_file_size=100)
+        opened = self.open(path)
+        reader = yield cache.get_reader(path, opened)
+        self.assertIs(opened, reader)
+        self.assertEqual({}, cache.files)
+
+    @inlineCallbacks
+    def test_drops_least_recently_used_files_when_full(self):
+        path1 = self.make_boot_file("kernel1", 40)
+        path2 = self.make_boot_file("kernel2", 40)
+        path3 = self.make_boot_file("kernel3", 40)
+        cache = BootFileCache(size=100)
+        yield self.get_data(cache, path1)
+        yield self.get_data(cache, path2)
+        yield self.get_data(cache, path1)
+        yield self.get_data(cache, path3)
+        self.assertEqual([path1, path3], list(cache.files))
+        self.assertEqual(80, cache.used)
+
+    @inlineCallbacks
+    def test_does_not_drop_files_being_read(self):
+        path1 = self.make_boot_file("kernel1", 60)
+        path2 = self.make_boot_file("kernel2", 60)
+        cache = BootFileCache(size=100)
+        reader = yield cache.get_reader(path1, self.open(path1))
+        self.addCleanup(reader.finish)
+        yield self.get_data(cache, path2)
+        self.assertEqual([path1], list(cache.files))
+        reader.finish()
+        yield self.get_data(cache, path2)
+        self.assertEqual([path2], list(cache.files))
+
+
 class TestTFTPService(MAASTestCase):
 
     def test_tftp_service(self):
@@ -0,0 +1,218 @@
+# Copyright 2017 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for `provisioningserver.rackdservices.tftp_session`."""
+
+__all__ = []
+
+from maastesting.factory import factory
+from maastesting.testcase import MAASTestCase
+from provisioningserver.boot import BytesReader
+from provisioningserver.rackdservices.tftp_session import (
+    MAX_BLOCK_SIZE,
+    MAX_WINDOW_SIZE,
+    WindowedReadSession,
+)
+from tftp.datagram import (
+    ACKDatagram,
+    ERR_TID_UNKNOWN,
+    ERRORDatagram,
+    OP_DATA,
+    OP_ERROR,
+    OP_OACK,
+    split_opcode,
+    TFTPDatagramFactory,
+)
+from twisted.internet.defer import succeed
+from twisted.internet.task import Clock
+
+
+class FakeTransport:
+
+    def __init__(self):
+        super(FakeTransport, self).__init__()
+        self.written = []
+        self.listening = True
+
+    def write(self, data, addr):
+        datagram = TFTPDatagramFactory(*split_opcode(data))
+        self.written.append((datagram, addr))
+
+    def stopListening(self):
+        self.listening = False
+
+
+class TestWindowedReadSession(MAASTestCase):
+    """Tests for `WindowedReadSession`."""
+
+    def setUp(self):
+        super(TestWindowedReadSession, self).setUp()
+        self.remote = factory.make_ipv4_address(), 1069
+        self.clock = Clock()
+
+    def make_session(self, data, options=None, reader_class=BytesReader):
+        reader = reader_class(data)
+        session = WindowedReadSession(
+            self.remote, reader, {} if options is None else options,
+            _clock=self.clock)
+        session.transport = FakeTransport()
+        session.startProtocol()
+        return session, reader
+
+    def ack(self, session, blocknum):
+        session.datagramReceived(
+            ACKDatagram(blocknum).to_wire(), self.remote)
+
+    def take(self, session):
+        """Return the datagrams that `session` has sent, and forget them."""
+        datagrams = [
+            datagram for datagram, addr in session.transport.written
+            if addr == self.remote
+        ]
+        del session.transport.written[:]
+        return datagrams
+
+    def take_blocks(self, session):
+        datagrams = self.take(session)
+        self.assertEqual({OP_DATA}, {d.opcode for d in datagrams})
+        return [(d.blocknum, d.data) for d in datagrams]
+
+    def test_sends_one_block_at_a_time_without_options(self):
+        data = factory.make_bytes(1000)
+        session, reader = self.make_session(data)
+        self.assertEqual([(1, data[:512])], self.take_blocks(session))
+        self.ack(session, 1)
+        self.assertEqual([(2, data[512:])], self.take_blocks(session))
+        self.ack(session, 2)
+        self.assertTrue(session.completed)
+        self.assertFalse(session.transport.listening)
+        self.assertRaises(ValueError, reader.read, 1)
+
+    def test_negotiates_options(self):
+        session, _ = self.make_session(factory.make_bytes(100), {
+            b"blksize": b"1024", b"windowsize": b"4",
+            b"tsize": b"0", b"timeout": b"2", b"other": b"1"})
+        [oack] = self.take(session)
+        self.assertEqual(OP_OACK, oack.opcode)
+        self.assertEqual({
+            b"blksize": b"1024", b"windowsize": b"4",
+            b"tsize": b"100", b"timeout": b"2"}, dict(oack.options))
+        self.assertEqual((2, 2, 2), session.timeout)
+
+    def test_limits_block_and_window_sizes(self):
+        session, _ = self.make_session(b"", {
+            b"BlkSize": b"65464", b"windowsize": b"65535"})
+        self.assertEqual(MAX_BLOCK_SIZE, session.block_size)
+        self.assertEqual(MAX_WINDOW_SIZE, session.window_size)
+
+    def test_ignores_invalid_options(self):
+        session, _ = self.make_session(b"", {
+            b"blksize": b"7", b"windowsize": b"0", b"timeout": b"many"})
+        self.assertEqual({}, session.options)
+        self.assertEqual([(1, b"")], self.take_blocks(session))
+
+    def test_sends_windows_of_blocks(self):
+        data = factory.make_bytes(50)
+        session, _ = self.make_session(
+            data, {b"blksize": b"8", b"windowsize": b"4"})
+        self.take(session)
+        self.ack(session, 0)
+        self.assertEqual(
+            [(n + 1, data[n * 8:n * 8 + 8]) for n in range(4)],
+            self.take_blocks(session))
+        self.ack(session, 4)
+        self.assertEqual(
+            [(5, data[32:40]), (6, data[40:48]), (7, data[48:])],
+            self.take_blocks(session))
+        self.ack(session, 7)
+        self.assertTrue(session.completed)
+
+    def test_sends_again_from_block_after_partial_ack(self):
+        data = factory.make_bytes(50)
+        session, _ = self.make_session(
+            data, {b"blksize": b"8", b"windowsize": b"4"})
+        self.ack(session, 0)
+        self.take(session)
+        self.ack(session, 2)
+        self.assertEqual(
+            [3, 4, 5, 6], [n for n, _ in self.take_blocks(session)])
+
+    def test_ignores_duplicate_acks(self):
+        session, _ = self.make_session(
+            factory.make_bytes(50), {b"blksize": b"8", b"windowsize": b"4"})
+        self.ack(session, 0)
+        self.ack(session, 4)
+        self.take(session)
+        self.ack(session, 4)
+        self.ack(session, 3)
+        self.assertEqual([], self.take(session))
+
+    def test_wraps_block_numbers(self):
+        data = factory.make_bytes(8 * 65537)
+        session, _ = self.make_session(
+            data, {b"blksize": b"8", b"windowsize": b"64"})
+        self.take(session)
+        self.ack(session, 0)
+        acked = 0
+        while not session.completed:
+            blocks = self.take_blocks(session)
+            acked = blocks[-1][0]
+            self.ack(session, acked)
+        self.assertEqual(2, acked)
+        self.assertEqual(65538, session.acked)
+
+    def test_sends_again_on_timeout_then_gives_up(self):
+        session, reader = self.make_session(factory.make_bytes(1000))
+        blocks = self.take_blocks(session)
+        for timeout in session.timeout[:-1]:
+            self.clock.advance(timeout)
+            self.assertEqual(blocks, self.take_blocks(session))
+        self.assertFalse(session.completed)
+        self.clock.advance(session.timeout[-1])
+        self.assertEqual([], self.take(session))
+        self.assertTrue(session.completed)
+        self.assertRaises(ValueError, reader.read, 1)
+
+    def test_ends_when_client_sends_error(self):
+        session, _ = self.make_session(factory.make_bytes(1000))
+        session.datagramReceived(
+            ERRORDatagram.from_code(8).to_wire(), self.remote)
+        self.assertTrue(session.completed)
+        self.assertFalse(session.transport.listening)
+
+    def test_rejects_other_clients(self):
+        session, _ = self.make_session(factory.make_bytes(1000))
+        other = self.remote[0], 1070
+        session.datagramReceived(ACKDatagram(1).to_wire(), other)
+        [(error, addr)] = session.transport.written[1:]
+        self.assertEqual(
+            (OP_ERROR, ERR_TID_UNKNOWN, other),
+            (error.opcode, error.errorcode, addr))
+        self.assertEqual(0, session.acked)
+
+    def test_reads_from_readers_returning_deferreds(self):
+
+        class DeferringReader(BytesReader):
+            def read(self, size):
+                return succeed(super(DeferringReader, self).read(size))
+
+        data = factory.make_bytes(20)
+        session, _ = self.make_session(
+            data, {b"blksize": b"8", b"windowsize": b"4"},
+            reader_class=DeferringReader)
+        self.take(session)
+        self.ack(session, 0)
+        self.assertEqual(
+            [(1, data[:8]), (2, data[8:16]), (3, data[16:])],
+            self.take_blocks(session))
+
+    def test_sends_error_when_reading_fails(self):
+
+        class BrokenReader(BytesReader):
+            def read(self, size):
+                raise IOError("Broken")
+
+        session, _ = self.make_session(b"", reader_class=BrokenReader)
+        [error] = self.take(session)
+        self.assertEqual(OP_ERROR, error.opcode)
+        self.assertTrue(session.completed)
@@ -4,10 +4,16 @@
 """Twisted Application Plugin for the MAAS TFTP server."""
 
 __all__ = [
+    "BootFileCache",
+    "KernelParamsCache",
     "TFTPBackend",
     "TFTPService",
     ]
 
+from collections import (
+    Counter,
+    OrderedDict,
+)
 from functools import partial
 from socket import (
     AF_INET,
@@ -30,7 +36,7 @@ from provisioningserver.logger import (
     get_maas_logger,
     LegacyLogger,
 )
-from provisioningserver.rpc.boot_images import list_boot_images
+from provisioningserver.rpc.boot_images import get_boot_image_index
 from provisioningserver.rpc.exceptions import BootConfigNoResponse
 from provisioningserver.rpc.region import (
     GetBootConfig,
@@ -41,12 +47,16 @@ from provisioningserver.utils import (
     typed,
 )
 from provisioningserver.utils.network import get_all_interface_addresses
+from provisioningserver.utils.templates import get_stat_key
 from provisioningserver.utils.tftp import TFTPPath
 from provisioningserver.utils.twisted import (
     deferred,
     RPCFetcher,
 )
-from tftp.backend import FilesystemSynchronousBackend
+from tftp.backend import (
+    FilesystemSynchronousBackend,
+    IReader,
+)
 from tftp.errors import (
     BackendError,
     FileNotFound,
@@ -64,12 +74,18 @@ from twisted.internet.address import (
     IPv6Address,
 )
 from twisted.internet.defer import (
+    Deferred,
+    fail,
     inlineCallbacks,
     maybeDeferred,
     returnValue,
+    succeed,
 )
 from twisted.internet.task import deferLater
+from twisted.internet.threads import deferToThread
+from twisted.python.failure import Failure
 from twisted.python.filepath import FilePath
+from zope.interface import implementer
 
 
 maaslog = get_maas_logger("tftp")
@@ -83,32 +99,313 @@ def get_boot_image(params):
     if purpose == "enlist":
         purpose = "commissioning"
 
-    # Get the matching boot images, minus subarchitecture.
-    boot_images = list_boot_images()
-    boot_images = [
-        image
-        for image in boot_images
-        if (image['osystem'] == params['osystem'] and
-            image['release'] == params['release'] and
-            image['architecture'] == params['arch'] and
-            image['purpose'] == purpose)
-    ]
+    # Look for an exact subarchitecture match, then for an image that has
+    # the subarchitecture in its supported subarchitectures list.
+    return get_boot_image_index().get(
+        params["osystem"], params["release"], params["arch"],
+        params["subarch"], purpose)
+
+
+# How long, in seconds, the kernel parameters obtained from the region for
+# a request are reused for identical requests.
+KERNEL_PARAMS_CACHE_TTL = 30
+
+# How long, in seconds, a request that the region told us not to answer
+# goes unanswered without asking the region again.
+NO_RESPONSE_CACHE_TTL = 30
+
+# The most requests for which answers are kept.
+KERNEL_PARAMS_CACHE_SIZE = 10000
+
+
+class KernelParamsCache:
+    """Short-lived cache of the region's answers to `GetBootConfig`.
+
+    Machines that are booting retry their TFTP requests, and machines that
+    MAAS does not know about and must not answer -- the region responds
+    with `BootConfigNoResponse` -- keep on asking. Both kinds of answer
+    are kept for a short while so that the region is asked only once.
+
+    Answers for a known machine are indexed by its system ID so that they
+    can be dropped when the region says that the machine has changed.
+    Answers are also dropped when the boot images on this rack change.
+    """
+
+    NO_RESPONSE = object()
+
+    def __init__(
+            self, ttl=KERNEL_PARAMS_CACHE_TTL,
+            no_response_ttl=NO_RESPONSE_CACHE_TTL,
+            size=KERNEL_PARAMS_CACHE_SIZE, clock=reactor):
+        super(KernelParamsCache, self).__init__()
+        self.ttl = ttl
+        self.no_response_ttl = no_response_ttl
+        self.size = size
+        self.clock = clock
+        # key -> (expires, system_id, boot image index, kernel params)
+        self.entries = {}
+        self.keys_by_node = {}
+        self.stats = Counter()
+
+    @staticmethod
+    def make_key(params):
+        """Return the cache key for the `GetBootConfig` arguments `params`.
 
-    # See if exact subarchitecture match.
-    for image in boot_images:
-        if image["subarchitecture"] == params["subarch"]:
-            return image
+        The remote IP address only matters to the region for logging, so
+        requests from the same machine over different addresses share an
+        entry.
+        """
+        return (
+            params.get("local_ip"), params.get("mac"), params.get("arch"),
+            params.get("subarch"), params.get("bios_boot_method"))
 
-    # Not exact match check if subarchitecture is in the supported
-    # subarchitectures list.
-    for image in boot_images:
-        subarches = image.get("supported_subarches", "")
-        subarches = subarches.split(",")
-        if params["subarch"] in subarches:
-            return image
+    def get(self, key):
+        """Return the cached answer for `key`, or `None`.
 
-    # No matching boot image was found.
-    return None
+        The answer is either a `KernelParameters` or `NO_RESPONSE`.
+        """
+        entry = self.entries.get(key)
+        if entry is not None:
+            expires, _, index, kernel_params = entry
+            if (expires > self.clock.seconds() and
+                    index is get_boot_image_index()):
+                self.stats["hits"] += 1
+                return kernel_params
+            self._remove(key)
+        self.stats["misses"] += 1
+        return None
+
+    def put(self, key, system_id, kernel_params):
+        """Cache `kernel_params` for the machine `system_id`."""
+        self._put(key, system_id, kernel_params, self.ttl)
+
+    def put_no_response(self, key):
+        """Cache that the region does not want `key` answered."""
+        self._put(key, None, self.NO_RESPONSE, self.no_response_ttl)
+
+    def _put(self, key, system_id, kernel_params, ttl):
+        if ttl <= 0:
+            return
+        self._remove(key)
+        if len(self.entries) >= self.size:
+            self.prune()
+        if len(self.entries) >= self.size:
+            # Everything is still fresh; forget the oldest entry.
+            self._remove(next(iter(self.entries)))
+        self.entries[key] = (
+            self.clock.seconds() + ttl, system_id, get_boot_image_index(),
+            kernel_params)
+        self.keys_by_node.setdefault(system_id, set()).add(key)
+
+    def invalidate(self, system_ids=None, no_response=True):
+        """Forget the answers for the given machines.
+
+        A new node, or a change to a node's MAC addresses, can also be what
+        makes the region start answering an unknown machine, so answers to
+        not respond are forgotten too unless `no_response` is false. If
+        `system_ids` is `None`, forget everything.
+        """
+        if system_ids is None:
+            self.stats["invalidations"] += len(self.entries)
+            self.entries.clear()
+            self.keys_by_node.clear()
+        else:
+            system_ids = set(system_ids)
+            if no_response:
+                system_ids.add(None)
+            for system_id in system_ids:
+                for key in self.keys_by_node.pop(system_id, ()):
+                    del self.entries[key]
+                    self.stats["invalidations"] += 1
+
+    def prune(self):
+        """Forget all answers that have expired."""
+        now = self.clock.seconds()
+        expired = [
+            key for key, (expires, _, _, _) in self.entries.items()
+            if expires <= now
+        ]
+        for key in expired:
+            self._remove(key)
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            system_id = entry[1]
+            keys = self.keys_by_node.get(system_id)
+            if keys is not None:
+                keys.discard(key)
+                if len(keys) == 0:
+                    del self.keys_by_node[system_id]
+
+
+# The most memory, in bytes, used to keep copies of boot files.
+BOOT_FILE_CACHE_SIZE = 512 * 2 ** 20
+
+# The largest boot file, in bytes, of which a copy is kept. Larger files are
+# read from disk for every request.
+BOOT_FILE_MAX_SIZE = 128 * 2 ** 20
+
+
+def read_all(reader, chunk_size=2 ** 20):
+    """Read everything from `reader`, then finish it."""
+    try:
+        return b"".join(iter(partial(reader.read, chunk_size), b""))
+    finally:
+        reader.finish()
+
+
+class CachedBootFile:
+    """The contents of a boot file, and how many readers are sending it.
+
+    :ivar key: The file's status when it was read; see `get_stat_key`.
+    """
+
+    def __init__(self, key, data):
+        super(CachedBootFile, self).__init__()
+        self.key = key
+        self.data = data
+        self.readers = 0
+
+
+@implementer(IReader)
+class CachedBootFileReader:
+    """Reads a `CachedBootFile`, holding it in its cache until finished."""
+
+    def __init__(self, cached):
+        super(CachedBootFileReader, self).__init__()
+        self.cached = cached
+        self.cached.readers += 1
+        self.view = memoryview(cached.data)
+        self.size = len(cached.data)
+        self.position = 0
+
+    def read(self, size):
+        if self.view is None:
+            raise ValueError("Reader has been finished.")
+        data = self.view[self.position:self.position + size].tobytes()
+        self.position += len(data)
+        return data
+
+    def finish(self):
+        if self.view is not None:
+            self.view.release()
+            self.view = None
+            self.cached.readers -= 1
+
+
+class BootFileCache:
+    """Copies in memory of the boot files that are sent most often.
+
+    Hundreds of machines booting at once all ask for the same bootloaders,
+    kernels, and initrds. Each file is read from disk once, in a thread,
+    with requests that arrive while it is being read waiting for that same
+    read, and is then sent from memory to every machine that asks for it.
+
+    A copy is used only while its file's inode, size, and modification time
+    are unchanged. All copies are dropped when the boot images on this rack
+    change, as they do when `reload_boot_images` runs. The least recently
+    used copies are dropped to make room for others, but not while they
+    are being sent, so the cache may hold more than `size` bytes while
+    many different files are being sent at once.
+    """
+
+    def __init__(self, size=BOOT_FILE_CACHE_SIZE,
+                 max_file_size=BOOT_FILE_MAX_SIZE):
+        super(BootFileCache, self).__init__()
+        self.size = size
+        self.max_file_size = max_file_size
+        self.used = 0
+        # path -> CachedBootFile, least recently used first.
+        self.files = OrderedDict()
+        # path -> (key, boot image index, [Deferred, ...])
+        self.loading = {}
+        self.index = None
+        self.stats = Counter()
+
+    def get_reader(self, path, reader):
+        """Return a reader for the file at `path` that reads from memory.
+
+        :param path: The path of the file.
+        :param reader: An `IReader` open on the file, from which the file is
+            read if there's no copy of it yet. It is finished either way,
+            unless the file is too large to keep a copy of, in which case
+            it is returned instead.
+        :return: A `Deferred` that fires with an `IReader`.
+        """
+        key = get_stat_key(path)
+        if key is None or key[2] > min(self.max_file_size, self.size):
+            self.stats["uncached"] += 1
+            return succeed(reader)
+        index = get_boot_image_index()
+        if index is not self.index:
+            self.clear()
+            self.index = index
+        cached = self.files.get(path)
+        if cached is not None:
+            if cached.key == key:
+                self.stats["hits"] += 1
+                self.files.move_to_end(path)
+                reader.finish()
+                return succeed(CachedBootFileReader(cached))
+            self._remove(path)
+        loading = self.loading.get(path)
+        if loading is not None and loading[0] == key:
+            self.stats["hits"] += 1
+            reader.finish()
+            d = Deferred()
+            loading[2].append(d)
+            return d
+        self.stats["misses"] += 1
+        loading = self.loading[path] = key, index, []
+        d = deferToThread(read_all, reader)
+        d.addBoth(self._loaded, path, loading)
+        return d
+
+    def _loaded(self, result, path, loading):
+        """Put a newly read file in the cache, and answer all who waited."""
+        key, index, waiting = loading
+        if self.loading.get(path) is loading:
+            del self.loading[path]
+        if isinstance(result, Failure):
+            for d in waiting:
+                d.errback(result)
+            return result
+        cached = CachedBootFile(key, result)
+        readers = [CachedBootFileReader(cached) for _ in range(len(waiting))]
+        reader = CachedBootFileReader(cached)
+        if index is self.index and path not in self.files:
+            self._add(path, cached)
+        for d, waiting_reader in zip(waiting, readers):
+            d.callback(waiting_reader)
+        return reader
+
+    def _add(self, path, cached):
+        """Add `cached` if there's room, dropping unused copies to make it."""
+        size = len(cached.data)
+        for other_path, other in list(self.files.items()):
+            if self.used + size <= self.size:
+                break
+            elif other.readers == 0:
+                self._remove(other_path)
+        if self.used + size <= self.size:
+            self.files[path] = cached
+            self.used += size
+
+    def _remove(self, path):
+        cached = self.files.pop(path, None)
+        if cached is not None:
+            self.used -= len(cached.data)
+
+    def clear(self):
+        """Drop all copies of files.
+
+        Those being sent are kept in memory until their readers finish.
+        """
+        if len(self.files) > 0:
+            self.stats["invalidations"] += len(self.files)
+            self.files.clear()
+            self.used = 0
 
 
 def log_request(mac_address, file_name, clock=reactor):
@@ -138,8 +435,9 @@ class TFTPBackend(FilesystemSynchronousBackend):
     """A partially dynamic read-only TFTP server.
 
     Static files such as kernels and initrds, as well as any non-MAAS files
-    that the system may already be set up to serve, are served up normally.
-    But PXE configurations are generated on the fly.
+    that the system may already be set up to serve, are served up normally,
+    from copies kept in memory by a `BootFileCache`. But PXE configurations
+    are generated on the fly.
 
     When a PXE configuration file is requested, the server asynchronously
     requests the appropriate parameters from the API (at a configurable
@@ -166,6 +464,8 @@ class TFTPBackend(FilesystemSynchronousBackend):
             base_path, can_read=True, can_write=False)
         self.client_service = client_service
         self.fetcher = RPCFetcher()
+        self.kernel_params_cache = KernelParamsCache()
+        self.boot_file_cache = BootFileCache()
 
     @inlineCallbacks
     @typed
@@ -252,11 +552,33 @@ class TFTPBackend(FilesystemSynchronousBackend):
             if name in params
         }
 
+        cache = self.kernel_params_cache
+        key = cache.make_key(params)
+        kernel_params = cache.get(key)
+        if kernel_params is cache.NO_RESPONSE:
+            return fail(BootConfigNoResponse())
+        elif kernel_params is not None:
+            return succeed(kernel_params)
+
+        def remember(data, client):
+            # get_boot_image() pops the machine's system ID, so note it
+            # here to index the cache entry by it.
+            system_id = data.get("system_id")
+            data = self.get_boot_image(data, client, params['remote_ip'])
+            kernel_params = KernelParameters(**data)
+            cache.put(key, system_id, kernel_params)
+            return kernel_params
+
+        def remember_no_response(failure):
+            failure.trap(BootConfigNoResponse)
+            cache.put_no_response(key)
+            return failure
+
         def fetch(client, params):
             params["system_id"] = client.localIdent
             d = self.fetcher(client, GetBootConfig, **params)
-            d.addCallback(self.get_boot_image, client, params['remote_ip'])
-            d.addCallback(lambda data: KernelParameters(**data))
+            d.addCallback(remember, client)
+            d.addErrback(remember_no_response)
             return d
 
         d = self.client_service.getClientNow()
@@ -288,7 +610,9 @@ class TFTPBackend(FilesystemSynchronousBackend):
     def handle_boot_method(self, file_name: TFTPPath, result):
         boot_method, params = result
         if boot_method is None:
-            return super(TFTPBackend, self).get_reader(file_name)
+            reader = super(TFTPBackend, self).get_reader(file_name)
+            return self.boot_file_cache.get_reader(
+                reader.file_path.path, reader)
 
         # Map pxe namespace architecture names to MAAS's.
         arch = params.get("arch")
@@ -0,0 +1,275 @@
+# Copyright 2017 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""TFTP read sessions that send several blocks per acknowledgement."""
+
+__all__ = [
+    "WindowedReadSession",
+    ]
+
+from collections import OrderedDict
+
+from provisioningserver.logger import LegacyLogger
+from tftp.datagram import (
+    DATADatagram,
+    ERR_NOT_DEFINED,
+    ERR_TID_UNKNOWN,
+    ERRORDatagram,
+    OACKDatagram,
+    OP_ACK,
+    OP_ERROR,
+    split_opcode,
+    TFTPDatagramFactory,
+)
+from tftp.errors import WireProtocolError
+from twisted.internet import reactor
+from twisted.internet.defer import (
+    Deferred,
+    maybeDeferred,
+    succeed,
+)
+from twisted.internet.protocol import DatagramProtocol
+
+
+log = LegacyLogger()
+
+
+# The block size to use when the client does not negotiate one.
+DEFAULT_BLOCK_SIZE = 512
+
+# The smallest block size that RFC 2348 allows.
+MIN_BLOCK_SIZE = 8
+
+# The largest block size to agree to. Larger blocks than this don't fit in
+# a standard Ethernet frame, and a window of fragmented datagrams is lost
+# entirely when any one fragment is.
+MAX_BLOCK_SIZE = 1468
+
+# The most blocks to send before waiting for an acknowledgement (RFC 7440).
+MAX_WINDOW_SIZE = 64
+
+# How long, in seconds, to wait for each acknowledgement before sending
+# again, and then giving up.
+DEFAULT_TIMEOUT = (1, 3, 7)
+
+# How many times to send again when the client negotiates a timeout.
+TIMEOUT_RETRIES = 3
+
+
+def parse_option(value, minimum, maximum):
+    """Return the option `value` as an integer, or `None` if it's invalid.
+
+    :param value: The option's value, as sent on the wire.
+    :param minimum: The smallest value that the option may have.
+    :param maximum: The largest value that the option may have.
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        return None
+    if minimum <= number <= maximum:
+        return number
+    else:
+        return None
+
+
+class WindowedReadSession(DatagramProtocol):
+    """Send a file to a TFTP client, several blocks per acknowledgement.
+
+    This replaces tx-tftp's `RemoteOriginReadSession`, which negotiates only
+    the `blksize`, `timeout`, and `tsize` options, and then sends one block
+    at a time, waiting for each to be acknowledged before reading the next.
+    That leaves a transfer bound by the round trip time of each block.
+
+    As well as those options, this negotiates `windowsize` (RFC 7440): the
+    client acknowledges only the last of each window of blocks, so the next
+    window is sent as soon as that acknowledgement arrives. An
+    acknowledgement for a block part way through a window means that the
+    blocks after it were lost, so the window is sent again from the block
+    after it. If no acknowledgement arrives in time the whole window is
+    sent again.
+
+    Block numbers wrap around to zero, so files of any size can be sent.
+
+    :ivar acked: The number of blocks that the client has acknowledged.
+    :ivar window: The blocks, in order, sent but not yet acknowledged.
+    """
+
+    def __init__(self, remote, reader, options, _clock=None):
+        """
+        :param remote: The client's address.
+        :param reader: An `IReader` for the file requested.
+        :param options: The options requested, a mapping of option name to
+            value, as they were sent on the wire.
+        """
+        super(WindowedReadSession, self).__init__()
+        self.remote = remote
+        self.reader = reader
+        self.options = self.negotiate(options)
+        self.block_size = self.options.get(b"blksize", DEFAULT_BLOCK_SIZE)
+        self.window_size = self.options.get(b"windowsize", 1)
+        if b"timeout" in self.options:
+            self.timeout = (self.options[b"timeout"],) * TIMEOUT_RETRIES
+        else:
+            self.timeout = DEFAULT_TIMEOUT
+        self.clock = reactor if _clock is None else _clock
+        self.acked = 0
+        self.window = []
+        self.eof = False
+        self.negotiating = len(self.options) > 0
+        self.reading = False
+        self.completed = False
+        self.timer = None
+
+    def negotiate(self, options):
+        """Return the options from `options` that this session accepts.
+
+        :return: An ordered mapping of option name to its accepted value,
+            as an integer.
+        """
+        accepted = OrderedDict()
+        for name, value in options.items():
+            name = name.lower()
+            if name == b"blksize":
+                size = parse_option(value, MIN_BLOCK_SIZE, 65464)
+                if size is not None:
+                    accepted[name] = min(size, MAX_BLOCK_SIZE)
+            elif name == b"timeout":
+                timeout = parse_option(value, 1, 255)
+                if timeout is not None:
+                    accepted[name] = timeout
+            elif name == b"tsize":
+                # The reader's size may not be known, as for files that are
+                # generated as they're read.
+                size = getattr(self.reader, "size", None)
+                if size is not None:
+                    accepted[name] = size
+            elif name == b"windowsize":
+                size = parse_option(value, 1, 65535)
+                if size is not None:
+                    accepted[name] = min(size, MAX_WINDOW_SIZE)
+        return accepted
+
+    def startProtocol(self):
+        if self.negotiating:
+            self.sendOACK()
+        else:
+            self.sendWindow()
+
+    def datagramReceived(self, data, addr):
+        if addr != self.remote:
+            # Some other client; tell it, but carry on with this one.
+            self.transport.write(ERRORDatagram.from_code(
+                ERR_TID_UNKNOWN).to_wire(), addr)
+            return
+        try:
+            datagram = TFTPDatagramFactory(*split_opcode(data))
+        except WireProtocolError:
+            return  # Ignore garbage; the client will send again.
+        if datagram.opcode == OP_ERROR:
+            self.finish()
+        elif datagram.opcode == OP_ACK and not self.reading:
+            self.ackReceived(datagram.blocknum)
+
+    def ackReceived(self, blocknum):
+        """The client acknowledged block number `blocknum`.
+
+        Acknowledgements for blocks that were already acknowledged, or that
+        have not been sent, are ignored.
+        """
+        if self.completed:
+            return
+        elif self.negotiating:
+            if blocknum == 0:
+                self.negotiating = False
+                self.sendWindow()
+        else:
+            count = (blocknum - self.acked) % 65536
+            if 0 < count <= len(self.window):
+                del self.window[:count]
+                self.acked += count
+                if self.eof and len(self.window) == 0:
+                    self.finish()
+                else:
+                    self.sendWindow()
+
+    def sendOACK(self):
+        """Send the accepted options, until the client acknowledges them."""
+        options = OrderedDict(
+            (name, str(value).encode("ascii"))
+            for name, value in self.options.items())
+        self.send([OACKDatagram(options).to_wire()])
+
+    def sendWindow(self):
+        """Fill the window with blocks from the reader, and send them all."""
+        self.cancelTimer()
+        self.reading = True
+        d = maybeDeferred(self.fill)
+        d.addCallback(self._sendWindow)
+        d.addErrback(self.readFailed)
+
+    def _sendWindow(self, _):
+        self.reading = False
+        if self.completed:
+            return  # The client gave up while blocks were being read.
+        first = self.acked + 1
+        self.send([
+            DATADatagram((first + offset) % 65536, data).to_wire()
+            for offset, data in enumerate(self.window)
+        ])
+
+    def fill(self):
+        """Read blocks until the window is full or the file is exhausted.
+
+        Readers may return a `Deferred` from `read`; blocks are read in
+        order whichever they do.
+        """
+        while not self.eof and len(self.window) < self.window_size:
+            data = self.reader.read(self.block_size)
+            if isinstance(data, Deferred):
+                data.addCallback(self.addBlock)
+                data.addCallback(lambda _: self.fill())
+                return data
+            else:
+                self.addBlock(data)
+        return succeed(None)
+
+    def addBlock(self, data):
+        self.window.append(data)
+        if len(data) < self.block_size:
+            self.eof = True
+
+    def readFailed(self, failure):
+        log.err(failure, "Reading a file for a TFTP client failed.")
+        self.transport.write(ERRORDatagram.from_code(
+            ERR_NOT_DEFINED, b"Read failed").to_wire(), self.remote)
+        self.finish()
+
+    def send(self, datagrams, retries=0):
+        """Send `datagrams` to the client, and again if it doesn't reply.
+
+        The session ends when the client has not replied after the last
+        timeout.
+        """
+        if retries < len(self.timeout):
+            for datagram in datagrams:
+                self.transport.write(datagram, self.remote)
+            self.timer = self.clock.callLater(
+                self.timeout[retries], self.send, datagrams, retries + 1)
+        else:
+            self.timer = None
+            self.finish()
+
+    def cancelTimer(self):
+        if self.timer is not None:
+            if self.timer.active():
+                self.timer.cancel()
+            self.timer = None
+
+    def finish(self):
+        """End the session, whether or not the file was sent."""
+        if not self.completed:
+            self.completed = True
+            self.cancelTimer()
+            self.reader.finish()
+            self.transport.stopListening()
@@ -4,6 +4,8 @@
 """RPC relating to boot images."""
 
 __all__ = [
+    "BootImageIndex",
+    "get_boot_image_index",
     "import_boot_images",
     "list_boot_images",
     "is_import_boot_images_running",
@@ -35,6 +37,45 @@ log = LegacyLogger()
 
 
 CACHED_BOOT_IMAGES = None
+CACHED_BOOT_IMAGE_INDEX = None
+
+
+class BootImageIndex:
+    """Index of boot images for finding the image to boot a machine.
+
+    Images are indexed on their operating system, release, architecture, and
+    purpose, and within that on their subarchitecture and each of their
+    supported subarchitectures, so that `get` does not need to look through
+    every image.
+    """
+
+    def __init__(self, images):
+        super(BootImageIndex, self).__init__()
+        self.images = images
+        self.exact = {}
+        self.supported = {}
+        for image in images:
+            key = (
+                image["osystem"], image["release"], image["architecture"],
+                image["purpose"])
+            exact = self.exact.setdefault(key, {})
+            exact.setdefault(image["subarchitecture"], image)
+            supported = self.supported.setdefault(key, {})
+            subarches = image.get("supported_subarches", "")
+            for subarch in subarches.split(","):
+                supported.setdefault(subarch, image)
+
+    def get(self, osystem, release, arch, subarch, purpose):
+        """Return the boot image to use, or `None` if there is none.
+
+        The first image with exactly `subarch` is preferred, then the first
+        image that supports `subarch`.
+        """
+        key = (osystem, release, arch, purpose)
+        image = self.exact.get(key, {}).get(subarch)
+        if image is None:
+            image = self.supported.get(key, {}).get(subarch)
+        return image
 
 
 def list_boot_images():
@@ -53,13 +94,32 @@ def list_boot_images():
     return CACHED_BOOT_IMAGES
 
 
+def get_boot_image_index():
+    """Return a `BootImageIndex` of the images from `list_boot_images`.
+
+    The index is cached alongside the boot images, and rebuilt whenever they
+    are reloaded.
+    """
+    global CACHED_BOOT_IMAGE_INDEX
+    images = list_boot_images()
+    index = CACHED_BOOT_IMAGE_INDEX
+    if index is None or index.images is not images:
+        index = CACHED_BOOT_IMAGE_INDEX = BootImageIndex(images)
+    return index
+
+
 def reload_boot_images():
     """Update the cached boot images so `list_boot_images` returns the
     most up-to-date boot images list."""
-    global CACHED_BOOT_IMAGES
+    global CACHED_BOOT_IMAGES, CACHED_BOOT_IMAGE_INDEX
     with ClusterConfiguration.open() as config:
         tftp_root = config.tftp_root
-    CACHED_BOOT_IMAGES = tftppath.list_boot_images(tftp_root)
+    images = tftppath.list_boot_images(tftp_root)
+    index = BootImageIndex(images)
+    # A reader that sees the new images before the new index will find that
+    # the index does not match and build one of its own, so the two never
+    # get out of step; see `get_boot_image_index`.
+    CACHED_BOOT_IMAGES, CACHED_BOOT_IMAGE_INDEX = images, index
 
 
 def get_hosts_from_sources(sources):
@@ -18,6 +18,7 @@ __all__ = [
     "DescribeNOSTypes",
     "GetPreseedData",
     "Identify",
+    "InvalidateKernelParams",
     "ListBootImages",
     "ListOperatingSystems",
     "ListSupportedArchitectures",
@@ -763,3 +764,23 @@ class DisableAndShutoffRackd(amp.Command):
         exceptions.CannotDisableAndShutoffRackd: (
             b"CannotDisableAndShutoffRackd"),
     }
+
+
+class InvalidateKernelParams(amp.Command):
+    """Forget the kernel parameters cached by the rack's TFTP server.
+
+    Forgets those for the given machines and, unless `no_response` is
+    false, all of the requests that the region asked not to be answered;
+    a new node, or a change to a node's MAC addresses, might mean that a
+    machine that was not being answered now should be.
+
+    If `system_ids` is not supplied, everything is forgotten.
+
+    :since: 2.3
+    """
+    arguments = [
+        (b"system_ids", amp.ListOf(amp.Unicode(), optional=True)),
+        (b"no_response", amp.Boolean(optional=True)),
+    ]
+    response = []
+    errors = []
@@ -25,6 +25,7 @@ from urllib.parse import urlparse
 from apiclient.creds import convert_string_to_tuple
 from apiclient.utils import ascii_url
 from netaddr import IPAddress
+import provisioningserver
 from provisioningserver import concurrency
 from provisioningserver.config import (
     ClusterConfiguration,
@@ -685,6 +686,23 @@ class Cluster(RPCProtocol):
             d.addBoth(callOut, lock.release)
         return {}
 
+    @cluster.InvalidateKernelParams.responder
+    def invalidate_kernel_params(self, system_ids=None, no_response=None):
+        """InvalidateKernelParams()
+
+        Implementation of
+        :py:class:`~provisioningserver.rpc.cluster.InvalidateKernelParams`.
+        """
+        try:
+            tftp_service = provisioningserver.services.getServiceNamed(
+                "tftp")
+        except KeyError:
+            pass  # The TFTP server is not running; nothing is cached.
+        else:
+            tftp_service.backend.kernel_params_cache.invalidate(
+                system_ids, no_response=(no_response is not False))
+        return {}
+
     @cluster.DisableAndShutoffRackd.responder
     def disable_and_shutoff_rackd(self):
         """DisableAndShutoffRackd()
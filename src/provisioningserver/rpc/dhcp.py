@@ -23,7 +23,10 @@ from provisioningserver.dhcp import (
     DHCPv6Server,
 )
 from provisioningserver.dhcp.config import get_config
-from provisioningserver.dhcp.omshell import Omshell
+from provisioningserver.dhcp.omapi import (
+    OmapiClient,
+    OmapiConnectionError,
+)
 from provisioningserver.logger import get_maas_logger
 from provisioningserver.rpc.exceptions import (
     CannotConfigureDHCP,
@@ -181,62 +184,82 @@ def _delete_config(server):
         sudo_delete_file(server.config_filename)
 
 
-def _remove_host_map(omshell, mac):
-    """Remove host by `mac`."""
-    try:
-        omshell.remove(mac)
-    except ExternalProcessError as e:
-        if 'not connected.' in e.output_as_unicode:
-            msg = "The DHCP server could not be reached."
-        else:
-            msg = str(e)
-        err = "Could not remove host map for %s: %s" % (mac, msg)
-        maaslog.error(err)
-        raise CannotRemoveHostMap(err)
+def _get_host_map_errors(hosts, call, *args):
+    """Return `(host, error)` for each host map that `call` failed to change.
 
-
-def _create_host_map(omshell, mac, ip_address):
-    """Create host with `mac` -> `ip_address`."""
+    If the DHCP server cannot be reached the first host is reported.
+    """
     try:
-        omshell.create(ip_address, mac)
-    except ExternalProcessError as e:
-        if 'not connected.' in e.output_as_unicode:
-            msg = "The DHCP server could not be reached."
+        errors = call(*args)
+    except OmapiConnectionError as error:
+        errors = [error]
+    for host, error in zip(hosts, errors):
+        if error is None:
+            continue
+        elif isinstance(error, OmapiConnectionError):
+            yield host, "The DHCP server could not be reached."
         else:
-            msg = str(e)
-        err = "Could not create host map for %s -> %s: %s" % (
-            mac, ip_address, msg)
-        maaslog.error(err)
-        raise CannotCreateHostMap(err)
+            yield host, str(error)
 
 
-def _modify_host_map(omshell, mac, ip_address):
-    """Modify host with `mac` -> `ip_address`."""
-    try:
-        omshell.modify(ip_address, mac)
-    except ExternalProcessError as e:
-        if 'not connected.' in e.output_as_unicode:
-            msg = "The DHCP server could not be reached."
-        else:
-            msg = str(e)
-        err = "Could not modify host map for %s -> %s: %s" % (
-            mac, ip_address, msg)
+def _remove_host_maps(client, hosts):
+    """Remove each of `hosts` by `mac`."""
+    failures = [
+        "Could not remove host map for %s: %s" % (host["mac"], msg)
+        for host, msg in _get_host_map_errors(
+            hosts, client.remove_hosts, [host["mac"] for host in hosts])
+    ]
+    for err in failures:
         maaslog.error(err)
-        raise CannotModifyHostMap(err)
+    if len(failures) > 0:
+        raise CannotRemoveHostMap(failures[0])
+
+
+def _create_host_maps(client, hosts):
+    """Create each of `hosts` with `mac` -> `ip`."""
+    failures = [
+        "Could not create host map for %s -> %s: %s" % (
+            host["mac"], host["ip"], msg)
+        for host, msg in _get_host_map_errors(
+            hosts, client.create_hosts,
+            [(host["mac"], host["ip"]) for host in hosts])
+    ]
+    for err in failures:
+        maaslog.error(err)
+    if len(failures) > 0:
+        raise CannotCreateHostMap(failures[0])
+
+
+def _modify_host_maps(client, hosts):
+    """Modify each of `hosts` with `mac` -> `ip`."""
+    failures = [
+        "Could not modify host map for %s -> %s: %s" % (
+            host["mac"], host["ip"], msg)
+        for host, msg in _get_host_map_errors(
+            hosts, client.modify_hosts,
+            [(host["mac"], host["ip"]) for host in hosts])
+    ]
+    for err in failures:
+        maaslog.error(err)
+    if len(failures) > 0:
+        raise CannotModifyHostMap(failures[0])
 
 
 @synchronous
 def _update_hosts(server, remove, add, modify):
-    """Update the hosts using the OMAPI."""
-    omshell = Omshell(
+    """Update the hosts using the OMAPI.
+
+    All of the changes are made over one connection to the DHCP server, and
+    each kind of change is pipelined, rather than running `omshell` once for
+    every host.
+    """
+    client = OmapiClient(
         server_address='127.0.0.1', shared_key=server.omapi_key,
         ipv6=server.ipv6)
-    for host in remove:
-        _remove_host_map(omshell, host["mac"])
-    for host in add:
-        _create_host_map(omshell, host["mac"], host["ip"])
-    for host in modify:
-        _modify_host_map(omshell, host["mac"], host["ip"])
+    with client:
+        _remove_host_maps(client, remove)
+        _create_host_maps(client, add)
+        _modify_host_maps(client, modify)
 
 
 @asynchronous
@@ -4,13 +4,19 @@
 """Power control."""
 
 __all__ = [
+    "get_max_power_query_concurrency",
     "power_action_registry",
     "power_state_update",
     "maybe_change_power_state",
+    "PowerQueryScheduler",
+    "PowerStateUpdates",
 ]
 
+from collections import Counter
 from datetime import timedelta
 from functools import partial
+import os
+import resource
 import sys
 
 from provisioningserver.drivers.power import (
@@ -35,6 +41,7 @@ from provisioningserver.rpc.exceptions import (
 from provisioningserver.rpc.region import (
     MarkNodeFailed,
     UpdateNodePowerState,
+    UpdateNodePowerStates,
 )
 from provisioningserver.utils.twisted import (
     asynchronous,
@@ -45,13 +52,17 @@ from provisioningserver.utils.twisted import (
 from twisted.internet import reactor
 from twisted.internet.defer import (
     CancelledError,
+    Deferred,
     DeferredList,
     DeferredSemaphore,
     inlineCallbacks,
+    maybeDeferred,
     returnValue,
     succeed,
 )
 from twisted.internet.task import deferLater
+from twisted.protocols.amp import UnhandledCommand
+from twisted.python.failure import Failure
 
 
 maaslog = get_maas_logger("power")
@@ -80,6 +91,80 @@ def power_state_update(system_id, state):
         power_state=state)
 
 
+class PowerStateUpdates:
+    """Report power states to the region in batches.
+
+    States are sent with `UpdateNodePowerStates` once `batch_size` of them
+    have been added, or `delay` seconds after the first of a batch was
+    added, whichever is sooner. Regions from before 2.3 are sent each state
+    with `UpdateNodePowerState` instead.
+    """
+
+    def __init__(self, clock=reactor, batch_size=100, delay=0.5):
+        super(PowerStateUpdates, self).__init__()
+        self.clock = clock
+        self.batch_size = batch_size
+        self.delay = delay
+        self.pending = []
+        self.call = None
+        self.bulk = True
+
+    def add(self, system_id, state):
+        """Report `state` as the power state of the node `system_id`.
+
+        :return: A `Deferred` that fires once the region has been told, or
+            fails with `NoSuchNode` if the region does not know the node.
+        """
+        d = Deferred()
+        self.pending.append((system_id, state, d))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        elif self.call is None:
+            self.call = self.clock.callLater(self.delay, self.flush)
+        return d
+
+    def flush(self):
+        """Send all pending power states to the region now."""
+        if self.call is not None:
+            if self.call.active():
+                self.call.cancel()
+            self.call = None
+        pending, self.pending = self.pending, []
+        if len(pending) == 0:
+            return succeed(None)
+        else:
+            return self._send(pending)
+
+    @inlineCallbacks
+    def _send(self, pending):
+        if self.bulk:
+            try:
+                client = getRegionClient()
+                response = yield client(UpdateNodePowerStates, states=[
+                    {"system_id": system_id, "power_state": state}
+                    for system_id, state, _ in pending
+                ])
+            except UnhandledCommand:
+                # The region is from before 2.3; tell it one by one.
+                self.bulk = False
+            except Exception:
+                failure = Failure()
+                for _, _, d in pending:
+                    d.errback(failure)
+                return
+            else:
+                missing = set(response["missing"])
+                for system_id, _, d in pending:
+                    if system_id in missing:
+                        d.errback(NoSuchNode.from_system_id(system_id))
+                    else:
+                        d.callback(None)
+                return
+        for system_id, state, d in pending:
+            maybeDeferred(
+                power_state_update, system_id, state).chainDeferred(d)
+
+
 @asynchronous(timeout=15)
 @inlineCallbacks
 def power_change_failure(system_id, hostname, power_change, message):
@@ -351,42 +436,59 @@ def get_power_state(system_id, hostname, power_type, context, clock=reactor):
     raise exc_type(exc_value).with_traceback(exc_trace)
 
 
+def _get_power_state_update(updates):
+    if updates is None:
+        return power_state_update
+    else:
+        return updates.add
+
+
 @inlineCallbacks
-def power_query_success(system_id, hostname, state):
-    """Report a node that for which power querying has succeeded."""
+def power_query_success(system_id, hostname, state, updates=None):
+    """Report a node that for which power querying has succeeded.
+
+    :param updates: A `PowerStateUpdates` with which to batch the report of
+        the node's power state, or `None` to report it immediately.
+    """
     message = "Power state queried: %s" % state
-    yield power_state_update(system_id, state)
+    yield _get_power_state_update(updates)(system_id, state)
     yield send_node_event(
         EVENT_TYPES.NODE_POWER_QUERIED_DEBUG,
         system_id, hostname, message)
 
 
 @inlineCallbacks
-def power_query_failure(system_id, hostname, failure):
-    """Report a node that for which power querying has failed."""
+def power_query_failure(system_id, hostname, failure, updates=None):
+    """Report a node that for which power querying has failed.
+
+    :param updates: A `PowerStateUpdates` with which to batch the report of
+        the node's power state, or `None` to report it immediately.
+    """
     maaslog.error("%s: Power state could not be queried: %s" % (
         hostname, failure.getErrorMessage()))
-    yield power_state_update(system_id, 'error')
+    yield _get_power_state_update(updates)(system_id, 'error')
     yield send_node_event(
         EVENT_TYPES.NODE_POWER_QUERY_FAILED,
         system_id, hostname, failure.getErrorMessage())
 
 
 @asynchronous
-def report_power_state(d, system_id, hostname):
+def report_power_state(d, system_id, hostname, updates=None):
     """Report the result of a power query.
 
     :param d: A `Deferred` that will fire with the node's updated power state,
         or an error condition. The callback/errback values are passed through
         unaltered. See `get_power_state` for details.
+    :param updates: A `PowerStateUpdates` with which to batch the report of
+        the node's power state, or `None` to report it immediately.
     """
     def cb(state):
-        d = power_query_success(system_id, hostname, state)
+        d = power_query_success(system_id, hostname, state, updates)
         d.addCallback(lambda _: state)
         return d
 
     def eb(failure):
-        d = power_query_failure(system_id, hostname, failure)
+        d = power_query_failure(system_id, hostname, failure, updates)
         d.addCallback(lambda _: failure)
         return d
 
@@ -423,10 +525,145 @@ def maaslog_report_failure(node, failure):
         # log.err(failure, "Failed to refresh power state.")
 
 
-def query_node(node, clock):
+def get_max_power_query_concurrency():
+    """Return how many power queries can sensibly be run at once.
+
+    Each query may need a handful of file descriptors for a subprocess or a
+    connection to the BMC, and some CPU to parse its output. Queries are
+    also run in the reactor's thread pool, so there's no point running more
+    of them at once than it has threads.
+    """
+    soft_limit, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    limits = [(os.cpu_count() or 1) * 16, reactor.getThreadPool().max]
+    if soft_limit != resource.RLIM_INFINITY:
+        limits.append(soft_limit // 16)
+    return max(5, min(limits))
+
+
+class PowerQueryScheduler:
+    """Schedule power queries across BMCs.
+
+    At most `max_concurrency` queries are run at once, and at most
+    `max_per_host` of them against any one BMC host. Hosts for which a
+    query fails or takes longer than `slow_query` seconds are backed off:
+    their nodes are not queried again for `backoff_min` seconds, doubling
+    with each consecutive slow or failed query up to `backoff_max`.
+
+    The latencies of queries are counted in a histogram, which is logged
+    and reset by `finishSweep`.
+    """
+
+    slow_query = 10.0
+    backoff_min = timedelta(seconds=30).total_seconds()
+    backoff_max = timedelta(minutes=10).total_seconds()
+    latency_buckets = (1, 2, 5, 10, 30)
+
+    def __init__(self, max_concurrency=None, max_per_host=2, clock=reactor):
+        super(PowerQueryScheduler, self).__init__()
+        if max_concurrency is None:
+            max_concurrency = get_max_power_query_concurrency()
+        self.semaphore = DeferredSemaphore(tokens=max_concurrency)
+        self.max_per_host = max_per_host
+        self.clock = clock
+        self.hosts = {}
+        self.backoff = {}
+        self.latencies = Counter()
+
+    @staticmethod
+    def get_host(node):
+        """Return the BMC host for `node`.
+
+        Nodes without a power address are treated as each having their own.
+        """
+        context = node['context']
+        if isinstance(context, dict) and context.get('power_address'):
+            return node['power_type'], context['power_address']
+        else:
+            return node['power_type'], node['system_id']
+
+    def isBackedOff(self, node):
+        """Is the BMC host for `node` being backed off?"""
+        host = self.get_host(node)
+        if host in self.backoff:
+            until, _ = self.backoff[host]
+            return self.clock.seconds() < until
+        else:
+            return False
+
+    def run(self, node, func, *args, **kwargs):
+        """Call `func` to query `node` when the limits allow.
+
+        :return: A `Deferred` that fires with the result of `func`.
+        """
+        host = self.get_host(node)
+        if host not in self.hosts:
+            self.hosts[host] = DeferredSemaphore(tokens=self.max_per_host)
+
+        def query():
+            started = self.clock.seconds()
+            d = maybeDeferred(func, *args, **kwargs)
+            d.addBoth(self._finished, host, started)
+            return d
+
+        # Wait for the host before taking a global token, so that queries
+        # to a busy host do not hold up queries to other hosts.
+        return self.hosts[host].run(self.semaphore.run, query)
+
+    def _finished(self, result, host, started):
+        elapsed = self.clock.seconds() - started
+        self.latencies[self._getBucket(elapsed)] += 1
+        if isinstance(result, Failure) or elapsed > self.slow_query:
+            _, delay = self.backoff.get(host, (None, None))
+            if delay is None:
+                delay = self.backoff_min
+            else:
+                delay = min(delay * 2, self.backoff_max)
+            self.backoff[host] = self.clock.seconds() + delay, delay
+        else:
+            self.backoff.pop(host, None)
+        return result
+
+    def _getBucket(self, elapsed):
+        for bucket in self.latency_buckets:
+            if elapsed <= bucket:
+                return "<=%ds" % bucket
+        return ">%ds" % self.latency_buckets[-1]
+
+    def finishSweep(self):
+        """Log and reset the latency histogram, and forget idle hosts."""
+        if sum(self.latencies.values()) > 0:
+            buckets = [
+                "<=%ds" % bucket for bucket in self.latency_buckets]
+            buckets.append(">%ds" % self.latency_buckets[-1])
+            maaslog.debug(
+                "Power query latencies: %s; %d BMC host(s) backed off.",
+                ", ".join(
+                    "%s: %d" % (bucket, self.latencies[bucket])
+                    for bucket in buckets),
+                len(self.backoff))
+        self.latencies.clear()
+        self.hosts = {
+            host: semaphore
+            for host, semaphore in self.hosts.items()
+            if semaphore.tokens < semaphore.limit
+        }
+        now = self.clock.seconds()
+        for host, (until, _) in list(self.backoff.items()):
+            # Remember hosts a while after their back-off expires so that
+            # a host that is slow again is backed off for longer.
+            if now > until + self.backoff_max:
+                del self.backoff[host]
+
+
+def query_node(node, clock, updates=None, scheduler=None):
     """Calls `get_power_state` on the given node.
 
     Logs to maaslog as errors and power states change.
+
+    :param updates: A `PowerStateUpdates` with which to batch the report of
+        the node's power state, or `None` to report it immediately.
+    :param scheduler: A `PowerQueryScheduler` through which to query the
+        node's BMC, or `None` to query it immediately.
     """
     if node['system_id'] in power_action_registry:
         maaslog.debug(
@@ -434,27 +671,57 @@ def query_node(node, clock):
             "power action already in progress.",
             node['hostname'])
         return succeed(None)
+    elif scheduler is not None and scheduler.isBackedOff(node):
+        maaslog.debug(
+            "%s: Skipping query power status, "
+            "BMC is being backed off.", node['hostname'])
+        return succeed(None)
     else:
-        d = get_power_state(
+        args = (
             node['system_id'], node['hostname'], node['power_type'],
-            node['context'], clock=clock)
-        d = report_power_state(d, node['system_id'], node['hostname'])
+            node['context'])
+        if scheduler is None:
+            d = get_power_state(*args, clock=clock)
+        else:
+            d = scheduler.run(node, get_power_state, *args, clock=clock)
+        if updates is None:
+            d = report_power_state(d, node['system_id'], node['hostname'])
+        else:
+            d = report_power_state(
+                d, node['system_id'], node['hostname'], updates=updates)
         d.addCallbacks(
             partial(maaslog_report_success, node),
             partial(maaslog_report_failure, node))
         return d
 
 
-def query_all_nodes(nodes, max_concurrency=5, clock=reactor):
+def query_all_nodes(
+        nodes, max_concurrency=5, clock=reactor, updates=None,
+        scheduler=None):
     """Queries the given nodes for their power state.
 
     Nodes' states are reported back to the region.
 
+    :param max_concurrency: The most nodes to query at once when no
+        `scheduler` is given.
+    :param updates: A `PowerStateUpdates` with which to batch reports of the
+        nodes' power states, or `None` to report each immediately.
+    :param scheduler: A `PowerQueryScheduler` to limit and track queries.
     :return: A deferred, which fires once all nodes have been queried,
         successfully or not.
     """
-    semaphore = DeferredSemaphore(tokens=max_concurrency)
-    queries = (
-        semaphore.run(query_node, node, clock)
-        for node in nodes if node['power_type'] in PowerDriverRegistry)
+    nodes = (
+        node for node in nodes if node['power_type'] in PowerDriverRegistry)
+    if scheduler is None:
+        semaphore = DeferredSemaphore(tokens=max_concurrency)
+        if updates is None:
+            queries = (
+                semaphore.run(query_node, node, clock) for node in nodes)
+        else:
+            queries = (
+                semaphore.run(query_node, node, clock, updates)
+                for node in nodes)
+    else:
+        queries = (
+            query_node(node, clock, updates, scheduler) for node in nodes)
     return DeferredList(queries, consumeErrors=True)
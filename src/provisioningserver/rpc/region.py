@@ -20,6 +20,7 @@ __all__ = [
     "GetTimeConfiguration",
     "Identify",
     "ListNodePowerParameters",
+    "ListNodePowerParametersV2",
     "MarkNodeFailed",
     "RegisterEventType",
     "RegisterRackController",
@@ -32,12 +33,15 @@ __all__ = [
     "SendEventMACAddress",
     "UpdateInterfaces",
     "UpdateLastImageSync",
+    "UpdateLeases",
     "UpdateNodePowerState",
+    "UpdateNodePowerStates",
 ]
 
 from provisioningserver.rpc.arguments import (
     AmpList,
     Bytes,
+    CompressedAmpList,
     ParsedURL,
     StructureAsJSON,
 )
@@ -279,6 +283,32 @@ class ListNodePowerParameters(amp.Command):
     }
 
 
+class ListNodePowerParametersV2(amp.Command):
+    """Return power parameters for the nodes in the specified cluster.
+
+    This is the same as `ListNodePowerParameters` except that the response
+    is compressed so that many more nodes can be returned at once.
+
+    :since: 2.3
+    """
+
+    arguments = [
+        # The cluster UUID.
+        (b"uuid", amp.Unicode()),
+    ]
+    response = [
+        (b"nodes", CompressedAmpList(
+            [(b"system_id", amp.Unicode()),
+             (b"hostname", amp.Unicode()),
+             (b"power_state", amp.Unicode()),
+             (b"power_type", amp.Unicode()),
+             (b"context", StructureAsJSON())])),
+    ]
+    errors = {
+        NoSuchCluster: b"NoSuchCluster",
+    }
+
+
 class UpdateLastImageSync(amp.Command):
     """Update Rack Controller's Last Image Sync.
 
@@ -309,6 +339,27 @@ class UpdateNodePowerState(amp.Command):
     errors = {NoSuchNode: b"NoSuchNode"}
 
 
+class UpdateNodePowerStates(amp.Command):
+    """Update the power states of several nodes at once.
+
+    The states are applied in order, in one transaction. Nodes that do not
+    exist are skipped, and their system IDs returned.
+
+    :since: 2.3
+    """
+
+    arguments = [
+        (b"states", CompressedAmpList([
+            (b"system_id", amp.Unicode()),
+            (b"power_state", amp.Unicode()),
+        ])),
+    ]
+    response = [
+        (b"missing", amp.ListOf(amp.Unicode())),
+    ]
+    errors = []
+
+
 class RegisterEventType(amp.Command):
     """Register an event type.
 
@@ -529,6 +580,32 @@ class UpdateLease(amp.Command):
     }
 
 
+class UpdateLeases(amp.Command):
+    """Report several DHCP lease updates from a cluster controller.
+
+    The updates are applied in order, in one transaction. Different from
+    `UpdateLease` as this call updates many leases at a time.
+
+    :since: 2.3
+    """
+    arguments = [
+        (b"cluster_uuid", amp.Unicode()),
+        (b"updates", CompressedAmpList([
+            (b"action", amp.Unicode()),
+            (b"mac", amp.Unicode()),
+            (b"ip_family", amp.Unicode()),
+            (b"ip", amp.Unicode()),
+            (b"timestamp", amp.Integer()),
+            (b"lease_time", amp.Integer(optional=True)),
+            (b"hostname", amp.Unicode(optional=True)),
+        ])),
+    ]
+    response = []
+    errors = {
+        NoSuchCluster: b"NoSuchCluster",
+    }
+
+
 class UpdateServices(amp.Command):
     """Report service statuses that are monitored on the rackd.
 
@@ -30,7 +30,9 @@ from provisioningserver.rpc import (
 )
 from provisioningserver.rpc.boot_images import (
     _run_import,
+    BootImageIndex,
     fix_sources_for_cluster,
+    get_boot_image_index,
     get_hosts_from_sources,
     import_boot_images,
     is_import_boot_images_running,
@@ -39,6 +41,10 @@ from provisioningserver.rpc.boot_images import (
 )
 from provisioningserver.rpc.region import UpdateLastImageSync
 from provisioningserver.rpc.testing import MockLiveClusterToRegionRPCFixture
+from provisioningserver.testing.boot_images import (
+    make_boot_image_params,
+    make_image,
+)
 from provisioningserver.testing.config import (
     BootSourcesFixture,
     ClusterConfigurationFixture,
@@ -47,6 +53,7 @@ from provisioningserver.utils.twisted import pause
 from testtools.matchers import (
     Equals,
     Is,
+    IsInstance,
 )
 from twisted.internet import defer
 from twisted.internet.defer import (
@@ -105,16 +112,122 @@ class TestListBootImages(MAASTestCase):
 
 class TestReloadBootImages(MAASTestCase):
 
+    def setUp(self):
+        super(TestReloadBootImages, self).setUp()
+        self.patch(boot_images, 'CACHED_BOOT_IMAGE_INDEX', None)
+
     def test__sets_CACHED_BOOT_IMAGES(self):
         self.patch(
             boot_images, 'CACHED_BOOT_IMAGES', factory.make_name('old_cache'))
-        fake_boot_images = [factory.make_name('image') for _ in range(3)]
+        fake_boot_images = [
+            make_image(make_boot_image_params(), 'xinstall')
+            for _ in range(3)
+        ]
         mock_list_boot_images = self.patch(tftppath, 'list_boot_images')
         mock_list_boot_images.return_value = fake_boot_images
         reload_boot_images()
         self.assertEqual(
             boot_images.CACHED_BOOT_IMAGES, fake_boot_images)
 
+    def test__sets_CACHED_BOOT_IMAGE_INDEX(self):
+        self.patch(boot_images, 'CACHED_BOOT_IMAGES', None)
+        fake_boot_images = [make_image(make_boot_image_params(), 'xinstall')]
+        mock_list_boot_images = self.patch(tftppath, 'list_boot_images')
+        mock_list_boot_images.return_value = fake_boot_images
+        reload_boot_images()
+        self.assertIs(
+            boot_images.CACHED_BOOT_IMAGES,
+            boot_images.CACHED_BOOT_IMAGE_INDEX.images)
+        self.assertIs(
+            boot_images.CACHED_BOOT_IMAGE_INDEX, get_boot_image_index())
+
+
+class TestGetBootImageIndex(MAASTestCase):
+
+    def setUp(self):
+        super(TestGetBootImageIndex, self).setUp()
+        self.patch(boot_images, 'CACHED_BOOT_IMAGE_INDEX', None)
+
+    def test__indexes_list_boot_images(self):
+        images = [make_image(make_boot_image_params(), 'xinstall')]
+        self.patch(boot_images, 'CACHED_BOOT_IMAGES', images)
+        index = get_boot_image_index()
+        self.assertThat(index, IsInstance(BootImageIndex))
+        self.assertIs(images, index.images)
+
+    def test__caches_index(self):
+        self.patch(boot_images, 'CACHED_BOOT_IMAGES', [])
+        self.assertIs(get_boot_image_index(), get_boot_image_index())
+
+    def test__rebuilds_index_when_images_change(self):
+        self.patch(boot_images, 'CACHED_BOOT_IMAGES', [])
+        index = get_boot_image_index()
+        images = [make_image(make_boot_image_params(), 'xinstall')]
+        self.patch(boot_images, 'CACHED_BOOT_IMAGES', images)
+        self.assertIsNot(index, get_boot_image_index())
+        self.assertIs(images, get_boot_image_index().images)
+
+
+class TestBootImageIndex(MAASTestCase):
+
+    def make_image(self, params, subarch=None, subarches=None):
+        image = make_image(params, 'xinstall')
+        if subarch is not None:
+            image['subarchitecture'] = subarch
+        if subarches is not None:
+            image['supported_subarches'] = subarches
+        return image
+
+    def get(self, index, image, subarch=None):
+        if subarch is None:
+            subarch = image['subarchitecture']
+        return index.get(
+            image['osystem'], image['release'], image['architecture'],
+            subarch, image['purpose'])
+
+    def test__finds_image_by_subarch(self):
+        images = [
+            self.make_image(make_boot_image_params()) for _ in range(3)]
+        index = BootImageIndex(images)
+        for image in images:
+            self.assertIs(image, self.get(index, image))
+
+    def test__finds_image_by_supported_subarch(self):
+        image = self.make_image(
+            make_boot_image_params(), subarch='generic',
+            subarches='generic,hwe-16.04,hwe-16.04-edge')
+        index = BootImageIndex([image])
+        self.assertIs(image, self.get(index, image, 'hwe-16.04-edge'))
+
+    def test__prefers_exact_subarch(self):
+        params = make_boot_image_params()
+        supporting = self.make_image(
+            params, subarch='generic',
+            subarches='generic,%s' % params['subarchitecture'])
+        exact = self.make_image(params)
+        index = BootImageIndex([supporting, exact])
+        self.assertIs(exact, self.get(index, exact))
+
+    def test__prefers_first_image(self):
+        params = make_boot_image_params()
+        first, second = self.make_image(params), self.make_image(params)
+        index = BootImageIndex([first, second])
+        self.assertIs(first, self.get(index, first))
+
+    def test__returns_None_when_no_match(self):
+        image = self.make_image(make_boot_image_params())
+        index = BootImageIndex([image])
+        self.assertIsNone(self.get(index, image, factory.make_name('sub')))
+        self.assertIsNone(index.get(
+            factory.make_name('os'), image['release'], image['architecture'],
+            image['subarchitecture'], image['purpose']))
+
+    def test__handles_images_without_supported_subarches(self):
+        image = self.make_image(make_boot_image_params())
+        del image['supported_subarches']
+        index = BootImageIndex([image])
+        self.assertIs(image, self.get(index, image))
+
 
 class TestGetHostsFromSources(MAASTestCase):
 
@@ -44,6 +44,7 @@ from maastesting.twisted import (
     TwistedLoggerFixture,
 )
 from netaddr import IPNetwork
+import provisioningserver
 from provisioningserver import concurrency
 from provisioningserver.boot import tftppath
 from provisioningserver.boot.tests.test_tftppath import make_osystem
@@ -3139,6 +3140,57 @@ class TestClusterProtocol_DecomposeMachine(MAASTestCase):
                 pod_type, context, pod_id=pod_id, name=name))
 
 
+class TestClusterProtocol_InvalidateKernelParams(MAASTestCase):
+
+    def test__is_registered(self):
+        protocol = Cluster()
+        responder = protocol.locateResponder(
+            cluster.InvalidateKernelParams.commandName)
+        self.assertIsNotNone(responder)
+
+    def patch_tftp_service(self):
+        services = self.patch(provisioningserver, "services")
+        tftp_service = services.getServiceNamed.return_value
+        return tftp_service.backend.kernel_params_cache
+
+    def test_invalidates_given_machines(self):
+        cache = self.patch_tftp_service()
+        system_ids = [factory.make_name("system_id") for _ in range(3)]
+        response = call_responder(
+            Cluster(), cluster.InvalidateKernelParams,
+            {"system_ids": system_ids})
+        self.assertEqual({}, response.result)
+        self.assertThat(
+            cache.invalidate,
+            MockCalledOnceWith(system_ids, no_response=True))
+
+    def test_keeps_no_responses_when_asked(self):
+        cache = self.patch_tftp_service()
+        system_ids = [factory.make_name("system_id") for _ in range(3)]
+        response = call_responder(
+            Cluster(), cluster.InvalidateKernelParams,
+            {"system_ids": system_ids, "no_response": False})
+        self.assertEqual({}, response.result)
+        self.assertThat(
+            cache.invalidate,
+            MockCalledOnceWith(system_ids, no_response=False))
+
+    def test_invalidates_everything_without_system_ids(self):
+        cache = self.patch_tftp_service()
+        response = call_responder(
+            Cluster(), cluster.InvalidateKernelParams, {})
+        self.assertEqual({}, response.result)
+        self.assertThat(
+            cache.invalidate, MockCalledOnceWith(None, no_response=True))
+
+    def test_does_nothing_when_tftp_is_not_running(self):
+        services = self.patch(provisioningserver, "services")
+        services.getServiceNamed.side_effect = KeyError("tftp")
+        response = call_responder(
+            Cluster(), cluster.InvalidateKernelParams, {})
+        self.assertEqual({}, response.result)
+
+
 class TestClusterProtocol_DisableAndShutoffRackd(MAASTestCase):
 
     run_tests_with = MAASTwistedRunTest.make_factory(timeout=5)
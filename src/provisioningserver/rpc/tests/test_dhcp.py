@@ -6,6 +6,7 @@
 __all__ = []
 
 import copy
+from functools import partial
 from operator import itemgetter
 from unittest.mock import (
     ANY,
@@ -25,6 +26,11 @@ from maastesting.testcase import (
     MAASTestCase,
     MAASTwistedRunTest,
 )
+from provisioningserver.dhcp.omapi import (
+    OmapiClient,
+    OmapiConnectionError,
+    OmapiError,
+)
 from provisioningserver.dhcp.testing.config import (
     DHCPConfigNameResolutionDisabled,
     fix_shared_networks_failover,
@@ -36,6 +42,7 @@ from provisioningserver.dhcp.testing.config import (
     make_shared_network,
     make_subnet_dhcp_snippets,
 )
+from provisioningserver.dhcp.testing.omapi import FakeOmapiServer
 from provisioningserver.rpc import (
     dhcp,
     exceptions,
@@ -299,154 +306,201 @@ class TestDHCPState(MAASTestCase):
                     global_dhcp_snippets, key=itemgetter("name"))))
 
 
-class TestRemoveHostMap(MAASTestCase):
+class TestRemoveHostMaps(MAASTestCase):
 
-    def test_calls_omshell_remove(self):
-        omshell = Mock()
-        mac = factory.make_mac_address()
-        dhcp._remove_host_map(omshell, mac)
-        self.assertThat(omshell.remove, MockCalledOnceWith(mac))
+    def test_calls_client_remove_hosts(self):
+        client = Mock()
+        hosts = [make_host(), make_host()]
+        client.remove_hosts.return_value = [None, None]
+        dhcp._remove_host_maps(client, hosts)
+        self.assertThat(client.remove_hosts, MockCalledOnceWith(
+            [hosts[0]["mac"], hosts[1]["mac"]]))
 
-    def test_raises_error_when_omshell_crashes(self):
-        error_message = factory.make_name("error").encode("ascii")
-        omshell = Mock()
-        omshell.remove.side_effect = ExternalProcessError(
-            returncode=2, cmd=("omshell",), output=error_message)
-        mac = factory.make_mac_address()
+    def test_raises_error_when_removal_fails(self):
+        error_message = factory.make_name("error")
+        client = Mock()
+        hosts = [make_host(), make_host()]
+        client.remove_hosts.return_value = [None, OmapiError(error_message)]
         with FakeLogger("maas.dhcp") as logger:
             error = self.assertRaises(
-                exceptions.CannotRemoveHostMap, dhcp._remove_host_map,
-                omshell, mac)
+                exceptions.CannotRemoveHostMap, dhcp._remove_host_maps,
+                client, hosts)
         # The CannotRemoveHostMap exception includes a message describing the
         # problematic mapping.
-        self.assertDocTestMatches(
-            "Could not remove host map for %s: ..." % (mac),
+        self.assertEqual(
+            "Could not remove host map for %s: %s" % (
+                hosts[1]["mac"], error_message),
             str(error))
         # A message is also written to the maas.dhcp logger that describes the
         # problematic mapping.
         self.assertDocTestMatches(
-            "Could not remove host map for %s: ..." % (mac),
+            "Could not remove host map for %s: %s" % (
+                hosts[1]["mac"], error_message),
             logger.output)
 
-    def test_raises_error_when_omshell_not_connected(self):
-        error = ExternalProcessError(
-            returncode=2, cmd=("omshell",), output="")
-        self.patch(ExternalProcessError, 'output_as_unicode', 'not connected.')
-        omshell = Mock()
-        omshell.remove.side_effect = error
-        mac = factory.make_mac_address()
+    def test_logs_every_failure_and_raises_the_first(self):
+        client = Mock()
+        hosts = [make_host(), make_host()]
+        client.remove_hosts.return_value = [
+            OmapiError("first"), OmapiError("second")]
         with FakeLogger("maas.dhcp") as logger:
             error = self.assertRaises(
-                exceptions.CannotRemoveHostMap, dhcp._remove_host_map,
-                omshell, mac)
-        # The CannotCreateHostMap exception includes a message describing the
+                exceptions.CannotRemoveHostMap, dhcp._remove_host_maps,
+                client, hosts)
+        self.assertDocTestMatches(
+            "Could not remove host map for %s: first" % hosts[0]["mac"],
+            str(error))
+        self.assertDocTestMatches(
+            "Could not remove host map for %s: first\n"
+            "Could not remove host map for %s: second" % (
+                hosts[0]["mac"], hosts[1]["mac"]),
+            logger.output)
+
+    def test_raises_error_when_server_not_reachable(self):
+        client = Mock()
+        client.remove_hosts.side_effect = OmapiConnectionError("refused")
+        hosts = [make_host(), make_host()]
+        with FakeLogger("maas.dhcp") as logger:
+            error = self.assertRaises(
+                exceptions.CannotRemoveHostMap, dhcp._remove_host_maps,
+                client, hosts)
+        # The CannotRemoveHostMap exception includes a message describing the
         # problematic mapping.
         self.assertDocTestMatches(
             "Could not remove host map for %s: "
-            "The DHCP server could not be reached." % (mac),
+            "The DHCP server could not be reached." % hosts[0]["mac"],
             str(error))
         # A message is also written to the maas.dhcp logger that describes the
         # problematic mapping.
         self.assertDocTestMatches(
             "Could not remove host map for %s: "
-            "The DHCP server could not be reached." % (mac),
+            "The DHCP server could not be reached." % hosts[0]["mac"],
             logger.output)
 
 
-class TestCreateHostMap(MAASTestCase):
-
-    def test_calls_omshell_create(self):
-        omshell = Mock()
-        mac = factory.make_mac_address()
-        ip = factory.make_ip_address()
-        dhcp._create_host_map(omshell, mac, ip)
-        self.assertThat(omshell.create, MockCalledOnceWith(ip, mac))
+class TestCreateHostMaps(MAASTestCase):
 
-    def test_raises_error_when_omshell_crashes(self):
-        error_message = factory.make_name("error").encode("ascii")
-        omshell = Mock()
-        omshell.create.side_effect = ExternalProcessError(
-            returncode=2, cmd=("omshell",), output=error_message)
-        mac = factory.make_mac_address()
-        ip = factory.make_ip_address()
+    def test_calls_client_create_hosts(self):
+        client = Mock()
+        host = make_host()
+        client.create_hosts.return_value = [None]
+        dhcp._create_host_maps(client, [host])
+        self.assertThat(client.create_hosts, MockCalledOnceWith(
+            [(host["mac"], host["ip"])]))
+
+    def test_raises_error_when_creation_fails(self):
+        error_message = factory.make_name("error")
+        client = Mock()
+        host = make_host()
+        client.create_hosts.return_value = [OmapiError(error_message)]
         with FakeLogger("maas.dhcp") as logger:
             error = self.assertRaises(
-                exceptions.CannotCreateHostMap, dhcp._create_host_map,
-                omshell, mac, ip)
+                exceptions.CannotCreateHostMap, dhcp._create_host_maps,
+                client, [host])
         # The CannotCreateHostMap exception includes a message describing the
         # problematic mapping.
         self.assertDocTestMatches(
-            "Could not create host map for %s -> %s: ..." % (mac, ip),
+            "Could not create host map for %s -> %s: %s" % (
+                host["mac"], host["ip"], error_message),
             str(error))
         # A message is also written to the maas.dhcp logger that describes the
         # problematic mapping.
         self.assertDocTestMatches(
-            "Could not create host map for %s -> %s: ..." % (mac, ip),
+            "Could not create host map for %s -> %s: %s" % (
+                host["mac"], host["ip"], error_message),
             logger.output)
 
-    def test_raises_error_when_omshell_not_connected(self):
-        error = ExternalProcessError(
-            returncode=2, cmd=("omshell",), output="")
-        self.patch(ExternalProcessError, 'output_as_unicode', 'not connected.')
-        omshell = Mock()
-        omshell.create.side_effect = error
-        mac = factory.make_mac_address()
-        ip = factory.make_ip_address()
+    def test_raises_error_when_server_not_reachable(self):
+        client = Mock()
+        client.create_hosts.side_effect = OmapiConnectionError("refused")
+        host = make_host()
         with FakeLogger("maas.dhcp") as logger:
             error = self.assertRaises(
-                exceptions.CannotCreateHostMap, dhcp._create_host_map,
-                omshell, mac, ip)
+                exceptions.CannotCreateHostMap, dhcp._create_host_maps,
+                client, [host])
         # The CannotCreateHostMap exception includes a message describing the
         # problematic mapping.
         self.assertDocTestMatches(
             "Could not create host map for %s -> %s: "
-            "The DHCP server could not be reached." % (mac, ip),
+            "The DHCP server could not be reached." % (
+                host["mac"], host["ip"]),
             str(error))
         # A message is also written to the maas.dhcp logger that describes the
         # problematic mapping.
         self.assertDocTestMatches(
             "Could not create host map for %s -> %s: "
-            "The DHCP server could not be reached." % (mac, ip),
+            "The DHCP server could not be reached." % (
+                host["mac"], host["ip"]),
+            logger.output)
+
+
+class TestModifyHostMaps(MAASTestCase):
+
+    def test_calls_client_modify_hosts(self):
+        client = Mock()
+        host = make_host()
+        client.modify_hosts.return_value = [None]
+        dhcp._modify_host_maps(client, [host])
+        self.assertThat(client.modify_hosts, MockCalledOnceWith(
+            [(host["mac"], host["ip"])]))
+
+    def test_raises_error_when_modification_fails(self):
+        error_message = factory.make_name("error")
+        client = Mock()
+        host = make_host()
+        client.modify_hosts.return_value = [OmapiError(error_message)]
+        with FakeLogger("maas.dhcp") as logger:
+            error = self.assertRaises(
+                exceptions.CannotModifyHostMap, dhcp._modify_host_maps,
+                client, [host])
+        self.assertDocTestMatches(
+            "Could not modify host map for %s -> %s: %s" % (
+                host["mac"], host["ip"], error_message),
+            str(error))
+        self.assertDocTestMatches(
+            "Could not modify host map for %s -> %s: %s" % (
+                host["mac"], host["ip"], error_message),
             logger.output)
 
 
 class TestUpdateHost(MAASTestCase):
 
-    def test__creates_omshell_with_correct_arguments(self):
-        omshell = self.patch(dhcp, "Omshell")
+    def test__creates_client_with_correct_arguments(self):
+        client = self.patch(dhcp, "OmapiClient")
         server = Mock()
         server.ipv6 = factory.pick_bool()
         dhcp._update_hosts(server, [], [], [])
-        self.assertThat(omshell, MockCallsMatch(
-            call(
-                ipv6=server.ipv6, server_address="127.0.0.1",
-                shared_key=server.omapi_key),
-        ))
-
-    def test__performs_operations(self):
-        omshell = Mock()
-        self.patch(dhcp, "Omshell").return_value = omshell
+        self.assertThat(client, MockCalledOnceWith(
+            ipv6=server.ipv6, server_address="127.0.0.1",
+            shared_key=server.omapi_key))
+
+    def test__performs_operations_over_one_connection(self):
+        server = self.useFixture(FakeOmapiServer())
+        self.patch(dhcp, "OmapiClient", partial(
+            OmapiClient, server_port=server.port))
         remove_host = make_host()
-        add_host = make_host()
+        server.add_host(remove_host["mac"], remove_host["ip"])
         modify_host = make_host()
-        server = Mock()
-        server.ipv6 = factory.pick_bool()
-        dhcp._update_hosts(server, [remove_host], [add_host], [modify_host])
-        self.assertThat(
-            omshell.remove,
-            MockCallsMatch(
-                call(remove_host["mac"]),
-            ))
-        self.assertThat(
-            omshell.create,
-            MockCallsMatch(
-                call(add_host["ip"], add_host["mac"]),
-            ))
-        self.assertThat(
-            omshell.modify,
-            MockCallsMatch(
-                call(modify_host["ip"], modify_host["mac"]),
-            ))
+        server.add_host(modify_host["mac"], factory.make_ipv4_address())
+        add_host = make_host()
+        dhcp_server = Mock(ipv6=False, omapi_key=server.shared_key)
+        dhcp._update_hosts(
+            dhcp_server, [remove_host], [add_host], [modify_host])
+        self.assertEqual({
+            add_host["mac"]: add_host["ip"],
+            modify_host["mac"]: modify_host["ip"],
+        }, server.get_hosts())
+
+    def test__closes_connection_on_failure(self):
+        client = self.patch(dhcp, "OmapiClient").return_value
+        client.__enter__ = Mock(return_value=client)
+        client.__exit__ = Mock(return_value=False)
+        client.remove_hosts.return_value = [OmapiError("error")]
+        self.assertRaises(
+            exceptions.CannotRemoveHostMap, dhcp._update_hosts,
+            Mock(), [make_host()], [make_host()], [])
+        self.assertThat(client.create_hosts, MockNotCalled())
+        self.assertThat(client.__exit__, MockCalledOnceWith(ANY, ANY, ANY))
 
 
 class TestConfigureDHCP(MAASTestCase):
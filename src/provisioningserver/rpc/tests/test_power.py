@@ -10,15 +10,18 @@ import random
 from unittest.mock import (
     ANY,
     call,
+    Mock,
     sentinel,
 )
 
 from fixtures import FakeLogger
 from maastesting.factory import factory
 from maastesting.matchers import (
+    MockCalledOnce,
     MockCalledOnceWith,
     MockCalledWith,
     MockCallsMatch,
+    MockNotCalled,
 )
 from maastesting.testcase import (
     MAASTestCase,
@@ -1151,3 +1154,323 @@ class TestPowerQueryAsync(MAASTestCase):
         self.assertEqual(
             [(True, node1['power_state']), (True, node2['power_state'])],
             results)
+
+
+class TestPowerStateUpdates(MAASTestCase):
+
+    run_tests_with = MAASTwistedRunTest.make_factory(timeout=5)
+
+    def patch_rpc_methods(self, *commands):
+        fixture = self.useFixture(MockClusterToRegionRPCFixture())
+        protocol, io = fixture.makeEventLoop(*commands)
+        return protocol, io
+
+    def test_sends_batch_after_delay(self):
+        protocol, io = self.patch_rpc_methods(region.UpdateNodePowerStates)
+        protocol.UpdateNodePowerStates.return_value = succeed(
+            {"missing": []})
+        clock = Clock()
+        updates = power.PowerStateUpdates(clock=clock, delay=1.0)
+        d1 = updates.add("abcdef", "on")
+        d2 = updates.add("ghijkl", "off")
+        io.flush()
+        self.assertThat(protocol.UpdateNodePowerStates, MockNotCalled())
+        clock.advance(1.0)
+        io.flush()
+        self.assertThat(
+            protocol.UpdateNodePowerStates, MockCalledOnceWith(
+                ANY, states=[
+                    {"system_id": "abcdef", "power_state": "on"},
+                    {"system_id": "ghijkl", "power_state": "off"},
+                ]))
+        self.assertIsNone(extract_result(d1))
+        self.assertIsNone(extract_result(d2))
+
+    def test_sends_batch_when_full(self):
+        protocol, io = self.patch_rpc_methods(region.UpdateNodePowerStates)
+        protocol.UpdateNodePowerStates.return_value = succeed(
+            {"missing": []})
+        clock = Clock()
+        updates = power.PowerStateUpdates(clock=clock, batch_size=2)
+        updates.add("abcdef", "on")
+        updates.add("ghijkl", "off")
+        io.flush()
+        self.assertThat(protocol.UpdateNodePowerStates, MockCalledOnce())
+        self.assertEqual([], clock.getDelayedCalls())
+
+    def test_fails_missing_nodes_with_NoSuchNode(self):
+        protocol, io = self.patch_rpc_methods(region.UpdateNodePowerStates)
+        protocol.UpdateNodePowerStates.return_value = succeed(
+            {"missing": ["ghijkl"]})
+        updates = power.PowerStateUpdates(clock=Clock())
+        d1 = updates.add("abcdef", "on")
+        d2 = updates.add("ghijkl", "off")
+        updates.flush()
+        io.flush()
+        self.assertIsNone(extract_result(d1))
+        self.assertRaises(exceptions.NoSuchNode, extract_result, d2)
+
+    def test_fails_all_when_the_update_fails(self):
+        protocol, io = self.patch_rpc_methods(region.UpdateNodePowerStates)
+        protocol.UpdateNodePowerStates.return_value = fail(
+            ZeroDivisionError())
+        updates = power.PowerStateUpdates(clock=Clock())
+        d1 = updates.add("abcdef", "on")
+        d2 = updates.add("ghijkl", "off")
+        updates.flush()
+        io.flush()
+        self.assertRaises(Exception, extract_result, d1)
+        self.assertRaises(Exception, extract_result, d2)
+
+    def test_falls_back_to_UpdateNodePowerState(self):
+        protocol, io = self.patch_rpc_methods(region.UpdateNodePowerState)
+        protocol.UpdateNodePowerState.return_value = succeed({})
+        updates = power.PowerStateUpdates(clock=Clock())
+        d1 = updates.add("abcdef", "on")
+        updates.flush()
+        io.flush()
+        self.assertEqual({}, extract_result(d1))
+        self.assertFalse(updates.bulk)
+        d2 = updates.add("ghijkl", "off")
+        updates.flush()
+        io.flush()
+        self.assertEqual({}, extract_result(d2))
+        self.assertThat(protocol.UpdateNodePowerState, MockCallsMatch(
+            call(ANY, system_id="abcdef", power_state="on"),
+            call(ANY, system_id="ghijkl", power_state="off"),
+        ))
+
+    def test_flush_does_nothing_when_nothing_is_pending(self):
+        get_client = self.patch(power, "getRegionClient")
+        updates = power.PowerStateUpdates(clock=Clock())
+        self.assertIsNone(extract_result(updates.flush()))
+        self.assertThat(get_client, MockNotCalled())
+
+    def test_power_query_success_uses_updates(self):
+        updates = power.PowerStateUpdates(clock=Clock())
+        add = self.patch(updates, "add")
+        add.return_value = succeed(None)
+        self.patch_autospec(power, "send_node_event")
+        power.power_query_success("abcdef", "hostname", "on", updates)
+        self.assertThat(add, MockCalledOnceWith("abcdef", "on"))
+
+    def test_power_query_failure_uses_updates(self):
+        updates = power.PowerStateUpdates(clock=Clock())
+        add = self.patch(updates, "add")
+        add.return_value = succeed(None)
+        self.patch_autospec(power, "send_node_event")
+        with FakeLogger("maas"):
+            power.power_query_failure(
+                "abcdef", "hostname", Failure(ZeroDivisionError()), updates)
+        self.assertThat(add, MockCalledOnceWith("abcdef", "error"))
+
+
+class TestGetMaxPowerQueryConcurrency(MAASTestCase):
+
+    def setUp(self):
+        super(TestGetMaxPowerQueryConcurrency, self).setUp()
+        self.patch(power.os, "cpu_count").return_value = 4
+        self.patch(power.reactor, "getThreadPool").return_value = (
+            Mock(max=1000))
+
+    def test_limited_by_file_descriptors(self):
+        self.patch(power.resource, "getrlimit").return_value = (800, 4096)
+        self.assertEqual(50, power.get_max_power_query_concurrency())
+
+    def test_limited_by_cpus(self):
+        self.patch(power.resource, "getrlimit").return_value = (
+            power.resource.RLIM_INFINITY, power.resource.RLIM_INFINITY)
+        self.assertEqual(64, power.get_max_power_query_concurrency())
+
+    def test_limited_by_thread_pool(self):
+        self.patch(power.resource, "getrlimit").return_value = (8192, 8192)
+        power.reactor.getThreadPool.return_value = Mock(max=10)
+        self.assertEqual(10, power.get_max_power_query_concurrency())
+
+    def test_at_least_5(self):
+        self.patch(power.resource, "getrlimit").return_value = (16, 16)
+        self.assertEqual(5, power.get_max_power_query_concurrency())
+
+
+class TestPowerQueryScheduler(MAASTestCase):
+
+    def make_node(self, power_address=None):
+        context = {}
+        if power_address is not None:
+            context["power_address"] = power_address
+        return {
+            "system_id": factory.make_name("system_id"),
+            "hostname": factory.make_name("hostname"),
+            "power_type": "ipmi",
+            "power_state": "on",
+            "context": context,
+        }
+
+    def test_get_host_uses_power_address(self):
+        node = self.make_node("10.0.0.1")
+        self.assertEqual(
+            ("ipmi", "10.0.0.1"), power.PowerQueryScheduler.get_host(node))
+
+    def test_get_host_falls_back_to_system_id(self):
+        node = self.make_node()
+        self.assertEqual(
+            ("ipmi", node["system_id"]),
+            power.PowerQueryScheduler.get_host(node))
+
+    def test_run_limits_queries_per_host(self):
+        scheduler = power.PowerQueryScheduler(
+            max_concurrency=10, max_per_host=2, clock=Clock())
+        queries = [Deferred() for _ in range(3)]
+        started = []
+
+        def query(index):
+            started.append(index)
+            return queries[index]
+
+        node = self.make_node("10.0.0.1")
+        results = [scheduler.run(node, query, index) for index in range(3)]
+        self.assertEqual([0, 1], started)
+        queries[0].callback("on")
+        self.assertEqual([0, 1, 2], started)
+        self.assertEqual("on", extract_result(results[0]))
+
+    def test_run_limits_queries_globally(self):
+        scheduler = power.PowerQueryScheduler(
+            max_concurrency=2, max_per_host=2, clock=Clock())
+        queries = [Deferred() for _ in range(3)]
+        started = []
+
+        def query(index):
+            started.append(index)
+            return queries[index]
+
+        for index in range(3):
+            scheduler.run(self.make_node(), query, index)
+        self.assertEqual([0, 1], started)
+        queries[1].callback("off")
+        self.assertEqual([0, 1, 2], started)
+
+    def test_run_backs_off_slow_hosts(self):
+        clock = Clock()
+        scheduler = power.PowerQueryScheduler(max_concurrency=5, clock=clock)
+        node = self.make_node("10.0.0.1")
+        query = Deferred()
+        scheduler.run(node, lambda: query)
+        clock.advance(scheduler.slow_query + 1)
+        query.callback("on")
+        self.assertTrue(scheduler.isBackedOff(node))
+        self.assertTrue(scheduler.isBackedOff(self.make_node("10.0.0.1")))
+        self.assertFalse(scheduler.isBackedOff(self.make_node("10.0.0.2")))
+        clock.advance(scheduler.backoff_min)
+        self.assertFalse(scheduler.isBackedOff(node))
+
+    def test_run_backs_off_failing_hosts_exponentially(self):
+        clock = Clock()
+        scheduler = power.PowerQueryScheduler(max_concurrency=5, clock=clock)
+        node = self.make_node("10.0.0.1")
+        host = scheduler.get_host(node)
+        d = scheduler.run(node, lambda: fail(PowerError()))
+        self.assertRaises(PowerError, extract_result, d)
+        self.assertEqual(scheduler.backoff_min, scheduler.backoff[host][1])
+        d = scheduler.run(node, lambda: fail(PowerError()))
+        self.assertRaises(PowerError, extract_result, d)
+        self.assertEqual(
+            scheduler.backoff_min * 2, scheduler.backoff[host][1])
+        for _ in range(10):
+            scheduler.run(node, lambda: fail(PowerError())).addErrback(
+                lambda failure: None)
+        self.assertEqual(scheduler.backoff_max, scheduler.backoff[host][1])
+
+    def test_run_forgets_back_off_after_success(self):
+        scheduler = power.PowerQueryScheduler(
+            max_concurrency=5, clock=Clock())
+        node = self.make_node("10.0.0.1")
+        scheduler.run(node, lambda: fail(PowerError())).addErrback(
+            lambda failure: None)
+        scheduler.run(node, lambda: "on")
+        self.assertEqual({}, scheduler.backoff)
+
+    def test_finishSweep_logs_and_resets_histogram(self):
+        clock = Clock()
+        scheduler = power.PowerQueryScheduler(max_concurrency=5, clock=clock)
+        scheduler.run(self.make_node(), lambda: "on")
+        query = Deferred()
+        scheduler.run(self.make_node(), lambda: query)
+        clock.advance(3)
+        query.callback("off")
+        with FakeLogger("maas.power", level=logging.DEBUG) as maaslog:
+            scheduler.finishSweep()
+        self.assertDocTestMatches(
+            "Power query latencies: <=1s: 1, <=2s: 0, <=5s: 1, <=10s: 0, "
+            "<=30s: 0, >30s: 0; 0 BMC host(s) backed off.",
+            maaslog.output)
+        self.assertEqual({}, scheduler.hosts)
+        with FakeLogger("maas.power", level=logging.DEBUG) as maaslog:
+            scheduler.finishSweep()
+        self.assertEqual("", maaslog.output)
+
+    def test_finishSweep_forgets_long_expired_back_offs(self):
+        clock = Clock()
+        scheduler = power.PowerQueryScheduler(max_concurrency=5, clock=clock)
+        scheduler.run(self.make_node(), lambda: fail(PowerError())).addErrback(
+            lambda failure: None)
+        scheduler.finishSweep()
+        self.assertEqual(1, len(scheduler.backoff))
+        clock.advance(scheduler.backoff_min + scheduler.backoff_max + 1)
+        scheduler.finishSweep()
+        self.assertEqual({}, scheduler.backoff)
+
+
+class TestQueryNodeScheduled(MAASTestCase):
+
+    run_tests_with = MAASTwistedRunTest.make_factory(timeout=5)
+
+    def make_node(self):
+        return {
+            "system_id": factory.make_name("system_id"),
+            "hostname": factory.make_name("hostname"),
+            "power_type": "ipmi",
+            "power_state": "on",
+            "context": {"power_address": factory.make_ip_address()},
+        }
+
+    def test_queries_through_scheduler_and_reports_to_updates(self):
+        node = self.make_node()
+        get_power_state = self.patch(power, "get_power_state")
+        get_power_state.return_value = succeed("on")
+        report_power_state = self.patch(power, "report_power_state")
+        report_power_state.side_effect = (
+            lambda d, sid, hn, updates: d)
+        scheduler = power.PowerQueryScheduler(
+            max_concurrency=5, clock=Clock())
+        run = self.patch(scheduler, "run")
+        run.return_value = succeed("on")
+        updates = power.PowerStateUpdates(clock=Clock())
+
+        d = power.query_all_nodes(
+            [node], clock=sentinel.clock, updates=updates,
+            scheduler=scheduler)
+
+        self.assertEqual([(True, "on")], extract_result(d))
+        self.assertThat(run, MockCalledOnceWith(
+            node, get_power_state, node["system_id"], node["hostname"],
+            node["power_type"], node["context"], clock=sentinel.clock))
+        self.assertThat(report_power_state, MockCalledOnceWith(
+            run.return_value, node["system_id"], node["hostname"],
+            updates=updates))
+
+    def test_skips_nodes_whose_bmc_is_backed_off(self):
+        node = self.make_node()
+        get_power_state = self.patch(power, "get_power_state")
+        scheduler = power.PowerQueryScheduler(
+            max_concurrency=5, clock=Clock())
+        self.patch(scheduler, "isBackedOff").return_value = True
+
+        with FakeLogger("maas.power", level=logging.DEBUG) as maaslog:
+            d = power.query_all_nodes([node], scheduler=scheduler)
+
+        self.assertEqual([(True, None)], extract_result(d))
+        self.assertThat(get_power_state, MockNotCalled())
+        self.assertDocTestMatches(
+            "hostname-...: Skipping query power status, "
+            "BMC is being backed off.", maaslog.output)
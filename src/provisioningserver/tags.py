@@ -10,8 +10,13 @@ __all__ = [
     ]
 
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 import http.client
+from itertools import (
+    islice,
+    zip_longest,
+)
 import json
 import urllib.error
 import urllib.parse
@@ -34,6 +39,23 @@ maaslog = get_maas_logger("tag_processing")
 # face of it, appears excessive.
 DEFAULT_BATCH_SIZE = 100
 
+# The most system IDs to add or remove from a tag in a single request. Each
+# is around a dozen bytes in the JSON body of the request.
+DEFAULT_UPDATE_BATCH_SIZE = 1000
+
+
+def check_response(response):
+    """Raise `HTTPError` unless `response` is httplib.OK.
+
+    :param response: The result of MAASClient.get/post/etc.
+    """
+    if response.code != http.client.OK:
+        text_status = http.client.responses.get(response.code, '<unknown>')
+        message = '%s, expected 200 OK' % text_status
+        raise urllib.error.HTTPError(
+            response.url, response.code, message,
+            response.headers, response.fp)
+
 
 def process_response(response):
     """All responses should be httplib.OK.
@@ -48,12 +70,7 @@ def process_response(response):
         .code attribute.)
 
     """
-    if response.code != http.client.OK:
-        text_status = http.client.responses.get(response.code, '<unknown>')
-        message = '%s, expected 200 OK' % text_status
-        raise urllib.error.HTTPError(
-            response.url, response.code, message,
-            response.headers, response.fp)
+    check_response(response)
     content = response.read()
     content_type = response.headers.get_content_type()
     if content_type == "application/bson":
@@ -67,24 +84,41 @@ def process_response(response):
 
 
 def get_details_for_nodes(client, system_ids):
-    """Retrieve details for a set of nodes.
+    """Retrieve details for a set of nodes, in a single request.
+
+    The region returns a sequence of BSON documents, one for each node. These
+    are decoded as they are read from the response.
 
     :param client: MAAS client
     :param system_ids: List of UUIDs of systems for which to fetch LLDP data
     :return: Dictionary mapping node UUIDs to details, e.g. LLDP output
     """
-    details = {}
-    for system_id in system_ids:
-        path = '/api/2.0/nodes/%s/' % system_id
-        data = process_response(client.get(path, op='details'))
-        details[system_id] = data
-    return details
+    response = client.get('/api/2.0/nodes/', op='details', id=system_ids)
+    check_response(response)
+    return {
+        document["system_id"]: document["details"]
+        for document in bson.decode_file_iter(response)
+    }
+
+
+def gen_chunks(things, size):
+    """Split `things` into consecutive lists of at most `size`."""
+    things = iter(things)
+    chunk = list(islice(things, size))
+    while len(chunk) != 0:
+        yield chunk
+        chunk = list(islice(things, size))
 
 
 def post_updated_nodes(
-        client, rack_id, tag_name, tag_definition, added, removed):
+        client, rack_id, tag_name, tag_definition, added, removed,
+        batch_size=None):
     """Update the nodes relevant for a particular tag.
 
+    Updates are sent in batches, so that no request grows with the number
+    of nodes. If the tag's definition has changed, the remaining batches are
+    not sent.
+
     :param client: MAAS client
     :param rack_id: System ID for rack controller
     :param tag_name: Name of tag
@@ -92,25 +126,37 @@ def post_updated_nodes(
         being done matches the current value.
     :param added: Set of nodes to add
     :param removed: Set of nodes to remove
+    :param batch_size: The most nodes to add, and to remove, in each request.
     """
+    if batch_size is None:
+        batch_size = DEFAULT_UPDATE_BATCH_SIZE
     path = '/api/2.0/tags/%s/' % (tag_name,)
     maaslog.debug(
         "Updating nodes for %s, adding %s removing %s"
         % (tag_name, len(added), len(removed)))
-    try:
-        return process_response(client.post(
-            path, op='update_nodes', as_json=True,
-            rack_controller=rack_id, definition=tag_definition,
-            add=added, remove=removed))
-    except urllib.error.HTTPError as e:
-        if e.code == http.client.CONFLICT:
-            if e.fp is not None:
-                msg = e.fp.read()
-            else:
-                msg = e.msg
-            maaslog.info("Got a CONFLICT while updating tag: %s", msg)
-            return {}
-        raise
+    batches = zip_longest(
+        gen_chunks(added, batch_size), gen_chunks(removed, batch_size),
+        fillvalue=[])
+    result = {}
+    for add, remove in batches:
+        try:
+            counts = process_response(client.post(
+                path, op='update_nodes', as_json=True,
+                rack_controller=rack_id, definition=tag_definition,
+                add=add, remove=remove))
+        except urllib.error.HTTPError as e:
+            if e.code == http.client.CONFLICT:
+                if e.fp is not None:
+                    msg = e.fp.read()
+                else:
+                    msg = e.msg
+                maaslog.info("Got a CONFLICT while updating tag: %s", msg)
+                return {}
+            raise
+        else:
+            for key, count in counts.items():
+                result[key] = result.get(key, 0) + count
+    return result
 
 
 def _details_prepare_merge(details):
@@ -260,14 +306,23 @@ def gen_node_details(client, batches):
     """Fetch node details.
 
     This lazily fetches data in batches, but this detail is hidden
-    from callers.
+    from callers. The next batch is fetched in another thread while the
+    caller works through the current one, so that evaluating one batch
+    overlaps with waiting for the next.
 
     :return: An iterator of ``(system-id, details-document)`` tuples.
     """
     get_details = partial(get_details_for_nodes, client)
-    for batch in batches:
-        for system_id, details in get_details(batch).items():
-            yield system_id, merge_details(details)
+    batches = iter(batches)
+    with ThreadPoolExecutor(1) as executor:
+        pending = [executor.submit(get_details, batch)
+                   for batch in islice(batches, 1)]
+        while len(pending) != 0:
+            details = pending.pop().result()
+            pending.extend(executor.submit(get_details, batch)
+                           for batch in islice(batches, 1))
+            for system_id, node_details in details.items():
+                yield system_id, merge_details(node_details)
 
 
 def process_all(client, rack_id, tag_name, tag_definition, system_ids,
@@ -24,7 +24,10 @@ from provisioningserver.plugin import (
 from provisioningserver.rackdservices.dhcp_probe_service import (
     DHCPProbeService,
 )
-from provisioningserver.rackdservices.image import BootImageEndpointService
+from provisioningserver.rackdservices.image import (
+    BootImageService,
+    ImageHTTPServer,
+)
 from provisioningserver.rackdservices.image_download_service import (
     ImageDownloadService,
 )
@@ -46,12 +49,10 @@ from provisioningserver.rackdservices.tftp import (
 )
 from provisioningserver.rackdservices.tftp_offload import TFTPOffloadService
 from provisioningserver.testing.config import ClusterConfigurationFixture
-from provisioningserver.utils.twisted import reducedWebLogFormatter
 from testtools.matchers import (
     AfterPreprocessing,
     Contains,
     Equals,
-    Is,
     IsInstance,
     KeysEqual,
     MatchesAll,
@@ -59,8 +60,6 @@ from testtools.matchers import (
     Not,
 )
 from twisted.application.service import MultiService
-from twisted.python.filepath import FilePath
-from twisted.web.server import Site
 
 
 class TestOptions(MAASTestCase):
@@ -206,18 +205,14 @@ class TestProvisioningServiceMaker(MAASTestCase):
         service_maker = ProvisioningServiceMaker("Harry", "Hill")
         service = service_maker.makeService(options, clock=None)
         image_service = service.getServiceNamed("image_service")
-        self.assertIsInstance(image_service, BootImageEndpointService)
-        self.assertIsInstance(image_service.site, Site)
-        self.assertThat(image_service.site, MatchesStructure(
-            _logFormatter=Is(reducedWebLogFormatter)))
-        resource = image_service.site.resource
-        root = resource.getChildWithDefault(b"images", request=None)
-        self.assertThat(root, IsInstance(FilePath))
+        self.assertIsInstance(image_service, BootImageService)
+        self.assertThat(image_service.server, IsInstance(ImageHTTPServer))
 
         with ClusterConfiguration.open() as config:
-            resource_root = FilePath(config.tftp_root)
+            resource_root = config.tftp_root
 
-        self.assertEqual(resource_root, root)
+        self.assertEqual(resource_root, image_service.server.resource_root)
+        self.assertEqual(5248, image_service.server.server_address[1])
 
     def test_lease_socket_service(self):
         options = Options()
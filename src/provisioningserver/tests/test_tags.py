@@ -10,6 +10,7 @@ import http.client
 from itertools import chain
 import json
 from textwrap import dedent
+import threading
 from unittest.mock import (
     call,
     MagicMock,
@@ -436,6 +437,28 @@ class TestGenBatches(MAASTestCase):
             self.assertIn(max(lens) - min(lens), (0, 1))
 
 
+class TestGenChunks(MAASTestCase):
+
+    def test_no_things(self):
+        self.assertEqual([], list(tags.gen_chunks([], 2)))
+
+    def test_chunks_in_order(self):
+        self.assertEqual(
+            [[1, 2], [3, 4], [5]], list(tags.gen_chunks(range(1, 6), 2)))
+
+
+def make_details_response(details):
+    """Make a response to a bulk ``details`` request.
+
+    :param details: A dict mapping system IDs to details.
+    """
+    return factory.make_response(
+        http.client.OK, b"".join(
+            bson.BSON.encode({"system_id": system_id, "details": data})
+            for system_id, data in details.items()),
+        'application/bson-seq')
+
+
 class TestGenNodeDetails(MAASTestCase):
 
     def fake_merge_details(self):
@@ -471,6 +494,23 @@ class TestGenNodeDetails(MAASTestCase):
             [call(sentinel.client, batch) for batch in batches],
             get_details_for_nodes.mock_calls)
 
+    def test__fetches_next_batch_while_current_batch_is_consumed(self):
+        batches = [["s1"], ["s2"]]
+        fetching_s2 = threading.Event()
+
+        def get_details_for_nodes(client, batch):
+            if batch == ["s2"]:
+                fetching_s2.set()
+            return {system_id: {} for system_id in batch}
+
+        self.patch(tags, "get_details_for_nodes", get_details_for_nodes)
+        self.fake_merge_details()
+        node_details = tags.gen_node_details(sentinel.client, batches)
+        self.assertEqual(("s1", "merged:"), next(node_details))
+        # The second batch is being fetched before the caller asks for it.
+        self.assertTrue(fetching_s2.wait(30))
+        self.assertEqual([("s2", "merged:")], list(node_details))
+
 
 class TestTagUpdating(MAASTestCase):
 
@@ -493,26 +533,24 @@ class TestTagUpdating(MAASTestCase):
                 "lldp": b"<lldp><data2 /></lldp>",
             },
         }
-        response1 = factory.make_response(
-            http.client.OK,
-            bson.BSON.encode(data["system-1"]),
-            'application/bson'
-        )
-        response2 = factory.make_response(
-            http.client.OK,
-            bson.BSON.encode(data["system-2"]),
-            'application/bson'
-        )
+        response = make_details_response(data)
         get = self.patch(client, 'get')
-        get.side_effect = [response1, response2]
+        get.return_value = response
         result = tags.get_details_for_nodes(
             client, ['system-1', 'system-2'])
         self.assertEqual(data, result)
         self.assertThat(
-            get,
-            MockCallsMatch(
-                call('/api/2.0/nodes/system-1/', op='details'),
-                call('/api/2.0/nodes/system-2/', op='details')))
+            get, MockCalledOnceWith(
+                '/api/2.0/nodes/', op='details',
+                id=['system-1', 'system-2']))
+
+    def test_get_details_raises_error_when_not_OK(self):
+        client = self.fake_client()
+        self.patch(client, 'get').return_value = factory.make_response(
+            http.client.NOT_FOUND, b"", 'text/plain')
+        self.assertRaises(
+            urllib.error.HTTPError, tags.get_details_for_nodes,
+            client, ['system-1'])
 
     def test_post_updated_nodes_calls_correct_api_and_parses_result(self):
         client = self.fake_client()
@@ -537,6 +575,43 @@ class TestTagUpdating(MAASTestCase):
             rack_controller=rack_id, definition=tag_definition,
             add=['add-system-id'], remove=['remove-1', 'remove-2'])
 
+    def test_post_updated_nodes_sends_updates_in_batches(self):
+        client = self.fake_client()
+        post_mock = self.patch(client, 'post')
+        post_mock.side_effect = lambda *args, **kwargs: (
+            factory.make_response(
+                http.client.OK, json.dumps({
+                    "added": len(kwargs["add"]),
+                    "removed": len(kwargs["remove"]),
+                }).encode("ascii"), 'application/json'))
+        name = factory.make_name('tag')
+        rack_id = factory.make_name('rack')
+        tag_definition = factory.make_name('//')
+        result = tags.post_updated_nodes(
+            client, rack_id, name, tag_definition,
+            ['a1', 'a2', 'a3'], ['r1'], batch_size=2)
+        self.assertEqual({'added': 3, 'removed': 1}, result)
+        url = '/api/2.0/tags/%s/' % (name,)
+        self.assertThat(post_mock, MockCallsMatch(
+            call(url, op='update_nodes', as_json=True,
+                 rack_controller=rack_id, definition=tag_definition,
+                 add=['a1', 'a2'], remove=['r1']),
+            call(url, op='update_nodes', as_json=True,
+                 rack_controller=rack_id, definition=tag_definition,
+                 add=['a3'], remove=[])))
+
+    def test_post_updated_nodes_stops_at_conflict(self):
+        client = self.fake_client()
+        err = urllib.error.HTTPError(
+            'url', http.client.CONFLICT, "conflict", {}, None)
+        post_mock = self.patch(client, 'post')
+        post_mock.side_effect = err
+        result = tags.post_updated_nodes(
+            client, factory.make_name('rack'), factory.make_name('tag'),
+            factory.make_name('//'), ['a1', 'a2', 'a3'], [], batch_size=1)
+        self.assertEqual({}, result)
+        self.assertEqual(1, post_mock.call_count)
+
     def test_post_updated_nodes_handles_conflict(self):
         # If a worker started processing a node late, it might try to post
         # an updated list with an out-of-date definition. It gets a CONFLICT in
@@ -580,18 +655,11 @@ class TestTagUpdating(MAASTestCase):
     def test_process_node_tags_integration(self):
         self.useFixture(ClusterConfigurationFixture(
             maas_url=factory.make_simple_http_url()))
-        get_hw_system1 = factory.make_response(
-            http.client.OK,
-            bson.BSON.encode({'lshw': b'<node />'}),
-            'application/bson',
-        )
-        get_hw_system2 = factory.make_response(
-            http.client.OK,
-            bson.BSON.encode({'lshw': b'<not-node />'}),
-            'application/bson',
-        )
         mock_get = self.patch(MAASClient, 'get')
-        mock_get.side_effect = [get_hw_system1, get_hw_system2]
+        mock_get.return_value = make_details_response({
+            'system-id1': {'lshw': b'<node />'},
+            'system-id2': {'lshw': b'<not-node />'},
+        })
         mock_post = self.patch(MAASClient, 'post')
         mock_post.return_value = factory.make_response(
             http.client.OK,
@@ -19,8 +19,14 @@ __all__ = [
     'ip_range_within_network',
 ]
 
+from bisect import (
+    bisect_left,
+    bisect_right,
+    insort,
+)
 import codecs
 from collections import namedtuple
+from heapq import merge
 from operator import attrgetter
 import re
 import socket
@@ -165,59 +171,61 @@ class MAASIPRange(IPRange):
         return json
 
 
-def _combine_overlapping_maasipranges(
-        ranges: Iterable[MAASIPRange]) -> List[MAASIPRange]:
-    """Returns the specified ranges after combining any overlapping ranges.
+def _iprange_sort_key(iprange: IPRange):
+    """Return the key by which `IPRange` objects are ordered.
 
-    Given a sorted list of `MAASIPRange` objects, returns a new (sorted)
-    list where any adjacent overlapping ranges have been combined into a single
-    range.
+    Sorting with this key is quicker than comparing the ranges themselves.
     """
-    new_ranges = []
-    previous_min = None
-    previous_max = None
-    for item in ranges:
-        if previous_min is not None and previous_max is not None:
-            # Check for an overlapping range.
-            min_overlaps = previous_min <= item.first <= previous_max
-            max_overlaps = previous_min <= item.last <= previous_max
-            if min_overlaps or max_overlaps:
-                previous = new_ranges.pop()
-                item = make_iprange(
-                    min(item.first, previous_min),
-                    max(item.last, previous_max),
-                    previous.purpose | item.purpose)
-        previous_min = item.first
-        previous_max = item.last
-        new_ranges.append(item)
-    return new_ranges
+    return iprange.version, iprange.first, iprange.last
 
 
-def _coalesce_adjacent_purposes(
-        ranges: Iterable[MAASIPRange]) -> List[MAASIPRange]:
-    """Combines and returns adjacent ranges that have an identical purpose.
+def _make_maasiprange(first: int, last: int, version, purpose) -> MAASIPRange:
+    """Returns a `MAASIPRange` from integer addresses of the given version.
+
+    This is quicker than `make_iprange`, which formats and parses addresses.
+    """
+    return MAASIPRange(
+        IPAddress(first, version), IPAddress(last, version), purpose=purpose)
+
+
+def _condense_ipranges(ranges: List[MAASIPRange]) -> List[MAASIPRange]:
+    """Returns the specified ranges after combining overlapping ranges, and
+    then adjacent ranges that have an identical purpose.
 
     Given a sorted list of `MAASIPRange` objects, returns a new (sorted)
-    list where any adjacent ranges with identical purposes have been combined
-    into a single range.
+    list in one pass. The purpose of a range made by combining overlapping
+    ranges is the union of their purposes. Ranges that are not combined with
+    another are returned as they are.
     """
     new_ranges = []
-    previous_first = None
-    previous_last = None
-    previous_purpose = None
-    for item in ranges:
-        if previous_purpose is not None and previous_last is not None:
-            adjacent_and_identical = (
-                item.first == (previous_last + 1) and
-                item.purpose == previous_purpose
-            )
-            if adjacent_and_identical:
-                new_ranges.pop()
-                item = make_iprange(previous_first, item.last, item.purpose)
-        previous_first = item.first
-        previous_last = item.last
-        previous_purpose = item.purpose
-        new_ranges.append(item)
+    # The range being built from overlapping ranges, as a list of
+    # [version, first, last, purpose, item]; item is the original range
+    # while it has not been combined with any other.
+    current = None
+    for item in ranges + [None]:
+        if current is not None and item is not None and (
+                item.version == current[0] and item.first <= current[2]):
+            # Overlaps with the current range.
+            current[2] = max(current[2], item.last)
+            current[3] = current[3] | item.purpose
+            current[4] = None
+            continue
+        if current is not None:
+            version, first, last, purpose, original = current
+            previous = new_ranges[-1] if len(new_ranges) > 0 else None
+            if (previous is not None and previous.version == version and
+                    previous.last + 1 == first and
+                    previous.purpose == purpose):
+                # Adjacent to the previous range, with an identical purpose.
+                new_ranges[-1] = _make_maasiprange(
+                    previous.first, last, version, purpose)
+            elif original is not None:
+                new_ranges.append(original)
+            else:
+                new_ranges.append(
+                    _make_maasiprange(first, last, version, purpose))
+        if item is not None:
+            current = [item.version, item.first, item.last, item.purpose, item]
     return new_ranges
 
 
@@ -231,7 +239,7 @@ def _normalize_ipranges(ranges: Iterable) -> List[MAASIPRange]:
         if not isinstance(item, MAASIPRange):
             item = MAASIPRange(item)
         new_ranges.append(item)
-    return sorted(new_ranges)
+    return sorted(new_ranges, key=_iprange_sort_key)
 
 
 class IPRangeStatistics:
@@ -255,7 +263,11 @@ class IPRangeStatistics:
         self.largest_available = 0
         self.suggested_gateway = None
         self.suggested_dynamic_range = None
+        # Gather the purposes while walking the ranges, rather than walking
+        # them again for each purpose of interest.
+        purposes = set()
         for range in full_maasipset.ranges:
+            purposes |= range.purpose
             if IPRANGE_TYPE.UNUSED in range.purpose:
                 self.num_available += range.num_addresses
                 if range.num_addresses > self.largest_available:
@@ -263,9 +275,9 @@ class IPRangeStatistics:
             else:
                 self.num_unavailable += range.num_addresses
         self.total_addresses = self.num_available + self.num_unavailable
-        if not self.ranges.includes_purpose(IPRANGE_TYPE.GATEWAY_IP):
+        if IPRANGE_TYPE.GATEWAY_IP not in purposes:
             self.suggested_gateway = self.get_recommended_gateway()
-        if not self.ranges.includes_purpose(IPRANGE_TYPE.DYNAMIC):
+        if IPRANGE_TYPE.DYNAMIC not in purposes:
             self.suggested_dynamic_range = self.get_recommended_dynamic_range()
 
     def get_recommended_gateway(self):
@@ -401,12 +413,19 @@ class IPRangeStatistics:
 
 
 class MAASIPSet(set):
+    """A set of `MAASIPRange` objects, condensed so that none overlap.
+
+    The condensed ranges are held, sorted, in `ranges`. Their first and last
+    addresses are also held in sorted lists of integers, so that finding the
+    range containing an address is a binary search, and two sets are
+    combined by merging their sorted ranges rather than by sorting again.
+    """
 
     def __init__(self, ranges, cidr=None):
         self.cidr = cidr
         self.ranges = ranges
         self._condense()
-        super().__init__(set(self.ranges))
+        super().__init__(self.ranges)
 
     def _condense(self):
         """Condenses the `ranges` ivar in this `MAASIPSet` by:
@@ -415,14 +434,19 @@ class MAASIPSet(set):
         (2) De-duplicate set by combining overlapping IP ranges.
         (3) Combining adjacent ranges with an identical purpose.
         """
-        self.ranges = _normalize_ipranges(self.ranges)
-        self.ranges = _combine_overlapping_maasipranges(self.ranges)
-        self.ranges = _coalesce_adjacent_purposes(self.ranges)
+        self.ranges = _condense_ipranges(_normalize_ipranges(self.ranges))
+        self._index()
+
+    def _index(self):
+        """Index the first and last addresses of `ranges`."""
+        self._firsts = [item.first for item in self.ranges]
+        self._lasts = [item.last for item in self.ranges]
 
     def __ior__(self, other):
         """Return self |= other."""
-        self.ranges.extend(list(other.ranges))
-        self._condense()
+        self.ranges = _condense_ipranges(list(merge(
+            self.ranges, other.ranges, key=_iprange_sort_key)))
+        self._index()
         # Replace the underlying set with the new ranges.
         super().clear()
         super().__ior__(set(self.ranges))
@@ -436,16 +460,14 @@ class MAASIPSet(set):
         within that range.)
         """
         if isinstance(search, IPRange):
-            for item in self.ranges:
-                if (item.first <= search.first <= item.last and
-                        item.first <= search.last <= item.last):
-                    return item
+            first, last = search.first, search.last
         else:
-            addr = IPAddress(search)
-            addr = int(addr)
-            for item in self.ranges:
-                if item.first <= addr <= item.last:
-                    return item
+            first = last = int(IPAddress(search))
+        # The ranges do not overlap, so only the last range to start at or
+        # before `first` can contain it.
+        index = bisect_right(self._firsts, first) - 1
+        if index >= 0 and last <= self._lasts[index]:
+            return self.ranges[index]
         return None
 
     @property
@@ -574,8 +596,9 @@ class MAASIPSet(set):
             # candidate range, and the address just before the next used
             # range.
             if candidate_end - candidate_start >= 0:
-                unused_ranges.append(
-                    make_iprange(candidate_start, candidate_end, purpose))
+                unused_ranges.append(_make_maasiprange(
+                    candidate_start, candidate_end, outer_range.version,
+                    purpose))
             candidate_start = used_range.last + 1
         # Skip the broadcast address, if this is an IPv4 network
         if type(outer_range) == IPNetwork:
@@ -589,13 +612,16 @@ class MAASIPSet(set):
         # Check if there is a gap between the last used range and the end
         # of the range we're checking against.
         if candidate_end - candidate_start >= 0:
-            unused_ranges.append(
-                make_iprange(candidate_start, candidate_end, purpose))
+            unused_ranges.append(_make_maasiprange(
+                candidate_start, candidate_end, outer_range.version,
+                purpose))
         return MAASIPSet(unused_ranges)
 
     def get_full_range(self, outer_range):
         unused_ranges = self.get_unused_ranges(outer_range)
-        full_range = MAASIPSet(self | unused_ranges, cidr=outer_range)
+        full_range = MAASIPSet(
+            merge(self.ranges, unused_ranges.ranges, key=_iprange_sort_key),
+            cidr=outer_range)
         # The full_range should always contain at least one IP address.
         # However, in bug #1570606 we observed a situation where there were
         # no resulting ranges. This assert is just in case the fix didn't cover
@@ -613,6 +639,128 @@ class MAASIPSet(set):
         return '%s(%s)' % (self.__class__.__name__, item_repr)
 
 
+class IPFreeRanges:
+    """An index of free IP addresses, kept as disjoint ranges.
+
+    The ranges are held in two sorted lists, one ordered by first address
+    and one ordered by size. Finding the range that contains an address and
+    finding the smallest range are binary searches, and marking an address
+    as used or as free changes at most three ranges. This lets a set of free
+    addresses be kept up to date as addresses are allocated, rather than be
+    calculated again with `MAASIPSet` for every allocation.
+
+    Addresses are given and returned as integers.
+    """
+
+    def __init__(self, ranges: Iterable=()):
+        """
+        :param ranges: The ranges of free addresses, each an `IPRange` or a
+            `(first, last)` tuple. They may overlap or be adjacent.
+        """
+        super(IPFreeRanges, self).__init__()
+        pairs = sorted(
+            (iprange.first, iprange.last)
+            if isinstance(iprange, IPRange) else tuple(iprange)
+            for iprange in ranges
+        )
+        self._by_first = []
+        for first, last in pairs:
+            if len(self._by_first) > 0 and first <= self._by_first[-1][1] + 1:
+                previous_first, previous_last = self._by_first[-1]
+                self._by_first[-1] = (previous_first, max(previous_last, last))
+            else:
+                self._by_first.append((first, last))
+        self._by_size = sorted(
+            (last - first + 1, first) for first, last in self._by_first)
+
+    def __len__(self):
+        """Return the number of ranges."""
+        return len(self._by_first)
+
+    def __iter__(self):
+        """Yield each range as a `(first, last)` tuple, in order."""
+        return iter(self._by_first)
+
+    def __contains__(self, address):
+        return self._find(int(address)) is not None
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self._by_first)
+
+    @property
+    def num_addresses(self) -> int:
+        """The number of free addresses."""
+        return sum(size for size, _ in self._by_size)
+
+    def _find(self, address) -> Optional[int]:
+        """Return the index of the range containing `address`, or `None`."""
+        index = bisect_right(self._by_first, (address, float("inf"))) - 1
+        if index >= 0 and self._by_first[index][1] >= address:
+            return index
+        else:
+            return None
+
+    def _remove_range(self, index):
+        first, last = self._by_first.pop(index)
+        key = (last - first + 1, first)
+        del self._by_size[bisect_left(self._by_size, key)]
+
+    def _insert_range(self, first, last):
+        insort(self._by_first, (first, last))
+        insort(self._by_size, (last - first + 1, first))
+
+    def remove(self, address) -> bool:
+        """Mark `address` as used.
+
+        :return: Whether the address was free.
+        """
+        address = int(address)
+        index = self._find(address)
+        if index is None:
+            return False
+        first, last = self._by_first[index]
+        self._remove_range(index)
+        if first < address:
+            self._insert_range(first, address - 1)
+        if address < last:
+            self._insert_range(address + 1, last)
+        return True
+
+    def add(self, address) -> bool:
+        """Mark `address` as free.
+
+        :return: Whether the address was used.
+        """
+        address = int(address)
+        if self._find(address) is not None:
+            return False
+        first = last = address
+        index = bisect_right(self._by_first, (address, float("inf")))
+        if index < len(self._by_first):
+            next_first, next_last = self._by_first[index]
+            if next_first == address + 1:
+                self._remove_range(index)
+                last = next_last
+        if index > 0:
+            previous_first, previous_last = self._by_first[index - 1]
+            if previous_last == address - 1:
+                self._remove_range(index - 1)
+                first = previous_first
+        self._insert_range(first, last)
+        return True
+
+    def get_smallest(self) -> Optional[tuple]:
+        """Return the smallest range as a `(first, last)` tuple.
+
+        Of the smallest ranges, the one with the lowest addresses is
+        returned. Returns `None` if there are no free addresses.
+        """
+        if len(self._by_size) == 0:
+            return None
+        size, first = self._by_size[0]
+        return first, first + size - 1
+
+
 def make_ipaddress(input: Optional[MaybeIPAddress]) -> Optional[IPAddress]:
     """Returns an `IPAddress` object for the specified input.
 
@@ -644,7 +792,7 @@ def make_iprange(first, second=None, purpose="unknown") -> MAASIPRange:
     else:
         if isinstance(second, int):
             second = IPAddress(second)
-    iprange = MAASIPRange(inet_ntop(first), inet_ntop(second), purpose=purpose)
+    iprange = MAASIPRange(IPAddress(first), IPAddress(second), purpose=purpose)
     return iprange
 
 
@@ -0,0 +1,127 @@
+# Copyright 2017 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Cache of parsed templates, reloaded when their files change."""
+
+__all__ = [
+    "TemplateCache",
+    "templates",
+]
+
+from errno import (
+    ENOENT,
+    ENOTDIR,
+)
+import os
+import threading
+import time
+
+import tempita
+
+
+# Timestamps are only so fine-grained: a file created in a directory within
+# this many seconds of its last modification may not change its modification
+# time. Misses in directories modified more recently are not remembered.
+MTIME_GRANULARITY = 1.0
+
+
+def get_stat_key(path):
+    """Return a key that changes when the file at `path` changes.
+
+    :return: A tuple of the file's device, inode, size, and modification
+        time, or `None` if it does not exist.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError as error:
+        if error.errno in (ENOENT, ENOTDIR):
+            return None
+        else:
+            raise
+    else:
+        return stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+class TemplateCache:
+    """Parsed templates, by filename, reloaded when their files change.
+
+    A file's status is checked every time its template is requested, and it
+    is read and parsed again only if its inode, size, or modification time
+    have changed. A filename that does not exist is remembered with the
+    status of its directory, and is not looked for again until that
+    directory changes, as it does when files are created in it -- unless the
+    directory was modified within `MTIME_GRANULARITY` seconds, in which case
+    it is looked for every time.
+
+    Templates are shared and must not be modified; copy one to change it.
+
+    :ivar loads: The number of templates that have been read and parsed.
+    """
+
+    def __init__(self):
+        super(TemplateCache, self).__init__()
+        self.lock = threading.Lock()
+        self.templates = {}
+        self.missing = {}
+        self.loads = 0
+
+    def get(self, filename, template_class=tempita.Template):
+        """Return the template in `filename`, or `None` if it doesn't exist.
+
+        :param filename: The absolute path to the template.
+        :param template_class: The class of template to load, a subclass of
+            `tempita.Template`. Templates are cached by class and filename.
+        """
+        cache_key = template_class, filename
+        directory = os.path.dirname(filename)
+        with self.lock:
+            missing = cache_key in self.missing
+            missing_key = self.missing.get(cache_key)
+            cached = self.templates.get(cache_key)
+        # The directory's status is checked before the file's, so that a
+        # file created in between is found next time, not missed forever.
+        directory_key = get_stat_key(directory)
+        if missing and directory_key == missing_key:
+            return None
+        key = get_stat_key(filename)
+        if key is None:
+            self._forget(cache_key, directory_key)
+            return None
+        elif cached is not None and cached[0] == key:
+            return cached[1]
+        try:
+            template = template_class.from_filename(
+                filename, encoding="UTF-8")
+        except IOError as error:
+            if error.errno in (ENOENT, ENOTDIR):
+                # Removed since its status was checked.
+                self._forget(cache_key, directory_key)
+                return None
+            else:
+                raise
+        with self.lock:
+            self.loads += 1
+            self.templates[cache_key] = key, template
+            self.missing.pop(cache_key, None)
+        return template
+
+    def _forget(self, cache_key, directory_key):
+        """Remember that the template for `cache_key` does not exist."""
+        settled = directory_key is None or (
+            time.time() - directory_key[3] / 1e9 >= MTIME_GRANULARITY)
+        with self.lock:
+            self.templates.pop(cache_key, None)
+            if settled:
+                self.missing[cache_key] = directory_key
+            else:
+                self.missing.pop(cache_key, None)
+
+    def clear(self):
+        """Discard all templates, and forget which are missing."""
+        with self.lock:
+            self.templates.clear()
+            self.missing.clear()
+
+
+# The global cache of templates.
+templates = TemplateCache()
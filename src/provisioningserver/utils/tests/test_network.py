@@ -69,6 +69,7 @@ from provisioningserver.utils.network import (
     interface_children,
     intersect_iprange,
     ip_range_within_network,
+    IPFreeRanges,
     IPRangeStatistics,
     is_loopback_address,
     LOOPBACK_INTERFACE_INFO,
@@ -840,6 +841,53 @@ class TestMAASIPSet(MAASTestCase):
         self.assertThat(u['2001:db8::'].purpose, Contains('unused'))
         self.assertThat(u['2001:db8::1'].purpose, Contains('unused'))
 
+    def test__unused_ranges_keep_ip_version_of_small_ipv6_network(self):
+        s = MAASIPSet([])
+        u = s.get_unused_ranges(IPNetwork('::/126'))
+        self.assertThat(u.ranges, HasLength(1))
+        self.assertThat(u.ranges[0], Equals(IPRange('::1', '::3')))
+
+    def test__finds_ranges_among_many(self):
+        s = MAASIPSet([
+            make_iprange(first, first + 1, purpose="foo")
+            for first in range(
+                int(IPAddress('10.0.0.0')), int(IPAddress('10.0.4.0')), 4)
+        ])
+        self.assertThat(s.ranges, HasLength(256))
+        self.assertThat(
+            s.find('10.0.2.5'),
+            Equals(make_iprange('10.0.2.4', '10.0.2.5')))
+        self.assertThat(s.find('10.0.2.6'), Is(None))
+        self.assertThat(s.find('10.0.4.0'), Is(None))
+        self.assertThat(
+            s.find(IPRange('10.0.2.4', '10.0.2.5')),
+            Equals(make_iprange('10.0.2.4', '10.0.2.5')))
+        self.assertThat(s.find(IPRange('10.0.2.4', '10.0.2.8')), Is(None))
+
+    def test__ior_merges_interleaved_ranges_in_order(self):
+        s1 = MAASIPSet([
+            make_iprange('10.0.0.1', '10.0.0.2', purpose="foo"),
+            make_iprange('10.0.0.8', '10.0.0.9', purpose="foo"),
+        ])
+        s2 = MAASIPSet([
+            make_iprange('10.0.0.2', '10.0.0.4', purpose="bar"),
+            make_iprange('10.0.0.6', '10.0.0.6', purpose="foo"),
+        ])
+        s1 |= s2
+        self.assertThat(
+            [
+                (str(IPAddress(item.first)), str(IPAddress(item.last)),
+                 item.purpose)
+                for item in s1.ranges
+            ],
+            Equals([
+                ("10.0.0.1", "10.0.0.4", {"foo", "bar"}),
+                ("10.0.0.6", "10.0.0.6", {"foo"}),
+                ("10.0.0.8", "10.0.0.9", {"foo"}),
+            ]))
+        self.assertThat(s1, Contains('10.0.0.6'))
+        self.assertThat(s1, Not(Contains('10.0.0.5')))
+
     def test__supports_ior(self):
         s1 = MAASIPSet(['10.0.0.2', '10.0.0.4', '10.0.0.6', '10.0.0.8'])
         s2 = MAASIPSet(['10.0.0.1', '10.0.0.3', '10.0.0.5', '10.0.0.7'])
@@ -878,6 +926,80 @@ class TestMAASIPSet(MAASTestCase):
         self.assertThat(str(IPAddress(s1.last)), Equals("10.0.0.8"))
 
 
+class TestIPFreeRanges(MAASTestCase):
+
+    def make_free(self, addresses):
+        # Free addresses as single-address ranges, in no particular order.
+        ranges = [(address, address) for address in addresses]
+        random.shuffle(ranges)
+        return IPFreeRanges(ranges)
+
+    def test_merges_overlapping_and_adjacent_ranges(self):
+        free = IPFreeRanges([(5, 6), (1, 2), (3, 3), (8, 10), (9, 12)])
+        self.assertEqual([(1, 3), (5, 6), (8, 12)], list(free))
+        self.assertEqual(10, free.num_addresses)
+
+    def test_accepts_ipranges(self):
+        free = IPFreeRanges([make_iprange("10.0.0.1", "10.0.0.4")])
+        self.assertEqual(
+            [(int(IPAddress("10.0.0.1")), int(IPAddress("10.0.0.4")))],
+            list(free))
+        self.assertIn(IPAddress("10.0.0.2"), free)
+        self.assertNotIn(IPAddress("10.0.0.5"), free)
+
+    def test_remove_splits_range(self):
+        free = IPFreeRanges([(1, 5)])
+        self.assertTrue(free.remove(3))
+        self.assertEqual([(1, 2), (4, 5)], list(free))
+        self.assertFalse(free.remove(3))
+        self.assertTrue(free.remove(1))
+        self.assertTrue(free.remove(5))
+        self.assertEqual([(2, 2), (4, 4)], list(free))
+
+    def test_add_merges_ranges(self):
+        free = IPFreeRanges([(1, 2), (4, 5)])
+        self.assertFalse(free.add(2))
+        self.assertTrue(free.add(3))
+        self.assertEqual([(1, 5)], list(free))
+        self.assertTrue(free.add(7))
+        self.assertEqual([(1, 5), (7, 7)], list(free))
+
+    def test_get_smallest_returns_lowest_of_smallest_ranges(self):
+        free = IPFreeRanges([(1, 3), (10, 11), (5, 6), (20, 29)])
+        self.assertEqual((5, 6), free.get_smallest())
+        free.remove(20)
+        free.remove(29)
+        self.assertEqual((5, 6), free.get_smallest())
+        free.remove(1)
+        free.remove(3)
+        self.assertEqual((2, 2), free.get_smallest())
+
+    def test_get_smallest_returns_none_when_empty(self):
+        free = IPFreeRanges([(1, 1)])
+        free.remove(1)
+        self.assertIsNone(free.get_smallest())
+        self.assertThat(free, HasLength(0))
+
+    def test_matches_maasipset_when_changed(self):
+        network = IPNetwork("10.0.0.0/26")
+        used = set(random.sample(range(network.first, network.last), 20))
+        free = self.make_free(
+            set(range(network.first + 1, network.last)) - used)
+        for _ in range(50):
+            address = random.randint(network.first + 1, network.last - 1)
+            if random.choice((True, False)):
+                free.remove(address)
+                used.add(address)
+            else:
+                free.add(address)
+                used.discard(address)
+            in_use = MAASIPSet([make_iprange(address) for address in used])
+            unused = in_use.get_unused_ranges(network)
+            self.assertEqual(
+                [(iprange.first, iprange.last) for iprange in unused.ranges],
+                list(free))
+
+
 class TestIPRangeStatistics(MAASTestCase):
 
     def test__statistics_are_accurate(self):
@@ -0,0 +1,190 @@
+# Copyright 2017 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for `provisioningserver.utils.templates`."""
+
+__all__ = []
+
+import errno
+import os
+from unittest.mock import (
+    call,
+    Mock,
+)
+
+from maastesting.factory import factory
+from maastesting.matchers import MockCallsMatch
+from maastesting.testcase import MAASTestCase
+from provisioningserver.utils import templates as templates_module
+from provisioningserver.utils.templates import (
+    get_stat_key,
+    TemplateCache,
+)
+import tempita
+from testtools.matchers import (
+    Equals,
+    Is,
+    IsInstance,
+    Not,
+)
+
+
+def touch(path, seconds=1):
+    """Move the modification time of `path` on by `seconds`.
+
+    Timestamps are not always fine-grained enough to see a change made
+    immediately after another.
+    """
+    stat = os.stat(path)
+    os.utime(path, ns=(
+        stat.st_atime_ns, stat.st_mtime_ns + seconds * 10 ** 9))
+
+
+class TestGetStatKey(MAASTestCase):
+    """Tests for `get_stat_key`."""
+
+    def test__returns_None_for_missing_files(self):
+        directory = self.make_dir()
+        self.assertThat(
+            get_stat_key(os.path.join(directory, "missing")), Is(None))
+        self.assertThat(
+            get_stat_key(os.path.join(directory, "missing", "file")),
+            Is(None))
+
+    def test__changes_when_file_is_modified(self):
+        filename = self.make_file()
+        key = get_stat_key(filename)
+        touch(filename)
+        self.assertThat(get_stat_key(filename), Not(Equals(key)))
+
+
+class TestTemplateCache(MAASTestCase):
+    """Tests for `TemplateCache`."""
+
+    def test__parses_template_once(self):
+        filename = self.make_file(contents="{{x}}")
+        cache = TemplateCache()
+        template = cache.get(filename)
+        self.assertThat(template, IsInstance(tempita.Template))
+        self.assertThat(template.substitute(x="foo"), Equals("foo"))
+        self.assertThat(template.name, Equals(filename))
+        self.assertThat(cache.get(filename), Is(template))
+        self.assertThat(cache.loads, Equals(1))
+
+    def test__reloads_template_when_file_changes(self):
+        filename = self.make_file(contents="{{x}}")
+        cache = TemplateCache()
+        cache.get(filename)
+        factory.make_file(
+            os.path.dirname(filename), os.path.basename(filename),
+            contents="{{x}}{{x}}")
+        touch(filename)
+        self.assertThat(
+            cache.get(filename).substitute(x="foo"), Equals("foofoo"))
+        self.assertThat(cache.loads, Equals(2))
+
+    def test__caches_templates_by_class(self):
+
+        class OtherTemplate(tempita.Template):
+            pass
+
+        filename = self.make_file()
+        cache = TemplateCache()
+        template = cache.get(filename)
+        other_template = cache.get(filename, OtherTemplate)
+        self.assertThat(other_template, IsInstance(OtherTemplate))
+        self.assertThat(cache.get(filename), Is(template))
+        self.assertThat(cache.get(filename, OtherTemplate), Is(other_template))
+        self.assertThat(cache.loads, Equals(2))
+
+    def test__returns_None_for_missing_files(self):
+        directory = self.make_dir()
+        cache = TemplateCache()
+        self.assertThat(
+            cache.get(os.path.join(directory, "missing")), Is(None))
+        self.assertThat(
+            cache.get(os.path.join(directory, "missing", "file")), Is(None))
+
+    def test__checks_only_directory_of_missing_files(self):
+        directory = self.make_dir()
+        touch(directory, -10)
+        filename = os.path.join(directory, "missing")
+        cache = TemplateCache()
+        cache.get(filename)
+        get_stat_key = self.patch(
+            templates_module, "get_stat_key",
+            Mock(side_effect=templates_module.get_stat_key))
+        self.assertThat(cache.get(filename), Is(None))
+        self.assertThat(get_stat_key, MockCallsMatch(call(directory)))
+
+    def test__does_not_remember_misses_in_recently_modified_directory(self):
+        directory = self.make_dir()
+        filename = os.path.join(directory, "template")
+        cache = TemplateCache()
+        self.assertThat(cache.get(filename), Is(None))
+        self.assertThat(cache.missing, Equals({}))
+        # Created without changing the directory's modification time, as
+        # can happen within the same timestamp tick.
+        stat = os.stat(directory)
+        factory.make_file(directory, "template", contents="foo")
+        os.utime(directory, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertThat(cache.get(filename).substitute(), Equals("foo"))
+
+    def test__checks_directory_before_missing_file(self):
+        directory = self.make_dir()
+        filename = os.path.join(directory, "missing")
+        cache = TemplateCache()
+        get_stat_key = self.patch(
+            templates_module, "get_stat_key",
+            Mock(side_effect=templates_module.get_stat_key))
+        self.assertThat(cache.get(filename), Is(None))
+        self.assertThat(get_stat_key, MockCallsMatch(
+            call(directory), call(filename)))
+
+    def test__finds_files_created_while_looking_for_them(self):
+        directory = self.make_dir()
+        filename = os.path.join(directory, "template")
+        cache = TemplateCache()
+
+        def stat_then_create(path):
+            key = get_stat_key(path)
+            if path == filename and key is None:
+                # Create the file just after it was found to be missing.
+                factory.make_file(directory, "template", contents="foo")
+                touch(directory)
+            return key
+
+        self.patch(templates_module, "get_stat_key", stat_then_create)
+        self.assertThat(cache.get(filename), Is(None))
+        self.assertThat(cache.get(filename).substitute(), Equals("foo"))
+
+    def test__finds_files_created_after_a_miss(self):
+        directory = self.make_dir()
+        filename = os.path.join(directory, "template")
+        cache = TemplateCache()
+        self.assertThat(cache.get(filename), Is(None))
+        factory.make_file(directory, "template", contents="foo")
+        touch(directory)
+        self.assertThat(cache.get(filename).substitute(), Equals("foo"))
+
+    def test__forgets_removed_files(self):
+        filename = self.make_file()
+        cache = TemplateCache()
+        cache.get(filename)
+        os.unlink(filename)
+        self.assertThat(cache.get(filename), Is(None))
+
+    def test__raises_other_errors(self):
+        filename = self.make_file()
+        from_filename = self.patch(tempita.Template, "from_filename")
+        from_filename.side_effect = IOError(errno.EACCES, "Denied")
+        cache = TemplateCache()
+        self.assertRaises(IOError, cache.get, filename)
+
+    def test__clear_discards_templates(self):
+        filename = self.make_file()
+        cache = TemplateCache()
+        cache.get(filename)
+        cache.clear()
+        cache.get(filename)
+        self.assertThat(cache.loads, Equals(2))